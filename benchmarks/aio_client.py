@@ -0,0 +1,179 @@
+"""
+Benchmark of the asynchronous client API (`labtasker.client.aio`) against the synchronous one.
+
+Submits --tasks tasks, then lists them back by pages of --page-size tasks: one request after
+another with the synchronous API, and all at once from one event loop with the asynchronous
+API. Uses the same local server as `micro_tasks.py`, behind a proxy delaying each way by half
+of --rtt-ms, as a remote server would. Reports requests/s.
+
+Usage:
+    python benchmarks/aio_client.py --tasks 1000 --page-size 10 --rtt-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from micro_tasks import free_port, setup
+
+
+async def _pipe(reader, writer, delay: float):
+    """Forward the data read, each chunk `delay` seconds after it was read."""
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    async def forward():
+        while True:
+            due, data = await chunks.get()
+            await asyncio.sleep(due - time.monotonic())
+            if not data:
+                writer.close()
+                return
+            writer.write(data)
+            await writer.drain()
+
+    forwarding = asyncio.create_task(forward())
+    while True:
+        data = await reader.read(65536)
+        chunks.put_nowait((time.monotonic() + delay, data))
+        if not data:
+            break
+    await forwarding
+
+
+def start_latency_proxy(port: int, rtt: float) -> int:
+    """Start a proxy to the local `port`, with a round trip time of `rtt` seconds.
+    Returns the port of the proxy."""
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", port)
+        await asyncio.gather(
+            _pipe(client_reader, server_writer, rtt / 2),
+            _pipe(server_reader, client_writer, rtt / 2),
+            return_exceptions=True,
+        )
+
+    proxy_port = free_port()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", proxy_port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return proxy_port
+
+
+def use_latency_proxy(rtt: float):
+    """Point the client at a latency proxy to the server."""
+    import tomlkit
+
+    from labtasker.client.core.api import close_httpx_client
+    from labtasker.client.core.config import load_client_config
+    from labtasker.client.core.paths import get_labtasker_client_config_path
+
+    config_path = get_labtasker_client_config_path()
+    config = tomlkit.parse(config_path.read_text())
+    port = int(str(config["endpoint"]["api_base_url"]).rstrip("/").rsplit(":", 1)[1])
+    proxy_port = start_latency_proxy(port, rtt)
+    config["endpoint"]["api_base_url"] = f"http://127.0.0.1:{proxy_port}/"
+    config_path.write_text(tomlkit.dumps(config))
+    load_client_config(skip_if_loaded=False, disable_warning=True)
+    close_httpx_client()
+
+
+def measure_sync(mode: str, n_tasks: int, page_size: int):
+    from labtasker.client.core.api import ls_tasks, submit_task
+
+    start = time.perf_counter()
+    for i in range(n_tasks):
+        submit_task(task_name=f"{mode}_{i}", args={"mode": mode, "i": i})
+    submitted = time.perf_counter()
+    for offset in range(0, n_tasks, page_size):
+        ls_tasks(extra_filter={"args.mode": mode}, limit=page_size, offset=offset)
+    listed = time.perf_counter()
+    return submitted - start, listed - submitted
+
+
+async def _measure_aio(mode: str, n_tasks: int, page_size: int):
+    from labtasker.client import aio
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            aio.submit_task(task_name=f"{mode}_{i}", args={"mode": mode, "i": i})
+            for i in range(n_tasks)
+        )
+    )
+    submitted = time.perf_counter()
+    await asyncio.gather(
+        *(
+            aio.ls_tasks(extra_filter={"args.mode": mode}, limit=page_size, offset=o)
+            for o in range(0, n_tasks, page_size)
+        )
+    )
+    listed = time.perf_counter()
+    await aio.close_httpx_client()
+    return submitted - start, listed - submitted
+
+
+def measure_aio(mode: str, n_tasks: int, page_size: int):
+    return asyncio.run(_measure_aio(mode, n_tasks, page_size))
+
+
+MODES = {
+    "sync": measure_sync,
+    "aio": measure_aio,
+}
+
+
+def measure(mode: str, n_tasks: int, page_size: int):
+    submit_s, ls_s = MODES[mode](mode, n_tasks, page_size)
+    n_pages = -(-n_tasks // page_size)
+    return {
+        "mode": mode,
+        "tasks": n_tasks,
+        "submit_per_second": n_tasks / submit_s,
+        "ls_per_second": n_pages / ls_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--rtt-ms", type=float, default=20)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # the output of the client is thrown away, results are printed to the real stdout
+    report = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.dup2(devnull, sys.stderr.fileno())
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmpdir:
+        server = setup(Path(tmpdir))
+        try:
+            if args.rtt_ms > 0:
+                use_latency_proxy(args.rtt_ms / 1000)
+            for mode in args.modes:
+                result = measure(mode, args.tasks, args.page_size)
+                if args.json:
+                    print(json.dumps(result), file=report, flush=True)
+                else:
+                    print(
+                        f"{mode:<6} {result['submit_per_second']:>8.1f} submit/s "
+                        f"{result['ls_per_second']:>8.1f} ls/s",
+                        file=report,
+                        flush=True,
+                    )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Contention benchmark of the embedded database.
+
+Many threads run a mix of heartbeats, fetches and task listings against several queues,
+like workers and dashboards talking to a single server. Pass `--global-lock` to run every
+transaction exclusively, as before transactions were scoped to queues, or `--db-mode sqlite`
+to run against the SQLite storage engine.
+
+Usage:
+    python benchmarks/embedded_db_contention.py --threads 16 --queues 8 --duration 10
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from labtasker.server import config, embedded_db
+from labtasker.server.database import DBService
+from labtasker.server.embedded_db import MongoClient, ServerStore
+from labtasker.server.sqlite_db import MongoClient as SQLiteMongoClient
+
+
+def setup(db: DBService, n_queues: int, n_tasks: int):
+    queue_ids = []
+    for i in range(n_queues):
+        queue_id = db.create_queue(queue_name=f"queue_{i}", password="password")
+        for j in range(n_tasks):
+            db.create_task(queue_id=queue_id, args={"i": j})
+        queue_ids.append(queue_id)
+    return queue_ids
+
+
+def run_client(db, queue_ids, deadline, mix, counts, lock):
+    rng = random.Random()
+    running = {}  # queue_id -> fetched task ids
+    local = Counter()
+    ops, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        queue_id = rng.choice(queue_ids)
+        op = rng.choices(ops, weights)[0]
+        if op == "fetch":
+            task = db.fetch_task(queue_id=queue_id)
+            if task is not None:
+                running.setdefault(queue_id, []).append(task["_id"])
+        elif op == "heartbeat":
+            if not running.get(queue_id):
+                continue
+            db.refresh_task_heartbeat(
+                queue_id=queue_id, task_id=rng.choice(running[queue_id])
+            )
+        elif op == "list":
+            db.query_collection(
+                queue_id=queue_id, collection_name="tasks", query={}, limit=20
+            )
+        local[op] += 1
+    with lock:
+        counts.update(local)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--queues", type=int, default=8)
+    parser.add_argument("--tasks", type=int, default=500, help="tasks per queue")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--db-mode", default="embedded", choices=("embedded", "sqlite"))
+    parser.add_argument(
+        "--durability", default="memory", choices=embedded_db.DURABILITY_POLICIES
+    )
+    parser.add_argument(
+        "--global-lock",
+        action="store_true",
+        help="run every transaction exclusively (the former behaviour)",
+    )
+    parser.add_argument(
+        "--fsync-latency",
+        type=float,
+        default=0.0,
+        help="milliseconds added to every fsync, to simulate a slower disk",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.global_lock:
+        acquire = embedded_db._transaction_locks.acquire
+        embedded_db._transaction_locks.acquire = (
+            lambda queue_id=None, read_only=False: acquire()
+        )
+
+    if args.fsync_latency:
+        fsync = os.fsync
+
+        def slow_fsync(fd):
+            time.sleep(args.fsync_latency / 1000)
+            fsync(fd)
+
+        os.fsync = slow_fsync
+
+    # events are published to the in-process bus, which reads its buffer size from the config
+    config._config = config.ServerConfig(db_user="benchmark", db_password="benchmark")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.db_mode == "sqlite":
+            client = SQLiteMongoClient(
+                Path(tmpdir) / "db.sqlite", durability=args.durability
+            )
+        else:
+            store = ServerStore(
+                persistence_path=Path(tmpdir) / "db.json", durability=args.durability
+            )
+            client = MongoClient(_store=store)
+        db = DBService(db_name="benchmark", client=client)
+        queue_ids = setup(db, args.queues, args.tasks)
+
+        counts, lock = Counter(), threading.Lock()
+        mix = {"heartbeat": 6, "fetch": 2, "list": 2}
+        deadline = time.monotonic() + args.duration
+        threads = [
+            threading.Thread(
+                target=run_client, args=(db, queue_ids, deadline, mix, counts, lock)
+            )
+            for _ in range(args.threads)
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        client.close()
+
+    total = sum(counts.values())
+    result = {
+        "db_mode": args.db_mode,
+        "threads": args.threads,
+        "queues": args.queues,
+        "durability": args.durability,
+        "fsync_latency": args.fsync_latency,
+        "global_lock": args.global_lock,
+        "elapsed": elapsed,
+        "ops": dict(counts),
+        "ops_per_second": total / elapsed,
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(
+        f"{total} ops in {elapsed:.1f}s: {result['ops_per_second']:.0f} ops/s "
+        f"({', '.join(f'{k}: {v}' for k, v in sorted(counts.items()))})"
+    )
+
+
+if __name__ == "__main__":
+    main()
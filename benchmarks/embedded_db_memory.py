@@ -0,0 +1,129 @@
+"""
+Memory benchmark of the embedded database.
+
+Submits a hyperparameter sweep of many tasks to a few queues, as `labtasker task submit` would
+(arguments and commands are decoded from a request body for each task), and reports the memory
+held by the store, as traced by tracemalloc. Pass `--baseline` to store documents without
+sharing equal values among them, as before.
+
+Usage:
+    python benchmarks/embedded_db_memory.py --tasks 1000000
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import time
+import tracemalloc
+import uuid
+
+from labtasker.server import config, embedded_document
+from labtasker.server.database import DBService
+from labtasker.server.embedded_db import MongoClient, ServerStore
+from labtasker.utils import get_current_time
+
+BATCH_SIZE = 10000
+
+
+class _NoSharing:
+    def setdefault(self, key, value):
+        return value
+
+
+def sweep():
+    """Request bodies of the tasks of a sweep."""
+    grid = itertools.product(
+        [1e-4, 3e-4, 1e-3], ["resnet18", "resnet50", "vit"], range(10)
+    )
+    for lr, model, seed in itertools.cycle(grid):
+        yield json.dumps(
+            {
+                "args": {"lr": lr, "model": model, "seed": seed},
+                "cmd": ["python", "train.py", "--lr", str(lr), "--model", model],
+                "metadata": {},
+            }
+        )
+
+
+def populate(db: DBService, queue_ids, n_tasks: int):
+    template = db._db.tasks.find_one({})
+    batch = []
+    for i, body in zip(range(n_tasks), sweep()):
+        request = json.loads(body)
+        now = get_current_time()
+        batch.append(
+            dict(
+                template,
+                _id=str(uuid.uuid4()),
+                queue_id=queue_ids[i % len(queue_ids)],
+                created_at=now,
+                last_modified=now,
+                args=request["args"],
+                cmd=request["cmd"],
+                metadata=request["metadata"],
+                summary={},
+            )
+        )
+        if len(batch) == BATCH_SIZE:
+            db._db.tasks.insert_many(batch)
+            batch = []
+    if batch:
+        db._db.tasks.insert_many(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--tasks", type=int, default=1000000)
+    parser.add_argument("--queues", type=int, default=10)
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="do not share equal values among documents (the former behaviour)",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.baseline:
+        embedded_document.INTERNED_FIELDS = ()
+        embedded_document._shared = _NoSharing()
+        embedded_document._intern_key = lambda key: key
+
+    config._config = config.ServerConfig(db_user="benchmark", db_password="benchmark")
+
+    client = MongoClient(_store=ServerStore(durability="memory"))
+    db = DBService(db_name="benchmark", client=client)
+    queue_ids = [
+        db.create_queue(queue_name=f"queue_{i}", password="password")
+        for i in range(args.queues)
+    ]
+    db.create_task(queue_id=queue_ids[0], args={"seed": 0})  # template of the documents
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    populate(db, queue_ids, args.tasks - 1)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    client.close()
+
+    result = {
+        "tasks": args.tasks,
+        "baseline": args.baseline,
+        "bytes": current,
+        "bytes_per_task": current / args.tasks,
+        "elapsed": elapsed,
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(
+        f"{args.tasks} tasks: {current / 2**20:.0f} MiB "
+        f"({result['bytes_per_task']:.0f} bytes per task), submitted in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
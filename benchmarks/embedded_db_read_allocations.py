@@ -0,0 +1,103 @@
+"""
+Memory benchmark of reads from the embedded database.
+
+Lists every task of a large queue, once with `DBService.query_collection` (like
+`labtasker task ls`) and once with a plain `find`, and reports the peak memory traced by
+tracemalloc and the elapsed time of each. Pass `--baseline` to read as before stored documents
+were frozen: every document read is deep copied, and cursors slice their results for every
+document they yield.
+
+Usage:
+    python benchmarks/embedded_db_read_allocations.py --tasks 100000
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import uuid
+
+import mongomock
+
+from labtasker.server import config
+from labtasker.server.database import DBService
+from labtasker.server.embedded_db import Collection, MongoClient, ServerStore
+
+
+def setup(db: DBService, n_tasks: int) -> str:
+    queue_id = db.create_queue(queue_name="queue", password="password")
+    task_id = db.create_task(
+        queue_id=queue_id, args={"lr": 0.1, "tags": ["a", "b"]}, metadata={"tag": "x"}
+    )
+    template = db._db.tasks.find_one({"_id": task_id})
+    batch = []
+    for i in range(1, n_tasks):
+        batch.append(
+            dict(template, _id=str(uuid.uuid4()), args={"lr": i, "tags": ["a", "b"]})
+        )
+        if len(batch) == 10000:
+            db._db.tasks.insert_many(batch)
+            batch = []
+    if batch:
+        db._db.tasks.insert_many(batch)
+    return queue_id
+
+
+def measure(fn):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(result), peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="copy documents on reads with mongomock cursors (the former behaviour)",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.baseline:
+        Collection._copy_only_fields = mongomock.Collection._copy_only_fields
+        Collection.find = mongomock.Collection.find
+
+    config._config = config.ServerConfig(db_user="benchmark", db_password="benchmark")
+
+    client = MongoClient(_store=ServerStore(durability="memory"))
+    db = DBService(db_name="benchmark", client=client)
+    queue_id = setup(db, args.tasks)
+
+    readers = {
+        "query_collection": lambda: db.query_collection(
+            queue_id=queue_id, collection_name="tasks", query={}, limit=args.tasks
+        ),
+        "find": lambda: list(db._db.tasks.find({"queue_id": queue_id})),
+    }
+    results = {}
+    for name, reader in readers.items():
+        count, peak, elapsed = measure(reader)
+        assert count == args.tasks, count
+        results[name] = {"peak_bytes": peak, "elapsed": elapsed}
+    client.close()
+
+    if args.json:
+        print(json.dumps({"tasks": args.tasks, "baseline": args.baseline, **results}))
+        return
+    for name, result in results.items():
+        print(
+            f"{name}: {args.tasks} tasks, peak {result['peak_bytes'] / 2**20:.1f} MiB, "
+            f"{result['elapsed']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Throughput benchmark of the client-side event listener (`labtasker.client.core.events`).
+
+Feeds --events events to an `EventListener` from a fake SSE connection, and reports the rate at
+which `iter_events()` yields them. Only the client is measured: the server and the network are
+left out. Consumption used to be capped at ~10 events/s by a sleep after every event.
+
+Usage:
+    python benchmarks/event_listener.py --events 100000
+"""
+
+import argparse
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from httpx_sse import ServerSentEvent
+
+from labtasker.api_models import BaseEventModel, EventResponse
+from labtasker.client.core import config, events
+from labtasker.utils import get_current_time
+
+
+class FakeEventSource:
+    def __init__(self, n_events: int):
+        timestamp = get_current_time()
+        self.sses = [
+            ServerSentEvent(
+                event="event",
+                data=EventResponse(
+                    sequence=i,
+                    timestamp=timestamp,
+                    event=BaseEventModel(
+                        queue_id="q", timestamp=timestamp, metadata={}
+                    ),
+                ).model_dump_json(),
+            )
+            for i in range(n_events)
+        ]
+        self.disconnect = threading.Event()
+
+        class Response:
+            def raise_for_status(self):
+                pass
+
+        self.response = Response()
+
+    def iter_sse(self):
+        yield ServerSentEvent(
+            event="connection", data=json.dumps({"client_id": "benchmark"})
+        )
+        yield from self.sses
+        self.disconnect.wait()
+
+
+def measure(n_events: int, max_queue_size: int):
+    source = FakeEventSource(n_events)
+
+    @contextmanager
+    def fake_connect_sse(*args, **kwargs):
+        yield source
+
+    events.connect_sse = fake_connect_sse
+    listener = events.EventListener(max_queue_size=max_queue_size).start(timeout=5)
+    try:
+        start = time.perf_counter()
+        received = 0
+        for _ in listener.iter_events():
+            received += 1
+            if received == n_events:
+                break
+        elapsed = time.perf_counter() - start
+    finally:
+        source.disconnect.set()
+        listener.stop()
+    return {
+        "events": n_events,
+        "elapsed": elapsed,
+        "events_per_second": n_events / elapsed,
+        "dropped": listener.get_stats()["dropped"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--max-queue-size", type=int, default=10000)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # the connection is faked, the endpoint is never reached
+    config._config = config.ClientConfig(
+        endpoint={"api_base_url": "http://localhost:9321/"},
+        queue={"queue_name": "benchmark", "password": "benchmark"},
+        version_check=False,
+    )
+    result = measure(args.events, args.max_queue_size)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(
+        f"Consumed {result['events']} events in {result['elapsed']:.3f}s "
+        f"({result['events_per_second']:.0f} events/s, {result['dropped']} dropped)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark of `print` inside `log_to_file`, on a fast and on a slow disk.
+
+The job prints short lines (with ANSI colors) as fast as it can, while `log_to_file` copies
+them to a log file; stdout goes to /dev/null. The slow disk is a FIFO drained by a thread at
+a limited rate, with short pauses, like an NFS home directory under load. Reports prints/s
+and the longest time a single `print` took, and the time `log_to_file` took to close.
+
+Usage:
+    python benchmarks/log_to_file.py --lines 300000 --slow-rate 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from labtasker.client.core.logging import log_to_file
+
+LINE = "\x1b[32mINFO\x1b[0m step {i} loss=0.123456"
+
+
+def drain_slowly(path: Path, megabytes_per_second: float):
+    """Read the FIFO at `path`, 64 KiB at a time, at a limited rate."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunk_time = 65536 / (megabytes_per_second * 1e6)
+        while True:
+            if not os.read(fd, 65536):
+                return
+            time.sleep(chunk_time)
+    finally:
+        os.close(fd)
+
+
+def measure(log_path: Path, lines: int):
+    worst = 0.0
+    start = time.perf_counter()
+    with log_to_file(log_path):
+        for i in range(lines):
+            t = time.perf_counter()
+            print(LINE.format(i=i))
+            worst = max(worst, time.perf_counter() - t)
+        printed = time.perf_counter()
+    return {
+        "prints_per_second": lines / (printed - start),
+        "worst_print_ms": worst * 1000,
+        "close_seconds": time.perf_counter() - printed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--lines", type=int, default=300000)
+    parser.add_argument(
+        "--slow-rate", type=float, default=2, help="MB/s of the slow disk"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # the output of the job is thrown away, results are printed to the real stdout
+    report = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmpdir:
+        results = {"fast disk": measure(Path(tmpdir) / "fast.log", args.lines)}
+
+        fifo = Path(tmpdir) / "slow.log"
+        os.mkfifo(fifo)
+        reader = threading.Thread(
+            target=drain_slowly, args=(fifo, args.slow_rate), daemon=True
+        )
+        reader.start()
+        results["slow disk"] = measure(fifo, args.lines)
+        reader.join()
+
+    for disk, result in results.items():
+        if args.json:
+            print(json.dumps({"disk": disk, **result}), file=report, flush=True)
+        else:
+            print(
+                f"{disk:<10} {result['prints_per_second']:>9.0f} prints/s  "
+                f"worst print {result['worst_print_ms']:>8.2f} ms  "
+                f"close {result['close_seconds']:>6.2f} s",
+                file=report,
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
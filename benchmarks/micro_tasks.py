@@ -0,0 +1,167 @@
+"""
+Throughput benchmark of `labtasker.loop` on no-op tasks.
+
+A loop runs tasks whose job does nothing, in the default mode and in lightweight mode
+(`lightweight=True`, with and without a shared log file), against a local server (embedded
+database kept in memory), so that the bookkeeping of the loop dominates. Reports tasks/s,
+and the CPU time of the client process per task (the server runs in another process, where
+requests mostly spend their time checking the queue password). The output of the loop goes
+to /dev/null.
+
+Usage:
+    python benchmarks/micro_tasks.py --tasks 1000
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+MODES = {
+    "default": {},
+    "lightweight": {"lightweight": True},
+    "lightweight_log": {"lightweight": True, "log_file": "loop.log"},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def setup(root: Path) -> subprocess.Popen:
+    """Start a server, and point the client at it."""
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "labtasker.server.cli",
+            "serve",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--db-durability",
+            "memory",
+            "--db-path",
+            str(root / "db.json"),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    # the client reads its root when imported
+    os.environ["LABTASKER_ROOT"] = str(root / ".labtasker")
+
+    import tomlkit
+
+    import labtasker.client.core.api
+    from labtasker.client.core.config import (
+        get_client_config,
+        init_labtasker_root,
+        load_client_config,
+    )
+    from labtasker.client.core.job_runner import set_prompt_on_task_failure
+    from labtasker.client.core.paths import get_labtasker_client_config_path
+
+    init_labtasker_root(exist_ok=True)
+    config_path = get_labtasker_client_config_path()
+    config = tomlkit.parse(config_path.read_text())
+    config["version_check"] = False
+    config["endpoint"]["api_base_url"] = f"http://127.0.0.1:{port}/"
+    config_path.write_text(tomlkit.dumps(config))
+    load_client_config(skip_if_loaded=False, disable_warning=True)
+    set_prompt_on_task_failure(False)
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            labtasker.client.core.api.health_check()
+            break
+        except Exception:
+            if time.monotonic() > deadline or server.poll() is not None:
+                server.kill()
+                raise
+            time.sleep(0.1)
+
+    queue = get_client_config().queue
+    labtasker.client.core.api.create_queue(
+        queue_name=queue.queue_name, password=queue.password.get_secret_value()
+    )
+    return server
+
+
+def measure(mode: str, n_tasks: int, root: Path):
+    import labtasker
+    from labtasker.client.core.api import submit_task
+
+    for i in range(n_tasks):
+        submit_task(task_name=f"{mode}_{i}", args={"mode": mode, "i": i})
+
+    kwargs = dict(MODES[mode])
+    if "log_file" in kwargs:
+        kwargs["log_file"] = root / kwargs["log_file"]
+
+    ran = []
+
+    @labtasker.loop(
+        required_fields=["mode", "i"], extra_filter={"args.mode": mode}, **kwargs
+    )
+    def job():
+        ran.append(labtasker.task_info().args["i"])
+
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    job()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    assert len(ran) == n_tasks, (mode, len(ran))
+    return {
+        "mode": mode,
+        "tasks": n_tasks,
+        "tasks_per_second": n_tasks / elapsed,
+        "client_cpu_ms_per_task": cpu / n_tasks * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # the output of the loop is thrown away, results are printed to the real stdout
+    report = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.dup2(devnull, sys.stderr.fileno())
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmpdir:
+        server = setup(Path(tmpdir))
+        try:
+            for mode in args.modes:
+                result = measure(mode, args.tasks, Path(tmpdir))
+                if args.json:
+                    print(json.dumps(result), file=report, flush=True)
+                else:
+                    print(
+                        f"{mode:<16} {result['tasks_per_second']:>8.1f} tasks/s "
+                        f"{result['client_cpu_ms_per_task']:>8.2f} ms of client CPU/task",
+                        file=report,
+                        flush=True,
+                    )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
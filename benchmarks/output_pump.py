@@ -0,0 +1,152 @@
+"""
+Throughput benchmark of the output of job processes.
+
+A child process writes lines as fast as it can (flushing each, like a logging handler would),
+while `run_with_subprocess` / `run_with_pty` copy its output to stdout and to the log file of
+`log_to_file`, as in `labtasker loop`. Reports MB/s, and the CPU time the launcher spent per MB,
+for the current output pump and for the previous implementations (64-byte reads in threads,
+pexpect `read_nonblocking` polling). The previous subprocess path wrote to `sys.stdout.buffer`,
+which skipped the log file: it does less work than the others.
+
+Usage:
+    python benchmarks/output_pump.py --megabytes 200 --line-length 100
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pexpect
+
+from labtasker.client.core.logging import log_to_file
+from labtasker.client.core.utils import run_with_pty, run_with_subprocess
+
+CHILD_SCRIPT = """
+import sys
+line = "x" * ({line_length} - 1) + "\\n"
+for _ in range({n_lines}):
+    sys.stdout.write(line)
+    sys.stdout.flush()
+"""
+
+
+def legacy_run_with_subprocess(cmd):
+    def read_stream(stream, is_stdout):
+        for chunk in iter(lambda: stream.read(64), b""):
+            out = sys.stdout if is_stdout else sys.stderr
+            out.buffer.write(chunk)
+            out.buffer.flush()
+
+    with subprocess.Popen(
+        args=cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        bufsize=0,
+    ) as process:
+        threads = [
+            threading.Thread(target=read_stream, args=(process.stdout, True)),
+            threading.Thread(target=read_stream, args=(process.stderr, False)),
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        process.wait()
+        for thread in threads:
+            thread.join(timeout=1.0)
+        return process.returncode
+
+
+def legacy_run_with_pty(cmd):
+    child = pexpect.spawn(cmd[0], cmd[1:], encoding="utf-8")
+    try:
+        while True:
+            try:
+                output = child.read_nonblocking(size=1024, timeout=0.1)
+                if output:
+                    sys.stdout.write(output)
+                    sys.stdout.flush()
+            except pexpect.TIMEOUT:
+                continue
+            except pexpect.EOF:
+                break
+    finally:
+        child.close()
+    return child.exitstatus
+
+
+RUNNERS = {
+    "subprocess": run_with_subprocess,
+    "subprocess-legacy": legacy_run_with_subprocess,
+    "pty": run_with_pty,
+    "pty-legacy": legacy_run_with_pty,
+}
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(runner, cmd, megabytes, log_path):
+    start_cpu, start = cpu_time(), time.perf_counter()
+    with log_to_file(log_path):
+        exit_code = RUNNERS[runner](cmd)
+    elapsed, cpu = time.perf_counter() - start, cpu_time() - start_cpu
+    assert exit_code == 0, exit_code
+    return {
+        "runner": runner,
+        "megabytes": megabytes,
+        "elapsed": elapsed,
+        "mb_per_second": megabytes / elapsed,
+        "launcher_cpu_seconds_per_mb": cpu / megabytes,
+        "log_bytes": log_path.stat().st_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--megabytes", type=float, default=100)
+    parser.add_argument("--line-length", type=int, default=100)
+    parser.add_argument("--runners", nargs="+", default=list(RUNNERS), choices=RUNNERS)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    n_lines = int(args.megabytes * 1e6 / args.line_length)
+    cmd = [
+        sys.executable,
+        "-c",
+        CHILD_SCRIPT.format(line_length=args.line_length, n_lines=n_lines),
+    ]
+
+    # the output of the child is thrown away, results are printed to the real stdout
+    report = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmpdir:
+        for runner in args.runners:
+            result = measure(
+                runner, cmd, args.megabytes, Path(tmpdir) / f"{runner}.log"
+            )
+            if args.json:
+                print(json.dumps(result), file=report, flush=True)
+            else:
+                print(
+                    f"{runner:<18} {result['mb_per_second']:>8.1f} MB/s  "
+                    f"{result['launcher_cpu_seconds_per_mb'] * 1000:>7.2f} ms CPU/MB  "
+                    f"{result['log_bytes'] / 1e6:>8.1f} MB logged",
+                    file=report,
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
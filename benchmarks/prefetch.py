@@ -0,0 +1,108 @@
+"""
+Benchmark of `labtasker.loop(prefetch=True)` on tasks with a slow preparation.
+
+Each task has inputs to fetch first (the `prepare` hook sleeps for --prepare-ms, e.g. a
+download), then a job (sleeping for --job-ms). Without prefetch, the loop fetches a task,
+prepares it, then runs it. With prefetch, the next task is reserved and prepared while the
+current one runs, so that only the longer of the two is left on the critical path. Uses the
+same local server as `micro_tasks.py`. Reports tasks/s, and the time per task spent outside
+of the job.
+
+Usage:
+    python benchmarks/prefetch.py --tasks 100 --prepare-ms 50 --job-ms 50
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from micro_tasks import setup
+
+MODES = {
+    "sequential": {},
+    "prefetch": {"prefetch": True},
+}
+
+
+def measure(mode: str, n_tasks: int, prepare_s: float, job_s: float):
+    import labtasker
+    from labtasker.client.core.api import submit_task
+
+    for i in range(n_tasks):
+        submit_task(task_name=f"{mode}_{i}", args={"mode": mode, "i": i})
+
+    prepared = set()
+
+    def prepare(args):
+        time.sleep(prepare_s)
+        prepared.add(args["i"])
+
+    ran = []
+
+    @labtasker.loop(
+        required_fields=["mode", "i"],
+        extra_filter={"args.mode": mode},
+        lightweight=True,
+        prepare=prepare,
+        **MODES[mode],
+    )
+    def job():
+        i = labtasker.task_info().args["i"]
+        assert i in prepared
+        time.sleep(job_s)
+        ran.append(i)
+
+    start = time.perf_counter()
+    job()
+    elapsed = time.perf_counter() - start
+    assert len(ran) == n_tasks, (mode, len(ran))
+    return {
+        "mode": mode,
+        "tasks": n_tasks,
+        "tasks_per_second": n_tasks / elapsed,
+        "overhead_ms_per_task": (elapsed / n_tasks - job_s) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--prepare-ms", type=float, default=50)
+    parser.add_argument("--job-ms", type=float, default=50)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # the output of the loop is thrown away, results are printed to the real stdout
+    report = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.dup2(devnull, sys.stderr.fileno())
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmpdir:
+        server = setup(Path(tmpdir))
+        try:
+            for mode in args.modes:
+                result = measure(
+                    mode, args.tasks, args.prepare_ms / 1000, args.job_ms / 1000
+                )
+                if args.json:
+                    print(json.dumps(result), file=report, flush=True)
+                else:
+                    print(
+                        f"{mode:<12} {result['tasks_per_second']:>8.1f} tasks/s "
+                        f"{result['overhead_ms_per_task']:>8.1f} ms/task outside of the job",
+                        file=report,
+                        flush=True,
+                    )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
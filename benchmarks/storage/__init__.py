@@ -0,0 +1,20 @@
+"""
+Benchmark suite of the storage backends.
+
+Drives `DBService` directly, through the workloads of a server: bulk submits, concurrent fetches,
+heartbeats, status reports, task listings and timeout sweeps, on queues of increasing sizes.
+For each backend, queue size and workload, it reports ops/s, p50/p99 latency and the bytes
+written per op, as JSON (see `results.py`), so that runs can be compared with `--compare`.
+
+Backends:
+    embedded  The embedded database (no Docker needed), under `--durability`.
+    sqlite    The SQLite storage engine, under `--durability`.
+    mongodb   A MongoDB server at `--mongodb-uri`, skipped if it can not be reached.
+              Transactions require it to run as a replica set (e.g. `mongod --replSet rs0`,
+              then `rs.initiate()` once).
+
+Usage:
+    python -m benchmarks.storage --backends embedded sqlite --sizes 1000 100000 1000000 \\
+        --output results.json
+    python -m benchmarks.storage --sizes 1000 --compare results.json
+"""
@@ -0,0 +1,135 @@
+import argparse
+import json
+import sys
+import time
+
+from labtasker.server import config, embedded_db
+
+from . import __doc__ as package_doc
+from .backends import BACKENDS, mongodb_available, open_backend
+from .results import compare, result_file
+from .workloads import WORKLOADS, preload, run_workloads
+
+DEFAULT_MONGODB_URI = "mongodb://localhost:27017/?directConnection=true"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=package_doc.split("\n\n")[0].strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=package_doc.split("\n\n", 1)[1],
+    )
+    parser.add_argument(
+        "--backends", nargs="+", default=["embedded", "sqlite"], choices=BACKENDS
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[1000, 100000, 1000000],
+        help="numbers of tasks in the queue",
+    )
+    parser.add_argument(
+        "--workloads", nargs="+", default=list(WORKLOADS), choices=WORKLOADS
+    )
+    parser.add_argument("--ops", type=int, default=2000, help="operations per workload")
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30.0,
+        help="seconds after which a workload stops, even if it has not run --ops operations",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=8, help="concurrent clients of each workload"
+    )
+    parser.add_argument(
+        "--durability",
+        default="sync",
+        choices=embedded_db.DURABILITY_POLICIES,
+        help="of the embedded and sqlite backends",
+    )
+    parser.add_argument("--mongodb-uri", default=DEFAULT_MONGODB_URI)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--compare", help="compare the results with those of a previous JSON file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="exit with an error if ops/s are divided, or bytes written per op "
+        "multiplied, by more than this compared to --compare",
+    )
+    args = parser.parse_args()
+
+    # events are published to the in-process bus, which reads its buffer size from the config
+    config._config = config.ServerConfig(db_user="benchmark", db_password="benchmark")
+
+    results = []
+    for backend in args.backends:
+        if backend == "mongodb" and not mongodb_available(args.mongodb_uri):
+            print(f"Skipping mongodb: {args.mongodb_uri} is not reachable")
+            continue
+        for size in args.sizes:
+            with open_backend(backend, args.durability, args.mongodb_uri) as (
+                db,
+                bytes_written,
+            ):
+                queue_id = db.create_queue(queue_name="queue", password="password")
+                start = time.perf_counter()
+                preload(db, queue_id, size)
+                print(
+                    f"{backend}, {size} tasks (preloaded in {time.perf_counter() - start:.1f}s):"
+                )
+                workload_results = run_workloads(
+                    db,
+                    bytes_written,
+                    queue_id,
+                    ops=args.ops,
+                    threads=args.threads,
+                    duration=args.duration,
+                    workloads=args.workloads,
+                )
+            for workload, result in workload_results.items():
+                results.append(
+                    {
+                        "backend": backend,
+                        "durability": None if backend == "mongodb" else args.durability,
+                        "size": size,
+                        "workload": workload,
+                        **result,
+                    }
+                )
+                print(f"  {workload:<10} {_summary(result)}")
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result_file(vars(args), results), f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(baseline, results, args.threshold)
+        print(f"Compared to {args.compare}:")
+        for line in lines:
+            print(f"  {line}")
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond x{args.threshold}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+def _summary(result):
+    written = result["bytes_written_per_op"]
+    return (
+        f"{result['ops_per_second']:>9.0f} ops/s  "
+        f"p50 {result['p50_ms']:>7.2f} ms  p99 {result['p99_ms']:>7.2f} ms  "
+        f"{'?' if written is None else f'{written:.0f}':>9} bytes/op"
+    )
+
+
+if __name__ == "__main__":
+    main()
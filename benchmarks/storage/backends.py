@@ -0,0 +1,91 @@
+"""Databases of the storage backends, and how many bytes each has written to disk."""
+
+import contextlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Tuple
+
+from pymongo import MongoClient as RealMongoClient
+
+from labtasker.server.database import DBService
+from labtasker.server.embedded_db import MongoClient, ServerStore
+from labtasker.server.sqlite_db import MongoClient as SQLiteMongoClient
+
+BACKENDS = ("embedded", "sqlite", "mongodb")
+
+DB_NAME = "labtasker_benchmark"
+
+# A counter of the bytes written so far
+BytesWritten = Callable[[], Optional[int]]
+
+
+def process_bytes_written() -> Optional[int]:
+    """Bytes this process passed to write() so far (Linux only), including writes of
+    background threads (e.g. group commits). Rewriting a whole file shows up here even if the
+    page cache absorbs it."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def mongodb_bytes_written(client: RealMongoClient) -> BytesWritten:
+    """Bytes written to the journal of a MongoDB server so far (by all its clients). Data
+    files are only written at checkpoints, which the journal stands for."""
+
+    def bytes_written():
+        status = client.admin.command("serverStatus")
+        try:
+            return status["wiredTiger"]["log"]["log bytes written"]
+        except KeyError:
+            return None
+
+    return bytes_written
+
+
+def mongodb_available(uri: str) -> bool:
+    try:
+        client = RealMongoClient(uri, serverSelectionTimeoutMS=1000)
+        return client.admin.command("ping")["ok"] != 0.0
+    except Exception:
+        return False
+
+
+@contextlib.contextmanager
+def open_backend(
+    backend: str, durability: str, mongodb_uri: str
+) -> Iterator[Tuple[DBService, BytesWritten]]:
+    """An empty database of a backend, and the counter of the bytes it writes."""
+    if backend == "mongodb":
+        db = DBService(db_name=DB_NAME, uri=mongodb_uri)
+        db._client.drop_database(DB_NAME)
+        db = DBService(db_name=DB_NAME, uri=mongodb_uri)  # recreates the indexes
+        try:
+            yield db, mongodb_bytes_written(db._client)
+        finally:
+            db._client.drop_database(DB_NAME)
+            db.close()
+        return
+
+    with tempfile.TemporaryDirectory(dir=os.environ.get("BENCHMARK_DIR")) as tmpdir:
+        if backend == "sqlite":
+            client = SQLiteMongoClient(
+                Path(tmpdir) / "db.sqlite", durability=durability
+            )
+        else:
+            client = MongoClient(
+                _store=ServerStore(
+                    persistence_path=str(Path(tmpdir) / "db.json"),
+                    durability=durability,
+                )
+            )
+        db = DBService(db_name=DB_NAME, client=client)
+        try:
+            yield db, process_bytes_written
+        finally:
+            client.close()
@@ -0,0 +1,99 @@
+"""Result files of the benchmark suite, and their comparison.
+
+A result file is a JSON object::
+
+    {
+        "format": 1,
+        "environment": {"labtasker": ..., "python": ..., "platform": ..., "time": ...},
+        "options": {...},  # of the run
+        "results": [
+            {"backend": "embedded", "durability": "sync", "size": 1000, "workload": "fetch",
+             "ops": 2000, "threads": 8, "elapsed": 1.2, "ops_per_second": 1666.7,
+             "p50_ms": 0.4, "p99_ms": 2.1, "bytes_written": 1234567,
+             "bytes_written_per_op": 617.3},
+            ...
+        ]
+    }
+
+`bytes_written` is null where it can not be measured.
+"""
+
+import platform
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import labtasker
+
+FORMAT_VERSION = 1
+
+# Bytes written per op may vary by this much without being a regression (e.g. 0 -> 30 bytes)
+BYTES_WRITTEN_TOLERANCE = 1024
+
+
+def result_file(options: Dict[str, Any], results: List[Dict[str, Any]]):
+    return {
+        "format": FORMAT_VERSION,
+        "environment": {
+            "labtasker": labtasker.__version__,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "time": datetime.now(timezone.utc).isoformat(),
+        },
+        "options": options,
+        "results": results,
+    }
+
+
+def _key(result: Dict[str, Any]) -> Tuple:
+    return (
+        result["backend"],
+        result["durability"],
+        result["size"],
+        result["workload"],
+    )
+
+
+def compare(
+    baseline: Dict[str, Any], results: List[Dict[str, Any]], threshold: float
+) -> Tuple[List[str], List[str]]:
+    """Compare results with those of a baseline result file.
+
+    Returns:
+        Lines of the comparison, and those of regressions: throughput divided by more than
+        `threshold`, or bytes written per op multiplied by more than `threshold` (and grown
+        by more than `BYTES_WRITTEN_TOLERANCE`).
+    """
+    before = {_key(result): result for result in baseline["results"]}
+    lines, regressions = [], []
+    for result in results:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        speedup = _ratio(result["ops_per_second"], old["ops_per_second"])
+        written = _ratio(result["bytes_written_per_op"], old["bytes_written_per_op"])
+        line = (
+            f"{'/'.join(map(str, _key(result)))}: ops/s x{_format(speedup)}, "
+            f"bytes/op x{_format(written)}"
+        )
+        lines.append(line)
+        if (speedup is not None and speedup * threshold < 1) or (
+            written is not None
+            and written > threshold
+            and result["bytes_written_per_op"] - old["bytes_written_per_op"]
+            > BYTES_WRITTEN_TOLERANCE
+        ):
+            regressions.append(line)
+    return lines, regressions
+
+
+def _ratio(new, old):
+    if new is None or old is None:
+        return None
+    if old == 0:
+        return 1.0 if new == 0 else float("inf")
+    return new / old
+
+
+def _format(ratio):
+    return "?" if ratio is None else f"{ratio:.2f}"
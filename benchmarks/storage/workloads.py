@@ -0,0 +1,212 @@
+"""Workloads of a server, run against `DBService`."""
+
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from labtasker.server.database import DBService
+from labtasker.utils import get_current_time
+
+from .backends import BytesWritten
+
+# In the order they run: fetched tasks are heartbeated, then reported
+WORKLOADS = ("submit", "fetch", "heartbeat", "report", "list", "sweep")
+
+PRELOAD_BATCH_SIZE = 10000
+
+# Tasks fetched with an expired heartbeat before each timeout sweep
+SWEEP_BATCH_SIZE = 10
+
+
+def preload(db: DBService, queue_id: str, n_tasks: int) -> None:
+    """Fill a queue with pending tasks, in bulk (not measured)."""
+    task_id = db.create_task(queue_id=queue_id, args={"i": 0})
+    template = db._tasks.find_one({"_id": task_id})
+    batch = []
+    for i in range(1, n_tasks):
+        now = get_current_time()
+        batch.append(
+            dict(
+                template,
+                _id=str(uuid.uuid4()),
+                args={"i": i},
+                created_at=now,
+                last_modified=now,
+            )
+        )
+        if len(batch) == PRELOAD_BATCH_SIZE:
+            db._tasks.insert_many(batch)
+            batch = []
+    if batch:
+        db._tasks.insert_many(batch)
+    db.flush()
+
+
+def _measure(
+    db: DBService,
+    bytes_written: BytesWritten,
+    op: Callable[[Any], Any],
+    items: Sequence[Any],
+    threads: int,
+    duration: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Run `op` on each item from a number of threads, and measure its latencies. Items left
+    once `duration` seconds elapsed are skipped."""
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def run(chunk):
+        local = []
+        for item in chunk:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            start = time.perf_counter()
+            op(item)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [
+        threading.Thread(target=run, args=(items[i::threads],)) for i in range(threads)
+    ]
+    written_before = bytes_written()
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    db.flush()  # what was written in the background counts as well
+    written_after = bytes_written()
+
+    latencies.sort()
+    written = (
+        written_after - written_before
+        if written_before is not None and written_after is not None
+        else None
+    )
+    return {
+        "ops": len(latencies),
+        "threads": threads,
+        "elapsed": elapsed,
+        "ops_per_second": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "bytes_written": written,
+        "bytes_written_per_op": (
+            written / len(latencies) if written is not None and latencies else None
+        ),
+    }
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_workloads(
+    db: DBService,
+    bytes_written: BytesWritten,
+    queue_id: str,
+    ops: int,
+    threads: int,
+    duration: Optional[float] = None,
+    workloads: Optional[Sequence[str]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Run workloads on a preloaded queue, in the order of `WORKLOADS`, each for `ops`
+    operations (`ops // 100` timeout sweeps) or `duration` seconds, whichever comes first.
+    """
+    workloads = [
+        workload for workload in WORKLOADS if workload in (workloads or WORKLOADS)
+    ]
+    results = {}
+    fetched: List[str] = []
+
+    def fetch(_):
+        task = db.fetch_task(queue_id=queue_id)
+        if task is not None:
+            fetched.append(task["_id"])
+
+    ops_of = {
+        "submit": (
+            lambda i: db.create_task(queue_id=queue_id, args={"submitted": i}),
+            range(ops),
+        ),
+        "fetch": (fetch, range(ops)),
+        "heartbeat": (
+            lambda task_id: db.refresh_task_heartbeat(
+                queue_id=queue_id, task_id=task_id
+            ),
+            lambda: [fetched[i % len(fetched)] for i in range(ops)],
+        ),
+        "report": (
+            lambda task_id: db.report_task_status(
+                queue_id=queue_id, task_id=task_id, report_status="success"
+            ),
+            lambda: list(fetched[:ops]),
+        ),
+        "list": (
+            lambda i: db.query_collection(
+                queue_id=queue_id,
+                collection_name="tasks",
+                query={"status": "pending"},
+                offset=i % 10 * 100,
+                limit=100,
+            ),
+            range(ops),
+        ),
+    }
+
+    for workload in workloads:
+        if workload == "sweep":
+            results[workload] = _measure_sweeps(
+                db, bytes_written, queue_id, max(1, ops // 100), duration
+            )
+            continue
+        op, items = ops_of[workload]
+        items = list(items() if callable(items) else items)
+        if not items:
+            continue  # e.g. heartbeats without fetching first
+        results[workload] = _measure(db, bytes_written, op, items, threads, duration)
+    return results
+
+
+def _measure_sweeps(
+    db: DBService,
+    bytes_written: BytesWritten,
+    queue_id: str,
+    n_sweeps: int,
+    duration: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Timeout sweeps run by the leader (one thread). Before each, tasks are fetched with a
+    heartbeat timeout that expires, so that each sweep has tasks to fail."""
+    latencies, written = [], 0
+    for _ in range(n_sweeps):
+        if duration is not None and sum(latencies) > duration:
+            break
+        for _ in range(SWEEP_BATCH_SIZE):
+            db.fetch_task(queue_id=queue_id, heartbeat_timeout=0.001)
+        time.sleep(0.01)
+        result = _measure(db, bytes_written, lambda _: db.handle_timeouts(), [0], 1)
+        latencies.append(result["elapsed"])
+        if written is not None and result["bytes_written"] is not None:
+            written += result["bytes_written"]
+        else:
+            written = None
+    elapsed = sum(latencies)
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "threads": 1,
+        "elapsed": elapsed,
+        "ops_per_second": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "bytes_written": written,
+        "bytes_written_per_op": (
+            written / len(latencies) if written is not None else None
+        ),
+    }
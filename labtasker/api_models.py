@@ -259,7 +259,9 @@ class Task(
 ):
     task_id: str = Field(alias="_id")  # Accepts "_id" as an input field
     queue_id: str
-    status: str = Field(..., pattern=r"^(pending|running|success|failed|cancelled)$")
+    status: str = Field(
+        ..., pattern=r"^(pending|reserved|running|success|failed|cancelled)$"
+    )
     task_name: Optional[str]
     created_at: datetime
     start_time: Optional[datetime]
@@ -275,6 +277,7 @@ class Task(
     cmd: Optional[Union[str, List[str]]]
     summary: Dict
     worker_id: Optional[str]
+    reserved_until: Optional[datetime] = None
 
 
 class TaskUpdateRequest(
@@ -333,7 +336,7 @@ class TaskLsRequest(DatetimeSerializationMixin, BaseRequestModel):  # type: igno
     task_id: Optional[str] = None
     task_name: Optional[str] = None
     status: Optional[str] = Field(
-        None, pattern=r"^(pending|running|success|failed|cancelled)$"
+        None, pattern=r"^(pending|reserved|running|success|failed|cancelled)$"
     )
     extra_filter: Optional[Dict[str, Any]] = None
     sort: Optional[List[Tuple[str, int]]] = None  # validate that int must be -1/1
@@ -375,6 +378,33 @@ class TaskStatusUpdateRequest(BaseRequestModel):
     summary: Optional[Dict[str, Any]] = None
 
 
+class TaskReportAndFetchRequest(TaskFetchRequest):  # type: ignore[misc]
+    """Status report of a task, and fetch request of the next task (by the same worker)."""
+
+    status: str = Field(..., pattern=r"^(success|failed|cancelled)$")
+    summary: Optional[Dict[str, Any]] = None
+
+
+class TaskReserveRequest(DatetimeSerializationMixin, BaseRequestModel):  # type: ignore[misc]
+    """Reservation of the next task for a worker, which is to start it (by fetching it)
+    within `reserve_timeout` seconds."""
+
+    worker_id: str
+    reserve_timeout: float = Field(..., gt=0)
+    required_fields: Optional[List[str]] = None
+    extra_filter: Optional[Dict[str, Any]] = None
+
+
+class TaskHeartbeatRequest(BaseRequestModel):
+    task_ids: List[str] = Field(..., min_length=1)
+    worker_id: Optional[str] = None
+
+
+class TaskHeartbeatResponse(BaseResponseModel):
+    refreshed: List[str] = Field(default_factory=list)
+    failed: Dict[str, str] = Field(default_factory=dict)
+
+
 class WorkerCreateRequest(BaseRequestModel, MetadataKeyValidateMixin):
     worker_name: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
@@ -0,0 +1,702 @@
+"""
+Asynchronous Python client API, on `httpx.AsyncClient`.
+
+It has the same functions as `labtasker.client.core.api` (with the same arguments,
+error casting and server notifications), as coroutines. Many requests can then be
+sent concurrently from one event loop, e.g.:
+
+    import asyncio
+    from labtasker.client import aio
+
+    async def main():
+        await asyncio.gather(
+            *(aio.submit_task(args={"i": i}) for i in range(1000))
+        )
+        await aio.close_httpx_client()
+
+    asyncio.run(main())
+"""
+
+import asyncio
+from functools import wraps
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import httpx
+import stamina
+from httpx_sse import aconnect_sse
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_409_CONFLICT
+
+from labtasker.api_models import (
+    EventResponse,
+    HealthCheckResponse,
+    QueueCreateRequest,
+    QueueCreateResponse,
+    QueueGetResponse,
+    QueueUpdateRequest,
+    TaskFetchRequest,
+    TaskFetchResponse,
+    TaskHeartbeatRequest,
+    TaskHeartbeatResponse,
+    TaskLsRequest,
+    TaskLsResponse,
+    TaskReportAndFetchRequest,
+    TaskReserveRequest,
+    TaskStatusUpdateRequest,
+    TaskSubmitRequest,
+    TaskSubmitResponse,
+    TaskUpdateRequest,
+    WorkerCreateRequest,
+    WorkerCreateResponse,
+    WorkerLsRequest,
+    WorkerLsResponse,
+    WorkerStatusUpdateRequest,
+)
+from labtasker.client.core.api import _is_network_transient_error
+from labtasker.client.core.config import get_client_config
+from labtasker.client.core.exceptions import (
+    LabtaskerRuntimeError,
+    LabtaskerValueError,
+    WorkerSuspended,
+)
+from labtasker.client.core.utils import (
+    _cast_http_error,
+    cast_http_error,
+    display_server_notifications,
+    raise_for_status,
+    transpile_query_safe,
+)
+from labtasker.constants import Priority
+from labtasker.security import SecretStr, get_auth_headers
+
+# Requests sent at once beyond this wait for one of them to end, as more requests in flight
+# only contend on the server. All the connections are kept alive, so that a burst of requests
+# does not reopen them
+MAX_CONNECTIONS = 10
+
+# the connections of a client belong to the event loop that opened them
+_httpx_client: Optional[httpx.AsyncClient] = None
+_httpx_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+__all__ = [
+    "get_httpx_client",
+    "close_httpx_client",
+    "health_check",
+    "create_queue",
+    "get_queue",
+    "delete_queue",
+    "submit_task",
+    "fetch_task",
+    "report_task_status",
+    "report_and_fetch_task",
+    "reserve_task",
+    "release_task",
+    "refresh_task_heartbeat",
+    "refresh_task_heartbeats",
+    "create_worker",
+    "ls_workers",
+    "report_worker_status",
+    "ls_tasks",
+    "update_tasks",
+    "delete_task",
+    "update_queue",
+    "delete_worker",
+    "iter_events",
+]
+
+
+def _network_err_retry(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await stamina.retry(
+            on=_is_network_transient_error,
+            attempts=10,
+            timeout=100.0,
+            wait_initial=0.5,
+            wait_max=16.0,
+            wait_jitter=1.0,
+            wait_exp_base=2.0,
+        )(func)(*args, **kwargs)
+
+    return wrapper
+
+
+class _BoundedTransport(httpx.AsyncHTTPTransport):
+    """Lets at most `max_connections` requests through at once, the others wait in order.
+
+    httpcore looks through all the requests waiting for a connection each time one is
+    assigned, which takes more CPU than sending them with hundreds of requests waiting.
+    """
+
+    def __init__(self, max_connections: int):
+        super().__init__(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            )
+        )
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # released once the response headers are received: a streamed response (e.g. of
+        # `iter_events`) keeps its connection, not a slot
+        async with self._semaphore:
+            return await super().handle_async_request(request)
+
+
+def get_httpx_client() -> httpx.AsyncClient:
+    """Lazily initialize the httpx async client of the running event loop.
+
+    A client created in an event loop that is no longer running (e.g. by a previous
+    `asyncio.run`) is replaced by a new one.
+    """
+    global _httpx_client, _httpx_client_loop
+    loop = asyncio.get_running_loop()
+    if _httpx_client is None or _httpx_client_loop is not loop:
+        config = get_client_config()
+        auth_headers = get_auth_headers(config.queue.queue_name, config.queue.password)
+        _httpx_client = httpx.AsyncClient(
+            base_url=str(config.endpoint.api_base_url),
+            headers={**auth_headers, "Content-Type": "application/json"},
+            transport=_BoundedTransport(MAX_CONNECTIONS),
+        )
+        _httpx_client_loop = loop
+    return _httpx_client
+
+
+async def close_httpx_client():
+    """Close the httpx async client."""
+    global _httpx_client, _httpx_client_loop
+    if _httpx_client is not None:
+        await _httpx_client.aclose()
+        _httpx_client = None
+        _httpx_client_loop = None
+
+
+@display_server_notifications
+@cast_http_error
+async def health_check(
+    client: Optional[httpx.AsyncClient] = None,
+) -> HealthCheckResponse:
+    """Check the health of the server."""
+    if client is None:
+        client = get_httpx_client()
+    response = await client.get("/health/full")
+    raise_for_status(response)
+    return HealthCheckResponse(**response.json())
+
+
+@display_server_notifications
+@cast_http_error
+async def create_queue(
+    queue_name: str,
+    password: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> QueueCreateResponse:
+    """Create a new queue."""
+    if client is None:
+        client = get_httpx_client()
+    payload = QueueCreateRequest(
+        queue_name=queue_name,
+        password=SecretStr(password),
+        metadata=metadata,
+    ).to_request_dict()  # Convert to dict for JSON serialization
+    response = await client.post("/api/v1/queues", json=payload)
+    raise_for_status(response)
+    return QueueCreateResponse(**response.json())
+
+
+@display_server_notifications
+@cast_http_error
+async def get_queue(client: Optional[httpx.AsyncClient] = None) -> QueueGetResponse:
+    """Get queue information."""
+    if client is None:
+        client = get_httpx_client()
+    response = await client.get("/api/v1/queues/me")
+    raise_for_status(response)
+    return QueueGetResponse(**response.json())
+
+
+@cast_http_error
+async def delete_queue(
+    cascade_delete: bool = True,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Delete a queue."""
+    if client is None:
+        client = get_httpx_client()
+    params = {"cascade_delete": cascade_delete}
+    response = await client.delete("/api/v1/queues/me", params=params)
+    raise_for_status(response)
+
+
+@display_server_notifications
+@cast_http_error
+async def submit_task(
+    task_name: Optional[str] = None,
+    args: Optional[Dict[str, Any]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    cmd: Optional[Union[str, List[str]]] = None,
+    heartbeat_timeout: Optional[float] = None,
+    task_timeout: Optional[int] = None,
+    max_retries: int = 3,
+    priority: int = Priority.MEDIUM,
+    client: Optional[httpx.AsyncClient] = None,
+) -> TaskSubmitResponse:
+    """Submit a task to the queue."""
+    if client is None:
+        client = get_httpx_client()
+
+    if not cmd and not args:
+        raise LabtaskerValueError("Either cmd or args must be specified.")
+
+    payload = TaskSubmitRequest(
+        task_name=task_name,
+        args=args,
+        metadata=metadata,
+        cmd=cmd,
+        heartbeat_timeout=heartbeat_timeout,
+        task_timeout=task_timeout,
+        max_retries=max_retries,
+        priority=priority,
+    ).model_dump(mode="json")
+    response = await client.post("/api/v1/queues/me/tasks", json=payload)
+    raise_for_status(response)
+    return TaskSubmitResponse(**response.json())
+
+
+@display_server_notifications
+@cast_http_error
+async def fetch_task(
+    worker_id: Optional[str] = None,
+    eta_max: Optional[str] = None,
+    heartbeat_timeout: Optional[float] = None,
+    start_heartbeat: bool = True,
+    required_fields: Optional[List[str]] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+    cmd: Optional[Union[str, List[str]]] = None,
+) -> TaskFetchResponse:
+    """Fetch the next available task from the queue."""
+    if client is None:
+        client = get_httpx_client()
+
+    if not eta_max and not start_heartbeat:
+        raise LabtaskerValueError(
+            "Either eta_max or start_heartbeat must be specified."
+        )
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    payload = TaskFetchRequest(
+        worker_id=worker_id,
+        eta_max=eta_max,
+        heartbeat_timeout=heartbeat_timeout,
+        start_heartbeat=start_heartbeat,
+        required_fields=required_fields,
+        extra_filter=extra_filter,
+        cmd=cmd,
+    ).dump_to_json_dict()  # make sure datetime is correctly serialized
+    response = await client.post("/api/v1/queues/me/tasks/next", json=payload)
+    if response.status_code == HTTP_403_FORBIDDEN:
+        raise WorkerSuspended(
+            "Current worker could be halted due to exceeding max failure counts."
+        )
+    raise_for_status(response)
+    return TaskFetchResponse(**response.json())
+
+
+@cast_http_error
+@_network_err_retry
+async def report_task_status(
+    task_id: str,
+    status: str,
+    summary: Optional[Dict[str, Any]] = None,
+    worker_id: Optional[str] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Report the status of a task. See `labtasker.client.core.api.report_task_status`."""
+    if client is None:
+        client = get_httpx_client()
+    payload = TaskStatusUpdateRequest(
+        status=status,
+        worker_id=worker_id,
+        summary=summary,
+    ).model_dump(mode="json")
+    response = await client.post(
+        f"/api/v1/queues/me/tasks/{task_id}/status", json=payload
+    )
+    if response.status_code == HTTP_409_CONFLICT:
+        raise LabtaskerRuntimeError(
+            "Current task is assigned to a different worker.\n"
+            f"Detail: {response.text}"
+        )
+    raise_for_status(response)
+
+
+@display_server_notifications
+@cast_http_error
+async def report_and_fetch_task(
+    task_id: str,
+    status: str,
+    summary: Optional[Dict[str, Any]] = None,
+    worker_id: Optional[str] = None,
+    eta_max: Optional[str] = None,
+    heartbeat_timeout: Optional[float] = None,
+    start_heartbeat: bool = True,
+    required_fields: Optional[List[str]] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+    cmd: Optional[Union[str, List[str]]] = None,
+) -> TaskFetchResponse:
+    """Report the status of a task and fetch the next available task in one request.
+    See `labtasker.client.core.api.report_and_fetch_task`.
+    """
+    if client is None:
+        client = get_httpx_client()
+
+    if not eta_max and not start_heartbeat:
+        raise LabtaskerValueError(
+            "Either eta_max or start_heartbeat must be specified."
+        )
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    request = TaskReportAndFetchRequest(
+        status=status,
+        summary=summary,
+        worker_id=worker_id,
+        eta_max=eta_max,
+        heartbeat_timeout=heartbeat_timeout,
+        start_heartbeat=start_heartbeat,
+        required_fields=required_fields,
+        extra_filter=extra_filter,
+        cmd=cmd,
+    )
+    payload = request.dump_to_json_dict()  # make sure datetime is correctly serialized
+    # serialized as by report_task_status
+    payload["summary"] = request.model_dump(mode="json", include={"summary"})["summary"]
+    response = await client.post(
+        f"/api/v1/queues/me/tasks/{task_id}/report_and_fetch", json=payload
+    )
+    if response.status_code == HTTP_403_FORBIDDEN:
+        raise WorkerSuspended(
+            "Current worker could be halted due to exceeding max failure counts."
+        )
+    if response.status_code == HTTP_409_CONFLICT:
+        raise LabtaskerRuntimeError(
+            "Current task is assigned to a different worker.\n"
+            f"Detail: {response.text}"
+        )
+    raise_for_status(response)
+    return TaskFetchResponse(**response.json())
+
+
+@display_server_notifications
+@cast_http_error
+async def reserve_task(
+    worker_id: str,
+    reserve_timeout: float,
+    required_fields: Optional[List[str]] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> TaskFetchResponse:
+    """Reserve the next available task for a worker, without starting it.
+    See `labtasker.client.core.api.reserve_task`.
+    """
+    if client is None:
+        client = get_httpx_client()
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    payload = TaskReserveRequest(
+        worker_id=worker_id,
+        reserve_timeout=reserve_timeout,
+        required_fields=required_fields,
+        extra_filter=extra_filter,
+    ).dump_to_json_dict()  # make sure datetime is correctly serialized
+    response = await client.post("/api/v1/queues/me/tasks/reserve", json=payload)
+    if response.status_code == HTTP_403_FORBIDDEN:
+        raise WorkerSuspended(
+            "Current worker could be halted due to exceeding max failure counts."
+        )
+    raise_for_status(response)
+    return TaskFetchResponse(**response.json())
+
+
+@cast_http_error
+@_network_err_retry
+async def release_task(
+    task_id: str,
+    worker_id: Optional[str] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Release a task reserved by `reserve_task`, so that it is pending again."""
+    if client is None:
+        client = get_httpx_client()
+    response = await client.post(
+        f"/api/v1/queues/me/tasks/{task_id}/release", params={"worker_id": worker_id}
+    )
+    raise_for_status(response)
+
+
+@cast_http_error
+@_network_err_retry
+async def refresh_task_heartbeat(
+    task_id: str,
+    worker_id: Optional[str] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Refresh the heartbeat of a task."""
+    if client is None:
+        client = get_httpx_client()
+    response = await client.post(
+        f"/api/v1/queues/me/tasks/{task_id}/heartbeat", params={"worker_id": worker_id}
+    )
+    raise_for_status(response)
+
+
+@cast_http_error
+@_network_err_retry
+async def refresh_task_heartbeats(
+    task_ids: List[str],
+    worker_id: Optional[str] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> TaskHeartbeatResponse:
+    """Refresh the heartbeats of several tasks in one request.
+    Tasks that could not be refreshed are listed in `failed` of the response, with the reason.
+    """
+    if client is None:
+        client = get_httpx_client()
+    payload = TaskHeartbeatRequest(
+        task_ids=task_ids,
+        worker_id=worker_id,
+    ).model_dump(mode="json")
+    response = await client.post("/api/v1/queues/me/tasks/heartbeat", json=payload)
+    raise_for_status(response)
+    return TaskHeartbeatResponse(**response.json())
+
+
+@cast_http_error
+async def create_worker(
+    worker_name: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    max_retries: Optional[int] = 3,
+    client: Optional[httpx.AsyncClient] = None,
+) -> str:
+    """Create a new worker."""
+    if client is None:
+        client = get_httpx_client()
+    payload = WorkerCreateRequest(
+        worker_name=worker_name,
+        metadata=metadata,
+        max_retries=max_retries,
+    ).model_dump(mode="json")
+    response = await client.post("/api/v1/queues/me/workers", json=payload)
+    raise_for_status(response)
+    return WorkerCreateResponse(**response.json()).worker_id
+
+
+@display_server_notifications
+@cast_http_error
+async def ls_workers(
+    worker_id: Optional[str] = None,
+    worker_name: Optional[str] = None,
+    status: Optional[str] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    limit: int = 100,
+    offset: int = 0,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> WorkerLsResponse:
+    """List workers."""
+    if client is None:
+        client = get_httpx_client()
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    payload = WorkerLsRequest(
+        worker_id=worker_id,
+        worker_name=worker_name,
+        status=status,
+        extra_filter=extra_filter,
+        limit=limit,
+        offset=offset,
+        sort=sort,
+    ).dump_to_json_dict()  # make sure datetime is correctly serialized
+    response = await client.post("/api/v1/queues/me/workers/search", json=payload)
+    raise_for_status(response)
+    return WorkerLsResponse(**response.json())
+
+
+@cast_http_error
+@_network_err_retry
+async def report_worker_status(
+    worker_id: str,
+    status: str,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Report the status of a worker."""
+    assert status in [
+        "active",
+        "suspended",
+        "crashed",
+    ], f"Invalid status {status}, should be one of ['active', 'suspended', 'crashed']"
+
+    if client is None:
+        client = get_httpx_client()
+    payload = WorkerStatusUpdateRequest(status=status).model_dump(mode="json")
+    response = await client.post(
+        f"/api/v1/queues/me/workers/{worker_id}/status", json=payload
+    )
+
+    if (
+        response.status_code == HTTP_400_BAD_REQUEST
+        and "InvalidStateTransition" in response.text
+    ):
+        raise LabtaskerRuntimeError(
+            f"FSM invalid transition: \n" f"Detail: {response.text}"
+        )
+
+    raise_for_status(response)
+
+
+@display_server_notifications
+@cast_http_error
+async def ls_tasks(
+    task_id: Optional[str] = None,
+    task_name: Optional[str] = None,
+    status: Optional[str] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    limit: int = 100,
+    offset: int = 0,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> TaskLsResponse:
+    """List tasks in a queue."""
+    if client is None:
+        client = get_httpx_client()
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    payload = TaskLsRequest(
+        task_id=task_id,
+        task_name=task_name,
+        status=status,
+        extra_filter=extra_filter,
+        limit=limit,
+        offset=offset,
+        sort=sort,
+    ).dump_to_json_dict()  # make sure datetime is correctly serialized
+    response = await client.post("/api/v1/queues/me/tasks/search", json=payload)
+    raise_for_status(response)
+    return TaskLsResponse(**response.json())
+
+
+@display_server_notifications
+@cast_http_error
+async def update_tasks(
+    task_updates: List[TaskUpdateRequest],
+    reset_pending: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+) -> TaskLsResponse:
+    if client is None:
+        client = get_httpx_client()
+    payload = [
+        task.model_dump(exclude_unset=True, mode="json") for task in task_updates
+    ]
+    response = await client.put(
+        "/api/v1/queues/me/tasks", json=payload, params={"reset_pending": reset_pending}
+    )
+    raise_for_status(response)
+    return TaskLsResponse(**response.json())
+
+
+@cast_http_error
+async def delete_task(
+    task_id: str,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Delete a specific task."""
+    if client is None:
+        client = get_httpx_client()
+    response = await client.delete(f"/api/v1/queues/me/tasks/{task_id}")
+    raise_for_status(response)
+
+
+@display_server_notifications
+@cast_http_error
+async def update_queue(
+    new_queue_name: Optional[str] = None,
+    new_password: Optional[str] = None,
+    metadata_update: Optional[Dict[str, Any]] = None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> QueueGetResponse:
+    """Update queue details."""
+    if client is None:
+        client = get_httpx_client()
+
+    update_request = QueueUpdateRequest(
+        new_queue_name=new_queue_name,
+        new_password=SecretStr(new_password) if new_password else None,
+        metadata_update=metadata_update,
+    )
+
+    response = await client.put(
+        "/api/v1/queues/me", json=update_request.to_request_dict()
+    )
+    raise_for_status(response)
+    return QueueGetResponse(**response.json())
+
+
+@cast_http_error
+async def delete_worker(
+    worker_id: str,
+    cascade_update: bool = True,
+    client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Delete a specific worker."""
+    if client is None:
+        client = get_httpx_client()
+    params = {"cascade_update": cascade_update}
+    response = await client.delete(
+        f"/api/v1/queues/me/workers/{worker_id}", params=params
+    )
+    raise_for_status(response)
+
+
+async def iter_events(
+    timeout: float = 300,
+    client: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[EventResponse]:
+    """
+    Iterate over the events of the queue as they arrive. (events only, pings are discarded)
+
+    Unlike `labtasker.client.core.events.EventListener`, there is no buffer nor reconnection:
+    the events are read from the connection as they are iterated over, and the iteration
+    ends with the error if the connection is lost.
+
+    Args:
+        timeout: Timeout of the connection (and between two SSEs, pings included) in seconds.
+        client: The httpx async client.
+
+    Yields:
+        EventResponse objects as they arrive.
+    """
+    if client is None:
+        client = get_httpx_client()
+    try:
+        async with aconnect_sse(
+            client, "GET", "/api/v1/queues/me/events", timeout=timeout
+        ) as event_source:
+            event_source.response.raise_for_status()
+            async for sse in event_source.aiter_sse():
+                if sse.event == "event":
+                    yield EventResponse.model_validate_json(sse.data)
+    except httpx.HTTPError as e:
+        raise _cast_http_error(e) from e
@@ -1,6 +1,7 @@
 import labtasker.client.cli.config
 import labtasker.client.cli.event as event
 import labtasker.client.cli.init
+import labtasker.client.cli.logs
 import labtasker.client.cli.loop
 import labtasker.client.cli.queue as queue
 import labtasker.client.cli.task as task
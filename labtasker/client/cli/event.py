@@ -23,6 +23,7 @@
 STATE_COLORS = {
     # task states
     "pending": "gold1",
+    "reserved": "orange1",
     "running": "dodger_blue1",
     "success": "green3",
     "failed": "red1",
@@ -0,0 +1,108 @@
+"""Implements `labtasker logs xxx`"""
+
+import sys
+
+import typer
+
+from labtasker.client.cli.cli import app
+from labtasker.client.core.cli_utils import cli_utils_decorator
+from labtasker.client.core.exceptions import (
+    LabtaskerRuntimeError,
+    LabtaskerValueError,
+)
+from labtasker.client.core.logging import stderr_console, stdout_console, write_bytes
+from labtasker.client.core.paths import get_labtasker_log_root
+from labtasker.client.core.run_logs import get_runs, open_run_file
+
+
+@app.command()
+@cli_utils_decorator(enable_requires_server_connection=False)
+def logs(
+    task_id: str = typer.Argument(..., help="ID of the task."),
+    file: str = typer.Option(
+        "run.log",
+        "--file",
+        help="File of the run dir to print, e.g. `summary.json`, `task_info.json`.",
+    ),
+    run: int = typer.Option(
+        -1,
+        "--run",
+        "-r",
+        help="Index of the run, in the order the runs of the task started. "
+        "Negative values count from the end (the last run by default).",
+    ),
+    list_runs: bool = typer.Option(
+        False,
+        "--list",
+        "-l",
+        help="List the runs of the task instead.",
+    ),
+    path: bool = typer.Option(
+        False,
+        "--path",
+        help="Print the path of the run dir (or of its archive) instead.",
+    ),
+):
+    """
+    Print the logs of a task that was run on this machine.
+
+    Runs are found through the local index of run logs (in `.labtasker/logs/index`),
+    including the runs compressed by the retention policy.
+
+    Examples:
+        labtasker logs <task_id>                     # run.log of the last run
+        labtasker logs <task_id> --file summary.json # summary of the last run
+        labtasker logs <task_id> --list              # all the runs of the task
+        labtasker logs <task_id> --run 0 --path      # where the first run is stored
+    """
+    try:
+        runs = get_runs(task_id)
+    except LabtaskerValueError as e:
+        raise typer.BadParameter(str(e))
+    if not runs:
+        stderr_console.print(
+            f"[bold red]Error:[/bold red] No logs of task {task_id} "
+            f"in {get_labtasker_log_root()}."
+        )
+        raise typer.Exit(1)
+
+    if list_runs:
+        for i, record in enumerate(runs):
+            if record.run_dir.is_dir():
+                location = str(record.run_dir)
+            elif record.archive is not None and record.archive.exists():
+                location = str(record.archive)
+            else:
+                location = "(deleted)"
+            stdout_console.print(
+                f"{i}  {record.status or 'unknown':<8}  {record.started or '-'}  {location}",
+                markup=False,
+                highlight=False,
+                soft_wrap=True,
+            )
+        raise typer.Exit()
+
+    try:
+        record = runs[run]
+    except IndexError:
+        raise typer.BadParameter(
+            f"Task {task_id} has {len(runs)} run(s), no run {run}."
+        )
+
+    if path:
+        location = record.run_dir
+        if not record.run_dir.is_dir() and record.archive is not None:
+            location = record.archive
+        stdout_console.print(
+            str(location), markup=False, highlight=False, soft_wrap=True
+        )
+        raise typer.Exit()
+
+    try:
+        with open_run_file(record, file) as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                write_bytes(sys.stdout, chunk)
+        sys.stdout.flush()
+    except (OSError, LabtaskerRuntimeError, LabtaskerValueError) as e:
+        stderr_console.print(f"[bold red]Error:[/bold red] {e}")
+        raise typer.Exit(1)
@@ -18,7 +18,12 @@
 )
 from labtasker.client.core.cmd_parser import cmd_interpolate
 from labtasker.client.core.config import get_client_config
-from labtasker.client.core.context import task_info
+from labtasker.client.core.context import (
+    current_task_id,
+    current_worker_id,
+    task_env,
+    task_info,
+)
 from labtasker.client.core.exceptions import CmdParserError, _LabtaskerJobFailed
 from labtasker.client.core.job_runner import loop_run
 from labtasker.client.core.logging import (
@@ -94,6 +99,28 @@ def loop(
         None,
         help="Time in seconds before a task is considered stalled if no heartbeat is received.",
     ),
+    concurrency: int = typer.Option(
+        1,
+        "--concurrency",
+        "-j",
+        min=1,
+        help="Number of tasks to run at the same time under this worker. Each task runs in its own run dir, with its own output capture.",
+    ),
+    prefetch: bool = typer.Option(
+        False,
+        "--prefetch",
+        help="While a task runs, reserve the next one for this worker, so that it starts right after (and run --prepare for it in the background).",
+    ),
+    prepare_cmd: Optional[str] = typer.Option(
+        None,
+        "--prepare",
+        help="Command run (with shell=True) before the command of each task, e.g. to download its data. Supports the same argument interpolation. With --prefetch, it runs while the previous task runs. The task fails if it exits with a non-zero code.",
+    ),
+    preload: Optional[List[str]] = typer.Option(
+        None,
+        "--preload",
+        help="Python modules to import once (e.g. `--preload torch,numpy`). Each task of a `python ...` command then runs in a child forked from a process that already imported them, instead of a fresh interpreter. POSIX only.",
+    ),
     use_pty: bool = typer.Option(
         os.name == "posix",  # enabled by default on POSIX systems
         callback=check_pty_available,
@@ -116,6 +143,14 @@ def loop(
 
     This will fetch tasks with 'input_file' and 'output_dir' arguments and run the command
     with those values substituted. Tasks are processed until the queue is empty.
+    With --concurrency N, up to N tasks run at the same time.
+
+    With --prefetch, the next task is reserved (and prepared by the --prepare command) while
+    the current one runs.
+
+    With --preload, a `python script.py ...`, `python -m module ...` or
+    `python -m module:function ...` command skips the startup of the interpreter and the
+    import of the preloaded modules for each task.
     """
     # Ensure only one of [CMD], [--command], or [--script-path] is specified
     cmd_sources = [cmd, option_cmd, script_path]
@@ -158,8 +193,54 @@ def loop(
 
     required_fields = list(queried_keys)
 
+    prepare = None
+    if prepare_cmd:
+        try:
+            _, prepare_keys = cmd_interpolate(prepare_cmd, dummy_variable_table)
+        except (CmdParserError, KeyError, TypeError) as e:
+            raise typer.BadParameter(f"Prepare command error with exception {e}")
+        required_fields += [k for k in prepare_keys if k not in required_fields]
+
+        def _run_prepare(args):
+            interpolated_prepare_cmd, _ = cmd_interpolate(prepare_cmd, args)
+            logger.info(f"Preparing task with command: {interpolated_prepare_cmd}")
+            # the task may be prepared while another one runs
+            env = dict(os.environ)
+            env["LABTASKER_TASK_ID"] = current_task_id() or ""
+            env["LABTASKER_WORKER_ID"] = current_worker_id() or ""
+            exit_code = run_with_subprocess(
+                interpolated_prepare_cmd, executable, True, env
+            )
+            if exit_code != 0:
+                raise _LabtaskerJobFailed(
+                    f"Prepare command finished with non-zero exit code: {exit_code}"
+                )
+
+        prepare = _run_prepare
+
     logger.info(f"Got command: {input_cmd}")
 
+    fork_server = None
+    if preload:
+        if os.name != "posix":
+            raise typer.BadParameter("--preload is only supported on POSIX systems.")
+        # imported here, as the fork server relies on POSIX-only modules (fcntl, termios)
+        from labtasker.client.core.fork_server import ForkServer, parse_python_command
+
+        python_cmd = (
+            parse_python_command(input_cmd) if isinstance(input_cmd, list) else None
+        )
+        if python_cmd is None:
+            raise typer.BadParameter(
+                "--preload requires a Python command given as [CMD] arguments, "
+                "e.g. `labtasker loop --preload torch -- python train.py --lr '%(lr)'`."
+            )
+        modules = [
+            m.strip() for entry in preload for m in entry.split(",") if m.strip()
+        ]
+        fork_server = ForkServer(python_cmd.interpreter, modules)
+        fork_server.start()
+
     @loop_run(
         required_fields=required_fields,
         extra_filter=parsed_filter,
@@ -167,6 +248,9 @@ def loop(
         eta_max=eta_max,
         heartbeat_timeout=heartbeat_timeout,
         pass_args_dict=True,
+        concurrency=concurrency,
+        prefetch=prefetch,
+        prepare=prepare,
     )
     def run_cmd(args):
         interpolated_cmd, _ = cmd_interpolate(input_cmd, args)
@@ -175,12 +259,27 @@ def run_cmd(args):
         use_shell = isinstance(interpolated_cmd, str)
 
         try:
-            if use_pty:
+            # the environment of this task, as tasks may run concurrently
+            env = task_env()
+            python_cmd = (
+                parse_python_command(interpolated_cmd, env)
+                if fork_server is not None and not use_shell
+                else None
+            )
+            if (
+                python_cmd is not None
+                and python_cmd.interpreter == fork_server.interpreter
+            ):
+                # Fork from the template process with the modules preloaded
+                exit_code = fork_server.run(python_cmd, env, use_pty)
+            elif use_pty:
                 # Use pexpect with PTY on POSIX systems
-                exit_code = run_with_pty(interpolated_cmd, executable, use_shell)
+                exit_code = run_with_pty(interpolated_cmd, executable, use_shell, env)
             else:
                 # Standard subprocess approach for non-PTY execution
-                exit_code = run_with_subprocess(interpolated_cmd, executable, use_shell)
+                exit_code = run_with_subprocess(
+                    interpolated_cmd, executable, use_shell, env
+                )
 
             if exit_code != 0:
                 raise _LabtaskerJobFailed(
@@ -192,6 +291,10 @@ def run_cmd(args):
 
         logger.info(f"Task {task_info().task_id} ended.")
 
-    run_cmd()
+    try:
+        run_cmd()
+    finally:
+        if fork_server is not None:
+            fork_server.close()
 
     logger.info("Loop ended.")
@@ -223,7 +223,7 @@ def ls(
         None,
         "--status",
         "-s",
-        help="Filter by task status. One of `pending`, `running`, `success`, `failed`, `cancelled`.",
+        help="Filter by task status. One of `pending`, `reserved`, `running`, `success`, `failed`, `cancelled`.",
     ),
     extra_filter: Optional[str] = typer.Option(
         None,
@@ -399,7 +399,7 @@ def update(
         None,
         "--status",
         "-s",
-        help="Filter by task status. One of `pending`, `running`, `success`, `failed`, `cancelled`.",
+        help="Filter by task status. One of `pending`, `reserved`, `running`, `success`, `failed`, `cancelled`.",
     ),
     extra_filter: Optional[str] = typer.Option(
         None,
@@ -1,4 +1,5 @@
-from typing import Any, Dict, List, Optional, Union
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from labtasker.client.core.api import *  # noqa: F403
 from labtasker.client.core.context import (
@@ -51,7 +52,11 @@
     "submit_task",
     "fetch_task",
     "report_task_status",
+    "report_and_fetch_task",
+    "reserve_task",
+    "release_task",
     "refresh_task_heartbeat",
+    "refresh_task_heartbeats",
     "create_worker",
     "ls_workers",
     "report_worker_status",
@@ -77,6 +82,12 @@ def loop(
     eta_max: Optional[str] = None,
     heartbeat_timeout: Optional[float] = None,
     pass_args_dict: bool = False,
+    concurrency: int = 1,
+    lightweight: bool = False,
+    log_file: Optional[Union[str, Path]] = None,
+    prefetch: bool = False,
+    prepare: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    reserve_timeout: Optional[float] = None,
 ):
     """Continuously run the wrapped job function with fetched task arguments until no tasks available.
 
@@ -89,6 +100,12 @@ def loop(
         eta_max: Maximum ETA for task execution.
         heartbeat_timeout: Heartbeat timeout in seconds. Default to 3 times the send interval.
         pass_args_dict: If True, passes task_info().args as first argument
+        concurrency: Number of tasks run at the same time by threads of this process, under the same worker.
+        lightweight: Run many short tasks faster, keeping the context of tasks in memory only (no run dir per task).
+        log_file: File that the output of the whole loop is written to, rotated as it grows.
+        prefetch: Reserve the next task while a task runs, so that it starts right after, and prepare it in the background.
+        prepare: Called with the args dict of each task before it runs (e.g. to download its data). With prefetch, ahead of time.
+        reserve_timeout: Lease of the reserved task in seconds, renewed by the heartbeats. Default to heartbeat_timeout.
 
     Returns:
         The decorated function
@@ -140,6 +157,12 @@ def decorator(func):
             eta_max=eta_max,
             heartbeat_timeout=heartbeat_timeout,
             pass_args_dict=True,
+            concurrency=concurrency,
+            lightweight=lightweight,
+            log_file=log_file,
+            prefetch=prefetch,
+            prepare=prepare,
+            reserve_timeout=reserve_timeout,
         )(func)
 
     return decorator
@@ -1,3 +1,4 @@
+import threading
 from functools import wraps
 from typing import Any, Dict, List, Optional, Tuple, Union
 
@@ -13,8 +14,12 @@
     QueueUpdateRequest,
     TaskFetchRequest,
     TaskFetchResponse,
+    TaskHeartbeatRequest,
+    TaskHeartbeatResponse,
     TaskLsRequest,
     TaskLsResponse,
+    TaskReportAndFetchRequest,
+    TaskReserveRequest,
     TaskStatusUpdateRequest,
     TaskSubmitRequest,
     TaskSubmitResponse,
@@ -41,6 +46,7 @@
 from labtasker.security import SecretStr, get_auth_headers
 
 _httpx_client: Optional[httpx.Client] = None
+_httpx_client_lock = threading.Lock()  # the client is shared by concurrent loop slots
 
 __all__ = [
     "get_httpx_client",
@@ -52,7 +58,11 @@
     "submit_task",
     "fetch_task",
     "report_task_status",
+    "report_and_fetch_task",
+    "reserve_task",
+    "release_task",
     "refresh_task_heartbeat",
+    "refresh_task_heartbeats",
     "create_worker",
     "ls_workers",
     "report_worker_status",
@@ -88,12 +98,16 @@ def get_httpx_client() -> httpx.Client:
     """Lazily initialize httpx client."""
     global _httpx_client
     if _httpx_client is None:
-        config = get_client_config()
-        auth_headers = get_auth_headers(config.queue.queue_name, config.queue.password)
-        _httpx_client = httpx.Client(
-            base_url=str(config.endpoint.api_base_url),
-            headers={**auth_headers, "Content-Type": "application/json"},
-        )
+        with _httpx_client_lock:
+            if _httpx_client is None:
+                config = get_client_config()
+                auth_headers = get_auth_headers(
+                    config.queue.queue_name, config.queue.password
+                )
+                _httpx_client = httpx.Client(
+                    base_url=str(config.endpoint.api_base_url),
+                    headers={**auth_headers, "Content-Type": "application/json"},
+                )
     return _httpx_client
 
 
@@ -278,6 +292,121 @@ def report_task_status(
     raise_for_status(response)
 
 
+@display_server_notifications
+@cast_http_error
+def report_and_fetch_task(
+    task_id: str,
+    status: str,
+    summary: Optional[Dict[str, Any]] = None,
+    worker_id: Optional[str] = None,
+    eta_max: Optional[str] = None,
+    heartbeat_timeout: Optional[float] = None,
+    start_heartbeat: bool = True,
+    required_fields: Optional[List[str]] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    client: Optional[httpx.Client] = None,
+    cmd: Optional[Union[str, List[str]]] = None,
+) -> TaskFetchResponse:
+    """Report the status of a task (see `report_task_status`) and fetch the next available
+    task (see `fetch_task`) in one request.
+
+    If the report fails, nothing is changed. Once reported, the fetch fails as `fetch_task`
+    would, e.g. with WorkerSuspended when the failure reported suspended the worker.
+    The request is not retried on network errors, as the report may have been done.
+    """
+    if client is None:
+        client = get_httpx_client()
+
+    if not eta_max and not start_heartbeat:
+        raise LabtaskerValueError(
+            "Either eta_max or start_heartbeat must be specified."
+        )
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    request = TaskReportAndFetchRequest(
+        status=status,
+        summary=summary,
+        worker_id=worker_id,
+        eta_max=eta_max,
+        heartbeat_timeout=heartbeat_timeout,
+        start_heartbeat=start_heartbeat,
+        required_fields=required_fields,
+        extra_filter=extra_filter,
+        cmd=cmd,
+    )
+    payload = request.dump_to_json_dict()  # make sure datetime is correctly serialized
+    # serialized as by report_task_status
+    payload["summary"] = request.model_dump(mode="json", include={"summary"})["summary"]
+    response = client.post(
+        f"/api/v1/queues/me/tasks/{task_id}/report_and_fetch", json=payload
+    )
+    if response.status_code == HTTP_403_FORBIDDEN:
+        raise WorkerSuspended(
+            "Current worker could be halted due to exceeding max failure counts."
+        )
+    if response.status_code == HTTP_409_CONFLICT:
+        raise LabtaskerRuntimeError(
+            "Current task is assigned to a different worker.\n"
+            f"Detail: {response.text}"
+        )
+    raise_for_status(response)
+    return TaskFetchResponse(**response.json())
+
+
+@display_server_notifications
+@cast_http_error
+def reserve_task(
+    worker_id: str,
+    reserve_timeout: float,
+    required_fields: Optional[List[str]] = None,
+    extra_filter: Optional[Union[str, Dict[str, Any]]] = None,
+    client: Optional[httpx.Client] = None,
+) -> TaskFetchResponse:
+    """Reserve the next available task for a worker, without starting it.
+
+    The worker starts it with its next `fetch_task` (or `report_and_fetch_task`), which
+    returns the tasks reserved by the worker first. A reservation not started within
+    `reserve_timeout` seconds is released, and the task is pending again.
+    """
+    if client is None:
+        client = get_httpx_client()
+
+    if isinstance(extra_filter, str):  # transpile to mongodb query
+        extra_filter = transpile_query_safe(query_str=extra_filter)
+
+    payload = TaskReserveRequest(
+        worker_id=worker_id,
+        reserve_timeout=reserve_timeout,
+        required_fields=required_fields,
+        extra_filter=extra_filter,
+    ).dump_to_json_dict()  # make sure datetime is correctly serialized
+    response = client.post("/api/v1/queues/me/tasks/reserve", json=payload)
+    if response.status_code == HTTP_403_FORBIDDEN:
+        raise WorkerSuspended(
+            "Current worker could be halted due to exceeding max failure counts."
+        )
+    raise_for_status(response)
+    return TaskFetchResponse(**response.json())
+
+
+@cast_http_error
+@_network_err_retry
+def release_task(
+    task_id: str,
+    worker_id: Optional[str] = None,
+    client: Optional[httpx.Client] = None,
+) -> None:
+    """Release a task reserved by `reserve_task`, so that it is pending again."""
+    if client is None:
+        client = get_httpx_client()
+    response = client.post(
+        f"/api/v1/queues/me/tasks/{task_id}/release", params={"worker_id": worker_id}
+    )
+    raise_for_status(response)
+
+
 @cast_http_error
 @_network_err_retry
 def refresh_task_heartbeat(
@@ -294,6 +423,27 @@ def refresh_task_heartbeat(
     raise_for_status(response)
 
 
+@cast_http_error
+@_network_err_retry
+def refresh_task_heartbeats(
+    task_ids: List[str],
+    worker_id: Optional[str] = None,
+    client: Optional[httpx.Client] = None,
+) -> TaskHeartbeatResponse:
+    """Refresh the heartbeats of several tasks in one request.
+    Tasks that could not be refreshed are listed in `failed` of the response, with the reason.
+    """
+    if client is None:
+        client = get_httpx_client()
+    payload = TaskHeartbeatRequest(
+        task_ids=task_ids,
+        worker_id=worker_id,
+    ).model_dump(mode="json")
+    response = client.post("/api/v1/queues/me/tasks/heartbeat", json=payload)
+    raise_for_status(response)
+    return TaskHeartbeatResponse(**response.json())
+
+
 @cast_http_error
 def create_worker(
     worker_name: Optional[str] = None,
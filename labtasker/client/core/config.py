@@ -7,7 +7,7 @@
 import tomlkit
 import typer
 from packaging.utils import canonicalize_name
-from pydantic import Field, HttpUrl, SecretStr, model_validator
+from pydantic import Field, HttpUrl, SecretStr, field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from labtasker.client.core.exceptions import LabtaskerRuntimeError
@@ -19,6 +19,7 @@
 )
 from labtasker.filtering import register_sensitive_text
 from labtasker.security import get_auth_headers
+from labtasker.utils import parse_time_interval
 
 
 class EndpointConfig(BaseSettings):
@@ -40,6 +41,26 @@ class QueueConfig(BaseSettings):
 class TaskConfig(BaseSettings):
     heartbeat_interval: float = 30.0  # seconds
 
+    # run.log is written in the background: output queued beyond log_buffer_size bytes
+    # either blocks the job until the file catches up ("block"), or is dropped ("drop")
+    log_buffer_size: int = Field(default=8 * 1024 * 1024, gt=0)
+    log_overflow: str = Field(default="block", pattern=r"^(block|drop)$")
+
+
+class LogsConfig(BaseSettings):
+    # retention of the run dirs of finished tasks (.labtasker/logs/run), applied by loops:
+    # compressed after compress_after, deleted after max_age, or oldest first while all
+    # the runs take more than max_size bytes. Durations as in "24h". All disabled by default.
+    compress_after: Optional[str] = None
+    max_age: Optional[str] = None
+    max_size: Optional[int] = Field(default=None, gt=0)
+
+    @field_validator("compress_after", "max_age")
+    def validate_duration(cls, value):
+        if value:
+            parse_time_interval(value)  # raises ValueError
+        return value
+
 
 class PluginConfig(BaseSettings):
     default: str = Field(default="all", pattern=r"^(all|selected)$")
@@ -79,6 +100,8 @@ class ClientConfig(BaseSettings):
 
     task: TaskConfig = Field(default_factory=TaskConfig)
 
+    logs: LogsConfig = Field(default_factory=LogsConfig)
+
     cli_plugins: PluginConfig = Field(default_factory=PluginConfig)
 
     model_config = SettingsConfigDict(
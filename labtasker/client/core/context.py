@@ -1,7 +1,7 @@
 import json
 import os
 from contextvars import ContextVar
-from typing import Optional
+from typing import Dict, Optional
 
 from labtasker.api_models import Task
 from labtasker.client.core.exceptions import LabtaskerRuntimeError
@@ -39,13 +39,14 @@ def task_info() -> Optional[Task]:
     return _current_task_info.get()
 
 
-def set_task_info(info: Task):
+def set_task_info(info: Task, set_env: bool = True):
     _current_task_info.set(info)
-    set_current_task_id(info.task_id)
+    set_current_task_id(info.task_id, set_env=set_env)
 
 
-def set_current_task_id(task_id: str):
-    os.environ["LABTASKER_TASK_ID"] = task_id
+def set_current_task_id(task_id: str, set_env: bool = True):
+    if set_env:
+        os.environ["LABTASKER_TASK_ID"] = task_id
     _current_task_id.set(task_id)
 
 
@@ -54,6 +55,16 @@ def set_current_worker_id(worker_id: Optional[str]):
     _current_worker_id.set(worker_id)
 
 
+def task_env() -> Dict[str, str]:
+    """Environment variables for a job process of the current task.
+    The process-wide ones may belong to another task when tasks run concurrently."""
+    env = dict(os.environ)
+    env["LABTASKER_TASK_ID"] = current_task_id() or ""
+    env["LABTASKER_WORKER_ID"] = current_worker_id() or ""
+    env["LABTASKER_LOG_DIR"] = str(get_labtasker_log_dir())
+    return env
+
+
 def is_enabled() -> bool:
     """Whether current script is executed under Labtasker context."""
     return current_worker_id() is not None
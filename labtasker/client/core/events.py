@@ -6,8 +6,8 @@
 import json
 import threading
 import time
-from queue import Empty, Queue
-from typing import Iterator, Optional
+from queue import Empty, Full, Queue
+from typing import Dict, Iterator, List, Literal, Optional
 
 import httpx
 import stamina
@@ -20,28 +20,50 @@
 from labtasker.client.core.logging import logger
 from labtasker.security import get_auth_headers
 
+OverflowPolicy = Literal["drop_oldest", "drop_newest", "block"]
+
 
 class EventListener:
     """Client-side event listener for Labtasker server events."""
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_queue_size: int = 10000,
+        overflow_policy: OverflowPolicy = "drop_oldest",
+    ):
         """
         Initialize an event listener.
+
+        Args:
+            max_queue_size: Maximum number of received SSEs buffered before being consumed.
+            overflow_policy: What to do when the buffer is full.
+                - "drop_oldest": discard the oldest buffered SSE to make room.
+                - "drop_newest": discard the incoming SSE.
+                - "block": stop reading from the connection until there is room
+                  (the server may then drop events for this client instead).
         """
+        if max_queue_size <= 0:
+            raise ValueError("max_queue_size must be positive")
+        if overflow_policy not in ("drop_oldest", "drop_newest", "block"):
+            raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+
         self.config = get_client_config()
         self.base_url = self.config.endpoint.api_base_url
         self.auth_headers = get_auth_headers(
             self.config.queue.queue_name, self.config.queue.password
         )
 
-        self._event_queue: Queue = Queue()
+        self.overflow_policy = overflow_policy
+        self._event_queue: Queue = Queue(maxsize=max_queue_size)
+        self._num_received = 0
+        self._num_dropped = 0
         self._stop_event = threading.Event()
         self._listener_thread: Optional[threading.Thread] = None
         self._client_id: Optional[str] = None
         self._connected = False
         self._error: Optional[Exception] = None
 
-        self._retry_context_iter = None
+        self._retry_context_iter: Optional[Iterator[stamina.Attempt]] = None
         self.retry_context_iter(reset=True)
 
     def start(self, timeout: int = 10) -> "EventListener":
@@ -110,6 +132,20 @@ def get_client_id(self) -> Optional[str]:
         """Get the client ID assigned by the server."""
         return self._client_id
 
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Get counters of the event buffer.
+
+        Returns:
+            A dict with the number of received, dropped (due to buffer overflow) and
+            currently buffered SSEs.
+        """
+        return {
+            "received": self._num_received,
+            "dropped": self._num_dropped,
+            "queued": self._event_queue.qsize(),
+        }
+
     def get_raw_sse(self, timeout: Optional[float] = None) -> Optional[ServerSentEvent]:
         """
         Get next SSE from the queue.
@@ -126,6 +162,34 @@ def get_raw_sse(self, timeout: Optional[float] = None) -> Optional[ServerSentEve
         except Empty:
             return None
 
+    def get_raw_sses(
+        self, max_n: int, timeout: Optional[float] = None
+    ) -> List[ServerSentEvent]:
+        """
+        Get up to `max_n` SSEs from the queue.
+        Waits for the first SSE, then takes whatever else is already buffered without waiting.
+
+        Args:
+            max_n: Maximum number of SSEs to return.
+            timeout: Maximum time to wait for the first SSE in seconds.
+                    If None, will wait indefinitely.
+
+        Returns:
+            A list of SSEs, empty if timeout is reached.
+        """
+        if not self.is_connected():
+            raise LabtaskerRuntimeError("Event listener is not connected")
+        try:
+            batch = [self._event_queue.get(timeout=timeout)]
+        except Empty:
+            return []
+        while len(batch) < max_n:
+            try:
+                batch.append(self._event_queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
     def get_event(self, timeout: Optional[float] = None) -> Optional[EventResponse]:
         """
         Get the next event from the queue. (event only, pings are discarded)
@@ -143,33 +207,67 @@ def get_event(self, timeout: Optional[float] = None) -> Optional[EventResponse]:
         try:
             sse = self._event_queue.get(timeout=timeout)
             if sse.event == "event":
-                return EventResponse(**json.loads(sse.data))
+                return EventResponse.model_validate_json(sse.data)
             return None  # Skip non-event messages like pings
         except Empty:
             return None
 
-    def iter_events(self) -> Iterator[EventResponse]:
+    def get_events(
+        self, max_n: int, timeout: Optional[float] = None
+    ) -> List[EventResponse]:
+        """
+        Get up to `max_n` events from the queue. (events only, pings are discarded)
+        Waits until at least one event arrives, then takes whatever else is already buffered.
+
+        Args:
+            max_n: Maximum number of events to return.
+            timeout: Maximum time to wait for the first event in seconds.
+                    If None, will wait indefinitely.
+
+        Returns:
+            A list of events, empty if timeout is reached.
+        """
+        if not self.is_connected():
+            raise LabtaskerRuntimeError("Event listener is not connected")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        events: List[EventResponse] = []
+        while len(events) < max_n:
+            try:
+                if events:
+                    sse = self._event_queue.get_nowait()
+                elif deadline is None:
+                    sse = self._event_queue.get()
+                else:
+                    sse = self._event_queue.get(
+                        timeout=max(0.0, deadline - time.monotonic())
+                    )
+            except Empty:
+                break
+            if sse.event == "event":
+                events.append(EventResponse.model_validate_json(sse.data))
+        return events
+
+    def iter_events(self, batch_size: int = 1000) -> Iterator[EventResponse]:
         """
         Iterate over events as they arrive.
 
+        Args:
+            batch_size: Maximum number of events taken from the queue at once.
+
         Yields:
             EventResponse objects as they arrive.
         """
         while self.is_connected():
-            event = self.get_event(timeout=1.0)  # prevent queue blocking forever
-            if event:
-                yield event
-            time.sleep(0.1)
+            # timeout prevents blocking forever after disconnection
+            yield from self.get_events(max_n=batch_size, timeout=1.0)
 
-    def iter_raw_sse(self) -> Iterator[ServerSentEvent]:
+    def iter_raw_sse(self, batch_size: int = 1000) -> Iterator[ServerSentEvent]:
         """
         Iterate over raw SSE events as they arrive.
         """
         while self.is_connected():
-            sse = self.get_raw_sse(timeout=1.0)
-            if sse:
-                yield sse
-            time.sleep(0.1)
+            yield from self.get_raw_sses(max_n=batch_size, timeout=1.0)
 
     def retry_context_iter(self, reset: bool = False):
         if reset:
@@ -210,7 +308,7 @@ def _event_listener_thread(self) -> None:
                                 self._connected = True
 
                             # Queue the event for processing
-                            self._event_queue.put(sse)
+                            self._enqueue(sse)
                             # reset retry context, as the retry is intended for **consecutive** failures
                             self.retry_context_iter(reset=True)
 
@@ -226,19 +324,57 @@ def _event_listener_thread(self) -> None:
         finally:
             self._connected = False
 
+    def _enqueue(self, sse: ServerSentEvent) -> None:
+        """Put the SSE into the queue, applying the overflow policy if it is full."""
+        self._num_received += 1
+        if self.overflow_policy == "block":
+            while not self._stop_event.is_set():
+                try:
+                    self._event_queue.put(sse, timeout=0.1)
+                    return
+                except Full:
+                    continue
+            return
+
+        try:
+            self._event_queue.put_nowait(sse)
+            return
+        except Full:
+            pass
+
+        if self.overflow_policy == "drop_newest":
+            self._num_dropped += 1
+            return
+
+        try:
+            self._event_queue.get_nowait()
+            self._num_dropped += 1
+        except Empty:
+            pass  # the consumer made room meanwhile, nothing is dropped
+        # this thread is the only producer, so there is room now
+        self._event_queue.put_nowait(sse)
+
 
 # Convenience functions
-def connect_events(timeout: int = 10) -> EventListener:
+def connect_events(
+    timeout: int = 10,
+    max_queue_size: int = 10000,
+    overflow_policy: OverflowPolicy = "drop_oldest",
+) -> EventListener:
     """
     Connect to the event stream.
 
     Args:
         timeout: Maximum time to wait for connection in seconds.
+        max_queue_size: Maximum number of received SSEs buffered before being consumed.
+        overflow_policy: What to do when the buffer is full. See `EventListener`.
 
     Returns:
         An EventListener instance.
     """
-    return EventListener().start(timeout=timeout)
+    return EventListener(
+        max_queue_size=max_queue_size, overflow_policy=overflow_policy
+    ).start(timeout=timeout)
 
 
 __all__ = [
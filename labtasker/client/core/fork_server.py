@@ -0,0 +1,231 @@
+"""Fork-server mode of `labtasker loop --preload`: instead of starting a fresh interpreter
+per task, a template process imports the preloaded modules once, then forks a child per task.
+The template side is in `labtasker.client.core.fork_template`."""
+
+import fcntl
+import os
+import re
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import termios
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from labtasker.client.core import fork_template
+from labtasker.client.core.exceptions import LabtaskerRuntimeError
+from labtasker.client.core.logging import logger
+from labtasker.client.core.utils import job_process_group, pump_output
+
+_PYTHON_RE = re.compile(r"^python[\d.]*(\.exe)?$")
+
+# Seconds an interrupted child is given to exit before it is killed
+_INTERRUPT_GRACE_PERIOD = 5.0
+
+
+@dataclass
+class PythonCommand:
+    """A `python ...` command, split the way the interpreter reads it."""
+
+    interpreter: str  # resolved path of the executable
+    kind: str  # "path", "module", "entry_point" or "code"
+    target: str  # script path, module name, "module:function" or code
+    args: List[str]  # sys.argv[1:]
+    unbuffered: bool = False
+
+
+def parse_python_command(
+    cmd: List[str], env: Optional[Dict[str, str]] = None
+) -> Optional[PythonCommand]:
+    """Parse `python [-u] (script | -m module[:function] | -c code) args...`.
+
+    Returns None if `cmd` is not such a command, e.g. if it sets interpreter options that can
+    not be applied to a forked child (-O, -X, -W...).
+    """
+    if not cmd or not _PYTHON_RE.match(os.path.basename(cmd[0])):
+        return None
+    interpreter = shutil.which(cmd[0], path=(env or os.environ).get("PATH"))
+    if interpreter is None:
+        return None
+
+    unbuffered = False
+    i = 1
+    while i < len(cmd) and cmd[i] == "-u":
+        unbuffered = True
+        i += 1
+    if i >= len(cmd):
+        return None  # an interactive interpreter
+    if cmd[i] in ("-m", "-c"):
+        if i + 1 >= len(cmd):
+            return None
+        target = cmd[i + 1]
+        if cmd[i] == "-c":
+            kind = "code"
+        elif ":" in target:
+            kind = "entry_point"
+        else:
+            kind = "module"
+        return PythonCommand(interpreter, kind, target, cmd[i + 2 :], unbuffered)
+    if cmd[i].startswith("-"):
+        return None
+    return PythonCommand(interpreter, "path", cmd[i], cmd[i + 1 :], unbuffered)
+
+
+class ForkServer:
+    """A template process with `modules` imported, which forks a child per task.
+
+    `run()` may be called from several threads at once: each task has its own reply socket.
+    """
+
+    def __init__(self, interpreter: str, modules: List[str]):
+        self.interpreter = interpreter
+        self.modules = modules
+        self._process: Optional[subprocess.Popen] = None
+        self._control: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the template process, and wait until it imported the modules."""
+        control, remote = socket.socketpair()
+        self._process = subprocess.Popen(
+            [
+                self.interpreter,
+                "-c",
+                fork_template.BOOTSTRAP,
+                fork_template.__file__,
+                str(remote.fileno()),
+                *self.modules,
+            ],
+            pass_fds=(remote.fileno(),),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            # interrupts are forwarded to the child of each task by run()
+            start_new_session=True,
+        )
+        remote.close()
+        self._control = control
+
+        message, _ = fork_template.recv_message(control)
+        if message is None or "error" in message:
+            self.close()
+            raise LabtaskerRuntimeError(
+                f"Failed to preload modules {self.modules} with {self.interpreter}:\n"
+                + (message["error"] if message else "the template process exited.")
+            )
+        logger.debug(
+            f"Fork server {self._process.pid} started with modules {self.modules}."
+        )
+
+    def close(self):
+        """Stop the template process (children still running are terminated)."""
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=_INTERRUPT_GRACE_PERIOD)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def run(
+        self,
+        command: PythonCommand,
+        env: Optional[Dict[str, str]] = None,
+        use_pty: bool = False,
+    ) -> int:
+        """Run a command in a child forked from the template, with its output streamed to
+        sys.stdout and sys.stderr (the pty merges both into sys.stdout).
+
+        Returns:
+            The exit code of the child, negative if it was killed by a signal.
+        """
+        if self._control is None:
+            raise LabtaskerRuntimeError("Fork server is not running.")
+
+        reply, remote = socket.socketpair()
+        if use_pty:
+            master, slave = os.openpty()
+            fcntl.ioctl(slave, termios.TIOCSWINSZ, _window_size())
+            child_fds = [slave, slave, slave]
+            outputs = {master: sys.stdout}
+        else:
+            out_r, out_w = os.pipe()
+            err_r, err_w = os.pipe()
+            child_fds = [os.open(os.devnull, os.O_RDONLY), out_w, err_w]
+            outputs = {out_r: sys.stdout, err_r: sys.stderr}
+
+        request = {
+            "argv": command.args,
+            "kind": command.kind,
+            "target": command.target,
+            "unbuffered": command.unbuffered,
+            "pty": use_pty,
+            "env": dict(os.environ if env is None else env),
+            "cwd": os.getcwd(),
+        }
+        try:
+            with self._lock:
+                fork_template.send_message(
+                    self._control, request, [remote.fileno(), *child_fds]
+                )
+        finally:
+            remote.close()
+            for fd in set(child_fds):
+                os.close(fd)
+
+        pid = None
+        try:
+            message, _ = fork_template.recv_message(reply)
+            if message is None:
+                raise LabtaskerRuntimeError("Fork server exited unexpectedly.")
+            pid = message["pid"]
+
+            with job_process_group(pid):
+                pump_output(outputs)
+
+            message, _ = fork_template.recv_message(reply)
+            if message is None:
+                raise LabtaskerRuntimeError("Fork server exited unexpectedly.")
+            return message["exit_code"]
+        except BaseException:
+            if pid is not None:
+                _interrupt(pid, reply)
+            raise
+        finally:
+            reply.close()
+            for fd in outputs:
+                os.close(fd)
+
+
+def _window_size() -> bytes:
+    """Window size of the pty of a child: that of the terminal of this process, if any."""
+    size = shutil.get_terminal_size()
+    return struct.pack("HHHH", size.lines, size.columns, 0, 0)
+
+
+def _interrupt(pid: int, reply: socket.socket) -> None:
+    """Interrupt a child (as Ctrl+C would), and kill it if it does not exit in time."""
+    try:
+        os.kill(pid, signal.SIGINT)
+        reply.settimeout(_INTERRUPT_GRACE_PERIOD)
+        try:
+            fork_template.recv_message(reply)
+            return
+        except (socket.timeout, OSError):
+            pass
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
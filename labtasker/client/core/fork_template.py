@@ -0,0 +1,274 @@
+"""The template process of `labtasker loop --preload`.
+
+It imports the preloaded modules once, then forks a child per task, which runs the Python
+command of the task (a script, `-m module`, `-m module:function` or `-c code`) as the
+interpreter would. See `labtasker.client.core.fork_server` for the loop side.
+
+This file only depends on the standard library, and is run by path with the interpreter of the
+tasks (`python -c <bootstrap> <this file> <control fd> <modules...>`), so that the template
+does not import labtasker: a job that imports it reads the `LABTASKER_*` variables of its own
+task, like in a fresh interpreter.
+
+Messages are length-prefixed JSON, file descriptors are passed along with them (SCM_RIGHTS).
+From the loop to the template, on the control socket:
+    {"argv": [...], "kind": ..., "target": ..., "unbuffered": bool, "pty": bool,
+     "env": {...}, "cwd": ...} with fds [reply socket, stdin, stdout, stderr]
+From the template, on the control socket once: {"ready": true} or {"error": traceback}
+From the template, on the reply socket of a task: {"pid": pid}, then {"exit_code": code}
+"""
+
+import builtins
+import importlib
+import io
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import struct
+import sys
+import traceback
+import types
+from typing import Any, Callable
+
+BOOTSTRAP = "import runpy, sys; runpy.run_path(sys.argv[1], run_name='__main__')"
+
+_HEADER = struct.Struct("!I")
+_MAX_FDS = 4
+
+
+def send_message(sock: socket.socket, message: dict, fds=()) -> None:
+    payload = json.dumps(message).encode()
+    header = _HEADER.pack(len(payload))
+    if fds:
+        socket.send_fds(sock, [header], list(fds))
+    else:
+        sock.sendall(header)
+    sock.sendall(payload)
+
+
+def recv_message(sock: socket.socket):
+    """Returns (message, fds), message is None once the peer closed the socket."""
+    header, fds, _, _ = socket.recv_fds(sock, _HEADER.size, _MAX_FDS)
+    if header:
+        header += _recv_exactly(sock, _HEADER.size - len(header))
+    if len(header) < _HEADER.size:
+        for fd in fds:
+            os.close(fd)
+        return None, []
+    payload = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    return json.loads(payload), fds
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def serve(control: socket.socket, modules) -> None:
+    try:
+        for module in modules:
+            importlib.import_module(module)
+    except BaseException:
+        send_message(control, {"error": traceback.format_exc()})
+        return
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    # SIGCHLD wakes the selector up, to report the exit codes of children
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(control, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    replies = {}  # pid -> reply socket
+
+    send_message(control, {"ready": True})
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is not control:
+                while True:
+                    try:
+                        if not os.read(wakeup_r, 4096):
+                            break
+                    except BlockingIOError:
+                        break
+                continue
+
+            request, fds = recv_message(control)
+            if request is None:  # the loop ended
+                for pid in replies:
+                    _kill(pid, signal.SIGTERM)
+                return
+
+            pid = os.fork()
+            if pid == 0:
+                selector.close()
+                control.close()
+                for sock in replies.values():
+                    sock.close()
+                signal.set_wakeup_fd(-1)
+                os.close(wakeup_r)
+                os.close(wakeup_w)
+                # ends the child as the end of a script would (atexit, non-daemon threads)
+                sys.exit(_run_child(request, fds))
+
+            reply = socket.socket(fileno=fds[0])
+            for fd in set(fds[1:]):
+                os.close(fd)
+            try:
+                send_message(reply, {"pid": pid})
+            except OSError:
+                pass
+            replies[pid] = reply
+
+        _reap(replies)
+
+
+def _reap(replies) -> None:
+    while replies:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        reply = replies.pop(pid, None)
+        if reply is None:
+            continue
+        try:
+            send_message(reply, {"exit_code": os.waitstatus_to_exitcode(status)})
+        except OSError:
+            pass
+        reply.close()
+
+
+def _kill(pid: int, sig: int) -> None:
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _run_child(request: dict, fds) -> int:
+    """Set the child up as a fresh interpreter of the task, and run its command."""
+    os.close(fds[0])
+    if request["pty"]:
+        os.setsid()
+    else:
+        os.setpgid(0, 0)  # so that the processes of the job can be terminated at once
+    for target_fd, fd in enumerate(fds[1:]):
+        os.dup2(fd, target_fd)
+    for fd in set(fds[1:]):
+        if fd > 2:
+            os.close(fd)
+    if request["pty"]:
+        import fcntl
+        import termios
+
+        fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    _reopen_stdio(
+        unbuffered=request["unbuffered"] or bool(os.environ.get("PYTHONUNBUFFERED"))
+    )
+
+    try:
+        return _exit_code_of(_run_target(request))
+    except SystemExit as e:
+        return _exit_code_of(e.code)
+    except BaseException as e:
+        tb = e.__traceback__
+        # hide the frames of the template, as a fresh interpreter would not have them
+        while tb is not None and tb.tb_frame.f_code.co_filename in (
+            __file__,
+            runpy.__file__,
+        ):
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        return 128 + signal.SIGINT if isinstance(e, KeyboardInterrupt) else 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def _run_target(request: dict):
+    kind, target, args = request["kind"], request["target"], request["argv"]
+    if kind == "path":
+        sys.argv = [target, *args]
+        sys.path[0] = os.path.dirname(os.path.realpath(target))
+        runpy.run_path(target, run_name="__main__")
+    elif kind == "module":
+        sys.argv = ["-m", *args]
+        sys.path[0] = os.getcwd()
+        runpy.run_module(target, run_name="__main__", alter_sys=True)
+    elif kind == "entry_point":
+        module, _, attr = target.partition(":")
+        sys.argv = [module, *args]
+        sys.path[0] = os.getcwd()
+        obj: Any = importlib.import_module(module)
+        for name in attr.split("."):
+            obj = getattr(obj, name)
+        func: Callable[[], Any] = obj
+        return func()  # as in console scripts: sys.exit(func())
+    elif kind == "code":
+        sys.argv = ["-c", *args]
+        sys.path[0] = ""
+        main = types.ModuleType("__main__")
+        main.__builtins__ = builtins  # type: ignore[attr-defined]
+        sys.modules["__main__"] = main
+        exec(compile(target, "<string>", "exec"), main.__dict__)
+    return None
+
+
+def _exit_code_of(code) -> int:
+    """Exit code of `sys.exit(code)`."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _reopen_stdio(unbuffered: bool) -> None:
+    """Streams on the new file descriptors 0, 1 and 2, buffered as the interpreter would."""
+    encoding = getattr(sys.stdout, "encoding", None) or "utf-8"
+    stdin = io.TextIOWrapper(
+        io.BufferedReader(io.FileIO(0, "r", closefd=False)), encoding=encoding
+    )
+    sys.stdin = stdin
+    # `sys.__stdin__` is typed as final, but is replaced as the other streams are
+    setattr(sys, "__stdin__", stdin)
+    for name, fd in (("stdout", 1), ("stderr", 2)):
+        raw = io.FileIO(fd, "w", closefd=False)
+        stream = io.TextIOWrapper(
+            raw if unbuffered else io.BufferedWriter(raw),  # type: ignore[arg-type]
+            encoding=encoding,
+            errors="backslashreplace" if name == "stderr" else "strict",
+            line_buffering=name == "stderr" or os.isatty(fd),
+            write_through=unbuffered,
+        )
+        setattr(sys, name, stream)
+        setattr(sys, f"__{name}__", stream)
+
+
+if __name__ == "__main__":
+    # argv: ["-c", <this file>, <control fd>, <modules...>], sys.path[0] is the working
+    # directory (as with -c), so that modules of the project can be preloaded
+    serve(socket.socket(fileno=int(sys.argv[2])), sys.argv[3:])
@@ -1,14 +1,17 @@
-import os
 import threading
 import time
+from collections import defaultdict
 from contextvars import ContextVar
-from typing import Optional
+from typing import Dict, List, Optional, Set
 
-from labtasker.client.core.api import refresh_task_heartbeat
+from labtasker.client.core.api import refresh_task_heartbeat, refresh_task_heartbeats
 from labtasker.client.core.config import get_client_config
-from labtasker.client.core.exceptions import LabtaskerRuntimeError
+from labtasker.client.core.exceptions import (
+    LabtaskerHTTPStatusError,
+    LabtaskerRuntimeError,
+)
 from labtasker.client.core.logging import logger
-from labtasker.client.core.paths import get_labtasker_log_dir
+from labtasker.client.core.utils import is_missing_route
 
 __all__ = [
     "start_heartbeat",
@@ -17,80 +20,149 @@
 
 
 class Heartbeat:
+    """Heartbeat of a running task, refreshed by the `HeartbeatScheduler` of the process.
+
+    It stops when `stop()` is called, or when a refresh fails: e.g. after the job process
+    reported the task (`labtasker.finish()`), the task is no longer running.
+    """
 
     def __init__(self, task_id, worker_id, heartbeat_interval):
         self.task_id = task_id
         self.worker_id = worker_id
         self.heartbeat_interval = heartbeat_interval
 
-        self._thread = None
-        self._stop_event = threading.Event()
-
-        # the heartbeat.lock file is useful for stopping heartbeat in the scheduler process from the actual job process
-        self._lockfile = get_labtasker_log_dir() / "heartbeat.lock"
-
-    def start(self):
-        """Start the heartbeat thread."""
-        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        # guarded by the lock of the scheduler
+        self._next_due = 0.0
+        self._alive = False
 
-        # create a heartbeat lock file
-        fd = os.open(self._lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-        os.close(fd)
+    def start(self, refresh_now: bool = True):
+        """Start refreshing the heartbeat. The first refresh is sent right away, or after
+        one interval if not `refresh_now` (e.g. the task was just fetched with its heartbeat).
+        """
+        _scheduler.add(self, delay=0.0 if refresh_now else self.heartbeat_interval)
 
-        self._thread.start()
+    def stop(self):
+        """Stop refreshing the heartbeat. Returns once no refresh of it is in flight."""
+        _scheduler.remove(self, timeout=self.heartbeat_interval * 10)
 
-    def delay(self, interval: float) -> bool:
-        """Returns False if it should exit."""
-        slice_t = 0.05  # check for stop event
-        start_time = time.perf_counter()
+    def is_alive(self):
+        return self._alive
+
+
+class HeartbeatScheduler:
+    """Refreshes the heartbeats of all the running tasks of the process, from one thread.
+
+    The thread sleeps until the next heartbeat is due, or until a heartbeat is added or
+    removed, and exits when there is none left. Heartbeats due within half of their interval
+    are refreshed along with the due ones, in one request per worker.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heartbeats: Set[Heartbeat] = set()
+        self._in_flight: Set[Heartbeat] = set()
+        self._thread: Optional[threading.Thread] = None
+        # Servers before the batch endpoint only refresh one task per request
+        self._batch_supported = True
+
+    def add(self, heartbeat: Heartbeat, delay: float = 0.0):
+        with self._cond:
+            heartbeat._next_due = time.monotonic() + delay
+            heartbeat._alive = True
+            self._heartbeats.add(heartbeat)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="labtasker-heartbeat", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def remove(self, heartbeat: Heartbeat, timeout: Optional[float] = None):
+        with self._cond:
+            heartbeat._alive = False
+            self._heartbeats.discard(heartbeat)
+            self._cond.notify_all()
+            self._cond.wait_for(
+                lambda: heartbeat not in self._in_flight, timeout=timeout
+            )
+
+    def _run(self):
         while True:
-            elapsed_time = time.perf_counter() - start_time
-            remaining_time = interval - elapsed_time
-
-            if remaining_time <= 0:
-                break
-
-            if self._stop_event.is_set() or not os.path.exists(self._lockfile):
-                return False
-
-            if remaining_time > 0.02:
-                time.sleep(
-                    min(
-                        max(remaining_time / 2, 0.0001),
-                        slice_t,
+            with self._cond:
+                while True:
+                    if not self._heartbeats:
+                        self._thread = None
+                        return
+                    now = time.monotonic()
+                    next_due = min(
+                        heartbeat._next_due for heartbeat in self._heartbeats
                     )
-                )  # Sleep for a fraction of remaining time
-            else:
-                pass  # Busy-wait for very short intervals
-
-        return True
+                    if next_due <= now:
+                        break
+                    self._cond.wait(next_due - now)
+
+                batch = [
+                    heartbeat
+                    for heartbeat in self._heartbeats
+                    if heartbeat._next_due - heartbeat.heartbeat_interval / 2 <= now
+                ]
+                for heartbeat in batch:
+                    heartbeat._next_due = now + heartbeat.heartbeat_interval
+                self._in_flight.update(batch)
 
-    def _heartbeat(self):
-        """Refresh heartbeat periodically"""
-        while True:
             try:
-                refresh_task_heartbeat(task_id=self.task_id, worker_id=self.worker_id)
+                self._refresh(batch)
+            finally:
+                with self._cond:
+                    self._in_flight.difference_update(batch)
+                    self._cond.notify_all()
+
+    def _refresh(self, batch: List[Heartbeat]):
+        by_worker: Dict[Optional[str], List[Heartbeat]] = defaultdict(list)
+        for heartbeat in batch:
+            by_worker[heartbeat.worker_id].append(heartbeat)
+
+        for worker_id, heartbeats in by_worker.items():
+            failed = self._send(worker_id, [h.task_id for h in heartbeats])
+            for heartbeat in heartbeats:
+                if heartbeat.task_id in failed:
+                    self._fail(heartbeat, failed[heartbeat.task_id])
+
+    def _send(self, worker_id: Optional[str], task_ids: List[str]) -> Dict[str, str]:
+        """Refresh the heartbeats of tasks. Returns the reasons of those that failed."""
+        if self._batch_supported:
+            try:
+                return refresh_task_heartbeats(
+                    task_ids=task_ids, worker_id=worker_id
+                ).failed
+            except LabtaskerHTTPStatusError as e:
+                if not is_missing_route(e):
+                    return {task_id: str(e) for task_id in task_ids}
+                logger.debug(
+                    "Server does not support batched heartbeats, refreshing them one by one."
+                )
+                self._batch_supported = False
             except Exception as e:
-                logger.error(f"Failed to refresh heartbeat: {str(e)}")
-                raise
+                return {task_id: str(e) for task_id in task_ids}
 
-            # Check if heartbeat should stop
-            if not self.delay(self.heartbeat_interval):
-                break
+        failed = {}
+        for task_id in task_ids:
+            try:
+                refresh_task_heartbeat(task_id=task_id, worker_id=worker_id)
+            except Exception as e:
+                failed[task_id] = str(e)
+        return failed
 
-    def stop(self):
-        """Stop the heartbeat thread."""
-        if self._thread:
-            self._stop_event.set()
-            self._thread.join(timeout=self.heartbeat_interval * 10)
-            try:  # try to remove heartbeat lock file
-                os.unlink(self._lockfile)
-            except FileNotFoundError:
-                pass
+    def _fail(self, heartbeat: Heartbeat, reason: str):
+        with self._cond:
+            if heartbeat not in self._heartbeats:
+                return  # stopped meanwhile
+            heartbeat._alive = False
+            self._heartbeats.discard(heartbeat)
+        logger.error(f"Failed to refresh heartbeat: {reason}")
 
-    def is_alive(self):
-        return self._thread and self._thread.is_alive()
 
+_scheduler = HeartbeatScheduler()
 
 _current_heartbeat: ContextVar[Optional[Heartbeat]] = ContextVar(
     "heartbeat", default=None
@@ -102,6 +174,7 @@ def start_heartbeat(
     worker_id: Optional[str] = None,
     heartbeat_interval: Optional[float] = None,
     raise_error=True,
+    refresh_now: bool = True,
 ):
     logger.debug("Try starting heartbeat.")
     if _current_heartbeat.get() is not None:
@@ -115,7 +188,7 @@ def start_heartbeat(
         heartbeat_interval=heartbeat_interval
         or get_client_config().task.heartbeat_interval,
     )
-    heartbeat_manager.start()
+    heartbeat_manager.start(refresh_now=refresh_now)
     _current_heartbeat.set(heartbeat_manager)
     logger.debug("Heartbeat started.")
     return heartbeat_manager
@@ -1,21 +1,28 @@
+import contextvars
 import json
 import os
 import sys
+import threading
 import time
 import traceback
+from contextlib import nullcontext
 from functools import wraps
-from typing import Any, Callable, Dict, List, Optional, Union
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Union
 
 from starlette.status import HTTP_401_UNAUTHORIZED
 
 import labtasker
-from labtasker.api_models import TaskUpdateRequest
+from labtasker.api_models import Task, TaskFetchResponse, TaskUpdateRequest
 from labtasker.client.core.api import (
     create_worker,
     delete_worker,
     fetch_task,
     get_queue,
+    release_task,
+    report_and_fetch_task,
     report_task_status,
+    reserve_task,
     update_tasks,
 )
 from labtasker.client.core.cli_utils import Choice, make_a_choice
@@ -29,6 +36,7 @@
 )
 from labtasker.client.core.exceptions import (
     LabtaskerHTTPStatusError,
+    LabtaskerNetworkError,
     LabtaskerRuntimeError,
     LabtaskerValueError,
     WorkerSuspended,
@@ -38,8 +46,13 @@
 from labtasker.client.core.heartbeat import end_heartbeat, start_heartbeat
 from labtasker.client.core.logging import log_to_file, logger, stderr_console
 from labtasker.client.core.paths import get_labtasker_log_dir, set_labtasker_log_dir
-from labtasker.client.core.utils import transpile_query_safe
-from labtasker.utils import parse_time_interval
+from labtasker.client.core.run_logs import record_run, schedule_retention
+from labtasker.client.core.utils import (
+    JobProcessGroups,
+    is_missing_route,
+    transpile_query_safe,
+)
+from labtasker.utils import get_current_time, parse_time_interval
 
 __all__ = [
     "loop_run",
@@ -50,6 +63,22 @@
 
 _prompt_on_task_failure: bool = True
 
+# Shared log file of the loops in lightweight mode, rotated at that size
+LIGHTWEIGHT_LOG_MAX_BYTES = 64 * 1024 * 1024
+LIGHTWEIGHT_LOG_BACKUP_COUNT = 3
+
+# Servers before the report_and_fetch endpoint take a report and a fetch request
+_report_and_fetch_supported = True
+
+# Servers before task reservations can not prefetch tasks
+_reserve_supported = True
+
+# Set in lightweight mode, where tasks have no run dir (and no summary.json telling
+# whether they were reported): the IDs of the running tasks reported by finish()
+_lightweight_reported: contextvars.ContextVar[Optional[Set[str]]] = (
+    contextvars.ContextVar("lightweight_reported", default=None)
+)
+
 
 def _default_loop_internal_error_handler(e: Exception, failure_count: int):
     if failure_count > 10:  # TODO: hard coded
@@ -67,6 +96,9 @@ def _default_loop_internal_error_handler(e: Exception, failure_count: int):
 
 
 _loop_internal_failure_count = 0
+_loop_internal_failure_lock = (
+    threading.Lock()
+)  # counted by the slots of concurrent loops
 _loop_internal_error_handler: Callable[[Exception, int], None] = (
     _default_loop_internal_error_handler
 )
@@ -98,6 +130,12 @@ def dump_status(status: str):
             f,  # type: ignore
             indent=4,
         )
+    record_run(
+        get_labtasker_log_dir(),
+        current_task_id(),
+        status=status,
+        finished=get_current_time().isoformat(),
+    )
 
 
 def dump_task_info():
@@ -114,6 +152,12 @@ def loop_run(
     eta_max: Optional[str] = None,
     heartbeat_timeout: Optional[float] = None,
     pass_args_dict: bool = False,
+    concurrency: int = 1,
+    lightweight: bool = False,
+    log_file: Optional[Union[str, Path]] = None,
+    prefetch: bool = False,
+    prepare: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    reserve_timeout: Optional[float] = None,
 ):
     """Run the wrapped job function in loop.
 
@@ -126,6 +170,21 @@ def loop_run(
         eta_max: Maximum ETA for task execution.
         heartbeat_timeout: Heartbeat timeout in seconds. Default to 3 times the send interval.
         pass_args_dict: If True, passes task_info().args as first argument
+        concurrency: Number of tasks run at the same time, each by a thread of its own (with its own
+            task context and run dir), under the same worker. Failures are reported without prompting.
+        lightweight: Run many short tasks faster: the context of a task is only kept in memory
+            (no run dir, so no run.log, task_info.json, summary.json or status.json, and
+            get_labtasker_log_dir() is not set), and the heartbeat of a task is first refreshed
+            one interval after it was fetched.
+        log_file: File that the output of the whole loop is written to (rotated at
+            LIGHTWEIGHT_LOG_MAX_BYTES, keeping LIGHTWEIGHT_LOG_BACKUP_COUNT old files).
+        prefetch: While a task runs, reserve the next one for the worker (see `reserve_task`), so
+            that it is started by the next fetch, and prepare it in the background.
+        prepare: Called with the args of each task before the job, e.g. to download its inputs.
+            With prefetch, it runs in a background thread while the previous task runs, with
+            task_info() set to the reserved task. It raising counts as a failure of the task.
+        reserve_timeout: Lease of the reservations in seconds, renewed by the heartbeats of the
+            worker's running tasks. Default to heartbeat_timeout.
     """
     if not isinstance(required_fields, list):
         raise LabtaskerValueError(
@@ -135,6 +194,14 @@ def loop_run(
     if heartbeat_timeout is None:
         heartbeat_timeout = get_client_config().task.heartbeat_interval * 3
 
+    if reserve_timeout is None:
+        reserve_timeout = heartbeat_timeout
+
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise LabtaskerValueError(
+            f"Invalid concurrency {concurrency}. Concurrency must be a positive integer."
+        )
+
     if eta_max is not None:
         try:
             parse_time_interval(eta_max)
@@ -179,191 +246,526 @@ def wrapper(*args, **kwargs):
             3. Run task
             4. Submit result (finish).
             """
-            global _loop_internal_failure_count
-            # Run task in a loop
-            while True:
-                try:
-                    # Fetch task
-                    resp = fetch_task(
+            # prompts of concurrent slots would get in the way of each other
+            prompt_on_failure = _prompt_on_task_failure and concurrency == 1
+            stopping = threading.Event()  # set to stop fetching tasks
+            schedule_retention()
+
+            # Tasks reserved ahead by the slots of the loop, not started yet
+            reservations: List[_Reservation] = []
+            reservations_lock = threading.Lock()
+
+            def reserve_next(context: contextvars.Context) -> Optional[_Reservation]:
+                """Reserve (and prepare) the next task in the background."""
+                if not prefetch or not _reserve_supported or stopping.is_set():
+                    return None
+                reservation = _Reservation(
+                    dict(
                         worker_id=current_worker_id(),
-                        eta_max=eta_max,
-                        heartbeat_timeout=heartbeat_timeout,
-                        start_heartbeat=True,
+                        reserve_timeout=reserve_timeout,
                         required_fields=required_fields,
                         extra_filter=extra_filter,
-                        cmd=cmd,
-                    )
-                    if not resp.found:  # task run complete
-                        logger.info(
-                            f"Tasks with required fields {required_fields} and extra filter {extra_filter} are all done."
+                    ),
+                    prepare=prepare,
+                    context=context.copy(),
+                )
+                with reservations_lock:
+                    reservations.append(reservation)
+                return reservation
+
+            def take_reservation(task_id: str) -> Optional[_Reservation]:
+                """The reservation of a fetched task (by any slot), if it was reserved ahead."""
+                with reservations_lock:
+                    in_progress = list(reservations)
+                for reservation in in_progress:
+                    reservation.reserved.wait()
+                with reservations_lock:
+                    for reservation in reservations:
+                        if reservation.task and reservation.task.task_id == task_id:
+                            reservations.remove(reservation)
+                            return reservation
+                return None
+
+            def release_reservations():
+                """Release the tasks reserved ahead that were not started."""
+                with reservations_lock:
+                    left = list(reservations)
+                    reservations.clear()
+                for reservation in left:
+                    reservation.reserved.wait()
+                    if reservation.task is None:
+                        continue
+                    try:
+                        release_task(
+                            task_id=reservation.task.task_id,
+                            worker_id=current_worker_id(),
+                        )
+                    except Exception as e:  # e.g. already released as its lease expired
+                        logger.debug(
+                            f"Failed to release task {reservation.task.task_id}: {e}"
                         )
-                        break
 
-                    task = resp.task
+            def run_tasks():
+                global _loop_internal_failure_count
+                # Status of the last task, reported along with the next fetch
+                report: Optional[Dict[str, Any]] = None
+                # Context the next tasks are reserved and prepared in (no task set yet)
+                slot_context = contextvars.copy_context()
+                # Last reservation made by this slot
+                reservation: Optional[_Reservation] = None
+
+                def report_later(status: str, summary: Optional[Dict[str, Any]] = None):
+                    nonlocal report
+                    if _finish_locally(status, summary):
+                        report = {
+                            "task_id": current_task_id(),
+                            "status": status,
+                            "summary": summary,
+                        }
+
+                def report_acknowledged():
+                    nonlocal report
+                    report = None
+
+                def send_report():
+                    """Send the report, kept until the server answered it."""
+                    if report is not None:
+                        try:
+                            report_task_status(**report, worker_id=current_worker_id())
+                        except Exception as e:
+                            if _answered(e):  # sending it again would not help
+                                report_acknowledged()
+                            raise
+                        report_acknowledged()
 
-                    logger.info(
-                        f"Prepared to run task {task.task_id} with args {task.args}."
-                    )
+                try:
+                    # Run task in a loop
+                    while not stopping.is_set():
+                        try:
+                            if reservation is not None:
+                                # fetched first if reserved, so that it is not left behind
+                                reservation.reserved.wait()
+                            # Fetch task
+                            fetch_kwargs: Dict[str, Any] = dict(
+                                worker_id=current_worker_id(),
+                                eta_max=eta_max,
+                                heartbeat_timeout=heartbeat_timeout,
+                                start_heartbeat=True,
+                                required_fields=required_fields,
+                                extra_filter=extra_filter,
+                                cmd=cmd,
+                            )
+                            if report is not None:
+                                resp = _report_and_fetch_task(
+                                    report, fetch_kwargs, report_acknowledged
+                                )
+                            else:
+                                resp = fetch_task(**fetch_kwargs)
+                            if not resp.found:  # task run complete
+                                logger.info(
+                                    f"Tasks with required fields {required_fields} and extra filter {extra_filter} are all done."
+                                )
+                                break
 
-                    # Set task info
-                    set_task_info(task)
+                            task = resp.task
+                            prepared = (
+                                take_reservation(task.task_id) if prefetch else None
+                            )
+                            reservation = reserve_next(slot_context)
 
-                    # Setup
-                    set_labtasker_log_dir(
-                        task_id=task.task_id,
-                        task_name=task.task_name,
-                        set_env=True,
-                        overwrite=True,
-                    )
+                            (logger.debug if lightweight else logger.info)(
+                                f"Prepared to run task {task.task_id} with args {task.args}."
+                            )
 
-                    # Dump task_info.json
-                    dump_task_info()
+                            # Set task info
+                            set_task_info(task)
 
-                    with log_to_file(file_path=get_labtasker_log_dir() / "run.log"):
-                        start_heartbeat(
-                            task_id=current_task_id(), worker_id=current_worker_id()
-                        )
-                        success_flag = False
-                        try:
-                            func_args = (task.args, *args) if pass_args_dict else args
-                            func(*func_args, **kwargs)
-                            success_flag = True
-                        except (
-                            _LabtaskerJobFailed,
-                            KeyboardInterrupt,
-                            BaseException,
-                        ) as e:
-                            # Task failure handling logic
-                            # 1. Log the exception
-                            # 2. Ask the user to decide what to do (only for 10s if enabled)
-                            #    A. Report: Report task as failed, with number of retries decreasing.
-                            #    B. Ignore: Reset task to back to PENDING with retries count set to 0, as if this crashed run never happened
-
-                            # 1. log exception
-                            if isinstance(e, KeyboardInterrupt):
-                                logger.warning("KeyboardInterrupt detected")
+                            if lightweight:
+                                task_log = nullcontext()
                             else:
-                                logger.error(f"Task {current_task_id()} failed")
-                                if not isinstance(e, _LabtaskerJobFailed):
-                                    stderr_console.print_exception(
-                                        # hide traceback from internals
-                                        suppress=[labtasker]
-                                    )
+                                # Setup
+                                set_labtasker_log_dir(
+                                    task_id=task.task_id,
+                                    task_name=task.task_name,
+                                    set_env=True,
+                                    overwrite=True,
+                                )
 
-                            # 2. ask the user
-                            _next_action = "report"  # one of ["report", "ignore"]
-
-                            if _prompt_on_task_failure:
-                                # ask the user (wait for 10 seconds) to decide what to do
-                                choices = [
-                                    Choice(
-                                        "(default) Report: Report task as failed, with number of retries decreasing.",
-                                        data="report",
-                                    ),
-                                    Choice(
-                                        "(ctrl+c) Ignore: Reset task to back to PENDING with retries count set to 0, as if this crashed run never happened.",
-                                        data="ignore",
-                                    ),
-                                ]
-                                choice = make_a_choice(
-                                    question="Task interrupted or failed with the above info. You have 10 seconds to make a choice:",
-                                    options=choices,
-                                    # if timed out while waiting for user input, we assume the user is not present and report this crash by default
-                                    default=choices[0],
-                                    # if user pressed Ctrl+C, we assume the user wants to exit without reporting
-                                    keyboard_interrupt_default=choices[1],
+                                record_run(
+                                    get_labtasker_log_dir(),
+                                    task.task_id,
+                                    task_name=task.task_name,
+                                    status="running",
+                                    started=get_current_time().isoformat(),
                                 )
 
-                                _next_action = choice.data
+                                # Dump task_info.json
+                                dump_task_info()
 
-                            if _next_action == "ignore":
-                                end_heartbeat(raise_error=False)
-                                resp = update_tasks(
-                                    task_updates=[
-                                        TaskUpdateRequest(
-                                            task_id=current_task_id(),  # noqa
-                                            status="pending",  # running -> pending
-                                            retries=0,
-                                        )
-                                    ]
+                                task_log = log_to_file(
+                                    file_path=get_labtasker_log_dir() / "run.log",
+                                    buffer_size=get_client_config().task.log_buffer_size,
+                                    overflow=get_client_config().task.log_overflow,
                                 )
-                                if not resp.found:
-                                    logger.error(
-                                        f"Failed to reset task {current_task_id()} to PENDING."
-                                    )
-                                logger.info(
-                                    f"Task {current_task_id()} reset to PENDING by user request."
-                                )
-                            else:  # report failure
-                                finish(
-                                    status="failed",
-                                    summary={
-                                        "labtasker_exception": {
-                                            "type": type(e).__name__,
-                                            "message": str(e),
-                                            "traceback": traceback.format_exc(),
-                                        }
-                                    },
-                                )
-                                logger.info(
-                                    f"Task {current_task_id()} crash incident reported."
+
+                            with task_log:
+                                start_heartbeat(
+                                    task_id=current_task_id(),
+                                    worker_id=current_worker_id(),
+                                    # the fetch started the heartbeat
+                                    refresh_now=not lightweight,
                                 )
+                                success_flag = False
+                                try:
+                                    _prepare_task(task, prepared, prepare)
+                                    func_args = (
+                                        (task.args, *args) if pass_args_dict else args
+                                    )
+                                    func(*func_args, **kwargs)
+                                    success_flag = True
+                                except (
+                                    _LabtaskerJobFailed,
+                                    KeyboardInterrupt,
+                                    BaseException,
+                                ) as e:
+                                    # Task failure handling logic
+                                    # 1. Log the exception
+                                    # 2. Ask the user to decide what to do (only for 10s if enabled)
+                                    #    A. Report: Report task as failed, with number of retries decreasing.
+                                    #    B. Ignore: Reset task to back to PENDING with retries count set to 0, as if this crashed run never happened
+
+                                    # 1. log exception
+                                    if isinstance(e, KeyboardInterrupt):
+                                        logger.warning("KeyboardInterrupt detected")
+                                    else:
+                                        logger.error(f"Task {current_task_id()} failed")
+                                        if not isinstance(e, _LabtaskerJobFailed):
+                                            stderr_console.print_exception(
+                                                # hide traceback from internals
+                                                suppress=[labtasker]
+                                            )
+
+                                    # 2. ask the user
+                                    _next_action = (
+                                        "report"  # one of ["report", "ignore"]
+                                    )
 
-                            if isinstance(e, KeyboardInterrupt):
-                                break
+                                    if prompt_on_failure:
+                                        # ask the user (wait for 10 seconds) to decide what to do
+                                        choices = [
+                                            Choice(
+                                                "(default) Report: Report task as failed, with number of retries decreasing.",
+                                                data="report",
+                                            ),
+                                            Choice(
+                                                "(ctrl+c) Ignore: Reset task to back to PENDING with retries count set to 0, as if this crashed run never happened.",
+                                                data="ignore",
+                                            ),
+                                        ]
+                                        choice = make_a_choice(
+                                            question="Task interrupted or failed with the above info. You have 10 seconds to make a choice:",
+                                            options=choices,
+                                            # if timed out while waiting for user input, we assume the user is not present and report this crash by default
+                                            default=choices[0],
+                                            # if user pressed Ctrl+C, we assume the user wants to exit without reporting
+                                            keyboard_interrupt_default=choices[1],
+                                        )
 
-                            _should_continue = True  # should the loop continue after exception has occurred and handled
-                            if _prompt_on_task_failure:
-                                # ask the user (wait for 10 seconds) to decide what to do
-                                choices = [
-                                    Choice(
-                                        "(default) Continue: Continue processing other tasks in the queue.",
-                                        data=True,
-                                    ),
-                                    Choice(
-                                        "(ctrl+c) Exit: Stop the task loop and exit the program.",
-                                        data=False,
-                                    ),
-                                ]
-                                choice = make_a_choice(
-                                    question="Do you want to continue processing other tasks or exit the program? (10 seconds to decide):",
-                                    options=choices,
-                                    # if timed out while waiting for user input, we assume the user is not present and continue by default
-                                    default=choices[0],
-                                    # if user pressed Ctrl+C, we assume the user wants to exit without reporting
-                                    keyboard_interrupt_default=choices[1],
-                                )
+                                        _next_action = choice.data
+
+                                    if _next_action == "ignore":
+                                        end_heartbeat(raise_error=False)
+                                        resp = update_tasks(
+                                            task_updates=[
+                                                TaskUpdateRequest(
+                                                    task_id=current_task_id(),  # noqa
+                                                    status="pending",  # running -> pending
+                                                    retries=0,
+                                                )
+                                            ]
+                                        )
+                                        if not resp.found:
+                                            logger.error(
+                                                f"Failed to reset task {current_task_id()} to PENDING."
+                                            )
+                                        if not lightweight:
+                                            record_run(
+                                                get_labtasker_log_dir(),
+                                                current_task_id(),
+                                                status="pending",
+                                            )
+                                        logger.info(
+                                            f"Task {current_task_id()} reset to PENDING by user request."
+                                        )
+                                    else:  # report failure
+                                        report_later(
+                                            status="failed",
+                                            summary={
+                                                "labtasker_exception": {
+                                                    "type": type(e).__name__,
+                                                    "message": str(e),
+                                                    "traceback": traceback.format_exc(),
+                                                }
+                                            },
+                                        )
+                                        if prompt_on_failure:
+                                            # not left running while the user decides
+                                            send_report()
+                                        logger.info(
+                                            f"Task {current_task_id()} crash incident reported."
+                                        )
 
-                                _should_continue = choice.data
-
-                                if not _should_continue:
-                                    raise _LabtaskerLoopExit()
-                        finally:
-                            if success_flag:
-                                # Default finish. Can be overridden by the user if called somewhere deep in the wrapped func().
-                                finish(status="success")
-                            # finish() already calls end_heartbeat(), but use raise_error=False as safety net
-                            end_heartbeat(raise_error=False)
-                except _LabtaskerLoopExit:
-                    # clean up the worker
-                    if auto_create_worker:  # worker is managed automatically
-                        delete_worker(worker_id=current_worker_id())
-
-                    logger.info("Exiting task loop.")
-                    break
-                except WorkerSuspended:
-                    logger.error("Worker suspended.")
-                    break
-                except Exception as e:
-                    logger.exception("Error in task loop.")
-                    _loop_internal_failure_count += 1
-                    _loop_internal_error_handler(e, _loop_internal_failure_count)
+                                    if isinstance(e, KeyboardInterrupt):
+                                        break
+
+                                    _should_continue = True  # should the loop continue after exception has occurred and handled
+                                    if prompt_on_failure:
+                                        # ask the user (wait for 10 seconds) to decide what to do
+                                        choices = [
+                                            Choice(
+                                                "(default) Continue: Continue processing other tasks in the queue.",
+                                                data=True,
+                                            ),
+                                            Choice(
+                                                "(ctrl+c) Exit: Stop the task loop and exit the program.",
+                                                data=False,
+                                            ),
+                                        ]
+                                        choice = make_a_choice(
+                                            question="Do you want to continue processing other tasks or exit the program? (10 seconds to decide):",
+                                            options=choices,
+                                            # if timed out while waiting for user input, we assume the user is not present and continue by default
+                                            default=choices[0],
+                                            # if user pressed Ctrl+C, we assume the user wants to exit without reporting
+                                            keyboard_interrupt_default=choices[1],
+                                        )
+
+                                        _should_continue = choice.data
+
+                                        if not _should_continue:
+                                            raise _LabtaskerLoopExit()
+                                finally:
+                                    if success_flag:
+                                        # Default finish. Can be overridden by the user if called somewhere deep in the wrapped func().
+                                        # Reported along with the next fetch.
+                                        report_later(status="success")
+                                    # report_later() already calls end_heartbeat(), but use raise_error=False as safety net
+                                    end_heartbeat(raise_error=False)
+                                    if lightweight:
+                                        _lightweight_reported.get().discard(
+                                            task.task_id
+                                        )
+                                    else:
+                                        schedule_retention()
+                        except _LabtaskerLoopExit:
+                            send_report()
+                            # clean up the worker
+                            if auto_create_worker:  # worker is managed automatically
+                                delete_worker(worker_id=current_worker_id())
+
+                            logger.info("Exiting task loop.")
+                            break
+                        except WorkerSuspended:
+                            logger.error("Worker suspended.")
+                            break
+                        except Exception as e:
+                            logger.exception("Error in task loop.")
+                            with _loop_internal_failure_lock:
+                                _loop_internal_failure_count += 1
+                                failure_count = _loop_internal_failure_count
+                            _loop_internal_error_handler(e, failure_count)
+                finally:
+                    # e.g. the failure of a task that was interrupted
+                    send_report()
+
+            if log_file is not None:
+                # before the slots copy the context, so that they all write to it
+                loop_log = log_to_file(
+                    file_path=Path(log_file),
+                    buffer_size=get_client_config().task.log_buffer_size,
+                    overflow=get_client_config().task.log_overflow,
+                    max_bytes=LIGHTWEIGHT_LOG_MAX_BYTES,
+                    backup_count=LIGHTWEIGHT_LOG_BACKUP_COUNT,
+                )
+            else:
+                loop_log = nullcontext()
+            reported_token = _lightweight_reported.set(set() if lightweight else None)
+            try:
+                with loop_log:
+                    if concurrency == 1:
+                        run_tasks()
+                    else:
+                        _run_concurrently(run_tasks, concurrency, stopping)
+            finally:
+                release_reservations()
+                _lightweight_reported.reset(reported_token)
 
         return wrapper
 
     return decorator
 
 
+def _report_and_fetch_task(
+    report: Dict[str, Any],
+    fetch_kwargs: Dict[str, Any],
+    acknowledged: Callable[[], None],
+) -> TaskFetchResponse:
+    """Report the status of the last task of a worker and fetch its next task, in one
+    request if the server supports it (see `report_and_fetch_task`).
+
+    `acknowledged` is called once the server answered the report, which the caller keeps until
+    then, to send it again if this raises."""
+    global _report_and_fetch_supported
+    maybe_sent = False
+    if _report_and_fetch_supported:
+        try:
+            resp = report_and_fetch_task(**report, **fetch_kwargs)
+        except LabtaskerHTTPStatusError as e:
+            if not is_missing_route(e):
+                acknowledged()  # rejected, sending it again would not help
+                raise
+            logger.debug(
+                "Server does not support reporting and fetching at once, "
+                "sending them one by one."
+            )
+            _report_and_fetch_supported = False
+        except Exception as e:
+            if _answered(e):  # e.g. WorkerSuspended, once reported
+                acknowledged()
+                raise
+            # e.g. a read timeout, the server may have received it or not: reported below
+            # (with retries)
+            logger.debug(f"Failed to report and fetch at once: {e}")
+            maybe_sent = True
+        else:
+            acknowledged()
+            return resp
+
+    try:
+        report_task_status(**report, worker_id=fetch_kwargs["worker_id"])
+    except Exception as e:
+        if not _answered(e):
+            raise
+        acknowledged()
+        if not maybe_sent:
+            raise
+        # most likely the task was reported by the request that failed
+        logger.debug(f"Task {report['task_id']} not reported again: {e}")
+    else:
+        acknowledged()
+    return fetch_task(**fetch_kwargs)
+
+
+def _answered(e: Exception) -> bool:
+    """Whether the server answered the request that raised `e`."""
+    return isinstance(e, LabtaskerHTTPStatusError) or not isinstance(
+        e, LabtaskerNetworkError
+    )
+
+
+class _Reservation:
+    """A task reserved ahead by a loop (see `reserve_task`), and prepared in a background
+    thread while the loop runs another task."""
+
+    def __init__(
+        self,
+        reserve_kwargs: Dict[str, Any],
+        prepare: Optional[Callable[[Dict[str, Any]], Any]],
+        context: contextvars.Context,
+    ):
+        self.task: Optional[Task] = None
+        self.error: Optional[BaseException] = None  # raised by prepare
+        self.reserved = threading.Event()  # the reservation request is done
+        self.prepared = threading.Event()
+        threading.Thread(
+            target=context.run,
+            args=(self._run, reserve_kwargs, prepare),
+            name="labtasker-prefetch",
+            daemon=True,
+        ).start()
+
+    def _run(self, reserve_kwargs, prepare):
+        global _reserve_supported
+        try:
+            resp = reserve_task(**reserve_kwargs)
+            self.task = resp.task if resp.found else None
+        except LabtaskerHTTPStatusError as e:
+            if is_missing_route(e):
+                logger.debug(
+                    "Server does not support reserving tasks, not prefetching."
+                )
+                _reserve_supported = False
+            else:
+                logger.warning(f"Failed to reserve the next task: {e}")
+        except Exception as e:
+            logger.warning(f"Failed to reserve the next task: {e}")
+        finally:
+            self.reserved.set()
+
+        try:
+            if self.task is not None and prepare is not None:
+                # the running task owns the environment variables
+                set_task_info(self.task, set_env=False)
+                prepare(self.task.args)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.prepared.set()
+
+
+def _prepare_task(
+    task: Task,
+    reservation: Optional[_Reservation],
+    prepare: Optional[Callable[[Dict[str, Any]], Any]],
+):
+    """Wait for the preparation of a task reserved ahead, or prepare it now."""
+    if reservation is not None:
+        reservation.prepared.wait()
+        if reservation.error is not None:
+            raise reservation.error
+    elif prepare is not None:
+        prepare(task.args)
+
+
+def _run_concurrently(run_tasks: Callable[[], None], concurrency: int, stopping):
+    """Run `run_tasks` in `concurrency` threads, each in a copy of the current context, so that
+    each slot has a task context of its own. A slot fetches another task once its task ended.
+
+    On KeyboardInterrupt, `stopping` is set, so that the slots do not fetch other tasks, and the
+    job processes of the running tasks are terminated (job functions run to their end).
+    """
+    process_groups = [JobProcessGroups() for _ in range(concurrency)]
+
+    def run_slot(groups: JobProcessGroups):
+        groups.setup()
+        run_tasks()
+
+    slots = [
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(run_slot, groups),
+            name=f"labtasker-loop-slot-{i}",
+            daemon=True,
+        )
+        for i, groups in enumerate(process_groups)
+    ]
+    for slot in slots:
+        slot.start()
+    try:
+        for slot in slots:
+            while (
+                slot.is_alive()
+            ):  # join with a timeout, so that KeyboardInterrupt is raised
+                slot.join(timeout=0.5)
+    except KeyboardInterrupt:
+        logger.warning("KeyboardInterrupt detected, terminating the running tasks.")
+        stopping.set()
+        for groups in process_groups:
+            groups.terminate()
+        for slot in slots:
+            slot.join()
+
+
 def finish(
     status: str,
     summary: Optional[Dict[str, Any]] = None,
@@ -393,26 +795,9 @@ def finish(
                 "You can either use @labtasker.loop() decorator or labtasker loop cli to run job."
             )
 
-    # Stop heartbeat before reporting status to avoid race condition
-    # where heartbeat thread tries to refresh a non-running task
-    end_heartbeat(raise_error=False)
-
-    summary_file_path = get_labtasker_log_dir() / "summary.json"
-    if summary_file_path.exists():
-        # Skip if summary.json exists. Might be already called from subprocess.
+    if not _finish_locally(status, summary):
         return
 
-    # Write summary and status locally
-    fd = os.open(summary_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-    with os.fdopen(fd, "w") as f:
-        json.dump(
-            summary if summary else {},
-            f,  # type: ignore
-            indent=4,
-        )
-
-    dump_status(status=status)
-
     # Report task status to server
     report_task_status(
         task_id=current_task_id(),
@@ -420,3 +805,39 @@ def finish(
         summary=summary,
         worker_id=current_worker_id(),
     )
+
+
+def _finish_locally(status: str, summary: Optional[Dict[str, Any]]) -> bool:
+    """Stop the heartbeat of the current task, and write its status and summary to its
+    log dir.
+
+    Returns:
+        False if the task was already finished (e.g. by the job), and must not be
+        reported again.
+    """
+    # Stop heartbeat before reporting status to avoid race condition
+    # where heartbeat thread tries to refresh a non-running task
+    end_heartbeat(raise_error=False)
+
+    reported = _lightweight_reported.get()
+    if reported is not None:  # lightweight mode, nothing is written locally
+        if current_task_id() in reported:
+            return False
+        reported.add(current_task_id())
+    else:
+        summary_file_path = get_labtasker_log_dir() / "summary.json"
+        if summary_file_path.exists():
+            # Skip if summary.json exists. Might be already called from subprocess.
+            return False
+
+        # Write summary and status locally
+        fd = os.open(summary_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                summary if summary else {},
+                f,  # type: ignore
+                indent=4,
+            )
+
+        dump_status(status=status)
+    return True
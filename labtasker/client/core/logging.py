@@ -1,3 +1,4 @@
+import atexit
 import contextlib
 import contextvars
 import io
@@ -7,7 +8,7 @@
 import threading
 import warnings
 from pathlib import Path
-from typing import Iterable, List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Set, Union
 
 from loguru import logger  # noqa
 from rich.console import Console
@@ -47,6 +48,49 @@
 _stderr_tee_stream = None
 _setup_lock = threading.Lock()
 
+ANSI_ESCAPE_BYTES = re.compile(rb"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+
+# Longest escape sequence held back when a chunk of raw output ends in the middle of one
+_MAX_ESCAPE_LEN = 64
+
+# Bytes of output a log file queues for the background writer, at most
+LOG_BUFFER_SIZE = 8 * 1024 * 1024
+LOG_OVERFLOW_POLICIES = ("block", "drop")
+
+# Seconds the background writer lets output pile up before writing it (unless the
+# buffer of a log file is half full, or the output is drained)
+LOG_WRITE_INTERVAL = 0.05
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def write_bytes(stream, data: bytes) -> None:
+    """Write raw output (e.g. of a child process) to a text stream, below its text layer
+    where possible: streams of this module write it to their file descriptors directly.
+    """
+    if hasattr(stream, "write_bytes"):
+        stream.write_bytes(data)
+        return
+    stream.flush()  # what was written as text goes first
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, ValueError):  # e.g. io.UnsupportedOperation
+        fd = None
+    if fd is not None:
+        _write_all(fd, data)
+        return
+    buffer = getattr(stream, "buffer", None)
+    if buffer is not None:
+        buffer.write(data)
+        buffer.flush()
+    else:
+        stream.write(data.decode(errors="replace"))
+        stream.flush()
+
 
 class TeeStream(io.TextIOBase):
     """
@@ -80,6 +124,24 @@ def write(self, text):
 
             return result
 
+    def write_bytes(self, data: bytes) -> None:
+        """Like `write`, for raw output: see `write_bytes()`."""
+        with self.lock:
+            write_bytes(self.original_stream, data)
+
+            for output in self.outputs_var.get():
+                if output != self.original_stream:
+                    try:
+                        write_bytes(output, data)
+                    except ValueError as e:
+                        if "I/O operation on closed file" in str(e):
+                            warnings.warn(
+                                "Attempted to write to a closed file",
+                                RuntimeWarning,
+                            )
+                        else:
+                            raise
+
     def flush(self):
         with self.lock:
             # Flush original stream
@@ -192,98 +254,297 @@ def __getattr__(self, name):
         return getattr(self.original_stream, name)
 
 
-class AnsiFilterStream(io.TextIOBase):
-    """Filter stream that removes ANSI escape sequences"""
+class _DroppedOutput:
+    """Stands in the pending output of a log file for what was dropped there."""
 
-    def __init__(self, stream):
-        self.stream = stream
-        self.ansi_escape = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+    def __init__(self):
+        self.size = 0
 
-    def write(self, text):
-        cleaned = self.ansi_escape.sub("", text)
-        return self.stream.write(cleaned)
 
-    def flush(self):
-        return self.stream.flush()
-
-    # Standard file methods proxied to original stream
-    def close(self) -> None:
-        return self.stream.close()
+class BackgroundLogFile(io.TextIOBase):
+    """Write-only log file, written by the background writer of the process.
 
-    def fileno(self) -> int:
-        return self.stream.fileno()
+    Writes only queue the output (encoded, for text), so that a slow disk does not stall
+    the job: the writer strips ANSI escape sequences and writes what is queued in batches.
+    At most `buffer_size` bytes are queued per file; beyond that, `overflow` decides
+    whether writes block until the writer catches up ("block"), or are dropped ("drop",
+    a line in the log file tells how many bytes are missing).
 
-    def isatty(self) -> bool:
-        return self.stream.isatty()
+    With `max_bytes`, the file is rotated once it reaches that size: it is renamed to
+    `<file>.1` (`<file>.1` to `<file>.2`, ... up to `backup_count` old files, the oldest
+    is deleted) and a new file is started. Only the writer of this process rotates it, so
+    rotated files should not be shared with other processes.
 
-    def readable(self) -> bool:
-        return self.stream.readable()
+    `flush()` does not wait for the writer, `drain()` does. `close()` drains the output
+    left, as happens for the files still open at exit.
+    """
 
-    def read(self, size: int = -1) -> str:  # type: ignore[override]
-        return self.stream.read(size)
+    def __init__(
+        self,
+        file_path: Path,
+        buffer_size: int = LOG_BUFFER_SIZE,
+        overflow: str = "block",
+        max_bytes: Optional[int] = None,
+        backup_count: int = 0,
+    ):
+        super().__init__()
+        if overflow not in LOG_OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow must be one of {LOG_OVERFLOW_POLICIES}, got {overflow!r}"
+            )
+        self.name = str(file_path)
+        self.buffer_size = buffer_size
+        self.overflow = overflow
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        self._size = os.fstat(self._fd).st_size
+
+        # guarded by the lock of the writer
+        self._chunks: List[Union[bytes, _DroppedOutput]] = []
+        self._pending_size = 0  # bytes queued or being written
+        self._writing = False
+        self._closed = False
+
+        # only used by the writer (and by close(), once drained)
+        self._carry = b""  # start of an escape sequence cut by the end of a batch
+        self._error: Optional[OSError] = None
+
+        _writer.register(self)
 
-    def readlines(self, hint: int = -1) -> List[str]:  # type: ignore[override]
-        return self.stream.readlines(hint)
+    def write(self, text):
+        self.write_bytes(text.encode("utf-8", errors="replace"))
+        return len(text)
+
+    def write_bytes(self, data: bytes) -> None:
+        if not data:
+            return
+        with _writer.lock:
+            if self._closed:
+                raise ValueError("I/O operation on closed file")
+            pending_size = self._pending_size + len(data)
+            if pending_size > self.buffer_size and self._pending_size:
+                if self.overflow == "drop":
+                    if not self._chunks or not isinstance(
+                        self._chunks[-1], _DroppedOutput
+                    ):
+                        self._chunks.append(_DroppedOutput())
+                    self._chunks[-1].size += len(data)  # type: ignore[union-attr]
+                    _writer.schedule(self)
+                    return
+                _writer.hurry()
+                _writer.cond.wait_for(
+                    lambda: self._closed
+                    or not self._pending_size
+                    or self._pending_size + len(data) <= self.buffer_size
+                )
+                self._checkClosed()
+                pending_size = self._pending_size + len(data)
+            self._chunks.append(data)
+            self._pending_size = pending_size
+            if self not in _writer.dirty:
+                _writer.schedule(self)
+            if pending_size > self.buffer_size // 2:
+                _writer.hurry()
 
-    def seek(self, offset: int, whence: int = 0) -> int:
-        return self.stream.seek(offset, whence)
+    def flush(self):
+        """Queued output is written by the writer as soon as it can: nothing to do."""
 
-    def seekable(self) -> bool:
-        return self.stream.seekable()
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the writer wrote all the output queued so far.
 
-    def tell(self) -> int:
-        return self.stream.tell()
+        Returns:
+            False if the timeout expired first.
+        """
+        with _writer.cond:
+            if self._chunks:
+                _writer.hurry()
+            return _writer.cond.wait_for(
+                lambda: not self._chunks and not self._writing, timeout=timeout
+            )
 
-    def truncate(self, size: Optional[int] = None) -> int:
-        if size is None:
-            return self.stream.truncate()
-        return self.stream.truncate(size)
+    def close(self) -> None:
+        with _writer.cond:
+            if self._closed:
+                return
+            self._closed = True
+            _writer.cond.notify_all()  # writes blocked on a full buffer give up
+        self.drain()
+        if self._carry:  # the output ended there
+            self._write_out([])
+        if self._fd != -1:
+            os.close(self._fd)
+        _writer.unregister(self)
+
+    def _write_out(self, chunks: List[Union[bytes, _DroppedOutput]]) -> None:
+        """Strip escape sequences from a batch of output, and write it (in the writer)."""
+        if self._error is not None:
+            return
+        data = self._carry + b"".join(
+            (
+                f"\n[labtasker: {chunk.size} bytes of output dropped, "
+                f"the log file could not keep up]\n".encode()
+                if isinstance(chunk, _DroppedOutput)
+                else chunk
+            )
+            for chunk in chunks
+        )
+        cut = data.rfind(b"\x1b", max(0, len(data) - _MAX_ESCAPE_LEN))
+        if chunks and cut != -1 and not ANSI_ESCAPE_BYTES.match(data, cut):
+            data, self._carry = data[:cut], data[cut:]
+        else:
+            self._carry = b""
+        data = ANSI_ESCAPE_BYTES.sub(b"", data)
+        try:
+            _write_all(self._fd, data)
+            self._size += len(data)
+            if self.max_bytes is not None and self._size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self._error = e
+            # not through sys.stderr: it may be waiting for this thread
+            if sys.__stderr__ is not None:
+                print(
+                    f"Failed to write log file {self.name}: {e}. "
+                    f"Further output is not logged.",
+                    file=sys.__stderr__,
+                    flush=True,
+                )
 
-    def writable(self) -> bool:
-        return self.stream.writable()
+    def _rotate(self) -> None:
+        """Keep the file as `<file>.1` and start a new one (in the writer)."""
+        os.close(self._fd)
+        self._fd = -1
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.name}.{i}"):
+                    os.replace(f"{self.name}.{i}", f"{self.name}.{i + 1}")
+            os.replace(self.name, f"{self.name}.1")
+        self._fd = os.open(
+            self.name, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_TRUNC, 0o666
+        )
+        self._size = 0
 
-    def writelines(self, lines: Iterable[str]) -> None:  # type: ignore[override]
-        # First write to original stream
-        self.stream.writelines(lines)
+    def isatty(self) -> bool:
+        return False
 
-    def readline(self, size: Optional[int] = -1) -> str:  # type: ignore[override]
-        return self.stream.readline(size)
+    def readable(self) -> bool:
+        return False
 
-    def __del__(self) -> None:
-        self.stream.close()
+    def writable(self) -> bool:
+        return True
 
     @property
     def closed(self) -> bool:  # type: ignore[override]
-        return self.stream.closed
+        return self._closed
 
     def _checkClosed(self) -> None:
-        if self.closed:
+        if self._closed:
             raise ValueError("I/O operation on closed file")
 
-    # Additional TextIOBase attributes that may be needed
     @property
     def encoding(self) -> str:  # type: ignore[override]
-        return getattr(self.stream, "encoding", None)  # type: ignore[return-value]
+        return "utf-8"
 
     @property
     def errors(self) -> Optional[str]:  # type: ignore[override]
-        return getattr(self.stream, "errors", None)
+        return "replace"
 
-    @property
-    def newlines(self) -> Optional[Union[str, tuple]]:  # type: ignore[override]
-        return getattr(self.stream, "newlines", None)
 
-    @property
-    def buffer(self):  # type: ignore[override]
-        return getattr(self.stream, "buffer", None)
+class _LogWriter:
+    """The thread writing the output of all the `BackgroundLogFile`s of the process.
 
-    @property
-    def line_buffering(self) -> bool:  # type: ignore[override]
-        return getattr(self.stream, "line_buffering", False)
+    Once output is queued, it waits up to `LOG_WRITE_INTERVAL` for more, then takes the
+    output queued for each file at once. It exits when no log file is open.
+    """
 
-    # Forward other methods/properties to wrapped stream
-    def __getattr__(self, name):
-        return getattr(self.stream, name)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self._files: Set[BackgroundLogFile] = set()  # open ones
+        self.dirty: Dict[BackgroundLogFile, None] = {}  # ordered set
+        self._thread: Optional[threading.Thread] = None
+        self._hurry = False
+
+    def register(self, log_file: BackgroundLogFile):
+        with self.cond:
+            self._files.add(log_file)
+
+    def unregister(self, log_file: BackgroundLogFile):
+        with self.cond:
+            self._files.discard(log_file)
+            self.cond.notify_all()
+
+    def schedule(self, log_file: BackgroundLogFile):
+        """Have the output queued for `log_file` written (called with the lock held)."""
+        self.dirty[log_file] = None
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="labtasker-log-writer", daemon=True
+            )
+            self._thread.start()
+        self.cond.notify_all()
+
+    def hurry(self):
+        """Write the output queued without waiting for more (called with the lock held)."""
+        if not self._hurry:
+            self._hurry = True
+            self.cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.dirty:
+                    if not self._files:
+                        self._thread = None
+                        return
+                    self.cond.wait()
+                self.cond.wait_for(lambda: self._hurry, timeout=LOG_WRITE_INTERVAL)
+                self._hurry = False
+                batch = []
+                for log_file in self.dirty:
+                    batch.append((log_file, log_file._chunks))
+                    log_file._chunks = []
+                    log_file._writing = True
+                self.dirty.clear()
+
+            try:
+                for log_file, chunks in batch:
+                    log_file._write_out(chunks)
+            finally:
+                with self.cond:
+                    for log_file, chunks in batch:
+                        log_file._writing = False
+                        log_file._pending_size -= sum(
+                            len(chunk) for chunk in chunks if isinstance(chunk, bytes)
+                        )
+                    self.cond.notify_all()
+
+    def drain_all(self):
+        """Wait until the output queued for all the open log files is written."""
+        with self.cond:
+            files = list(self._files)
+        for log_file in files:
+            log_file.drain()
+
+    def _after_fork_in_child(self):
+        # the writer thread is gone, and the output queued is the parent's to write
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self._thread = None
+        self._hurry = False
+        self.dirty.clear()
+        for log_file in self._files:
+            log_file._chunks = []
+            log_file._pending_size = 0
+            log_file._writing = False
+            log_file._carry = b""
+
+
+_writer = _LogWriter()
+atexit.register(_writer.drain_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_writer._after_fork_in_child)
 
 
 def reset_logger(reset_all: bool = False, debug: bool = False):
@@ -356,23 +617,38 @@ def log_to_file(
     file_path: Path,
     capture_stdout: bool = True,
     capture_stderr: bool = True,
+    buffer_size: int = LOG_BUFFER_SIZE,
+    overflow: str = "block",
+    max_bytes: Optional[int] = None,
+    backup_count: int = 0,
 ):
     """
     Context manager that redirects logs, stdout and/or stderr to a file
     while preserving the original outputs.
 
+    The file is written in the background (see `BackgroundLogFile`), the original
+    outputs are written right away.
+
     Args:
         file_path (Path): Path to the log file
         capture_stdout (bool): Whether to capture standard output
         capture_stderr (bool): Whether to capture standard error
+        buffer_size (int): Bytes of output queued for the file, at most
+        overflow (str): What happens to output beyond buffer_size: "block" or "drop"
+        max_bytes (Optional[int]): Size at which the file is rotated, if any
+        backup_count (int): Rotated files kept (`<file>.1`, `<file>.2`, ...)
     """
     # Make sure tee streams are set up
     _ensure_tee_streams_setup()
 
     # Open log file
-    log_file = open(file_path, "a", encoding="utf-8")
-    if not log_file.isatty():
-        log_file = AnsiFilterStream(log_file)  # type: ignore[assignment]
+    log_file = BackgroundLogFile(
+        file_path,
+        buffer_size=buffer_size,
+        overflow=overflow,
+        max_bytes=max_bytes,
+        backup_count=backup_count,
+    )
 
     # Add file to appropriate output streams
     stdout_token = None
@@ -400,7 +676,7 @@ def log_to_file(
         if stderr_token is not None:
             stderr_tee_outputs_var.reset(stderr_token)
 
-        # Close the log file
+        # Close the log file (once the output left is written)
         try:
             log_file.close()
         except ValueError:
@@ -0,0 +1,325 @@
+"""Index and retention of the run dirs of tasks (`logs/run/run_t<time>_n<name>_id<id>_rd<rand>`).
+
+The index finds the runs of a task without listing the run dirs: the records of a task are
+appended to `logs/index/<first 2 characters of its id>/<task id>.jsonl`. Each line updates some
+fields of one run, identified by its run dir (relative to `logs`): "task_name", "status",
+"started", "finished", "archive" (once compressed) and "removed" (once deleted). Lines are
+short and appended with O_APPEND, so that the loops and job processes sharing a log root need
+no lock.
+
+Retention applies to the runs of finished tasks (with a `status.json`): they are compressed
+into `<run dir>.tar.gz` after `compress_after` seconds, and deleted after `max_age` seconds, or
+oldest first while all the runs take more than `max_size` bytes.
+"""
+
+import contextlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from labtasker.client.core.config import get_client_config
+from labtasker.client.core.exceptions import (
+    LabtaskerRuntimeError,
+    LabtaskerValueError,
+)
+from labtasker.client.core.logging import logger
+from labtasker.client.core.paths import get_labtasker_log_root
+from labtasker.utils import parse_time_interval
+
+ARCHIVE_SUFFIX = ".tar.gz"
+
+# Seconds between two retention passes of a loop
+RETENTION_INTERVAL = 3600.0
+
+_TASK_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+_RUN_DIR_RE = re.compile(r"^run_t.+_id(?P<task_id>[A-Za-z0-9_-]+)_rd[0-9a-f]+$")
+
+
+@dataclass
+class RunRecord:
+    """A run of a task, as recorded in the index."""
+
+    run_dir: Path
+    task_name: Optional[str] = None
+    status: Optional[str] = None
+    started: Optional[str] = None
+    finished: Optional[str] = None
+    archive: Optional[Path] = None
+    removed: bool = False
+
+
+def _index_path(log_root: Path, task_id: str) -> Path:
+    if not _TASK_ID_RE.match(task_id):
+        raise LabtaskerValueError(f"Invalid task id {task_id!r}.")
+    return log_root / "index" / task_id[:2] / f"{task_id}.jsonl"
+
+
+def record_run(run_dir: Path, task_id: str, **fields) -> None:
+    """Update fields of a run in the index of its log root (the grandparent of `run_dir`).
+
+    Failures are logged, not raised: the index is not needed to run tasks.
+    """
+    log_root = run_dir.parent.parent
+    entry = {"run_dir": run_dir.relative_to(log_root).as_posix(), **fields}
+    try:
+        path = _index_path(log_root, task_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode())
+        finally:
+            os.close(fd)
+    except (OSError, LabtaskerValueError) as e:
+        logger.warning(f"Failed to update the index of run logs: {e}")
+
+
+def get_runs(task_id: str, log_root: Optional[Path] = None) -> List[RunRecord]:
+    """Runs of a task, in the order they started.
+
+    Tasks run before the index existed are found by listing the run dirs.
+    """
+    log_root = log_root or get_labtasker_log_root()
+    try:
+        with open(_index_path(log_root, task_id), "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return _scan_runs(log_root, task_id)
+
+    runs: Dict[str, RunRecord] = {}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:  # cut short by a crash
+            continue
+        run_dir = entry.pop("run_dir")
+        record = runs.setdefault(run_dir, RunRecord(run_dir=log_root / run_dir))
+        for key, value in entry.items():
+            if key == "archive":
+                value = log_root / value
+            if hasattr(record, key):
+                setattr(record, key, value)
+    return list(runs.values())
+
+
+def _scan_runs(log_root: Path, task_id: str) -> List[RunRecord]:
+    runs = []
+    # names start with the time the run started
+    for path in sorted((log_root / "run").glob(f"run_t*_id{task_id}_rd*")):
+        if path.name.endswith(ARCHIVE_SUFFIX):
+            run_dir = path.with_name(path.name[: -len(ARCHIVE_SUFFIX)])
+            runs.append(RunRecord(run_dir=run_dir, archive=path))
+            continue
+        record = RunRecord(run_dir=path)
+        try:
+            with open(path / "status.json", "r") as f:
+                record.status = json.load(f).get("status")
+        except (OSError, ValueError):
+            pass
+        runs.append(record)
+    return runs
+
+
+@contextlib.contextmanager
+def open_run_file(record: RunRecord, name: str = "run.log") -> Iterator[IO[bytes]]:
+    """Open a file of a run (e.g. `run.log`, `summary.json`), from its run dir or archive."""
+    if Path(name).is_absolute() or ".." in Path(name).parts:
+        raise LabtaskerValueError(f"Invalid file name {name!r}.")
+    if record.run_dir.is_dir():
+        with open(record.run_dir / name, "rb") as f:
+            yield f
+        return
+    if record.archive is not None and record.archive.exists():
+        with tarfile.open(record.archive, "r:gz") as tar:
+            try:
+                member = tar.extractfile(f"{record.run_dir.name}/{name}")
+            except KeyError:
+                member = None
+            if member is None:
+                raise FileNotFoundError(f"No {name} in {record.archive}")
+            with member:
+                yield member
+        return
+    if record.removed:
+        raise LabtaskerRuntimeError(
+            f"Logs of run {record.run_dir.name} were deleted by the retention policy."
+        )
+    raise FileNotFoundError(f"Run dir {record.run_dir} not found.")
+
+
+def compress_run(run_dir: Path) -> Optional[Path]:
+    """Replace the run dir of a finished task by an archive.
+
+    Returns:
+        The archive, or None if the run dir was changed meanwhile (e.g. compressed by
+        another loop).
+    """
+    archive = run_dir.with_name(run_dir.name + ARCHIVE_SUFFIX)
+    # hidden until complete, see apply_retention()
+    tmp = run_dir.with_name(f".{run_dir.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        finished_at = (run_dir / "status.json").stat().st_mtime
+        with tarfile.open(tmp, "w:gz", compresslevel=6) as tar:
+            tar.add(run_dir, arcname=run_dir.name)
+        os.utime(tmp, (finished_at, finished_at))  # ages are counted from the end
+        os.rename(tmp, archive)
+    except (OSError, tarfile.TarError):
+        tmp.unlink(missing_ok=True)
+        return None
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return archive
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                size += _dir_size(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+def _list_runs(
+    log_root: Path, with_sizes: bool
+) -> Tuple[List[Tuple[float, Path, str, int]], int]:
+    """Returns the finished runs as (finished at, path, task id, size), oldest first, and
+    the size of all the runs (0 unless `with_sizes`)."""
+    finished = []
+    total_size = 0
+    try:
+        entries = list(os.scandir(log_root / "run"))
+    except FileNotFoundError:
+        return [], 0
+    for entry in entries:
+        is_archive = entry.name.endswith(ARCHIVE_SUFFIX)
+        name = entry.name[: -len(ARCHIVE_SUFFIX)] if is_archive else entry.name
+        match = _RUN_DIR_RE.match(name)
+        if match is None:  # not a run, or an archive being written
+            continue
+        try:
+            if is_archive:
+                stat = entry.stat()
+                finished_at: Optional[float] = stat.st_mtime
+                size = stat.st_size
+            else:
+                try:
+                    finished_at = os.stat(Path(entry.path) / "status.json").st_mtime
+                except FileNotFoundError:
+                    finished_at = None  # running, or ended without a status
+                size = _dir_size(entry.path) if with_sizes else 0
+        except FileNotFoundError:  # removed meanwhile
+            continue
+        total_size += size
+        if finished_at is not None:
+            finished.append((finished_at, Path(entry.path), match["task_id"], size))
+    finished.sort()
+    return finished, total_size
+
+
+def _remove_run(path: Path, task_id: str) -> None:
+    if path.name.endswith(ARCHIVE_SUFFIX):
+        path.unlink(missing_ok=True)
+        run_dir = path.with_name(path.name[: -len(ARCHIVE_SUFFIX)])
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+        run_dir = path
+    record_run(run_dir, task_id, removed=True)
+
+
+def apply_retention(
+    compress_after: Optional[float] = None,
+    max_age: Optional[float] = None,
+    max_size: Optional[int] = None,
+    log_root: Optional[Path] = None,
+) -> Dict[str, int]:
+    """Compress and delete the runs of finished tasks (see the module docstring).
+
+    Returns:
+        The number of runs "compressed" and "removed".
+    """
+    log_root = log_root or get_labtasker_log_root()
+    counts = {"compressed": 0, "removed": 0}
+    finished, total_size = _list_runs(log_root, with_sizes=max_size is not None)
+    now = time.time()
+
+    kept = []
+    for finished_at, path, task_id, size in finished:
+        if max_age is not None and now - finished_at > max_age:
+            _remove_run(path, task_id)
+            total_size -= size
+            counts["removed"] += 1
+            continue
+        if (
+            compress_after is not None
+            and now - finished_at > compress_after
+            and not path.name.endswith(ARCHIVE_SUFFIX)
+        ):
+            archive = compress_run(path)
+            if archive is not None:
+                record_run(
+                    path, task_id, archive=archive.relative_to(log_root).as_posix()
+                )
+                counts["compressed"] += 1
+                compressed_size = archive.stat().st_size
+                total_size -= size - compressed_size
+                path, size = archive, compressed_size
+        kept.append((path, task_id, size))
+
+    if max_size is not None:
+        for path, task_id, size in kept:
+            if total_size <= max_size:
+                break
+            _remove_run(path, task_id)
+            total_size -= size
+            counts["removed"] += 1
+    return counts
+
+
+_retention_lock = threading.Lock()
+_last_retention: Optional[float] = None
+
+
+def schedule_retention() -> None:
+    """Apply the retention policy of the client config in a background thread, unless it
+    was applied by this process less than `RETENTION_INTERVAL` ago."""
+    global _last_retention
+    with _retention_lock:
+        now = time.monotonic()
+        if _last_retention is not None and now - _last_retention < RETENTION_INTERVAL:
+            return
+        _last_retention = now
+
+    config = get_client_config().logs
+    if not (config.compress_after or config.max_age or config.max_size):
+        return
+
+    def run():
+        try:
+            counts = apply_retention(
+                compress_after=(
+                    parse_time_interval(config.compress_after)
+                    if config.compress_after
+                    else None
+                ),
+                max_age=parse_time_interval(config.max_age) if config.max_age else None,
+                max_size=config.max_size,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to apply the retention policy of run logs: {e}")
+            return
+        if any(counts.values()):
+            logger.debug(
+                f"Run logs: {counts['compressed']} runs compressed, "
+                f"{counts['removed']} removed."
+            )
+
+    threading.Thread(target=run, name="labtasker-log-retention", daemon=True).start()
@@ -1,14 +1,21 @@
+import inspect
 import json
 import os
+import selectors
+import signal
 import subprocess
 import sys
 import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
 from functools import partial, wraps
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Dict, Optional, Set
 
 import httpx
 import pexpect
 from pydantic_core import to_jsonable_python
+from starlette.status import HTTP_404_NOT_FOUND, HTTP_405_METHOD_NOT_ALLOWED
 
 from labtasker.api_models import BaseResponseModel
 from labtasker.client.core.config import get_client_config
@@ -18,10 +25,22 @@
     LabtaskerHTTPStatusError,
     LabtaskerNetworkError,
 )
-from labtasker.client.core.logging import stderr_console, stdout_console
+from labtasker.client.core.logging import stderr_console, stdout_console, write_bytes
 from labtasker.client.core.paths import get_labtasker_client_config_path
 from labtasker.client.core.query_transpiler import transpile_query
 
+# Output of a child process is read in chunks of up to PUMP_READ_SIZE bytes, and written out
+# once PUMP_FLUSH_SIZE bytes are pending or PUMP_FLUSH_INTERVAL seconds passed
+PUMP_READ_SIZE = 65536
+PUMP_FLUSH_SIZE = 65536
+PUMP_FLUSH_INTERVAL = 0.05
+PUMP_DRAIN_TIMEOUT = 1.0
+
+# Set in the slots of concurrent loops, see `JobProcessGroups`
+_job_process_groups: ContextVar[Optional["JobProcessGroups"]] = ContextVar(
+    "job_process_groups", default=None
+)
+
 server_notification_prefix = {
     "info": "[bold dodger_blue1]INFO(notification):[/bold dodger_blue1] ",
     "warning": "[bold orange1]WARNING(notification):[/bold orange1] ",
@@ -64,35 +83,42 @@ def json_serializer(obj: Any, **kwargs) -> str:
     return json.dumps(to_jsonable_python(obj), **kwargs)
 
 
+def _print_server_notifications(resp: "BaseResponseModel") -> None:
+    level = "medium"
+    if get_labtasker_client_config_path().exists():
+        level = get_client_config().display_server_notifications_level
+
+    if level == "none":
+        return
+
+    notifications = resp.notification or []
+    for n in notifications:
+        if (
+            server_notification_level[n.level] < server_notification_level[level]
+        ):  # skip if level is lower than the config
+            continue
+        out = stdout_console if n.type == "info" else stderr_console
+        out.print(f"{server_notification_prefix[n.type]}{n.details}")
+
+
 def display_server_notifications(
     func: Optional[Callable[..., "BaseResponseModel"]] = None, /
 ):
     def decorator(function: Callable[..., "BaseResponseModel"]):
-        @wraps(function)
-        def wrapped(*args, **kwargs):
-            resp = function(*args, **kwargs)
-
-            level = "medium"
-            if get_labtasker_client_config_path().exists():
-                level = get_client_config().display_server_notifications_level
-
-            enabled = level != "none"
+        if inspect.iscoroutinefunction(function):
 
-            if not enabled:
+            @wraps(function)
+            async def async_wrapped(*args, **kwargs):
+                resp = await function(*args, **kwargs)
+                _print_server_notifications(resp)
                 return resp
 
-            notifications = resp.notification or []
-            for n in notifications:
-                if (
-                    server_notification_level[n.level]
-                    < server_notification_level[level]
-                ):  # skip if level is lower than the config
-                    continue
-                out = stdout_console if n.type == "info" else stderr_console
-                out.print(
-                    server_notification_prefix[n.type] + n.details,
-                )
+            return async_wrapped
 
+        @wraps(function)
+        def wrapped(*args, **kwargs):
+            resp = function(*args, **kwargs)
+            _print_server_notifications(resp)
             return resp
 
         return wrapped
@@ -103,22 +129,37 @@ def wrapped(*args, **kwargs):
     return decorator
 
 
+def _cast_http_error(e: httpx.HTTPError) -> Exception:
+    if isinstance(e, httpx.HTTPStatusError):
+        return LabtaskerHTTPStatusError(
+            message=str(e), request=e.request, response=e.response
+        )
+    if isinstance(e, httpx.ConnectError):
+        return LabtaskerConnectError(message=str(e), request=e.request)
+    if isinstance(e, httpx.ConnectTimeout):
+        return LabtaskerConnectTimeout(message=str(e), request=e.request)
+    return LabtaskerNetworkError(str(e))
+
+
 def cast_http_error(func: Optional[Callable] = None, /):
     def decorator(function: Callable):
+        if inspect.iscoroutinefunction(function):
+
+            @wraps(function)
+            async def async_wrapped(*args, **kwargs):
+                try:
+                    return await function(*args, **kwargs)
+                except httpx.HTTPError as e:
+                    raise _cast_http_error(e) from e
+
+            return async_wrapped
+
         @wraps(function)
         def wrapped(*args, **kwargs):
             try:
                 return function(*args, **kwargs)
-            except httpx.HTTPStatusError as e:
-                raise LabtaskerHTTPStatusError(
-                    message=str(e), request=e.request, response=e.response
-                ) from e
-            except httpx.ConnectError as e:
-                raise LabtaskerConnectError(message=str(e), request=e.request) from e
-            except httpx.ConnectTimeout as e:
-                raise LabtaskerConnectTimeout(message=str(e), request=e.request) from e
             except httpx.HTTPError as e:
-                raise LabtaskerNetworkError(str(e)) from e
+                raise _cast_http_error(e) from e
 
         return wrapped
 
@@ -128,6 +169,18 @@ def wrapped(*args, **kwargs):
     return decorator
 
 
+def is_missing_route(e: LabtaskerHTTPStatusError) -> bool:
+    """Whether the request failed because the server has no such endpoint."""
+    if e.response.status_code == HTTP_405_METHOD_NOT_ALLOWED:
+        return True
+    if e.response.status_code != HTTP_404_NOT_FOUND:
+        return False
+    try:
+        return e.response.json().get("detail") == "Not Found"
+    except ValueError:
+        return False
+
+
 def raise_for_status(r: httpx.Response) -> httpx.Response:
     """
     Call the original raise_for_status but preserve detailed error information.
@@ -151,88 +204,161 @@ def raise_for_status(r: httpx.Response) -> httpx.Response:
         ) from None
 
 
-def run_with_pty(cmd, shell_exec=None, use_shell=False):
+class JobProcessGroups:
+    """Process groups of the job processes run by a slot of a concurrent loop, so that another
+    thread can terminate them (see `terminate()`) to stop the slot.
+
+    Once set up in the context of the slot (see `setup()`), job processes are started in a
+    process group of their own (on POSIX systems), recorded while they run.
+    """
+
+    def __init__(self):
+        self._pgids: Set[int] = set()
+        self._lock = threading.Lock()
+        self._terminated = False
+
+    def setup(self) -> None:
+        _job_process_groups.set(self)
+
+    def terminate(self) -> None:
+        """Terminate the running job processes, and those started from now on."""
+        with self._lock:
+            self._terminated = True
+            pgids = list(self._pgids)
+        for pgid in pgids:
+            _terminate_process_group(pgid)
+
+    @contextmanager
+    def _running(self, pgid: int):
+        with self._lock:
+            self._pgids.add(pgid)
+            terminated = self._terminated
+        if terminated:
+            _terminate_process_group(pgid)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pgids.discard(pgid)
+
+
+def job_process_group(pgid: int):
+    """Context manager recording a job process group (led by the job process) while it runs,
+    if the current context is a slot of a concurrent loop."""
+    groups = _job_process_groups.get()
+    if groups is None or os.name != "posix":
+        return nullcontext()
+    return groups._running(pgid)
+
+
+def in_job_process_group() -> bool:
+    """Whether job processes are to be started in a process group of their own."""
+    return _job_process_groups.get() is not None and os.name == "posix"
+
+
+def _terminate_process_group(pgid: int) -> None:
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        # the process has not made its group yet
+        try:
+            os.kill(pgid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def run_with_pty(cmd, shell_exec=None, use_shell=False, env=None):
     """Run a command with PTY support for interactive programs."""
     if use_shell:
         shell_exec = shell_exec or "/bin/sh"
-        child = pexpect.spawn(shell_exec, ["-c", cmd], encoding="utf-8")
+        child = pexpect.spawn(shell_exec, ["-c", cmd], env=env)
     else:
-        child = pexpect.spawn(cmd[0], cmd[1:], encoding="utf-8")
+        child = pexpect.spawn(cmd[0], cmd[1:], env=env)
 
-    stream_child_output(child)
+    # the child leads a session of its own, as the pty is its controlling terminal
+    with job_process_group(child.pid):
+        stream_child_output(child)
 
     return child.exitstatus
 
 
-def run_with_subprocess(cmd, shell_exec=None, use_shell=False):
+def run_with_subprocess(cmd, shell_exec=None, use_shell=False, env=None):
     """Run a command using standard subprocess approach with real-time output.
 
-    This implementation uses threads to handle stdout and stderr streams separately,
-    providing good cross-platform compatibility with improved real-time output.
+    On POSIX systems, the output is pumped from the pipes by `pump_output`. On Windows,
+    where only sockets can be selected, threads read stdout and stderr separately instead
+    (see `read_output_threaded`).
 
     Args:
         cmd: Command to execute, either as a string or a list of arguments
         shell_exec: Shell executable to use (if any)
         use_shell: Whether to run the command through the shell
+        env: Environment variables of the subprocess (defaults to those of this process)
 
     Returns:
         The return code from the subprocess
     """
+    with (
+        subprocess.Popen(
+            args=cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=False,  # Use binary mode for more direct control
+            bufsize=0,  # Disable buffering for immediate output
+            executable=shell_exec,
+            shell=use_shell,
+            env=env,
+            start_new_session=in_job_process_group(),
+        ) as process,
+        job_process_group(process.pid),
+    ):
+        if os.name == "nt":
+            read_output_threaded(
+                {process.stdout: sys.stdout, process.stderr: sys.stderr},
+                wait=process.wait,
+            )
+        else:
+            pump_output(
+                {process.stdout.fileno(): sys.stdout, process.stderr.fileno(): sys.stderr},  # type: ignore[union-attr]
+                alive=lambda: process.poll() is None,
+            )
+        process.wait()
+        return process.returncode
 
-    def read_stream(stream, is_stdout):
-        """Read from a stream in small chunks for more immediate output.
-
-        This approach avoids line-buffering issues and ensures output appears
-        in real-time even when the subprocess doesn't output complete lines.
-
-        Args:
-            stream: The stream to read from (process stdout or stderr)
-            is_stdout: Boolean indicating if this is stdout (True) or stderr (False)
-        """
-        # Read in small chunks (64 bytes) instead of lines for more responsive output
-        for chunk in iter(lambda: stream.read(64), b""):
-            if is_stdout:
-                sys.stdout.buffer.write(chunk)
-                sys.stdout.buffer.flush()
-            else:
-                sys.stderr.buffer.write(chunk)
-                sys.stderr.buffer.flush()
-
-    with subprocess.Popen(
-        args=cmd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=False,  # Use binary mode for more direct control
-        bufsize=0,  # Disable buffering for immediate output
-        executable=shell_exec,
-        shell=use_shell,
-    ) as process:
-        # Create threads to handle output streams
-        stdout_thread = threading.Thread(
-            target=read_stream, args=(process.stdout, True)
-        )
-        stderr_thread = threading.Thread(
-            target=read_stream, args=(process.stderr, False)
-        )
 
-        # Set as daemon threads to avoid blocking when main process exits
-        stdout_thread.daemon = True
-        stderr_thread.daemon = True
+def read_output_threaded(outputs: Dict[Any, Any], wait: Callable[[], Any]) -> None:
+    """Copy the output of a child process from its pipes to streams (e.g. sys.stdout),
+    with one thread per pipe, until `wait()` returned and the threads finished, or
+    `PUMP_DRAIN_TIMEOUT` seconds after that.
 
-        # Start the threads
-        stdout_thread.start()
-        stderr_thread.start()
+    This implementation provides good cross-platform compatibility, as it does not need
+    pipes to be selectable. The threads run in copies of the calling context, so that its
+    output capture applies.
+    """
 
-        # Wait for process to complete
-        process.wait()
+    def read_stream(pipe, stream):
+        # the pipes are unbuffered: a read returns what is available, up to PUMP_READ_SIZE
+        for chunk in iter(lambda: pipe.read(PUMP_READ_SIZE), b""):
+            write_bytes(stream, chunk)
+        stream.flush()
+
+    threads = []
+    for pipe, stream in outputs.items():
+        # Set as daemon threads to avoid blocking when the main process exits
+        thread = threading.Thread(
+            target=copy_context().run,
+            args=(read_stream, pipe, stream),
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
 
-        # Wait for output processing to complete
-        # Use a timeout to prevent potential deadlocks
-        stdout_thread.join(timeout=1.0)
-        stderr_thread.join(timeout=1.0)
+    wait()
 
-        return process.returncode
+    # Use a timeout, as a background process of the job may hold the pipes open
+    for thread in threads:
+        thread.join(timeout=PUMP_DRAIN_TIMEOUT)
 
 
 def check_pty_available(opt: bool) -> bool:
@@ -248,16 +374,79 @@ def check_pty_available(opt: bool) -> bool:
 def stream_child_output(child) -> None:
     """Stream the output of a pexpect child in real-time, supporting progress bars."""
     try:
-        while True:
-            try:
-                output = child.read_nonblocking(size=1024, timeout=0.1)
-                if output:
-                    # keep \r
-                    sys.stdout.write(output)
-                    sys.stdout.flush()
-            except pexpect.TIMEOUT:
-                continue
-            except pexpect.EOF:
-                break
+        pump_output({child.child_fd: sys.stdout}, alive=child.isalive)
     finally:
         child.close()
+
+
+def pump_output(
+    outputs: Dict[int, Any], alive: Optional[Callable[[], bool]] = None
+) -> None:
+    """Copy the output of a child process from its file descriptors to streams (e.g.
+    sys.stdout), until it closed them, or `alive()` turned False and they stayed quiet for
+    `PUMP_DRAIN_TIMEOUT` seconds (e.g. a background process of the job holds them open).
+
+    Output is read in large chunks, and written out once `PUMP_FLUSH_SIZE` bytes are pending,
+    or `PUMP_FLUSH_INTERVAL` seconds after the oldest of them was read: chatty jobs cost a few
+    writes per interval, while progress bars (`\\r`) stay responsive. Writes go below the
+    text layers of the streams, to their file descriptors where possible (see `write_bytes`).
+
+    Runs in the calling thread, so that the output capture of its context applies.
+    """
+    pending = {fd: bytearray() for fd in outputs}
+    oldest: Dict[int, float] = {}  # fd -> when its oldest pending output was read
+
+    def flush(fd):
+        if pending[fd]:
+            write_bytes(outputs[fd], bytes(pending[fd]))
+            pending[fd].clear()
+        oldest.pop(fd, None)
+
+    exited_at = None
+    with selectors.DefaultSelector() as selector:
+        for fd in outputs:
+            selector.register(fd, selectors.EVENT_READ)
+        try:
+            while selector.get_map():
+                # wakes up regularly, to notice that the process exited (see `alive`)
+                timeout = 0.1
+                if oldest:
+                    timeout = min(
+                        timeout,
+                        max(
+                            0.0,
+                            min(oldest.values())
+                            + PUMP_FLUSH_INTERVAL
+                            - time.monotonic(),
+                        ),
+                    )
+                events = selector.select(timeout)
+                for key, _ in events:
+                    try:
+                        data = os.read(key.fd, PUMP_READ_SIZE)
+                    except OSError:  # EIO: the pty has no writer left
+                        data = b""
+                    if not data:
+                        selector.unregister(key.fd)
+                        flush(key.fd)
+                        continue
+                    pending[key.fd] += data
+                    oldest.setdefault(key.fd, time.monotonic())
+                    if len(pending[key.fd]) >= PUMP_FLUSH_SIZE:
+                        flush(key.fd)
+
+                now = time.monotonic()
+                for fd, read_at in list(oldest.items()):
+                    if now - read_at >= PUMP_FLUSH_INTERVAL:
+                        flush(fd)
+
+                if alive is not None and not events:
+                    if exited_at is None and not alive():
+                        exited_at = now
+                    elif exited_at is not None and now - exited_at > PUMP_DRAIN_TIMEOUT:
+                        break
+        finally:
+            for fd in outputs:
+                flush(fd)
+            for stream in set(outputs.values()):
+                stream.flush()
@@ -3,25 +3,55 @@
 from pathlib import Path
 from typing import Optional
 
+import httpx
 import typer
 import uvicorn
 
 from labtasker.filtering import install_traceback_filter
 from labtasker.server.config import get_server_config, init_server_config
-from labtasker.server.database import DBService, set_db_service
-from labtasker.server.embedded_db import MongoClient, ServerStore
-from labtasker.server.logging import log_config
+from labtasker.server.database import DBService, get_db, set_db_service
+from labtasker.server.embedded_db import (
+    MongoClient,
+    ServerStore,
+    convert_persistence_file,
+)
+from labtasker.server.event_bus import init_event_bus
+from labtasker.server.logging import log_config, logger
+from labtasker.server.replication import Replica, set_replica
+from labtasker.server.sqlite_db import MongoClient as SQLiteMongoClient
 
 install_traceback_filter()
 
+DEFAULT_EMBEDDED_DB_PATH = "labtasker_db.snapshot"
+# default of previous versions, in which the database was saved as JSON
+LEGACY_EMBEDDED_DB_PATH = "labtasker_db.json"
+
 cli = typer.Typer(context_settings={"help_option_names": ["-h", "--help"]})
 
 
 class DbMode(str, Enum):
     EMBEDDED = "embedded"
+    SQLITE = "sqlite"
     EXTERNAL = "external"
 
 
+class DbDurability(str, Enum):
+    SYNC = "sync"
+    GROUP = "group"
+    SNAPSHOT = "snapshot"
+    MEMORY = "memory"
+
+
+class SnapshotFormat(str, Enum):
+    BINARY = "binary"
+    JSON = "json"
+
+
+class EventBusMode(str, Enum):
+    LOCAL = "local"
+    DATABASE = "database"
+
+
 @cli.callback(invoke_without_command=True)
 def callback(ctx: typer.Context):
     if not ctx.invoked_subcommand:
@@ -38,47 +68,247 @@ def serve(
     db_mode: DbMode = typer.Option(
         "embedded", case_sensitive=False, envvar="DB_MODE", help="Database mode."
     ),
-    db_path: Path = typer.Option(
-        Path("labtasker_db.json"),
+    db_path: Optional[Path] = typer.Option(
+        None,
         writable=True,
         readable=True,
-        help="Path to the database persistence file.",
+        help="Path to the database persistence file. "
+        f"Defaults to {DEFAULT_EMBEDDED_DB_PATH} in 'embedded' mode "
+        f"(or {LEGACY_EMBEDDED_DB_PATH} if it exists, as saved by previous versions) "
+        "and labtasker_db.sqlite in 'sqlite' mode.",
+    ),
+    db_durability: DbDurability = typer.Option(
+        "sync",
+        case_sensitive=False,
+        envvar="DB_DURABILITY",
+        help="Durability policy of the embedded and sqlite databases. "
+        "Embedded: 'sync': every write is on disk before it returns. "
+        "'group': writes are committed to disk by a background thread every --db-flush-interval. "
+        "'snapshot': a snapshot is written every --db-flush-interval if changed. "
+        "'memory': nothing is saved to disk (for CI and benchmarks). "
+        "SQLite: every write goes to the database file, which 'sync' syncs on every commit, "
+        "'group' and 'snapshot' at WAL checkpoints only, and 'memory' never.",
+    ),
+    db_flush_interval: Optional[float] = typer.Option(
+        None,
+        envvar="DB_FLUSH_INTERVAL",
+        help="Flush interval in seconds of the 'group' (default: 0.1) and 'snapshot' (default: 60) durability policies of the embedded database.",
     ),
     env_file: Optional[Path] = typer.Option(
         None,
         help="Path to the server.env file to load.",
     ),
+    event_bus: Optional[EventBusMode] = typer.Option(
+        None,
+        case_sensitive=False,
+        envvar="EVENT_BUS",
+        help="Event bus backend. Use 'database' to relay events across multiple server processes sharing one database. "
+        "Defaults to 'database' when running multiple workers, otherwise 'local'.",
+    ),
+    workers: int = typer.Option(
+        1,
+        min=1,
+        envvar="WORKERS",
+        help="Number of worker processes. Requires the external database mode when larger than 1.",
+    ),
+    replica_of: Optional[str] = typer.Option(
+        None,
+        envvar="REPLICA_OF",
+        help="URL of a primary server to run as a warm standby of (embedded mode only). "
+        "The standby replicates the database of the primary and rejects other requests "
+        "until promoted with `labtasker-server promote`. "
+        "Both servers must share the same REPLICATION_TOKEN.",
+    ),
 ):
     """Create a local server with a Python emulated MongoDB.
     (It is recommended to use the docker compose instead of this.)
     """
-    if db_mode == "embedded":
+    if workers > 1 and db_mode != "external":
+        # each worker process would end up with its own copy of the embedded database,
+        # and operations of the sqlite database are only atomic within a process
+        raise typer.BadParameter(
+            f"Multiple workers are not supported with the {db_mode.value} database.",
+            param_hint="--workers",
+        )
+
+    if replica_of is not None and db_mode != "embedded":
+        raise typer.BadParameter(
+            "Replication is only supported with the embedded database.",
+            param_hint="--replica-of",
+        )
+
+    if event_bus is None:
+        event_bus = EventBusMode.DATABASE if workers > 1 else EventBusMode.LOCAL
+
+    if db_mode != "external":
         # authentication is not needed, as we are using Python emulated embedded DB
         os.environ["DB_USER"] = "admin"
         os.environ["DB_PASSWORD"] = "admin"
 
     os.environ["API_HOST"] = host
     os.environ["API_PORT"] = str(port)
+    os.environ["EVENT_BUS"] = event_bus.value
+
+    if workers > 1:
+        # worker processes are spawned from scratch and set up their own services
+        # via create_app(), so the options are handed over through the environment
+        if env_file:
+            os.environ["LABTASKER_SERVER_ENV_FILE"] = str(env_file.resolve())
+
+        init_server_config(env_file)
+        config = get_server_config()
+        uvicorn.run(
+            "labtasker.server.cli:create_app",
+            factory=True,
+            workers=workers,
+            host=config.api_host,
+            port=config.api_port,
+            log_config=log_config,
+        )
+        return
 
     init_server_config(env_file)
     config = get_server_config()
 
+    if replica_of is not None and not config.replication_token:
+        raise typer.BadParameter(
+            "REPLICATION_TOKEN must be set to run as a standby.",
+            param_hint="--replica-of",
+        )
+
+    setup_services(
+        db_mode=db_mode,
+        db_path=db_path,
+        db_durability=db_durability,
+        db_flush_interval=db_flush_interval,
+        replica_of=replica_of,
+    )
+
+    # import after set_db_service
+    from labtasker.server.endpoints import app
+
+    try:
+        uvicorn.run(
+            app, host=config.api_host, port=config.api_port, log_config=log_config
+        )
+    finally:
+        # stop background persistence of the embedded database
+        get_db().close()
+
+
+@cli.command()
+def convert_db(
+    src: Path = typer.Argument(
+        ..., exists=True, dir_okay=False, help="Path to the database persistence file."
+    ),
+    dest: Optional[Path] = typer.Argument(
+        None, dir_okay=False, help="Output path. Defaults to converting in place."
+    ),
+    to: SnapshotFormat = typer.Option(
+        "binary", case_sensitive=False, help="Format to convert to."
+    ),
+):
+    """Convert the persistence file of the embedded database, e.g. from the former JSON
+    format to the binary snapshot format. The server must be stopped.
+    """
+    convert_persistence_file(src, dest, fmt=to.value)
+    print(f"Converted {src} to {dest or src} ({to.value}).")
+
+
+def _default_embedded_db_path() -> str:
+    if (
+        not Path(DEFAULT_EMBEDDED_DB_PATH).exists()
+        and Path(LEGACY_EMBEDDED_DB_PATH).exists()
+    ):
+        logger.warning(
+            f"Using {LEGACY_EMBEDDED_DB_PATH} saved by a previous version, which is now saved "
+            f"as a binary snapshot. Rename it to {DEFAULT_EMBEDDED_DB_PATH} to silence this warning."
+        )
+        return LEGACY_EMBEDDED_DB_PATH
+    return DEFAULT_EMBEDDED_DB_PATH
+
+
+def setup_services(
+    db_mode: DbMode,
+    db_path: Optional[Path] = None,
+    db_durability: DbDurability = DbDurability.SYNC,
+    db_flush_interval: Optional[float] = None,
+    replica_of: Optional[str] = None,
+):
+    """Set up database service and event bus according to the initialized server config."""
+    config = get_server_config()
+
     if db_mode == "embedded":
+        store = ServerStore(
+            persistence_path=str(db_path or _default_embedded_db_path()),
+            durability=db_durability.value,
+            flush_interval=db_flush_interval,
+        )
+        if config.replication_token:
+            # a standby keeps a log as well, for standbys of its own once promoted
+            store.enable_replication()
+        set_db_service(
+            DBService(db_name=config.db_name, client=MongoClient(_store=store))
+        )
+        if replica_of is not None:
+            assert config.replication_token, "checked by serve()"
+            replica = Replica(store, replica_of, token=config.replication_token)
+            set_replica(replica)
+            replica.start()
+    elif db_mode == "sqlite":
+        # commits are made durable by SQLite, so there is no flush interval
         set_db_service(
             DBService(
                 db_name=config.db_name,
-                client=MongoClient(
-                    _store=ServerStore(persistence_path=str(db_path)),
+                client=SQLiteMongoClient(
+                    db_path or "labtasker_db.sqlite",
+                    durability=db_durability.value,
                 ),
             )
         )
     else:
         set_db_service(DBService(db_name=config.db_name, uri=config.mongodb_uri))
 
-    # import after set_db_service
+    init_event_bus(get_db())
+
+
+@cli.command()
+def promote(
+    url: str = typer.Argument(
+        "http://localhost:9321", help="URL of the standby server to promote."
+    ),
+    token: str = typer.Option(
+        ...,
+        envvar="REPLICATION_TOKEN",
+        help="Replication token of the standby server.",
+    ),
+):
+    """Promote a standby server (`serve --replica-of`) to primary.
+    Point the clients to it afterwards, and stop the former primary if it is still running.
+    """
+    response = httpx.post(
+        f"{url.rstrip('/')}/api/v1/replication/promote",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    if response.is_error:
+        print(f"Failed to promote {url}: {response.text}")
+        raise typer.Exit(1)
+    replication = response.json()["replication"]
+    print(
+        f"Promoted {url}. It was {replication['lag_records']} records behind "
+        f"{replication['primary_url']}."
+    )
+
+
+def create_app():
+    """App factory used by each uvicorn worker process of `serve --workers N`."""
+    init_server_config(os.environ.get("LABTASKER_SERVER_ENV_FILE"))
+    # multiple workers are only supported with the external database
+    setup_services(db_mode=DbMode.EXTERNAL)
+
     from labtasker.server.endpoints import app
 
-    uvicorn.run(app, host=config.api_host, port=config.api_port, log_config=log_config)
+    return app
 
 
 def main():
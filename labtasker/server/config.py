@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 
 from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -19,10 +19,22 @@ class ServerConfig(BaseSettings):
 
     # Other settings
     periodic_task_interval: float = 30.0
+    # Only the server process holding the lease checks timeouts.
+    # If it dies, another process takes over within about this many seconds.
+    leader_lease_ttl: float = 10.0
 
     event_buffer_size: int = 100
     sse_ping_interval: float = 15.0  # in seconds
 
+    # "local": events are only delivered to subscribers connected to the same process.
+    # "database": events are relayed across server processes through the database.
+    event_bus: Literal["local", "database"] = "local"
+    event_bus_poll_interval: float = 0.1  # in seconds
+
+    # Standby servers (`serve --replica-of`) authenticate to the primary with this token.
+    # Replication is disabled unless it is set (embedded database only).
+    replication_token: Optional[str] = None
+
     model_config = SettingsConfigDict(
         # env_file=".env",
         env_file_encoding="utf-8",
@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta
 from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
 from uuid import uuid4
 
@@ -27,6 +28,8 @@
     sanitize_update,
     validate_arg,
 )
+from labtasker.server.embedded_db import MongoClient as EmbeddedMongoClient
+from labtasker.server.embedded_db import ServerStore
 from labtasker.server.fsm import (
     StateTransitionEventHandle,
     TaskFSM,
@@ -43,6 +46,9 @@
     unflatten_dict,
 )
 
+# How long journaled events are kept for relaying across server processes
+EVENT_JOURNAL_TTL = 3600  # in seconds
+
 
 class DBService:
 
@@ -98,6 +104,16 @@ def _setup_collections(self):
         self._tasks.create_index([("status", ASCENDING)])
         self._tasks.create_index([("priority", DESCENDING)])  # Higher priority first
         self._tasks.create_index([("created_at", ASCENDING)])  # Older tasks first
+        # Serves fetch_task: pending tasks of a queue in the order they are fetched
+        self._tasks.create_index(
+            [
+                ("queue_id", ASCENDING),
+                ("status", ASCENDING),
+                ("priority", DESCENDING),
+                ("last_modified", ASCENDING),
+                ("created_at", ASCENDING),
+            ]
+        )
 
         # Workers collection
         self._workers: Collection = self._db.workers
@@ -107,10 +123,45 @@ def _setup_collections(self):
             [("worker_name", ASCENDING)]
         )  # Optional index for searching
 
+        # Event journal collection (used for relaying events across server processes)
+        self._events: Collection = self._db.events
+        self._events.create_index(
+            [("created_at", ASCENDING)], expireAfterSeconds=EVENT_JOURNAL_TTL
+        )
+
+        # Leases collection (used for electing a leader among server processes)
+        # _id is the lease name
+        self._leases: Collection = self._db.leases
+
     def close(self):
         """Close the database client."""
         self._client.close()
 
+    def _start_transaction(
+        self, session, queue_id: Optional[str] = None, read_only: bool = False
+    ):
+        """Start a transaction on the session.
+
+        For the embedded database, the transaction only locks the given queue (all queues
+        if not given), and read-only transactions on the same queue run concurrently.
+        """
+        if isinstance(self._client, EmbeddedMongoClient):
+            return session.start_transaction(queue_id=queue_id, read_only=read_only)
+        return session.start_transaction()
+
+    def flush(self):
+        """Make all writes so far durable.
+        Only relevant to the embedded database, which may persist writes in the background.
+        """
+        if isinstance(self._client, EmbeddedMongoClient):
+            self._client.flush()
+
+    @property
+    def embedded_store(self) -> Optional[ServerStore]:
+        """Store of the embedded database, if used (e.g. for replication)."""
+        store = getattr(self._client, "_store", None)
+        return store if isinstance(store, ServerStore) else None
+
     def erase(self):
         """Erase all data"""
         for col_name in self._db.list_collection_names():
@@ -150,7 +201,7 @@ def query_collection(
             ("last_modified", ASCENDING)
         ]  # Default sort by last_modified first
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id, read_only=True):
                 if collection_name not in ["queues", "tasks", "workers"]:
                     raise HTTPException(
                         status_code=HTTP_400_BAD_REQUEST,
@@ -203,7 +254,7 @@ def update_collection(
     ) -> int:
         """Update a collection. Return modified count"""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 if collection_name not in ["queues", "tasks", "workers"]:
                     raise HTTPException(
                         status_code=HTTP_400_BAD_REQUEST,
@@ -243,7 +294,7 @@ def create_queue(
                 status_code=HTTP_400_BAD_REQUEST, detail="Queue name is required"
             )
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session):
                 try:
                     now = get_current_time()
                     queue = {
@@ -285,7 +336,7 @@ def create_task(
                 detail="Either args or cmd must be provided",
             )
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 now = get_current_time()
 
                 task_id = str(uuid4())
@@ -337,7 +388,7 @@ def create_worker(
     ) -> str:
         """Create a worker."""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 now = get_current_time()
 
                 worker_id = str(uuid4())
@@ -387,7 +438,7 @@ def delete_queue(
             deleted_count: total affected entries
         """
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 deleted_count = 0
                 # Delete queue
                 deleted_count += self._queues.delete_one(
@@ -415,7 +466,7 @@ def delete_task(
     ) -> int:
         """Delete a task."""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 # Delete task
                 return self._tasks.delete_one(
                     {"_id": task_id, "queue_id": queue_id}, session=session
@@ -441,7 +492,7 @@ def delete_worker(
             affected_count:
         """
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 affected_count = 0
                 # Delete worker
                 affected_count += self._workers.delete_one(
@@ -449,6 +500,11 @@ def delete_worker(
                 ).deleted_count
 
                 now = get_current_time()
+                # Its reservations would not be started
+                event_handles = self._release_tasks(
+                    session, {"queue_id": queue_id, "worker_id": worker_id}, now=now
+                )
+                affected_count += len(event_handles)
                 if cascade_update:
                     # Update all tasks associated with the worker
                     affected_count += self._tasks.update_many(
@@ -457,7 +513,10 @@ def delete_worker(
                         session=session,
                     ).modified_count
 
-                return affected_count
+        for event_handle in event_handles:
+            event_handle.commit()
+
+        return affected_count
 
     @retry_on_transient
     @validate_arg
@@ -470,7 +529,7 @@ def update_queue(
     ) -> int:
         """Update queue settings. Returns modified_count"""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session):
                 # Make sure name does not already exist
                 if new_queue_name and self._get_queue_by_name(
                     new_queue_name, session=session, raise_exception=False
@@ -541,184 +600,539 @@ def fetch_task(
             extra_filter (Dict[str, Any], optional): Additional filter criteria for the task.
             cmd (Optional[Union[str, List[str]]]): The command that runs the job.
         """
-        task_timeout = parse_time_interval(eta_max) if eta_max else None
+        fetch = self._prepare_fetch(
+            queue_id=queue_id,
+            worker_id=worker_id,
+            eta_max=eta_max,
+            heartbeat_timeout=heartbeat_timeout,
+            start_heartbeat=start_heartbeat,
+            required_fields=required_fields,
+            extra_filter=extra_filter,
+            cmd=cmd,
+        )
+
+        with self._client.start_session() as session:
+            with self._start_transaction(session, queue_id=queue_id):
+                fetched_task, event_handle = self._fetch_task(session, **fetch)
 
-        required_fields = required_fields or []
+        if fetched_task:
+            event_handle.update_fsm_event(fetched_task, commit=True)  # type: ignore
+            return fetched_task
 
-        allow_arbitrary_args = "*" in required_fields
-        if allow_arbitrary_args:  # prevent "*" messing with constructed mongodb query
-            required_fields.remove("*")
+        return None  # Return None if no tasks matched
 
-        if not start_heartbeat and not task_timeout:
+    @retry_on_transient
+    @validate_arg
+    def report_and_fetch_task(
+        self,
+        queue_id: str,
+        task_id: str,
+        report_status: str,
+        summary_update: Optional[Dict[str, Any]] = None,
+        worker_id: Optional[str] = None,
+        eta_max: Optional[str] = None,
+        heartbeat_timeout: Optional[float] = None,
+        start_heartbeat: bool = True,
+        required_fields: Optional[List[str]] = None,
+        extra_filter: Optional[Dict[str, Any]] = None,
+        cmd: Optional[Union[str, List[str]]] = None,
+    ) -> Optional[Mapping[str, Any]]:
+        """Report the status of a task (as `worker_report_task_status` if `worker_id` is
+        given, else as `report_task_status`) and fetch the next task (as `fetch_task`), in
+        one transaction.
+
+        If the report fails, nothing is changed. If the report is done but no task can be
+        fetched for the worker (e.g. the failure reported suspended it), the report is kept
+        and the error of the fetch is raised.
+        """
+        fetch = self._prepare_fetch(
+            queue_id=queue_id,
+            worker_id=worker_id,
+            eta_max=eta_max,
+            heartbeat_timeout=heartbeat_timeout,
+            start_heartbeat=start_heartbeat,
+            required_fields=required_fields,
+            extra_filter=extra_filter,
+            cmd=cmd,
+        )
+
+        fetch_error = None
+        fetched_task, fetch_event_handle = None, None
+        with self._client.start_session() as session:
+            with self._start_transaction(session, queue_id=queue_id):
+                task = self._tasks.find_one(
+                    {"_id": task_id, "queue_id": queue_id}, session=session
+                )
+                if not task:
+                    raise HTTPException(
+                        status_code=HTTP_404_NOT_FOUND,
+                        detail=f"Task {task_id} not found",
+                    )
+                if worker_id is not None and task["worker_id"] != worker_id:
+                    raise HTTPException(
+                        status_code=HTTP_409_CONFLICT,
+                        detail=f"Task {task_id} is assigned to worker {task['worker_id']}",
+                    )
+
+                event_handles = self._report_task_status(
+                    queue_id=queue_id,
+                    task=task,
+                    report_status=report_status,
+                    summary_update=summary_update,
+                    session=session,
+                )
+
+                try:
+                    fetched_task, fetch_event_handle = self._fetch_task(
+                        session, **fetch
+                    )
+                except HTTPException as e:  # the worker can not fetch tasks
+                    fetch_error = e
+
+        for event_handle in event_handles:
+            event_handle.commit()
+
+        if fetch_error is not None:
+            raise fetch_error
+
+        if fetched_task:
+            fetch_event_handle.update_fsm_event(fetched_task, commit=True)  # type: ignore
+            return fetched_task
+
+        return None
+
+    @retry_on_transient
+    @validate_arg
+    def reserve_task(
+        self,
+        queue_id: str,
+        worker_id: str,
+        reserve_timeout: float,
+        required_fields: Optional[List[str]] = None,
+        extra_filter: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Mapping[str, Any]]:
+        """
+        Reserve the next available task for a worker, without starting it.
+        The task is set to RESERVED until `reserve_timeout` seconds from now, a lease that
+        the heartbeats of the worker renew. Until then, only that worker fetches it (before
+        any pending task). Once the lease expired, the task is released to PENDING by
+        `handle_timeouts`, without counting a retry.
+
+        Args:
+            queue_id (str): The id of the queue to reserve the task from.
+            worker_id (str): The ID of the worker to reserve the task for.
+            reserve_timeout (float): The lease of the reservation in seconds.
+            required_fields (list, optional): See `fetch_task`.
+            extra_filter (Dict[str, Any], optional): See `fetch_task`.
+        """
+        if reserve_timeout <= 0:
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST,
-                detail="Eta max must be specified when start_heartbeat is False",
+                detail="Reserve timeout must be positive",
             )
 
-        fetched_task = None
+        fetch = self._prepare_fetch(
+            queue_id=queue_id,
+            worker_id=worker_id,
+            eta_max=None,
+            heartbeat_timeout=None,
+            start_heartbeat=True,
+            required_fields=required_fields,
+            extra_filter=extra_filter,
+            cmd=None,
+            reserve_timeout=reserve_timeout,
+        )
+
         with self._client.start_session() as session:
-            with session.start_transaction():
-                # Verify worker status if specified
-                if worker_id:
-                    worker = self._workers.find_one(
-                        {"_id": worker_id, "queue_id": queue_id}, session=session
-                    )
-                    if not worker:
-                        raise HTTPException(
-                            status_code=HTTP_404_NOT_FOUND,
-                            detail=f"Worker '{worker_id}' not found in queue '{queue_id}'",
-                        )
-                    worker_status = worker["status"]
-                    if worker_status != WorkerState.ACTIVE:
-                        raise HTTPException(
-                            status_code=HTTP_403_FORBIDDEN,
-                            detail=f"Worker '{worker_id}' is {worker_status} in queue '{queue_id}'",
-                        )
+            with self._start_transaction(session, queue_id=queue_id):
+                reserved_task, event_handle = self._fetch_task(session, **fetch)
 
-                # Fetch task
-                now = get_current_time()
+        if reserved_task:
+            event_handle.update_fsm_event(reserved_task, commit=True)  # type: ignore
+            return reserved_task
 
-                # "no less" of the "no more, no less" principle, user demanded fields must
-                # exist in task args
-                # even if allow_arbitrary_args==True, this principle should still be followed
-                # else it may lead to unexpected missing keys.
-                try:
-                    query_dict = keys_to_query_dict(required_fields, mode="deepest")
-                except (TypeError, ValueError) as e:
+        return None
+
+    @retry_on_transient
+    @validate_arg
+    def release_task(
+        self, queue_id: str, task_id: str, worker_id: Optional[str] = None
+    ) -> bool:
+        """Release a reserved task back to PENDING (e.g. once its worker stopped)."""
+        with self._client.start_session() as session:
+            with self._start_transaction(session, queue_id=queue_id):
+                task = self._tasks.find_one(
+                    {"_id": task_id, "queue_id": queue_id}, session=session
+                )
+                if not task:
                     raise HTTPException(
-                        status_code=HTTP_400_BAD_REQUEST,
-                        detail=f"Invalid required fields. Detail: {str(e)}",
+                        status_code=HTTP_404_NOT_FOUND,
+                        detail=f"Task {task_id} not found",
                     )
-                required_fields_filter = query_dict_to_mongo_filter(
-                    query_dict, parent_key="args"
-                )
-
-                combined_filter = merge_filter(
-                    required_fields_filter, extra_filter, logical_op="and"
+                if task["status"] != TaskState.RESERVED or (
+                    worker_id is not None and task["worker_id"] != worker_id
+                ):
+                    raise HTTPException(
+                        status_code=HTTP_409_CONFLICT,
+                        detail=f"Task {task_id} is not reserved"
+                        + (f" by worker {worker_id}" if worker_id else ""),
+                    )
+                event_handles = self._release_tasks(
+                    session, {"_id": task_id}, now=get_current_time()
                 )
 
-                sanitized_filter = sanitize_query(queue_id, combined_filter)
-
-                # Construct the query
-                query = {
-                    **sanitized_filter,
-                    "queue_id": queue_id,
-                    "status": TaskState.PENDING,
-                }
+        for event_handle in event_handles:
+            event_handle.commit()
+        return True
 
-                update = {
+    def _release_tasks(
+        self, session, query: Dict[str, Any], now: datetime
+    ) -> List[StateTransitionEventHandle]:
+        """Release the reserved tasks matching `query` back to PENDING (in a transaction)."""
+        event_handles = []
+        for task in list(
+            self._tasks.find({**query, "status": TaskState.RESERVED}, session=session)
+        ):
+            fsm = TaskFSM.from_db_entry(task)
+            event_handle = fsm.release()
+            updated_task = self._tasks.find_one_and_update(
+                {"_id": task["_id"]},
+                {
                     "$set": {
-                        "status": TaskState.RUNNING,
-                        "start_time": now,
-                        "last_heartbeat": now if start_heartbeat else None,
+                        "status": fsm.state,
+                        "worker_id": None,
+                        "reserved_until": None,
                         "last_modified": now,
-                        "worker_id": worker_id,
-                        "cmd": cmd,
-                        "summary": {},  # clear previous summary before fetched
                     }
+                },
+                session=session,
+                return_document=ReturnDocument.AFTER,
+            )
+            event_handle.update_fsm_event(updated_task)  # type: ignore
+            event_handles.append(event_handle)
+        return event_handles
+
+    def _prepare_fetch(
+        self,
+        queue_id: str,
+        worker_id: Optional[str],
+        eta_max: Optional[str],
+        heartbeat_timeout: Optional[float],
+        start_heartbeat: bool,
+        required_fields: Optional[List[str]],
+        extra_filter: Optional[Dict[str, Any]],
+        cmd: Optional[Union[str, List[str]]],
+        reserve_timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Validate the arguments of a fetch (or a reservation, with `reserve_timeout`),
+        and build its query and update (outside of the transaction, so that invalid
+        arguments fail before anything is changed)."""
+        if reserve_timeout is not None and not worker_id:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail="Tasks can only be reserved for a worker",
+            )
+
+        task_timeout = parse_time_interval(eta_max) if eta_max else None
+
+        required_fields = list(required_fields or [])
+
+        allow_arbitrary_args = "*" in required_fields
+        if allow_arbitrary_args:  # prevent "*" messing with constructed mongodb query
+            required_fields.remove("*")
+
+        if not start_heartbeat and not task_timeout:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail="Eta max must be specified when start_heartbeat is False",
+            )
+
+        # "no less" of the "no more, no less" principle, user demanded fields must
+        # exist in task args
+        # even if allow_arbitrary_args==True, this principle should still be followed
+        # else it may lead to unexpected missing keys.
+        try:
+            query_dict = keys_to_query_dict(required_fields, mode="deepest")
+        except (TypeError, ValueError) as e:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail=f"Invalid required fields. Detail: {str(e)}",
+            )
+        required_fields_filter = query_dict_to_mongo_filter(
+            query_dict, parent_key="args"
+        )
+
+        combined_filter = merge_filter(
+            required_fields_filter, extra_filter, logical_op="and"
+        )
+
+        sanitized_filter = sanitize_query(queue_id, combined_filter)
+
+        # Construct the query
+        query = {
+            **sanitized_filter,
+            "queue_id": queue_id,
+            "status": TaskState.PENDING,
+        }
+
+        update: Dict[str, Any]
+        if reserve_timeout is not None:
+            update = {
+                "$set": {
+                    "status": TaskState.RESERVED,
+                    "worker_id": worker_id,
+                    "reserve_timeout": reserve_timeout,
+                }
+            }
+        else:
+            update = {
+                "$set": {
+                    "status": TaskState.RUNNING,
+                    "worker_id": worker_id,
+                    "cmd": cmd,
+                    "summary": {},  # clear previous summary before fetched
+                    "reserved_until": None,
                 }
+            }
 
-                if task_timeout:
-                    update["$set"]["task_timeout"] = task_timeout
+            if task_timeout:
+                update["$set"]["task_timeout"] = task_timeout
+
+            if heartbeat_timeout:
+                update["$set"]["heartbeat_timeout"] = heartbeat_timeout
+
+        return {
+            "queue_id": queue_id,
+            "worker_id": worker_id,
+            "start_heartbeat": start_heartbeat,
+            "reserve_timeout": reserve_timeout,
+            "query": query,
+            "update": update,
+            # "no more" of the "no more, no less" principle
+            # those specified in the task["args"] should be required
+            "required_fields_no_more": (
+                None
+                if allow_arbitrary_args
+                else keys_to_query_dict(required_fields, mode="topmost")
+            ),
+        }
 
-                if heartbeat_timeout:
-                    update["$set"]["heartbeat_timeout"] = heartbeat_timeout
+    def _fetch_task(
+        self,
+        session,
+        queue_id: str,
+        worker_id: Optional[str],
+        start_heartbeat: bool,
+        query: Dict[str, Any],
+        update: Dict[str, Any],
+        required_fields_no_more: Optional[Dict[str, Any]],
+        reserve_timeout: Optional[float] = None,
+    ) -> Tuple[Optional[Mapping[str, Any]], Optional[StateTransitionEventHandle]]:
+        """Fetch the next task (in a transaction), see `fetch_task`. The tasks reserved by
+        the worker are fetched first. With `reserve_timeout`, the task is reserved instead,
+        see `reserve_task`.
 
-                tasks = self._tasks.aggregate(
-                    [
-                        {"$match": query},
-                        {"$addFields": {"task_id": "$_id"}},
-                        # sort: highest priority, least recently modified, oldest created
-                        {
-                            "$sort": {
-                                "priority": DESCENDING,
-                                "last_modified": ASCENDING,
-                                "created_at": ASCENDING,
-                            }
-                        },
-                    ],
-                    session=session,
+        Returns:
+            The fetched task and the handle of its event, or (None, None).
+        """
+        # Verify worker status if specified
+        if worker_id:
+            worker = self._workers.find_one(
+                {"_id": worker_id, "queue_id": queue_id}, session=session
+            )
+            if not worker:
+                raise HTTPException(
+                    status_code=HTTP_404_NOT_FOUND,
+                    detail=f"Worker '{worker_id}' not found in queue '{queue_id}'",
+                )
+            worker_status = worker["status"]
+            if worker_status != WorkerState.ACTIVE:
+                raise HTTPException(
+                    status_code=HTTP_403_FORBIDDEN,
+                    detail=f"Worker '{worker_id}' is {worker_status} in queue '{queue_id}'",
+                )
+
+        # Fetch task
+        now = get_current_time()
+        queries = [query]
+        if reserve_timeout is not None:
+            update = {
+                "$set": {
+                    **update["$set"],
+                    "reserved_until": now + timedelta(seconds=reserve_timeout),
+                    "last_modified": now,
+                }
+            }
+        else:
+            update = {
+                "$set": {
+                    **update["$set"],
+                    "start_time": now,
+                    "last_heartbeat": now if start_heartbeat else None,
+                    "last_modified": now,
+                }
+            }
+            if worker_id:
+                queries.insert(
+                    0, {**query, "status": TaskState.RESERVED, "worker_id": worker_id}
                 )
 
-                # "no more" of the "no more, no less" principle
-                # those specified in the task["args"] should be required
-                required_fields_no_more = keys_to_query_dict(
-                    required_fields, mode="topmost"
+        for query in queries:
+            task = self._next_task(session, query, required_fields_no_more)
+            if task:
+                fsm = TaskFSM.from_db_entry(task)
+                event_handle = fsm.reserve() if reserve_timeout else fsm.fetch()
+
+                fetched_task = self._tasks.find_one_and_update(
+                    {"_id": task["_id"]},
+                    update,
+                    session=session,
+                    return_document=ReturnDocument.AFTER,
                 )
-                for task in tasks:
-                    if task:
-                        if (
-                            not allow_arbitrary_args
-                            and required_fields_no_more
-                            and not arg_match(required_fields_no_more, task["args"])
-                        ):
-                            continue  # Skip to the next task if it doesn't match
-
-                        fsm = TaskFSM.from_db_entry(task)
-                        event_handle = fsm.fetch()
-
-                        fetched_task = self._tasks.find_one_and_update(
-                            {"_id": task["_id"]},
-                            update,
-                            session=session,
-                            return_document=ReturnDocument.AFTER,
-                        )
-                        break
+                return fetched_task, event_handle
 
-        if fetched_task:
-            event_handle.update_fsm_event(fetched_task, commit=True)  # type: ignore
-            return fetched_task
+        return None, None
 
-        return None  # Return None if no tasks matched
+    def _next_task(
+        self,
+        session,
+        query: Dict[str, Any],
+        required_fields_no_more: Optional[Dict[str, Any]],
+    ) -> Optional[Mapping[str, Any]]:
+        """The first task matching `query`, in the order tasks are fetched."""
+        tasks = self._tasks.aggregate(
+            [
+                {"$match": query},
+                {"$addFields": {"task_id": "$_id"}},
+                # sort: highest priority, least recently modified, oldest created
+                {
+                    "$sort": {
+                        "priority": DESCENDING,
+                        "last_modified": ASCENDING,
+                        "created_at": ASCENDING,
+                    }
+                },
+            ],
+            session=session,
+        )
+
+        for task in tasks:
+            if task:
+                if required_fields_no_more and not arg_match(
+                    required_fields_no_more, task["args"]
+                ):
+                    continue  # Skip to the next task if it doesn't match
+                return task
+
+        return None
 
     @retry_on_transient
     @validate_arg
     def refresh_task_heartbeat(
         self, queue_id: str, task_id: str, worker_id: Optional[str] = None
     ):
-        """Update task heartbeat timestamp."""
-        query = {"_id": task_id, "queue_id": queue_id, "status": "running"}
-
+        """Update task heartbeat timestamp (and renew the reservations of the worker)."""
         with self._client.start_session() as session:
-            with session.start_transaction():
-                # Find the task in a single query
-                task = self._tasks.find_one(query)
-                if not task:
-                    raise HTTPException(
-                        status_code=HTTP_404_NOT_FOUND,
-                        detail=f"Task '{task_id}' not found in queue '{queue_id}' or not in 'running' state",
-                    )
-
-                # Validate worker if provided
+            with self._start_transaction(session, queue_id=queue_id):
+                self._refresh_task_heartbeat(session, queue_id, task_id, worker_id)
                 if worker_id:
-                    if task["worker_id"] != worker_id:
-                        raise HTTPException(
-                            status_code=HTTP_403_FORBIDDEN,
-                            detail=f"Task '{task_id}' is assigned to worker '{task['worker_id']}', not '{worker_id}'",
-                        )
+                    self._renew_reservations(session, queue_id, worker_id)
 
-                    # Check worker status in a single query
-                    worker = self._workers.find_one(
-                        {"_id": worker_id, "status": WorkerState.ACTIVE}
-                    )
-                    if not worker:
-                        raise HTTPException(
-                            status_code=HTTP_404_NOT_FOUND,
-                            detail=f"Worker '{worker_id}' not found or not active",
+    @retry_on_transient
+    @validate_arg
+    def refresh_task_heartbeats(
+        self, queue_id: str, task_ids: List[str], worker_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Update the heartbeat timestamps of several tasks in one transaction.
+
+        A task that can not be refreshed (e.g. no longer running) does not fail the others.
+
+        Returns:
+            {"refreshed": [task_id, ...], "failed": {task_id: reason, ...}}
+        """
+        refreshed, failed = [], {}
+        with self._client.start_session() as session:
+            with self._start_transaction(session, queue_id=queue_id):
+                for task_id in dict.fromkeys(task_ids):  # deduplicated, in order
+                    try:
+                        self._refresh_task_heartbeat(
+                            session, queue_id, task_id, worker_id
                         )
+                        refreshed.append(task_id)
+                    except HTTPException as e:
+                        failed[task_id] = e.detail
+                if worker_id and refreshed:
+                    self._renew_reservations(session, queue_id, worker_id)
+        return {"refreshed": refreshed, "failed": failed}
+
+    def _renew_reservations(self, session, queue_id: str, worker_id: str):
+        """Extend the lease of the tasks reserved by a worker that is alive, by their
+        reserve_timeout from now."""
+        now = get_current_time()
+        for task in list(
+            self._tasks.find(
+                {
+                    "queue_id": queue_id,
+                    "status": TaskState.RESERVED,
+                    "worker_id": worker_id,
+                },
+                session=session,
+            )
+        ):
+            self._tasks.update_one(
+                {"_id": task["_id"]},
+                {
+                    "$set": {
+                        "reserved_until": now
+                        + timedelta(seconds=task["reserve_timeout"])
+                    }
+                },
+                session=session,
+            )
 
-                # Update the task heartbeat
-                result = self._tasks.update_one(
-                    query,
-                    {"$set": {"last_heartbeat": get_current_time()}},
-                    session=session,
+    def _refresh_task_heartbeat(
+        self, session, queue_id: str, task_id: str, worker_id: Optional[str]
+    ):
+        query = {"_id": task_id, "queue_id": queue_id, "status": "running"}
+
+        # Find the task in a single query
+        task = self._tasks.find_one(query)
+        if not task:
+            raise HTTPException(
+                status_code=HTTP_404_NOT_FOUND,
+                detail=f"Task '{task_id}' not found in queue '{queue_id}' or not in 'running' state",
+            )
+
+        # Validate worker if provided
+        if worker_id:
+            if task["worker_id"] != worker_id:
+                raise HTTPException(
+                    status_code=HTTP_403_FORBIDDEN,
+                    detail=f"Task '{task_id}' is assigned to worker '{task['worker_id']}', not '{worker_id}'",
                 )
 
-                if result.modified_count == 0:
-                    raise HTTPException(
-                        status_code=HTTP_404_NOT_FOUND,
-                        detail=f"Failed to update heartbeat for task '{task_id}' - it may have changed state during the operation",
-                    )
+            # Check worker status in a single query
+            worker = self._workers.find_one(
+                {"_id": worker_id, "status": WorkerState.ACTIVE}
+            )
+            if not worker:
+                raise HTTPException(
+                    status_code=HTTP_404_NOT_FOUND,
+                    detail=f"Worker '{worker_id}' not found or not active",
+                )
+
+        # Update the task heartbeat
+        result = self._tasks.update_one(
+            query,
+            {"$set": {"last_heartbeat": get_current_time()}},
+            session=session,
+        )
+
+        if result.modified_count == 0:
+            raise HTTPException(
+                status_code=HTTP_404_NOT_FOUND,
+                detail=f"Failed to update heartbeat for task '{task_id}' - it may have changed state during the operation",
+            )
 
     @retry_on_transient
     @validate_arg
@@ -748,7 +1162,7 @@ def worker_report_task_status(
 
         """
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 task = self._tasks.find_one(
                     {"_id": task_id, "queue_id": queue_id}, session=session
                 )
@@ -790,7 +1204,7 @@ def report_task_status(
     ) -> bool:
         """Update task status. Used for reporting task execution results."""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 task = self._tasks.find_one(
                     {"_id": task_id, "queue_id": queue_id}, session=session
                 )
@@ -901,7 +1315,7 @@ def update_task(
         Potentially Auto-Overwritten Fields: [status, retries]
         """
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 task = self._tasks.find_one(
                     {"_id": task_id, "queue_id": queue_id}, session=session
                 )
@@ -1043,7 +1457,7 @@ def report_worker_status(
     ) -> bool:
         """Update worker status."""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id):
                 event_handle = self._report_worker_status(
                     queue_id=queue_id,
                     worker_id=worker_id,
@@ -1092,7 +1506,7 @@ def get_queue(
     ) -> Optional[Mapping[str, Any]]:
         """Get queue by id or name. Name and id must match."""
         with self._client.start_session() as session:
-            with session.start_transaction():
+            with self._start_transaction(session, queue_id=queue_id, read_only=True):
                 if queue_id:
                     queue = self._queues.find_one({"_id": queue_id}, session=session)
                 else:
@@ -1116,9 +1530,73 @@ def get_queue(
 
                 return queue
 
+    @retry_on_transient
+    def append_event(self, queue_id: str, origin: str, event: Dict[str, Any]) -> None:
+        """Append an event to the event journal.
+
+        Args:
+            queue_id: The queue the event belongs to.
+            origin: Identifier of the publishing process.
+            event: JSON serializable event data.
+        """
+        self._events.insert_one(
+            {
+                "queue_id": queue_id,
+                "origin": origin,
+                "created_at": get_current_time(),
+                "event": event,
+            }
+        )
+
+    @retry_on_transient
+    def read_events(
+        self, since: datetime, exclude_origin: Optional[str] = None
+    ) -> List[Mapping[str, Any]]:
+        """Read journaled events created no earlier than `since`, oldest first."""
+        query: Dict[str, Any] = {"created_at": {"$gte": since}}
+        if exclude_origin:
+            query["origin"] = {"$ne": exclude_origin}
+        return list(self._events.find(query).sort("created_at", ASCENDING))
+
+    @retry_on_transient
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Acquire or renew the lease `name` for `ttl` seconds.
+
+        The lease is granted if it is free, expired, or already held by `holder`.
+
+        Returns:
+            Whether `holder` holds the lease.
+        """
+        now = get_current_time()
+        try:
+            self._leases.find_one_and_update(
+                {
+                    "_id": name,
+                    "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}],
+                },
+                {
+                    "$set": {
+                        "holder": holder,
+                        "expires_at": now + timedelta(seconds=ttl),
+                        "renewed_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # the lease exists and is held by someone else
+            return False
+
+    @retry_on_transient
+    def release_lease(self, name: str, holder: str) -> bool:
+        """Release the lease `name` if it is held by `holder`, so that others can take over immediately."""
+        result = self._leases.delete_one({"_id": name, "holder": holder})
+        return result.deleted_count > 0
+
     @retry_on_transient
     def handle_timeouts(self) -> List[str]:
-        """Check and handle task timeouts."""
+        """Check and handle task timeouts, and release the reservations whose lease expired."""
         now = get_current_time()
         transitioned_tasks = []
 
@@ -1157,60 +1635,81 @@ def handle_timeouts(self) -> List[str]:
         }
 
         fsm_event_handles = []
-        with self._client.start_session() as session:
-            with session.start_transaction():
-                # Find tasks that might have timed out
-                tasks = self._tasks.find(query, session=session)
-
-                tasks = list(tasks)  # type: ignore
+        # Each queue is swept in its own transaction, so that other queues are not blocked.
+        # Tasks are queried again within the transaction, as they may have changed meanwhile.
+        for queue_id in self._tasks.distinct("queue_id", query):
+            with self._client.start_session() as session:
+                with self._start_transaction(session, queue_id=queue_id):
+                    # Find tasks that might have timed out
+                    tasks = self._tasks.find(
+                        {**query, "queue_id": queue_id}, session=session
+                    )
 
-                for task in tasks:
-                    try:
-                        # Create FSM with current state
-                        fsm = TaskFSM.from_db_entry(task)
-
-                        # Transition to FAILED state through FSM
-                        event_handle = fsm.fail()
-
-                        # Update worker status if worker is specified
-                        if task["worker_id"]:
-                            worker_event_handle = self._report_worker_status(
-                                queue_id=task["queue_id"],
-                                worker_id=task["worker_id"],
-                                report_status="failed",
+                    tasks = list(tasks)  # type: ignore
+
+                    for task in tasks:
+                        try:
+                            # Create FSM with current state
+                            fsm = TaskFSM.from_db_entry(task)
+
+                            # Transition to FAILED state through FSM
+                            event_handle = fsm.fail()
+
+                            # Update worker status if worker is specified
+                            if task["worker_id"]:
+                                worker_event_handle = self._report_worker_status(
+                                    queue_id=task["queue_id"],
+                                    worker_id=task["worker_id"],
+                                    report_status="failed",
+                                    session=session,
+                                )
+                                fsm_event_handles.append(worker_event_handle)
+
+                            # Update task in database
+                            updated_task = self._tasks.find_one_and_update(
+                                {"_id": task["_id"]},
+                                {
+                                    "$set": {
+                                        "status": fsm.state,
+                                        "retries": fsm.retries,
+                                        "last_modified": now,
+                                        "worker_id": None,
+                                        "summary.labtasker_error": "Either heartbeat or task execution timed out",
+                                    }
+                                },
+                                return_document=ReturnDocument.AFTER,
                                 session=session,
                             )
-                            fsm_event_handles.append(worker_event_handle)
 
-                        # Update task in database
-                        updated_task = self._tasks.find_one_and_update(
-                            {"_id": task["_id"]},
-                            {
-                                "$set": {
-                                    "status": fsm.state,
-                                    "retries": fsm.retries,
-                                    "last_modified": now,
-                                    "worker_id": None,
-                                    "summary.labtasker_error": "Either heartbeat or task execution timed out",
-                                }
-                            },
-                            return_document=ReturnDocument.AFTER,
-                            session=session,
-                        )
+                            assert (
+                                updated_task is not None
+                            ), f"Task {task['_id']} not found after update"
 
-                        assert (
-                            updated_task is not None
-                        ), f"Task {task['_id']} not found after update"
+                            event_handle.update_fsm_event(updated_task)
+                            fsm_event_handles.append(event_handle)
 
-                        event_handle.update_fsm_event(updated_task)
-                        fsm_event_handles.append(event_handle)
+                            transitioned_tasks.append(task["_id"])
+                        except Exception as e:
+                            # Log error but continue processing other tasks
+                            logger.info(
+                                f"Error handling timeout for task {task['_id']}: {e}"
+                            )
 
-                        transitioned_tasks.append(task["_id"])
-                    except Exception as e:
-                        # Log error but continue processing other tasks
-                        logger.info(
-                            f"Error handling timeout for task {task['_id']}: {e}"
-                        )
+        # Reservations not started by their worker in time
+        expired_query = {
+            "status": TaskState.RESERVED,
+            "reserved_until": {"$lt": now},
+        }
+        for queue_id in self._tasks.distinct("queue_id", expired_query):
+            with self._client.start_session() as session:
+                with self._start_transaction(session, queue_id=queue_id):
+                    event_handles = self._release_tasks(
+                        session, {**expired_query, "queue_id": queue_id}, now=now
+                    )
+            fsm_event_handles.extend(event_handles)
+            transitioned_tasks.extend(
+                event_handle.entity_id for event_handle in event_handles
+            )
 
         # commit the event after the transaction is completed
         for event_handle in fsm_event_handles:
@@ -1,15 +1,24 @@
 """Shared dependencies."""
 
-from typing import Any, Mapping
+import hmac
+from typing import Any, Mapping, Optional
 
 from fastapi import Depends, HTTPException, Security
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from starlette.status import HTTP_401_UNAUTHORIZED
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBasic,
+    HTTPBasicCredentials,
+    HTTPBearer,
+)
+from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND
 
 from labtasker.security import verify_password
+from labtasker.server.config import get_server_config
 from labtasker.server.database import DBService, get_db
+from labtasker.server.embedded_db import ServerStore
 
 http_basic = HTTPBasic()
+http_bearer = HTTPBearer(auto_error=False)
 
 
 async def get_verified_queue_dependency(
@@ -37,3 +46,34 @@ async def get_verified_queue_dependency(
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
+
+
+async def verify_replication_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(http_bearer),
+) -> None:
+    """Verify the replication token of a standby server (see `ServerConfig.replication_token`)."""
+    token = get_server_config().replication_token
+    if token is None:
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND, detail="Replication is not enabled"
+        )
+    if credentials is None or not hmac.compare_digest(
+        credentials.credentials.encode(), token.encode()
+    ):
+        raise HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            detail="Invalid replication token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+async def get_replicated_store(
+    _: None = Depends(verify_replication_token), db: DBService = Depends(get_db)
+) -> ServerStore:
+    """Store of the embedded database, to be replicated by a standby server."""
+    store = db.embedded_store
+    if store is None or store.replication_log is None:
+        raise HTTPException(
+            status_code=HTTP_404_NOT_FOUND, detail="Replication is not enabled"
+        )
+    return store
@@ -4,30 +4,111 @@
 """
 
 import collections
+import contextlib
 import datetime
 import functools
+import heapq
 import threading
+import weakref
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import jsonpickle
 import mongomock
-from mongomock.thread import RWLock
+from mongomock import ObjectId, aggregate, helpers
+from mongomock.collection import Cursor as _MongoCursor
+from mongomock.command_cursor import CommandCursor
+from mongomock.filtering import filter_applies
+
+from labtasker.server.embedded_document import FrozenDict, freeze, thaw
+from labtasker.server.embedded_index import CompoundIndex, build_indexes
+from labtasker.server.logging import logger
+from labtasker.server.replication import ReplicationLog
+from labtasker.server.snapshot import (
+    LazyCollections,
+    SnapshotError,
+    encode_snapshot,
+    is_binary_snapshot,
+    read_snapshot,
+)
+from labtasker.server.wal import WriteAheadLog, atomic_write, fsync_dir
+
+# Fold the write-ahead log into the snapshot once it grows beyond this size
+WAL_COMPACTION_SIZE = 64 * 1024 * 1024  # in bytes
+
+# Durability policies of the persistence:
+# - "sync": every write is logged and fsynced before it returns (concurrent writes are group committed)
+# - "group": writes are logged, and a background thread commits the log every `flush_interval`
+# - "snapshot": no log, a background thread writes a snapshot every `flush_interval` if changed
+# - "memory": nothing is loaded from or saved to disk
+DURABILITY_POLICIES = ("sync", "group", "snapshot", "memory")
+DEFAULT_FLUSH_INTERVALS = {"group": 0.1, "snapshot": 60.0}  # in seconds
+
+# Formats of the persistence file, see `convert_persistence_file()`
+SNAPSHOT_FORMATS = ("binary", "json")
 
 
 class ServerStore:
-    """Object holding the data for a whole server (many databases)."""
-
-    def __init__(self, persistence_path=None):
+    """Object holding the data for a whole server (many databases).
+
+    Persistence consists of a snapshot file (`persistence_path`, see `snapshot` for the format)
+    and a write-ahead log (`<persistence_path>.wal`) of document mutations since the snapshot.
+    Once the log grows beyond `wal_compaction_size`, it is folded into the snapshot in a
+    background thread. Snapshots in the former jsonpickle format are still loaded.
+    See `DURABILITY_POLICIES` for when data reaches the disk.
+
+    Mutations can be shipped to standby servers as well (see `enable_replication()`).
+    """
+
+    def __init__(
+        self,
+        persistence_path=None,
+        durability="sync",
+        flush_interval=None,
+        wal_compaction_size=WAL_COMPACTION_SIZE,
+    ):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError(
+                f"Invalid durability policy: {durability}. Must be one of {DURABILITY_POLICIES}"
+            )
         self._databases = {}
         self._persistence_path = persistence_path
+        self._durability = durability
+        self._flush_interval = (
+            flush_interval
+            if flush_interval is not None
+            else DEFAULT_FLUSH_INTERVALS.get(durability)
+        )
+        self._wal_compaction_size = wal_compaction_size
+        self._wal: Optional[WriteAheadLog] = None
+        self._dirty = False  # changed since the last snapshot ("snapshot" policy)
+        self.replication_log: Optional[ReplicationLog] = None
+
+        # serializes writing snapshots (explicit saves and compactions)
+        self._snapshot_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+
+        self._stop_event = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+
+        if durability == "memory":
+            return
 
         self.load_from_disk()
 
+        if self._flush_interval:
+            self._flush_thread = threading.Thread(
+                target=self._periodic_flush, daemon=True
+            )
+            self._flush_thread.start()
+
     def __getitem__(self, db_name):
         try:
             return self._databases[db_name]
         except KeyError:
-            db = self._databases[db_name] = DatabaseStore(server_store=self)
+            db = self._databases[db_name] = DatabaseStore(
+                name=db_name, server_store=self
+            )
             return db
 
     def __contains__(self, db_name):
@@ -36,36 +117,360 @@ def __contains__(self, db_name):
     def list_created_database_names(self):
         return [name for name, db in self._databases.items() if db.is_created]
 
+    @staticmethod
+    def _wal_paths(snapshot_path):
+        """Paths of the log being compacted (if any) and the current log, in replay order."""
+        return Path(f"{snapshot_path}.wal.compacting"), Path(f"{snapshot_path}.wal")
+
+    def log(self, op: str, db_name: str, col_name: str, *args) -> None:
+        """Append a mutation record to the write-ahead log (and the replication log)."""
+        if self._wal is not None:
+            self._wal.append([op, db_name, col_name, *args])
+        else:
+            self._dirty = True
+        if self.replication_log is not None:
+            # documents are frozen, so records can hold on to them
+            self.replication_log.append([op, db_name, col_name, *args])
+
+    def enable_replication(self) -> None:
+        """Keep the most recent mutation records in memory, to be shipped to standby servers
+        (see `replication`)."""
+        if self.replication_log is None:
+            self.replication_log = ReplicationLog()
+
+    def replication_snapshot(self) -> Tuple[str, int, List[List[Any]]]:
+        """Snapshot for a standby to start from, as the mutation records that rebuild the store
+        (see `install_snapshot()`).
+
+        Returns:
+            Id of the replication log, LSN of the last record covered by the snapshot, and the
+            snapshot. Records appended while taking it may be covered as well, which is fine
+            as replaying records is idempotent.
+        """
+        log = self.replication_log
+        if log is None:
+            raise RuntimeError("Replication is not enabled")
+        log_id, lsn = log.log_id, log.lsn
+        records = []
+        for db_name, db in list(self._databases.items()):
+            for col_name in list(db._collections):
+                state = db._collections[col_name].snapshot_state()
+                if state["_is_force_created"]:
+                    records.append(["create", db_name, col_name])
+                for index_name, index_dict in state["indexes"].items():
+                    records.append(
+                        ["create_index", db_name, col_name, index_name, index_dict]
+                    )
+                for key, doc in state["_documents"].items():
+                    records.append(["set", db_name, col_name, key, doc])
+        return log_id, lsn, records
+
+    def install_snapshot(self, records: Iterable[List[Any]]) -> None:
+        """Replace the whole state with a snapshot (of the primary, for a standby, see
+        `replication_snapshot()`). The store must not be accessed meanwhile."""
+        databases: Dict[str, DatabaseStore] = {}
+        for record in records:
+            _replay_record(databases, record)
+        # clients hold on to the database stores, so they are kept
+        for db_name, db in self._databases.items():
+            replaced = databases.pop(db_name, None)
+            db._collections = replaced._collections if replaced is not None else {}
+        self._databases.update(databases)
+        _link_databases(self._databases, server_store=self)
+        if self.replication_log is not None:
+            # standbys of this store start over, from a snapshot
+            self.replication_log = ReplicationLog()
+        if self._durability != "memory":
+            self.save_to_disk()
+
+    def apply_records(self, records: Iterable[List[Any]]) -> None:
+        """Apply mutation records of another store (shipped by the primary, for a standby)."""
+        for record in records:
+            op, db_name, col_name, *args = record
+            col = self[db_name]._collections.get(col_name)
+            with col._rwlock.writer() if col is not None else contextlib.nullcontext():
+                _replay_record(self._databases, record)
+            self.log(op, db_name, col_name, *args)
+        self.commit()
+
+    def commit(self) -> None:
+        """Called after each write. Makes logged mutations durable under the "sync" policy."""
+        if self._durability == "sync":
+            self._commit_wal()
+
+    def flush(self) -> None:
+        """Make all mutations so far durable, regardless of the durability policy."""
+        if self._wal is not None:
+            self._commit_wal()
+        elif self._durability == "snapshot" and self._dirty:
+            self.save_to_disk()
+
     def save_to_disk(self, path=None):
-        """Save the current state of the database to disk using jsonpickle."""
+        """Save the current state of the database to disk as a binary snapshot.
+
+        Saving to the persistence path writes a fresh snapshot and starts a new write-ahead log.
+        """
         save_path = path or self._persistence_path
         if not save_path:
             raise ValueError("No persistence path specified")
 
-        # Ensure directory exists
-        Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-        # Serialize and save
-        with open(save_path, "w") as f:
-            f.write(jsonpickle.encode(self._databases))
+        if not self._persistence_path or Path(save_path) != Path(
+            self._persistence_path
+        ):
+            atomic_write(save_path, self._encode())
+            return
+
+        with self._snapshot_lock:
+            compacting_path, wal_path = self._wal_paths(save_path)
+            # Mutations logged from now on go to a fresh log, which is replayed on top of the
+            # snapshot: replaying records of mutations the snapshot already includes is harmless.
+            # A leftover of a failed compaction is kept until the snapshot is written.
+            if self._wal is not None and not compacting_path.exists():
+                self._wal.rotate(compacting_path)
+            self._dirty = False
+            atomic_write(save_path, self._encode())
+            # the snapshot covers whatever is left in logs being compacted (or from previous runs)
+            stale_paths = (
+                [compacting_path] if self._wal else [compacting_path, wal_path]
+            )
+            for stale_path in stale_paths:
+                if stale_path.exists():
+                    stale_path.unlink()
+                    fsync_dir(stale_path.parent)
 
     def load_from_disk(self, path=None):
-        """Load the database state from disk using jsonpickle."""
+        """Load the database state from the snapshot and replay the write-ahead log."""
         load_path = path or self._persistence_path
         if not load_path:
             raise ValueError("No persistence path specified")
 
-        load_path = Path(load_path)
-        if load_path.exists():
-            with open(load_path, "r") as f:
-                self._databases = jsonpickle.decode(f.read())
-        else:
-            self._databases = {}
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+        self._databases = _load_databases(load_path)
+        _link_databases(self._databases, server_store=self)
+
+        if not self._persistence_path or Path(load_path) != Path(
+            self._persistence_path
+        ):
+            return
+
+        replayed = any(p.exists() for p in self._wal_paths(load_path))
+        if self._durability in ("sync", "group"):
+            _, wal_path = self._wal_paths(load_path)
+            self._wal = WriteAheadLog(wal_path)
+        if replayed:
+            # start with a fresh snapshot
+            self.save_to_disk()
+
+    def close(self):
+        """Stop background threads and make all mutations durable."""
+        if self._flush_thread is not None:
+            self._stop_event.set()
+            self._flush_thread.join()
+            self._flush_thread = None
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _commit_wal(self):
+        self._wal.commit()
+        if self._wal.size > self._wal_compaction_size:
+            self._start_compaction()
+
+    def _periodic_flush(self):
+        while not self._stop_event.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush embedded database: {e}")
+
+    def _encode(self) -> bytes:
+        return _encode_databases(self._databases)
+
+    def _start_compaction(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self._compact, daemon=True)
+        self._compaction_thread.start()
+
+    def _compact(self):
+        """Fold the write-ahead log into the snapshot without touching the live data."""
+        snapshot_path = self._persistence_path
+        compacting_path, _ = self._wal_paths(snapshot_path)
+        try:
+            with self._snapshot_lock:
+                if self._wal is None:
+                    return
+                # a leftover of a failed compaction is folded first, the log keeps growing
+                if not compacting_path.exists():
+                    self._wal.rotate(compacting_path)
+
+                databases = _load_databases(snapshot_path, wal_paths=[compacting_path])
+                atomic_write(snapshot_path, _encode_databases(databases))
+                compacting_path.unlink()
+                fsync_dir(compacting_path.parent)
+        except Exception as e:
+            logger.error(f"Failed to compact write-ahead log: {e}")
+
+
+def _load_databases(snapshot_path, wal_paths: Optional[Iterable[Path]] = None):
+    """Decode the snapshot and replay the write-ahead logs on top of it."""
+    if wal_paths is None:
+        wal_paths = ServerStore._wal_paths(snapshot_path)
+
+    snapshot_path = Path(snapshot_path)
+    if not snapshot_path.exists():
+        databases = {}
+    elif is_binary_snapshot(snapshot_path):
+        databases = {}
+        _load_snapshot(read_snapshot(snapshot_path), databases)
+    else:
+        # the former jsonpickle format
+        try:
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                databases = jsonpickle.decode(f.read(), keys=True)
+        except ValueError as e:  # including UnicodeDecodeError
+            raise SnapshotError(
+                f"Not a binary snapshot nor a JSON database: {snapshot_path}"
+            ) from e
+
+    for wal_path in wal_paths:
+        for record in WriteAheadLog.read_records(wal_path):
+            _replay_record(databases, record)
+
+    return databases
+
+
+def _load_snapshot(snapshot: Dict[str, Dict[str, Any]], databases):
+    """Set the collections of the databases to the (lazily decoded) ones of a snapshot."""
+    for db_name, records in snapshot.items():
+        db = databases.get(db_name)
+        if db is None:
+            db = databases[db_name] = DatabaseStore(name=db_name)
+        db._collections = LazyCollections(
+            records, decode=functools.partial(_decode_collection, db)
+        )
+
+
+def _encode_databases(databases: Dict[str, "DatabaseStore"]) -> bytes:
+    return encode_snapshot(
+        {db_name: db._collections for db_name, db in list(databases.items())},
+        get_state=CollectionStore.snapshot_state,
+    )
+
+
+def _decode_collection(db: "DatabaseStore", name: str, state: Dict[str, Any]):
+    col = CollectionStore.__new__(CollectionStore)
+    col.__setstate__(state)
+    col._database_store = db
+    return col
+
+
+def _link_databases(databases: Dict[str, "DatabaseStore"], server_store):
+    """Restore back references that are not part of the persisted state."""
+    for db_name, db in databases.items():
+        db.name = db_name
+        db._server_store = server_store
+        collections = db._collections
+        if isinstance(collections, LazyCollections):
+            # the others are linked as they are decoded
+            collections = collections.loaded()
+        for col in collections.values():
+            col._database_store = db
+
+
+def convert_persistence_file(src, dest=None, fmt: str = "binary"):
+    """Convert a persistence file (and its write-ahead log) to the given format.
+
+    The server must not be running. Converting in place (`dest` is None or `src`) folds the
+    write-ahead log into the converted snapshot.
+    """
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Invalid format: {fmt}. Must be one of {SNAPSHOT_FORMATS}")
+    src = Path(src)
+    if not src.exists():
+        raise FileNotFoundError(src)
+    dest = Path(dest) if dest is not None else src
+
+    databases = _load_databases(src)
+    if fmt == "binary":
+        data = _encode_databases(databases)
+    else:
+        for db in databases.values():
+            db._collections = dict(db._collections.items())  # decode all
+        data = jsonpickle.encode(databases, keys=True)
+    atomic_write(dest, data)
+
+    if dest.resolve() == src.resolve():
+        for wal_path in ServerStore._wal_paths(src):
+            if wal_path.exists():
+                wal_path.unlink()
+                fsync_dir(wal_path.parent)
+
+
+def _replay_record(databases: Dict[str, "DatabaseStore"], record: List[Any]):
+    """Apply a write-ahead log record. Replaying a record more than once is harmless."""
+    op, db_name, col_name, *args = record
+
+    db = databases.get(db_name)
+    if db is None:
+        db = databases[db_name] = DatabaseStore(name=db_name)
+
+    if op == "rename":
+        (new_name,) = args
+        if col_name in db._collections:
+            col = db._collections.pop(col_name)
+            col.name = new_name
+            db._collections[new_name] = col
+        return
+
+    col = db._collections.get(col_name)
+    if col is None:
+        col = db._collections[col_name] = CollectionStore(col_name, database_store=db)
+
+    if op == "set":
+        key, doc = args
+        doc = freeze(doc)
+        col._documents[key] = doc
+        col._index_document(key, doc)
+    elif op == "del":
+        (key,) = args
+        col._documents.pop(key, None)
+        col._unindex_document(key)
+    elif op == "create":
+        col._is_force_created = True
+    elif op == "create_index":
+        index_name, index_dict = args
+        col.indexes[index_name] = index_dict
+        if index_dict.get("expireAfterSeconds") is not None:
+            col._ttl_indexes[index_name] = index_dict
+        col.rebuild_indexes()
+    elif op == "drop_index":
+        (index_name,) = args
+        col.indexes.pop(index_name, None)
+        col._ttl_indexes.pop(index_name, None)
+        col.rebuild_indexes()
+    elif op == "drop":
+        col._documents = collections.OrderedDict()
+        col.indexes = {}
+        col._ttl_indexes = {}
+        col._is_force_created = False
+        col.rebuild_indexes()
+    else:
+        raise ValueError(f"Unknown write-ahead log record: {op}")
 
 
 class DatabaseStore:
     """Object holding the data for a database (many collections)."""
 
-    def __init__(self, server_store=None):
+    def __init__(self, name=None, server_store=None):
+        self.name = name
         self._collections = {}
         self._server_store = server_store
 
@@ -82,6 +487,8 @@ def __contains__(self, col_name):
         return self[col_name].is_created
 
     def list_created_collection_names(self):
+        if isinstance(self._collections, LazyCollections):
+            return self._collections.created_names()  # without decoding them
         return [name for name, col in self._collections.items() if col.is_created]
 
     def create_collection(self, name):
@@ -93,14 +500,128 @@ def rename(self, name, new_name):
         col = self._collections.pop(name, CollectionStore(new_name))
         col.name = new_name
         self._collections[new_name] = col
+        if self._server_store is not None:
+            self._server_store.log("rename", self.name, name, new_name)
+            self._server_store.commit()
 
     @property
     def is_created(self):
-        return any(col.is_created for col in self._collections.values())
+        return bool(self.list_created_collection_names())
+
+    def __getstate__(self):
+        """Custom serialization that excludes the back reference to the server store."""
+        state = self.__dict__.copy()
+        state.pop("_server_store", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("name", None)
+        self._server_store = None
+
+
+class ReentrantRWLock:
+    """Reader/writer lock that is reentrant for the owning thread.
+
+    A thread holding the write lock may acquire the read lock as well,
+    but upgrading a read lock to a write lock is not supported.
+    Waiting writers take precedence over new readers, so that writers do not starve.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers: Dict[int, int] = {}  # thread id -> reentrance count
+        self._writer: Optional[int] = None
+        self._writer_count = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError(
+                    "Upgrading a read lock to a write lock is not supported"
+                )
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_count = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_count -= 1
+            if not self._writer_count:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def reader(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writer(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+_SECONDARY_INDEX_STATE = (
+    "_secondary_indexes",
+    "_index_keys",
+    "_seqs",
+    "_keys_by_seq",
+    "_next_seq",
+    "_ttl_fields",
+    "_expiry_heap",
+    "_deadlines",
+)
+
+
+class _WorkingCopy(dict):
+    """Mutable copy of a stored document, being updated (see `CollectionStore.copy_for_update()`)."""
+
+    __slots__ = ("key",)
 
 
 class CollectionStore:
-    """Object holding the data for a collection."""
+    """Object holding the data for a collection.
+
+    Stored documents are frozen (see `embedded_document`), so they are handed out to readers
+    without copying them. Updates are applied to a working copy, which replaces the document.
+    """
 
     def __init__(self, name, database_store=None):
         self._documents = collections.OrderedDict()
@@ -110,11 +631,16 @@ def __init__(self, name, database_store=None):
         self._ttl_indexes = {}
         self._database_store = database_store
 
-        # 694 - Lock for safely iterating and mutating OrderedDicts
-        self._rwlock = RWLock()
+        # 694 - Lock for safely iterating and mutating OrderedDicts.
+        # Reentrant, as update operations match documents while holding the write lock.
+        self._rwlock = ReentrantRWLock()
+
+        self.rebuild_indexes()
 
     def create(self):
         self._is_force_created = True
+        self._log("create")
+        self._trigger_save()
 
     @property
     def is_created(self):
@@ -125,12 +651,16 @@ def drop(self):
         self.indexes = {}
         self._ttl_indexes = {}
         self._is_force_created = False
+        self.rebuild_indexes()
+        self._log("drop")
         self._trigger_save()
 
     def create_index(self, index_name, index_dict):
         self.indexes[index_name] = index_dict
         if index_dict.get("expireAfterSeconds") is not None:
             self._ttl_indexes[index_name] = index_dict
+        self.rebuild_indexes()
+        self._log("create_index", index_name, index_dict)
         self._trigger_save()
 
     def drop_index(self, index_name):
@@ -140,14 +670,176 @@ def drop_index(self, index_name):
         # TTL indexes have no meaning to the outside.
         del self.indexes[index_name]
         self._ttl_indexes.pop(index_name, None)
+        self.rebuild_indexes()
+        self._log("drop_index", index_name)
         self._trigger_save()
 
+    @property
+    def _server_store(self):
+        if self._database_store is None:
+            return None
+        return getattr(self._database_store, "_server_store", None)
+
+    def _log(self, op, *args):
+        """Log a mutation to the write-ahead log of the server store (if any)."""
+        server_store = self._server_store
+        if server_store is not None:
+            server_store.log(op, self._database_store.name, self.name, *args)
+
     def _trigger_save(self):
-        """Trigger a save operation if we have a reference to the server store."""
-        if self._database_store and hasattr(self._database_store, "_server_store"):
-            server_store = self._database_store._server_store
-            if server_store and hasattr(server_store, "save_to_disk"):
-                server_store.save_to_disk()
+        """Make logged mutations durable if we have a reference to the server store."""
+        server_store = self._server_store
+        if server_store is not None:
+            server_store.commit()
+
+    def copy_for_update(self, doc):
+        """Mutable copy of a stored document, to apply an update operation to.
+        It replaces the stored document once updated (see `document_updated()`)."""
+        copy = thaw(doc, _WorkingCopy)
+        copy.key = _document_key(doc)
+        return copy
+
+    def document_updated(self, doc):
+        """Store, re-index and log the working copy of a document that was updated."""
+        # documents being upserted are not stored yet, they are handled on insertion
+        if not isinstance(doc, _WorkingCopy):
+            return
+        key = doc.key
+        with self._rwlock.writer():
+            # an update altering the _id is rolled back (by mongomock)
+            if key in self._documents and _document_key(doc) == key:
+                frozen = self._documents[key] = freeze(doc)
+                self._index_document(key, frozen)
+                self._log("set", key, frozen)
+
+    def rebuild_indexes(self):
+        """(Re-)build the secondary indexes from the index specs and the stored documents."""
+        with self._rwlock.writer():
+            self._secondary_indexes = build_indexes(self.indexes.values())
+            self._index_keys: Dict[int, tuple] = (
+                {}
+            )  # seq -> key of the doc in each index
+            self._seqs: Dict[Any, int] = {}  # document key -> seq
+            self._keys_by_seq: Dict[int, Any] = {}
+            self._next_seq = 0
+            # expiry deadlines of the documents with TTL indexes, in a min-heap of
+            # (deadline, seq) entries. Entries not matching `_deadlines` are stale.
+            self._ttl_fields = _ttl_fields(self._ttl_indexes.values())
+            self._expiry_heap: List[Tuple[datetime.datetime, int]] = []
+            self._deadlines: Dict[int, datetime.datetime] = {}  # seq -> deadline
+            for key, doc in self._documents.items():
+                self._index_document(key, doc)
+
+    def _index_document(self, key, doc):
+        seq = self._seqs.get(key)
+        if seq is None:
+            # sequence numbers follow the insertion order of `_documents`
+            seq = self._seqs[key] = self._next_seq
+            self._keys_by_seq[seq] = key
+            self._next_seq += 1
+        old_keys = self._index_keys.get(seq)
+        index_keys = tuple(index.key_of(doc) for index in self._secondary_indexes)
+        for i, (index, index_key) in enumerate(
+            zip(self._secondary_indexes, index_keys)
+        ):
+            if old_keys is not None:
+                if old_keys[i] == index_key:
+                    continue  # e.g. a heartbeat does not move a task in most indexes
+                index.remove(seq, old_keys[i])
+            index.add(seq, index_key)
+        self._index_keys[seq] = index_keys
+        if self._ttl_fields:
+            self._schedule_expiry(seq, doc)
+
+    def _schedule_expiry(self, seq, doc):
+        deadline = _expiry_deadline(doc, self._ttl_fields)
+        if deadline == self._deadlines.get(seq):
+            return
+        if deadline is None:
+            del self._deadlines[seq]  # its heap entry is now stale
+            return
+        self._deadlines[seq] = deadline
+        heapq.heappush(self._expiry_heap, (deadline, seq))
+        if len(self._expiry_heap) > 2 * len(self._deadlines) + 64:
+            # drop stale entries
+            self._expiry_heap = [(d, s) for s, d in self._deadlines.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def _unindex_seq(self, seq):
+        index_keys = self._index_keys.pop(seq)
+        for index, index_key in zip(self._secondary_indexes, index_keys):
+            index.remove(seq, index_key)
+        self._deadlines.pop(seq, None)
+
+    def _unindex_document(self, key):
+        seq = self._seqs.pop(key, None)
+        if seq is not None:
+            self._unindex_seq(seq)
+            del self._keys_by_seq[seq]
+
+    def find_candidates(self, filter) -> Optional[List[Any]]:
+        """Documents that may match the filter, in insertion order, or None if no index
+        applies. Must be called with the read lock held."""
+        seqs = self._lookup(filter)
+        if seqs is None:
+            return None
+        documents, keys = self._documents, self._keys_by_seq
+        return [documents[keys[seq]] for seq in sorted(set(seqs))]
+
+    def all_documents(self):
+        """Documents in insertion order. Must be called with the read lock held."""
+        return self._documents.values()
+
+    def find_ordered_index(self, equalities, sort):
+        """Compound index serving documents with the given field values in the given sort
+        order, and the key prefix to scan, or None if there is none."""
+        for index in self._secondary_indexes:
+            if isinstance(index, CompoundIndex):
+                prefix = index.prefix_for(equalities, sort)
+                if prefix is not None:
+                    return index, prefix
+        return None
+
+    def scan_ordered_index(self, index, prefix, after, n):
+        """Next `n` documents of a compound index scan, as (entry, document) pairs.
+        Must be called with the read lock held."""
+        documents, keys = self._documents, self._keys_by_seq
+        return [
+            (entry, documents[keys[entry[-1]]])
+            for entry in index.scan(prefix, after, n)
+        ]
+
+    def _lookup(self, filter):
+        """Smallest candidate set among the conditions that can be looked up in an index."""
+        best = None
+        for field, condition in filter.items():
+            if field == "$and" and isinstance(condition, list):
+                candidates = [
+                    self._lookup(sub) for sub in condition if isinstance(sub, dict)
+                ]
+            elif field == "_id":
+                candidates = [self._lookup_id(condition)]
+            else:
+                candidates = [
+                    index.lookup(condition)
+                    for index in self._secondary_indexes
+                    if index.field == field
+                ]
+            for c in candidates:
+                if c is not None and (best is None or len(c) < len(best)):
+                    best = c
+        return best
+
+    def _lookup_id(self, condition):
+        if isinstance(condition, dict):
+            if list(condition) != ["$in"] or not isinstance(condition["$in"], list):
+                return None
+            values = condition["$in"]
+        else:
+            values = [condition]
+        if not all(isinstance(v, (str, int, ObjectId)) for v in values):
+            return None
+        return [self._seqs[v] for v in values if v in self._seqs]
 
     @property
     def is_empty(self):
@@ -165,13 +857,19 @@ def __getitem__(self, key):
             return self._documents[key]
 
     def __setitem__(self, key, val):
+        val = freeze(val)
         with self._rwlock.writer():
             self._documents[key] = val
+            self._index_document(key, val)
+            # logged under the lock, so that records are in the same order as mutations
+            self._log("set", key, val)
         self._trigger_save()
 
     def __delitem__(self, key):
         with self._rwlock.writer():
             del self._documents[key]
+            self._unindex_document(key)
+            self._log("del", key)
         self._trigger_save()
 
     def __len__(self):
@@ -183,46 +881,35 @@ def __len__(self):
     def documents(self):
         self._remove_expired_documents()
         with self._rwlock.reader():
-            yield from self._documents.values()
+            documents = list(self._documents.values())
+        # not yielded under the lock, as the generator may be closed from another thread
+        yield from documents
 
     def _remove_expired_documents(self):
-        for index in self._ttl_indexes.values():
-            self._expire_documents(index)
-
-    def _expire_documents(self, index):
-        # TODO(juannyg): use a caching mechanism to avoid re-expiring the documents if
-        # we just did and no document was added / updated
-
-        # Ignore non-integer values
+        """Remove documents past their expiry deadline, in O(1) if there are none."""
         try:
-            expiry = int(index["expireAfterSeconds"])
-        except ValueError:
+            # peeked without the lock, the heap is only mutated under the write lock
+            next_deadline = self._expiry_heap[0][0]
+        except IndexError:
             return
-
-        # Ignore commpound keys
-        if len(index["key"]) > 1:
+        if next_deadline > mongomock.utcnow():
             return
 
-        # "key" structure = list of (field name, direction) tuples
-        ttl_field_name = next(iter(index["key"]))[0]
-        ttl_now = mongomock.utcnow()
-
-        with self._rwlock.reader():
-            expired_ids = [
-                doc["_id"]
-                for doc in self._documents.values()
-                if self._value_meets_expiry(doc.get(ttl_field_name), expiry, ttl_now)
-            ]
-
-        for exp_id in expired_ids:
-            del self[exp_id]
-
-    def _value_meets_expiry(self, val, expiry, ttl_now):
-        val_to_compare = _get_min_datetime_from_value(val)
-        try:
-            return (ttl_now - val_to_compare).total_seconds() >= expiry
-        except TypeError:
-            return False
+        removed = False
+        with self._rwlock.writer():
+            now = mongomock.utcnow()
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                deadline, seq = heapq.heappop(heap)
+                if self._deadlines.get(seq) != deadline:
+                    continue  # the document was updated or removed since
+                key = self._keys_by_seq[seq]
+                del self._documents[key]
+                self._unindex_document(key)
+                self._log("del", key)
+                removed = True
+        if removed:
+            self._trigger_save()
 
     # Add a method to handle jsonpickle serialization of RWLock
     def __getstate__(self):
@@ -230,13 +917,76 @@ def __getstate__(self):
         state = self.__dict__.copy()
         # Remove the lock as it's not serializable
         state.pop("_rwlock", None)
+        # The back reference is restored on load
+        state.pop("_database_store", None)
+        # Secondary indexes are rebuilt on load
+        for attr in _SECONDARY_INDEX_STATE:
+            state.pop(attr, None)
+        return state
+
+    def snapshot_state(self):
+        """State to be pickled, as of now: the collection may be mutated while it is pickled.
+        Stored documents are frozen, so shallow copies are enough."""
+        with self._rwlock.reader():
+            state = self.__getstate__()
+            state["_documents"] = state["_documents"].copy()
+            state["indexes"] = dict(state["indexes"])
+            state["_ttl_indexes"] = dict(state["_ttl_indexes"])
         return state
 
     def __setstate__(self, state):
         """Custom deserialization that recreates the lock."""
         self.__dict__.update(state)
+        self.__dict__.setdefault("_database_store", None)
+        # documents of snapshots in the jsonpickle format are not frozen
+        for key, doc in self._documents.items():
+            if not isinstance(doc, FrozenDict):
+                self._documents[key] = freeze(doc)
         # Recreate the lock
-        self._rwlock = RWLock()
+        self._rwlock = ReentrantRWLock()
+        self.rebuild_indexes()
+
+
+def _document_key(doc):
+    key = doc.get("_id")
+    if isinstance(key, dict):
+        key = helpers.hashdict(key)
+    return key
+
+
+def _ttl_fields(ttl_indexes: Iterable[Dict[str, Any]]) -> List[Tuple[str, int]]:
+    """Field and expiry (in seconds) of the TTL indexes that apply."""
+    fields = []
+    for index in ttl_indexes:
+        # Ignore non-integer values
+        try:
+            expiry = int(index["expireAfterSeconds"])
+        except ValueError:
+            continue
+        # Ignore compound keys
+        if len(index["key"]) > 1:
+            continue
+        # "key" structure = list of (field name, direction) tuples
+        fields.append((next(iter(index["key"]))[0], expiry))
+    return fields
+
+
+def _expiry_deadline(doc, ttl_fields) -> Optional[datetime.datetime]:
+    """Earliest time at which the document expires, if it does."""
+    deadline = None
+    for field, expiry in ttl_fields:
+        value = _get_min_datetime_from_value(doc.get(field))
+        if not isinstance(value, datetime.datetime) or value == datetime.datetime.max:
+            continue
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        try:
+            field_deadline = value + datetime.timedelta(seconds=expiry)
+        except OverflowError:
+            continue
+        if deadline is None or field_deadline < deadline:
+            deadline = field_deadline
+    return deadline
 
 
 def _get_min_datetime_from_value(val):
@@ -274,36 +1024,97 @@ def _min_dt(dt1, dt2):
     "bulk_write",
 ]
 
-# Global transaction lock
-_transaction_lock = threading.RLock()
+
+class TransactionLocks:
+    """Locks taken by transactions of the embedded database.
+
+    Transactions scoped to a queue share the global lock and take the lock of their queue,
+    exclusively unless read-only. Transactions spanning all queues take the global lock
+    (exclusively unless read-only).
+    """
+
+    def __init__(self):
+        self._global_lock = ReentrantRWLock()
+        self._queue_locks: "weakref.WeakValueDictionary[str, ReentrantRWLock]" = (
+            weakref.WeakValueDictionary()
+        )
+        self._mutex = threading.Lock()
+
+    def _get_queue_lock(self, queue_id: str) -> ReentrantRWLock:
+        with self._mutex:
+            lock = self._queue_locks.get(queue_id)
+            if lock is None:
+                lock = self._queue_locks[queue_id] = ReentrantRWLock()
+            return lock
+
+    def acquire(
+        self, queue_id: Optional[str] = None, read_only: bool = False
+    ) -> Callable[[], None]:
+        """Acquire the locks for a transaction. Returns the function that releases them."""
+        if queue_id is None:
+            if read_only:
+                self._global_lock.acquire_read()
+                return self._global_lock.release_read
+            self._global_lock.acquire_write()
+            return self._global_lock.release_write
+
+        queue_lock = self._get_queue_lock(queue_id)
+        self._global_lock.acquire_read()
+        try:
+            if read_only:
+                queue_lock.acquire_read()
+            else:
+                queue_lock.acquire_write()
+        except BaseException:
+            self._global_lock.release_read()
+            raise
+
+        def release():
+            if read_only:
+                queue_lock.release_read()
+            else:
+                queue_lock.release_write()
+            self._global_lock.release_read()
+
+        return release
+
+
+_transaction_locks = TransactionLocks()
 
 
 class MockSession:
     def __init__(self):
-        self._transaction_active = False
+        self._release: Optional[Callable[[], None]] = None
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._transaction_active:
-            self._transaction_active = False
-            _transaction_lock.release()
-
-    def start_transaction(self):
-        _transaction_lock.acquire()
-        self._transaction_active = True
+        self._end_transaction()
+
+    def start_transaction(
+        self, queue_id: Optional[str] = None, read_only: bool = False, **kwargs
+    ):
+        """Start a transaction. Unlike MongoDB, writes are not rolled back on abort.
+
+        Args:
+            queue_id: Lock only this queue. All queues are locked if not given.
+            read_only: Whether the transaction only reads, so that it can run concurrently
+                with other read-only transactions.
+        """
+        self._release = _transaction_locks.acquire(queue_id, read_only)
         return self
 
     def commit_transaction(self):
-        if self._transaction_active:
-            self._transaction_active = False
-            _transaction_lock.release()
+        self._end_transaction()
 
     def abort_transaction(self):
-        if self._transaction_active:
-            self._transaction_active = False
-            _transaction_lock.release()
+        self._end_transaction()
+
+    def _end_transaction(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
 
 
 def ignore_session(original_method):
@@ -318,9 +1129,236 @@ def wrapper(*args, session=None, **kwargs):
     return wrapper
 
 
+def _pipeline_prefilter(pipeline) -> Optional[Dict[str, Any]]:
+    """Conditions of the leading `$match` stages of a pipeline on fields of the stored documents,
+    so that only the documents possibly matching them are fed into the pipeline."""
+    added = set()  # fields computed by preceding stages
+    conditions = []
+
+    def collect(query):
+        for field, condition in query.items():
+            if field == "$and" and isinstance(condition, list):
+                for sub in condition:
+                    if isinstance(sub, dict):
+                        collect(sub)
+            elif not field.startswith("$") and field.split(".")[0] not in added:
+                conditions.append({field: condition})
+
+    for stage in pipeline:
+        (op, spec), *_ = stage.items()
+        if op in ("$addFields", "$set"):
+            added.update(field.split(".")[0] for field in spec)
+        elif op == "$match" and isinstance(spec, dict):
+            collect(spec)
+        else:
+            break
+
+    return {"$and": conditions} if conditions else None
+
+
+def _equalities(query) -> Dict[str, Any]:
+    """Top level `field: value` (or `$eq`) conditions of a query, including those in `$and`."""
+    equalities = {}
+    for field, condition in query.items():
+        if field == "$and" and isinstance(condition, list):
+            for sub in condition:
+                if isinstance(sub, dict):
+                    equalities.update(_equalities(sub))
+        elif not field.startswith("$"):
+            if isinstance(condition, dict) and list(condition) == ["$eq"]:
+                condition = condition["$eq"]
+            if not isinstance(condition, dict):
+                equalities[field] = condition
+    return equalities
+
+
+# documents matched, copied and fed into the rest of the pipeline at a time by ordered scans
+ORDERED_SCAN_CHUNK_SIZE = 16
+
+
+# Set while an update operation matches documents, so that they are copied for update
+_matching_for_update = threading.local()
+
+
+class Cursor(_MongoCursor):
+    """Cursor that yields results without slicing them for every document (which mongomock
+    does, so iterating over n results allocates O(n^2))."""
+
+    def __next__(self):
+        results = self._compute_results()
+        index = (self._skip or 0) + self._emitted
+        if index >= len(results) or (self._limit and self._emitted >= abs(self._limit)):
+            raise StopIteration()
+        self._emitted += 1
+        return results[index]
+
+    next = __next__
+
+
+class Collection(mongomock.Collection):
+    """Collection that reports updated documents to the store, so that they are stored and logged.
+
+    Stored documents are frozen, so reads return them without copying them (unless projected),
+    and update operations apply to copies of them (see `CollectionStore.copy_for_update()`).
+    Update operations hold the write lock of the store, so that concurrent updates of the same
+    document are not lost. Queries are narrowed down by the secondary indexes of the store
+    (see `embedded_index`).
+    """
+
+    def aggregate(self, pipeline, session=None, **kwargs):
+        scan = self._plan_ordered_scan(pipeline)
+        if scan is not None:
+            return CommandCursor(self._ordered_scan(*scan, session=session))
+
+        prefilter = _pipeline_prefilter(pipeline)
+        if prefilter is None:
+            return super().aggregate(pipeline, session=session, **kwargs)
+        in_collection = list(self.find(prefilter))
+        return aggregate.process_pipeline(
+            in_collection, self.database, pipeline, session
+        )
+
+    def find(self, *args, **kwargs):
+        cursor = super().find(*args, **kwargs)
+        cursor.__class__ = Cursor
+        return cursor
+
+    def _plan_ordered_scan(self, pipeline):
+        """Check whether a `$match`, `$addFields`..., `$sort` pipeline can be served by walking a
+        compound index in order (e.g. fetching the next task), instead of copying and sorting
+        every matching document."""
+        if len(pipeline) < 2:
+            return None
+        (match_op, match), *_ = pipeline[0].items()
+        (sort_op, sort), *_ = pipeline[-1].items()
+        if match_op != "$match" or sort_op != "$sort" or not isinstance(match, dict):
+            return None
+        sort = list(sort.items())
+        stages = pipeline[1:-1]
+        for stage in stages:
+            (op, spec), *_ = stage.items()
+            # the sort fields must not be changed before sorting
+            if op not in ("$addFields", "$set") or any(
+                field.split(".")[0] in dict(sort) for field in spec
+            ):
+                return None
+
+        found = self._store.find_ordered_index(_equalities(match), sort)
+        if found is None:
+            return None
+        index, prefix = found
+        return index, prefix, match, stages
+
+    def _ordered_scan(self, index, prefix, match, stages, session=None):
+        store = self._store
+        document_class = self.codec_options.document_class
+        after = None
+        while True:
+            with store._rwlock.reader():
+                chunk = store.scan_ordered_index(
+                    index, prefix, after, ORDERED_SCAN_CHUNK_SIZE
+                )
+                documents = [
+                    self._copy_only_fields(doc, None, document_class)
+                    for _, doc in chunk
+                    if filter_applies(match, doc)
+                ]
+            if stages:
+                documents = aggregate.process_pipeline(
+                    documents, self.database, stages, session
+                )
+            yield from documents
+            if len(chunk) < ORDERED_SCAN_CHUNK_SIZE:
+                return
+            # continue after the last entry, as entries may have moved in the meantime
+            after = chunk[-1][0]
+
+    def _apply_update_document(self, existing_document, *args, **kwargs):
+        super()._apply_update_document(existing_document, *args, **kwargs)
+        self._store.document_updated(existing_document)
+
+    def _apply_update_pipeline(self, existing_document, *args, **kwargs):
+        super()._apply_update_pipeline(existing_document, *args, **kwargs)
+        self._store.document_updated(existing_document)
+
+    def _iter_documents(self, filter):
+        store = self._store
+        for_update = getattr(_matching_for_update, "value", False)
+        _matching_for_update.value = False
+        # also removes expired documents, which takes the write lock
+        if store.is_empty:
+            # Validate the filter even if no documents can be returned.
+            filter_applies(filter, {})
+            return iter(())
+
+        with store._rwlock.reader():
+            candidates = store.find_candidates(filter)
+            if candidates is None:
+                candidates = store.all_documents()
+            matches = [
+                document for document in candidates if filter_applies(filter, document)
+            ]
+        if for_update:
+            # copied lazily, as single updates stop at the first match
+            return (store.copy_for_update(document) for document in matches)
+        return iter(matches)
+
+    def _copy_only_fields(self, doc, fields, container):
+        if fields is None and container is dict:
+            return doc  # stored documents are frozen, no need to copy them
+        return super()._copy_only_fields(doc, fields, container)
+
+    def _update(self, *args, **kwargs):
+        try:
+            with self._store._rwlock.writer():
+                _matching_for_update.value = True
+                try:
+                    return super()._update(*args, **kwargs)
+                finally:
+                    _matching_for_update.value = False
+        finally:
+            # commit all documents updated by this operation at once
+            self._store._trigger_save()
+
+
+class Database(mongomock.Database):
+    def get_collection(self, name, *args, **kwargs):
+        if name not in self._collection_accesses:
+            self._ensure_valid_collection_name(name)
+            self._collection_accesses[name] = Collection(
+                self,
+                name=name,
+                read_preference=self.read_preference,
+                codec_options=self._codec_options,
+                _db_store=self._store,
+            )
+        return super().get_collection(name, *args, **kwargs)
+
+
 class MongoClient(mongomock.MongoClient):
     """A wrapper around mongomock.MongoClient to ignore session and transactions."""
 
+    def get_database(self, name=None, *args, **kwargs):
+        if name is not None and name not in self._database_accesses:
+            self._database_accesses[name] = Database(
+                self,
+                name,
+                read_preference=self.read_preference,
+                codec_options=self._codec_options,
+                _store=self._store[name],
+            )
+        return super().get_database(name, *args, **kwargs)
+
+    def flush(self):
+        """Make all writes so far durable, regardless of the durability policy of the store."""
+        if isinstance(self._store, ServerStore):
+            self._store.flush()
+
+    def close(self):
+        super().close()
+        if isinstance(self._store, ServerStore):
+            self._store.close()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._patch_methods()
@@ -0,0 +1,158 @@
+"""
+Immutable documents of the embedded database.
+
+Documents held by the embedded store are frozen: updates are applied to a copy, which then
+replaces the stored document. So reads hand out the stored documents as they are, without
+copying them, and a document read once never changes underneath its reader.
+Frozen documents are plain dicts and lists otherwise (serialization, `isinstance` checks, ...).
+
+As they can not be modified, equal values are shared among frozen documents to save memory:
+keys and the values of `INTERNED_FIELDS` are interned, and equal containers of scalars (e.g. the
+`cmd` of tasks of a sweep, empty `metadata`) are the same object as long as one is referenced.
+"""
+
+import datetime
+import sys
+import threading
+import weakref
+from typing import Any, Dict, NoReturn, Optional, Tuple, Union
+
+import jsonpickle.handlers
+
+# Top level fields whose values are interned. They take few distinct values (queues, workers,
+# states), which are kept for the lifetime of the process.
+INTERNED_FIELDS = ("queue_id", "status", "worker_id")
+
+# Scalars that frozen containers may hold to be shared (see `_freeze_value()`)
+_SHAREABLE_SCALARS = (str, int, float, bool, type(None), datetime.datetime)
+
+
+def _read_only(self, *args, **kwargs) -> NoReturn:
+    raise TypeError(
+        f"{type(self).__name__} of the embedded database is read-only, copy it to modify it"
+    )
+
+
+class FrozenDict(dict):
+    """A dict that can not be modified. Copies of it (`copy.copy()`, `copy.deepcopy()`) are
+    plain, mutable dicts."""
+
+    __slots__ = ("__weakref__",)
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class FrozenList(list):
+    """A list that can not be modified. Copies of it are plain, mutable lists."""
+
+    __slots__ = ("__weakref__",)
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+_interned: Dict[Tuple[type, str], str] = {}
+_shared: "weakref.WeakValueDictionary[Tuple, Any]" = weakref.WeakValueDictionary()
+_shared_lock = threading.Lock()
+
+
+def freeze(value: Any) -> Any:
+    """Frozen (deep) copy of a document or value, or the value itself if already frozen."""
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if not isinstance(value, dict):
+        return _freeze_value(value)[0]
+    # documents are unique, only their values are shared
+    doc = {}
+    for k, v in value.items():
+        if k in INTERNED_FIELDS and isinstance(v, str):
+            v = _interned.setdefault((type(v), v), v)  # str enums are equal to str
+        else:
+            v = _freeze_value(v)[0]
+        doc[_intern_key(k)] = v
+    return FrozenDict(doc)
+
+
+def _freeze_value(value: Any) -> Tuple[Any, Optional[Tuple]]:
+    """Frozen copy of a value, shared with equal frozen values in use if it holds scalars
+    only, and the key it is shared by (None if it is not)."""
+    if isinstance(value, dict):
+        fields, keys = {}, []
+        for k, v in value.items():
+            v, key = _freeze_value(v)
+            k = _intern_key(k)
+            fields[k] = v
+            keys.append(key and (k, key))
+        frozen: Union[FrozenDict, FrozenList] = FrozenDict(fields)
+    elif isinstance(value, list):
+        elements = [_freeze_value(v) for v in value]
+        keys = [key for _, key in elements]
+        frozen = FrozenList(v for v, _ in elements)
+    elif isinstance(value, _SHAREABLE_SCALARS):
+        return value, (type(value), _scalar_key(value))
+    else:
+        return value, None
+
+    if None in keys:
+        return frozen, None
+    key = (type(frozen), tuple(keys))
+    with _shared_lock:
+        return _shared.setdefault(key, frozen), key
+
+
+def _scalar_key(value) -> Any:
+    """Key of a shareable scalar, which only equal scalars of the same type share: typed
+    apart, `1 == 1.0 == True` (and `-0.0 == 0.0`, `nan != nan`), and aware datetimes of
+    the same instant are equal in any timezone."""
+    if type(value) is float:
+        return repr(value)
+    if isinstance(value, datetime.datetime):
+        return value, value.tzinfo, value.utcoffset(), value.fold
+    return value
+
+
+def _intern_key(key):
+    return sys.intern(key) if type(key) is str else key
+
+
+def thaw(value: Any, container=dict) -> Any:
+    """Mutable (deep) copy of a frozen document or value."""
+    if isinstance(value, dict):
+        return container({k: thaw(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+@jsonpickle.handlers.register(FrozenDict)
+@jsonpickle.handlers.register(FrozenList)
+class _FrozenHandler(jsonpickle.handlers.BaseHandler):
+    """Encode frozen documents in write-ahead log records and JSON snapshots as plain ones
+    (jsonpickle can not restore them by mutation). They are frozen again when loaded."""
+
+    def flatten(self, obj, data):
+        plain = dict(obj) if isinstance(obj, dict) else list(obj)
+        data["value"] = self.context.flatten(plain, reset=False)
+        return data
+
+    def restore(self, data):
+        return self.context.restore(data["value"], reset=False)
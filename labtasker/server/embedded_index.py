@@ -0,0 +1,333 @@
+"""
+In-memory secondary indexes of the embedded database.
+
+Indexes only narrow down the documents a filter is evaluated on, matching is still done by
+mongomock. So a lookup returns a superset of the matching documents, and values that can
+not be indexed (arrays, sub-documents, ...) are kept aside and always returned as candidates.
+"""
+
+import bisect
+import datetime
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# fields that are looked up by equality in most queries of the server
+HASH_INDEXED_FIELDS = ("queue_id", "status", "queue_name")
+
+UNINDEXED = object()
+
+# Number of distinct string and integer field keys shared among the entries of a compound index
+# (e.g. queue ids, states and priorities take few distinct values)
+SHARED_FIELD_KEYS_LIMIT = 4096
+
+# BSON type brackets, see mongomock.filtering._get_compare_type
+_NULL = 5
+_NUMBER = 10
+_STRING = 15
+_BOOL = 40
+_DATE = 45
+
+_EQUALITY_TYPES = (str, int, float, datetime.datetime, type(None))
+_RANGE_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+
+
+def _normalize(value):
+    """Make aware and naive datetimes comparable."""
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _sort_key(value) -> Optional[Tuple[int, Any]]:
+    """Type bracket and value, for values that are ordered consistently within a bracket."""
+    if isinstance(value, bool):
+        return _BOOL, value
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        return _NUMBER, value
+    if isinstance(value, str):
+        return _STRING, value
+    if isinstance(value, datetime.datetime):
+        return _DATE, _normalize(value)
+    return None
+
+
+class _Descending:
+    """Sort key wrapper reversing the order."""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return isinstance(other, _Descending) and self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+def _operators(condition) -> Optional[Dict[str, Any]]:
+    """Operators of a field condition, with plain values turned into `$eq`."""
+    if isinstance(condition, dict):
+        if condition and all(k.startswith("$") for k in condition):
+            return condition
+        return None  # sub-document equality
+    return {"$eq": condition}
+
+
+class Index:
+    """Index of the documents of a collection on a top level field.
+
+    Documents are referred to by their sequence number in the collection store.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self._unindexed: Dict[int, None] = {}
+
+    def key_of(self, doc: Dict[str, Any]) -> Any:
+        raise NotImplementedError
+
+    def add(self, seq: int, key: Any) -> None:
+        if key is UNINDEXED:
+            self._unindexed[seq] = None
+
+    def remove(self, seq: int, key: Any) -> None:
+        if key is UNINDEXED:
+            self._unindexed.pop(seq, None)
+
+    def lookup(self, condition) -> Optional[List[int]]:
+        """Candidates for a condition on the field, or None if the index can not be used."""
+        raise NotImplementedError
+
+
+class HashIndex(Index):
+    """Equality (`$eq`, `$in`) lookups in O(1)."""
+
+    def __init__(self, field: str):
+        super().__init__(field)
+        self._buckets: Dict[Any, Dict[int, None]] = {}
+
+    def key_of(self, doc):
+        value = doc.get(self.field)  # missing fields are matched by None as well
+        if not isinstance(value, _EQUALITY_TYPES):
+            return UNINDEXED
+        return _normalize(value)
+
+    def add(self, seq, key):
+        if key is UNINDEXED:
+            super().add(seq, key)
+        else:
+            self._buckets.setdefault(key, {})[seq] = None
+
+    def remove(self, seq, key):
+        if key is UNINDEXED:
+            super().remove(seq, key)
+            return
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(seq, None)
+            if not bucket:
+                del self._buckets[key]
+
+    def lookup(self, condition):
+        operators = _operators(condition)
+        if operators is None:
+            return None
+        if "$eq" in operators:
+            values = [operators["$eq"]]
+        elif isinstance(operators.get("$in"), (list, tuple)):
+            values = operators["$in"]
+        else:
+            return None
+        if not all(isinstance(v, _EQUALITY_TYPES) for v in values):
+            return None  # e.g. regular expressions
+
+        candidates = list(self._unindexed)
+        for value in values:
+            candidates.extend(self._buckets.get(_normalize(value), ()))
+        return candidates
+
+
+class SortedIndex(Index):
+    """Range (`$gt`, `$gte`, `$lt`, `$lte`) lookups in O(log n)."""
+
+    def __init__(self, field: str):
+        super().__init__(field)
+        self._entries: List[Tuple[int, Any, int]] = []  # (type bracket, value, seq)
+
+    def key_of(self, doc):
+        if self.field not in doc:
+            return None  # missing fields never match a range
+        return _sort_key(doc[self.field]) or UNINDEXED
+
+    def add(self, seq, key):
+        if key is None:
+            return
+        if key is UNINDEXED:
+            super().add(seq, key)
+        else:
+            bisect.insort(self._entries, (*key, seq))
+
+    def remove(self, seq, key):
+        if key is None:
+            return
+        if key is UNINDEXED:
+            super().remove(seq, key)
+            return
+        entry = (*key, seq)
+        i = bisect.bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def lookup(self, condition):
+        operators = _operators(condition)
+        if operators is None:
+            return None
+
+        bracket = lo = hi = None
+        for op in _RANGE_OPERATORS:
+            if op not in operators:
+                continue
+            key = _sort_key(operators[op])
+            if key is None or (bracket is not None and key[0] != bracket):
+                continue
+            bracket = key[0]
+            if op == "$gt":
+                lo = max(lo, (*key, math.inf)) if lo else (*key, math.inf)
+            elif op == "$gte":
+                lo = max(lo, key) if lo else key
+            elif op == "$lt":
+                hi = min(hi, key) if hi else key
+            else:
+                hi = min(hi, (*key, math.inf)) if hi else (*key, math.inf)
+
+        if bracket is None:
+            eq = operators.get("$eq")
+            # numbers are equal to booleans of other brackets, so only these are looked up
+            if not isinstance(eq, (str, datetime.datetime)):
+                return None
+            key = _sort_key(eq)
+            bracket, lo, hi = key[0], key, (*key, math.inf)
+
+        start = bisect.bisect_left(self._entries, lo or (bracket,))
+        stop = bisect.bisect_left(self._entries, hi or (bracket + 1,))
+        candidates = list(self._unindexed)
+        candidates.extend(entry[-1] for entry in self._entries[start:stop])
+        return candidates
+
+
+class CompoundIndex(Index):
+    """Documents ordered by several fields, like a MongoDB compound index.
+
+    Serves queries with equality conditions on a prefix of the fields, sorted by the remaining
+    fields, by walking the matching entries in order (see `scan()`).
+    Entries are in the order of a mongomock sort by the same fields, with ties broken by
+    insertion order.
+    """
+
+    def __init__(self, keys: List[Tuple[str, int]]):
+        # named as by MongoDB, e.g. "status_1_priority_-1": matches no field of a query, and
+        # `lookup()` does not serve single field conditions anyway
+        super().__init__(
+            field="_".join(f"{field}_{direction}" for field, direction in keys)
+        )
+        self.keys = [(field, direction) for field, direction in keys]
+        self._entries: List[tuple] = []  # (key of each field, ..., seq)
+        self._shared_field_keys: Dict[tuple, Any] = {}
+
+    def _field_key(self, value, direction):
+        shared = isinstance(value, (str, int))
+        if shared:
+            key = self._shared_field_keys.get((type(value), value, direction))
+            if key is not None:
+                return key
+        key = (_NULL, 0) if value is None else _sort_key(value)
+        if key is None:
+            return None
+        if direction < 0:
+            key = _Descending(key)
+        if shared and len(self._shared_field_keys) < SHARED_FIELD_KEYS_LIMIT:
+            self._shared_field_keys[type(value), value, direction] = key
+        return key
+
+    def key_of(self, doc):
+        keys = []
+        for field, direction in self.keys:
+            key = self._field_key(doc.get(field), direction)  # missing sorts as None
+            if key is None:
+                return UNINDEXED
+            keys.append(key)
+        return tuple(keys)
+
+    def add(self, seq, key):
+        if key is UNINDEXED:
+            super().add(seq, key)
+        else:
+            bisect.insort(self._entries, (*key, seq))
+
+    def remove(self, seq, key):
+        if key is UNINDEXED:
+            super().remove(seq, key)
+            return
+        entry = (*key, seq)
+        i = bisect.bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def lookup(self, condition):
+        return None
+
+    def prefix_for(
+        self, equalities: Dict[str, Any], sort: List[Tuple[str, int]]
+    ) -> Optional[tuple]:
+        """Key prefix to scan for documents with these field values, in this sort order,
+        or None if the index can not serve the query."""
+        if self._unindexed:
+            return None  # their position in the order is unknown
+        n = len(self.keys) - len(sort)
+        if n < 0 or self.keys[n:] != list(sort):
+            return None
+        prefix = []
+        for field, direction in self.keys[:n]:
+            value = equalities.get(field)
+            # numbers are equal to booleans of other brackets, so only strings are looked up
+            if not isinstance(value, str):
+                return None
+            prefix.append(self._field_key(value, direction))
+        return tuple(prefix)
+
+    def scan(self, prefix: tuple, after: Optional[tuple], n: int) -> List[tuple]:
+        """Up to `n` entries starting with `prefix`, following `after` (an entry) if given."""
+        entries = self._entries
+        if after is None:
+            start = bisect.bisect_left(entries, prefix)
+        else:
+            start = bisect.bisect_right(entries, after)
+        chunk = entries[start : start + n]
+        for i, entry in enumerate(chunk):
+            if entry[: len(prefix)] != prefix:
+                return chunk[:i]
+        return chunk
+
+
+def build_indexes(index_specs: Iterable[Dict[str, Any]]) -> List[Index]:
+    """Hash indexes for HASH_INDEXED_FIELDS, sorted indexes for single field index specs and
+    compound indexes for compound index specs."""
+    indexes: List[Index] = [HashIndex(field) for field in HASH_INDEXED_FIELDS]
+    fields = set(HASH_INDEXED_FIELDS) | {"_id"}
+    for spec in index_specs:
+        keys = list(spec.get("key", ()))
+        if not keys or any("." in field for field, _ in keys):
+            continue
+        if len(keys) > 1:
+            indexes.append(CompoundIndex(keys))
+            continue
+        field = keys[0][0]
+        if field in fields:
+            continue
+        fields.add(field)
+        indexes.append(SortedIndex(field))
+    return indexes
@@ -3,14 +3,17 @@
 from contextlib import asynccontextmanager
 from typing import Any, Dict, List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
 from sse_starlette.sse import EventSourceResponse
 from starlette.status import (
     HTTP_201_CREATED,
     HTTP_204_NO_CONTENT,
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
+    HTTP_410_GONE,
     HTTP_500_INTERNAL_SERVER_ERROR,
+    HTTP_503_SERVICE_UNAVAILABLE,
 )
 
 from labtasker.api_models import (
@@ -21,8 +24,12 @@
     Task,
     TaskFetchRequest,
     TaskFetchResponse,
+    TaskHeartbeatRequest,
+    TaskHeartbeatResponse,
     TaskLsRequest,
     TaskLsResponse,
+    TaskReportAndFetchRequest,
+    TaskReserveRequest,
     TaskStatusUpdateRequest,
     TaskSubmitRequest,
     TaskSubmitResponse,
@@ -36,51 +43,129 @@
 )
 from labtasker.server.config import get_server_config
 from labtasker.server.database import DBService
-from labtasker.server.dependencies import get_db, get_verified_queue_dependency
+from labtasker.server.dependencies import (
+    get_db,
+    get_replicated_store,
+    get_verified_queue_dependency,
+    verify_replication_token,
+)
+from labtasker.server.embedded_db import ServerStore
+from labtasker.server.event_bus import get_event_bus
 from labtasker.server.event_manager import event_manager
+from labtasker.server.leader import TIMEOUT_SWEEPER_LEASE, LeaderLease
 from labtasker.server.logging import logger
+from labtasker.server.replication import (
+    POLL_BATCH_SIZE,
+    ReplicationGap,
+    encode_record,
+    encode_records,
+    get_replica,
+    is_standby,
+)
 from labtasker.utils import get_current_time, parse_obj_as, unflatten_dict
 
 
-async def periodic_task(app: FastAPI, interval_seconds: float):
+async def periodic_task(app: FastAPI, interval_seconds: float, lease: LeaderLease):
     """Run a periodic task at specified intervals."""
+    loop = asyncio.get_running_loop()
     while True:
         try:
-            # logger.info(
-            #     f"now: {get_current_time()}, current_event_loop: {asyncio.get_running_loop().__hash__()}"
-            # )
-            db = get_db()
-            transitioned_tasks = db.handle_timeouts()
+            # only one of the server processes sharing the database sweeps timeouts
+            if lease.is_leader and not is_standby():
+                db = get_db()
+                # run in executor so that requests are not blocked during the sweep
+                transitioned_tasks = await loop.run_in_executor(
+                    None, db.handle_timeouts
+                )
+                if transitioned_tasks:
+                    logger.info(
+                        f"Transitioned {len(transitioned_tasks)} timed out tasks"
+                    )
             app.state.prev_polling = get_current_time().timestamp()
-            if transitioned_tasks:
-                logger.info(f"Transitioned {len(transitioned_tasks)} timed out tasks")
         except Exception as e:
             logger.info(f"Error checking timeouts: {e}")
         await asyncio.sleep(interval_seconds)
 
 
+async def keep_lease(lease: LeaderLease):
+    """Keep acquiring or renewing the lease."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(lease.renew_interval)
+        if not is_standby():  # the database is read-only until promoted
+            await loop.run_in_executor(None, lease.refresh)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifespan and background tasks."""
     # Setup
     config = get_server_config()
-    task = asyncio.create_task(periodic_task(app, config.periodic_task_interval))
+    loop = asyncio.get_running_loop()
+
+    lease = LeaderLease(
+        get_db(), name=TIMEOUT_SWEEPER_LEASE, ttl=config.leader_lease_ttl
+    )
+    if not is_standby():
+        await loop.run_in_executor(None, lease.refresh)
+
+    tasks = [
+        asyncio.create_task(periodic_task(app, config.periodic_task_interval, lease)),
+        asyncio.create_task(keep_lease(lease)),
+    ]
 
     app.state.prev_polling = get_current_time().timestamp()
 
+    event_bus = get_event_bus()
+    event_bus.start()
+
     yield
 
     # Cleanup
-    task.cancel()
+    event_bus.stop()
+
+    replica = get_replica()
+    if replica is not None:
+        replica.stop()
+
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    # hand over to other server processes right away
+    await loop.run_in_executor(None, lease.release)
+
     try:
-        await task
-    except asyncio.CancelledError:
-        pass
+        await loop.run_in_executor(None, get_db().flush)
+    except Exception as e:
+        logger.error(f"Failed to flush database: {e}")
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def reject_requests_to_standby(request: Request, call_next):
+    """A standby server only serves replication (and health checks) until it is promoted."""
+    path = request.url.path
+    replica = get_replica()
+    if (
+        replica is not None
+        and not replica.is_promoted
+        and path.startswith("/api/")
+        and not path.startswith("/api/v1/replication/")
+    ):
+        return JSONResponse(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": f"This server is a standby of {replica.primary_url}"},
+        )
+    return await call_next(request)
+
+
 # Debug only
 # @app.exception_handler(HTTPException)
 # async def http_exception_handler(request, exc: HTTPException):
@@ -271,6 +356,55 @@ def fetch_task(
     return TaskFetchResponse(found=True, task=parse_obj_as(Task, task))
 
 
+@app.post(
+    "/api/v1/queues/me/tasks/reserve",
+    response_model=TaskFetchResponse,
+    response_model_by_alias=False,
+)
+def reserve_task(
+    task_request: TaskReserveRequest,
+    queue: Dict[str, Any] = Depends(get_verified_queue_dependency),
+    db: DBService = Depends(get_db),
+):
+    """
+    Reserve the next available task for a worker, without starting it.
+    The worker starts it by fetching the next task before the lease expires (the heartbeats
+    of the worker renew it), after which the task is pending again.
+    """
+    task = db.reserve_task(
+        queue_id=queue["_id"],
+        worker_id=task_request.worker_id,
+        reserve_timeout=task_request.reserve_timeout,
+        required_fields=task_request.required_fields,
+        extra_filter=task_request.extra_filter,
+    )
+
+    if not task:
+        return TaskFetchResponse(found=False)
+    return TaskFetchResponse(found=True, task=parse_obj_as(Task, task))
+
+
+@app.post(
+    "/api/v1/queues/me/tasks/heartbeat",
+    response_model=TaskHeartbeatResponse,
+)
+def refresh_task_heartbeats(
+    heartbeat_request: TaskHeartbeatRequest,
+    queue: Dict[str, Any] = Depends(get_verified_queue_dependency),
+    db: DBService = Depends(get_db),
+):
+    """Update the heartbeat timestamps of several tasks at once.
+    Tasks that can not be refreshed are listed in `failed` with the reason, instead of failing the request.
+    """
+    return TaskHeartbeatResponse(
+        **db.refresh_task_heartbeats(
+            queue_id=queue["_id"],
+            task_ids=heartbeat_request.task_ids,
+            worker_id=heartbeat_request.worker_id,
+        )
+    )
+
+
 @app.post("/api/v1/queues/me/tasks/{task_id}/status")
 def report_task_status(
     task_id: str,
@@ -304,6 +438,40 @@ def report_task_status(
         raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@app.post(
+    "/api/v1/queues/me/tasks/{task_id}/report_and_fetch",
+    response_model=TaskFetchResponse,
+    response_model_by_alias=False,
+)
+def report_and_fetch_task(
+    task_id: str,
+    request: TaskReportAndFetchRequest,
+    queue: Dict[str, Any] = Depends(get_verified_queue_dependency),
+    db: DBService = Depends(get_db),
+):
+    """Report the status of a task and fetch the next task, in one round trip.
+    The report is done as with the status endpoint (checking the worker, if given), and the
+    next task is fetched as with the next endpoint. If the report fails, nothing changes.
+    """
+    task = db.report_and_fetch_task(
+        queue_id=queue["_id"],
+        task_id=task_id,
+        report_status=request.status,
+        summary_update=request.summary,
+        worker_id=request.worker_id,
+        eta_max=request.eta_max,
+        heartbeat_timeout=request.heartbeat_timeout,
+        start_heartbeat=request.start_heartbeat,
+        required_fields=request.required_fields,
+        extra_filter=request.extra_filter,
+        cmd=request.cmd,
+    )
+
+    if not task:
+        return TaskFetchResponse(found=False)
+    return TaskFetchResponse(found=True, task=parse_obj_as(Task, task))
+
+
 @app.post(
     "/api/v1/queues/me/tasks/{task_id}/heartbeat", status_code=HTTP_204_NO_CONTENT
 )
@@ -319,6 +487,17 @@ def refresh_task_heartbeat(
     )
 
 
+@app.post("/api/v1/queues/me/tasks/{task_id}/release", status_code=HTTP_204_NO_CONTENT)
+def release_task(
+    task_id: str,
+    worker_id: Optional[str] = Query(None),  # use query param
+    queue: Dict[str, Any] = Depends(get_verified_queue_dependency),
+    db: DBService = Depends(get_db),
+):
+    """Release a reserved task back to pending."""
+    db.release_task(queue_id=queue["_id"], task_id=task_id, worker_id=worker_id)
+
+
 @app.get(
     "/api/v1/queues/me/tasks/{task_id}",
     response_model=Task,
@@ -541,3 +720,64 @@ async def subscribe_events(
     return EventSourceResponse(
         queue_manager.subscribe(client_id, disconnect_handle=request.is_disconnected)
     )
+
+
+@app.get("/api/v1/replication/snapshot")
+def get_replication_snapshot(store: ServerStore = Depends(get_replicated_store)):
+    """Snapshot of the embedded database, for a standby server to start from."""
+    log_id, lsn, records = store.replication_snapshot()
+    return Response(
+        content=encode_records(records),
+        media_type="application/x-ndjson",
+        headers={"X-Replication-Log-Id": log_id, "X-Replication-LSN": str(lsn)},
+    )
+
+
+@app.get("/api/v1/replication/log")
+async def get_replication_log(
+    log_id: str,
+    after: int = Query(..., ge=0),
+    limit: int = Query(POLL_BATCH_SIZE, ge=1, le=10 * POLL_BATCH_SIZE),
+    timeout: float = Query(0.0, ge=0, le=60),
+    standby_id: Optional[str] = None,
+    store: ServerStore = Depends(get_replicated_store),
+):
+    """Mutation records following the LSN `after`. If there are none yet, the request is held
+    for up to `timeout` seconds until there is one."""
+    log = store.replication_log
+    assert log is not None  # checked by get_replicated_store()
+    try:
+        records = log.read(log_id, after, limit=limit, standby_id=standby_id)
+        if not records and timeout > 0:
+            await log.wait(after, timeout)
+            records = log.read(log_id, after, limit=limit, standby_id=standby_id)
+    except ReplicationGap as e:
+        raise HTTPException(status_code=HTTP_410_GONE, detail=str(e))
+    return {"lsn": log.lsn, "records": [encode_record(record) for record in records]}
+
+
+@app.get("/api/v1/replication/status", dependencies=[Depends(verify_replication_token)])
+def get_replication_status(db: DBService = Depends(get_db)):
+    """Role of this server, and the replication lag of its standbys or of itself."""
+    status: Dict[str, Any] = {"role": "standby" if is_standby() else "primary"}
+    store = db.embedded_store
+    if store is not None and store.replication_log is not None:
+        status["log"] = store.replication_log.status()
+    replica = get_replica()
+    if replica is not None:
+        status["replication"] = replica.status()
+    return status
+
+
+@app.post(
+    "/api/v1/replication/promote", dependencies=[Depends(verify_replication_token)]
+)
+def promote_standby(db: DBService = Depends(get_db)):
+    """Promote this standby server to primary: stop replicating and serve requests."""
+    replica = get_replica()
+    if replica is None:
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST, detail="This server is not a standby"
+        )
+    replica.promote()
+    return get_replication_status(db)
@@ -0,0 +1,183 @@
+"""
+Event bus that FSM state transitions are published through.
+
+- `InProcessEventBus` hands events straight to the event manager of the current process.
+- `DatabaseEventBus` additionally journals every event into a shared database collection
+  and tails that collection, so that subscribers connected to *other* server processes
+  (e.g. multiple uvicorn workers or hosts behind a load balancer) receive them as well.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Optional, Type
+from uuid import uuid4
+
+from labtasker.api_models import BaseEventModel, StateTransitionEvent
+from labtasker.server.config import get_server_config
+from labtasker.server.event_manager import EventManager, event_manager
+from labtasker.server.logging import logger
+from labtasker.utils import get_current_time
+
+if TYPE_CHECKING:  # avoid circular import (database -> fsm -> event_bus)
+    from labtasker.server.database import DBService
+
+_event_models: Dict[str, Type[BaseEventModel]] = {
+    "base": BaseEventModel,
+    "state_transition": StateTransitionEvent,
+}
+
+
+class EventBus:
+    """Base class of event bus backends."""
+
+    def publish(self, queue_id: str, event: BaseEventModel) -> None:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        """Start background machinery of the backend (if any)."""
+        pass
+
+    def stop(self) -> None:
+        """Stop background machinery of the backend (if any)."""
+        pass
+
+
+class InProcessEventBus(EventBus):
+    """Deliver events to subscribers connected to the current process only."""
+
+    def __init__(self, manager: EventManager = event_manager):
+        self.manager = manager
+
+    def publish(self, queue_id: str, event: BaseEventModel) -> None:
+        self.manager.publish_event(queue_id, event)
+
+
+class DatabaseEventBus(EventBus):
+    """Relay events across server processes through a shared database collection.
+
+    Events are delivered to local subscribers immediately and appended to the event journal.
+    A background thread tails the journal and delivers events published by other processes.
+    Entries are re-read within a small lookback window (to tolerate commit order and clock skew
+    between processes) and de-duplicated by their id.
+    """
+
+    def __init__(
+        self,
+        db: "DBService",
+        manager: EventManager = event_manager,
+        poll_interval: float = 0.1,
+        lookback: float = 2.0,
+    ):
+        self.db = db
+        self.manager = manager
+        self.poll_interval = poll_interval
+        self.lookback = timedelta(seconds=lookback)
+
+        # identifies events published by this process, so that they are not delivered twice
+        self.origin = uuid4().hex
+
+        # entry id -> created_at
+        self._seen: "OrderedDict[str, datetime]" = OrderedDict()
+        self._cursor = get_current_time()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def publish(self, queue_id: str, event: BaseEventModel) -> None:
+        # local subscribers do not need to wait for the round trip through the database
+        self.manager.publish_event(queue_id, event)
+        try:
+            self.db.append_event(
+                queue_id=queue_id,
+                origin=self.origin,
+                event=event.model_dump(mode="json"),
+            )
+        except Exception as e:
+            # the state transition itself is already committed, do not fail the request
+            logger.error(f"Failed to append event to the event journal: {e}")
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._cursor = get_current_time()
+        self._thread = threading.Thread(target=self._tail, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=max(1.0, self.poll_interval * 10))
+        self._thread = None
+
+    def poll(self) -> int:
+        """Deliver journal entries from other processes that are not yet seen.
+
+        Returns:
+            Number of delivered events.
+        """
+        since = self._cursor - self.lookback
+        delivered = 0
+        for entry in self.db.read_events(since=since, exclude_origin=self.origin):
+            entry_id = str(entry["_id"])
+            created_at = entry["created_at"]
+            if created_at > self._cursor:
+                self._cursor = created_at
+            if entry_id in self._seen:
+                continue
+            self._seen[entry_id] = created_at
+
+            try:
+                event_data = entry["event"]
+                model = _event_models.get(event_data.get("type"), BaseEventModel)
+                self.manager.publish_event(entry["queue_id"], model(**event_data))
+                delivered += 1
+            except Exception as e:
+                logger.error(f"Failed to deliver journaled event {entry_id}: {e}")
+
+        # forget entries that fell out of the lookback window
+        while self._seen:
+            entry_id, created_at = next(iter(self._seen.items()))
+            if created_at >= since:
+                break
+            self._seen.popitem(last=False)
+
+        return delivered
+
+    def _tail(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error tailing the event journal: {e}")
+            self._stop_event.wait(self.poll_interval)
+
+
+_event_bus: Optional[EventBus] = None
+
+
+def get_event_bus() -> EventBus:
+    """Get the event bus. Defaults to an in-process event bus."""
+    global _event_bus
+    if _event_bus is None:
+        _event_bus = InProcessEventBus()
+    return _event_bus
+
+
+def set_event_bus(event_bus: EventBus):
+    global _event_bus
+    _event_bus = event_bus
+
+
+def init_event_bus(db: "DBService") -> EventBus:
+    """Create the event bus backend specified by server config."""
+    config = get_server_config()
+    if config.event_bus == "database":
+        event_bus: EventBus = DatabaseEventBus(
+            db, poll_interval=config.event_bus_poll_interval
+        )
+    else:
+        event_bus = InProcessEventBus()
+    set_event_bus(event_bus)
+    return event_bus
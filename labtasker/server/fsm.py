@@ -7,7 +7,7 @@
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 
 from labtasker.api_models import StateTransitionEvent
-from labtasker.server.event_manager import event_manager
+from labtasker.server.event_bus import get_event_bus
 from labtasker.utils import get_current_time
 
 
@@ -61,7 +61,7 @@ def _create_event_data(self):
 
     def _publish_event(self, event_data):
         # Use fully synchronous event publishing
-        event_manager.publish_event(self.queue_id, event_data)
+        get_event_bus().publish(self.queue_id, event_data)
 
 
 class NullEventHandle(StateTransitionEventHandle):
@@ -112,6 +112,7 @@ def __repr__(self):
 class TaskState(State):
     CREATED = "created"  # temporary state
     PENDING = "pending"
+    RESERVED = "reserved"  # leased to a worker, to be started by it
     RUNNING = "running"
     SUCCESS = "success"
     FAILED = "failed"
@@ -201,7 +202,17 @@ class TaskFSM(BaseFSM):
     # Define valid state transitions
     VALID_TRANSITIONS = {
         TaskState.CREATED: {TaskState.PENDING},
-        TaskState.PENDING: {TaskState.RUNNING, TaskState.PENDING, TaskState.CANCELLED},
+        TaskState.PENDING: {
+            TaskState.RUNNING,
+            TaskState.RESERVED,
+            TaskState.PENDING,
+            TaskState.CANCELLED,
+        },
+        TaskState.RESERVED: {
+            TaskState.RUNNING,
+            TaskState.PENDING,  # released, or lease expired
+            TaskState.CANCELLED,
+        },
         TaskState.RUNNING: {
             TaskState.SUCCESS,
             TaskState.FAILED,
@@ -286,9 +297,31 @@ def fetch(self) -> StateTransitionEventHandle:
 
         Transitions:
         - PENDING -> RUNNING (task fetched for execution)
+        - RESERVED -> RUNNING (reserved task started by its worker)
         """
         return self.transition_to(TaskState.RUNNING)
 
+    def reserve(self) -> StateTransitionEventHandle:
+        """Reserve task for a worker, which is to start it before the lease expires.
+
+        Transitions:
+        - PENDING -> RESERVED
+        """
+        if self.state != TaskState.PENDING:
+            raise InvalidStateTransition(f"Cannot reserve task in {self.state} state")
+        return self.transition_to(TaskState.RESERVED)
+
+    def release(self) -> StateTransitionEventHandle:
+        """Release a reserved task (by its worker, or once its lease expired).
+        Unlike fail(), retries are left unchanged.
+
+        Transitions:
+        - RESERVED -> PENDING
+        """
+        if self.state != TaskState.RESERVED:
+            raise InvalidStateTransition(f"Cannot release task in {self.state} state")
+        return self.transition_to(TaskState.PENDING)
+
     def complete(self) -> StateTransitionEventHandle:
         """Mark task as success.
 
@@ -0,0 +1,75 @@
+"""
+Lease-based leader election among server processes sharing one database.
+
+Background jobs that must not run concurrently (e.g. the timeout sweep) are only run by
+the process holding the corresponding lease. The holder renews the lease several times per
+TTL. If it dies, the lease expires and another process takes over within about one TTL.
+On graceful shutdown the lease is released so that others can take over right away.
+"""
+
+import time
+from typing import TYPE_CHECKING, Optional
+from uuid import uuid4
+
+from labtasker.server.logging import logger
+
+if TYPE_CHECKING:
+    from labtasker.server.database import DBService
+
+TIMEOUT_SWEEPER_LEASE = "timeout_sweeper"
+
+
+class LeaderLease:
+
+    def __init__(self, db: "DBService", name: str, ttl: float):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.holder = uuid4().hex
+
+        # local deadline (monotonic) until which the lease is known to be held
+        self._held_until: Optional[float] = None
+
+    @property
+    def renew_interval(self) -> float:
+        return self.ttl / 3
+
+    @property
+    def is_leader(self) -> bool:
+        return self._held_until is not None and time.monotonic() < self._held_until
+
+    def refresh(self) -> bool:
+        """Acquire or renew the lease. Should be called every `renew_interval` seconds.
+
+        Returns:
+            Whether the current process is the leader.
+        """
+        # the deadline is counted from before the request, so it never outlives the lease in db
+        start = time.monotonic()
+        was_leader = self.is_leader
+        try:
+            acquired = self.db.acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            # keep the current deadline, leadership runs out by itself if db stays unreachable
+            logger.error(f"Failed to refresh lease '{self.name}': {e}")
+            return self.is_leader
+
+        self._held_until = start + self.ttl if acquired else None
+
+        if acquired and not was_leader:
+            logger.info(f"Acquired lease '{self.name}' (holder: {self.holder})")
+        elif was_leader and not acquired:
+            logger.warning(f"Lost lease '{self.name}' (holder: {self.holder})")
+
+        return acquired
+
+    def release(self) -> None:
+        """Release the lease if held."""
+        if self._held_until is None:
+            return
+        self._held_until = None
+        try:
+            self.db.release_lease(self.name, self.holder)
+            logger.info(f"Released lease '{self.name}' (holder: {self.holder})")
+        except Exception as e:
+            logger.error(f"Failed to release lease '{self.name}': {e}")
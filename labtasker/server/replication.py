@@ -0,0 +1,391 @@
+"""
+Log-shipping replication of the embedded database (warm standby).
+
+The primary keeps the most recent mutation records of its store in memory (`ReplicationLog`),
+numbered by a log sequence number (LSN). A standby (`labtasker-server serve --replica-of URL`)
+downloads a snapshot of the primary once, then long-polls the records that follow it and
+applies them to its own store (`Replica`), which persists them under its own durability policy.
+
+Snapshots and records are shipped as JSON, with tagged objects for the few other types that
+documents hold (see `encode_record()`): decoding them never builds arbitrary objects.
+
+Promoting the standby stops the replication. The standby already holds the whole state, so it
+serves requests right away: failover time does not depend on the database size.
+Replication is asynchronous, records acknowledged by the primary may not have reached the
+standby yet when it is promoted (see the lag metrics of `Replica.status()`).
+"""
+
+import asyncio
+import base64
+import collections
+import datetime
+import itertools
+import json
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from urllib.parse import urlparse
+from uuid import uuid4
+
+import httpx
+from mongomock import ObjectId, helpers
+
+from labtasker.server.logging import logger
+
+if TYPE_CHECKING:
+    from labtasker.server.embedded_db import ServerStore
+
+# Number of records kept for standbys. Standbys lagging further behind download a snapshot.
+REPLICATION_LOG_CAPACITY = 100_000
+
+# How long the primary holds a poll of a standby that is up to date
+POLL_TIMEOUT = 5.0  # in seconds
+POLL_BATCH_SIZE = 1000  # records per poll
+RETRY_INTERVAL = 1.0  # in seconds, after a failed poll
+
+# Standbys that did not poll for this long are no longer reported by the primary
+STANDBY_EXPIRY = 60.0  # in seconds
+
+
+class ReplicationGap(Exception):
+    """The records requested are no longer kept, or belong to another log (e.g. the primary
+    restarted). The standby has to download a snapshot."""
+
+
+def encode_record(record: List[Any]) -> str:
+    """Encode a mutation record as JSON. Values of documents that JSON has no type for are
+    tagged, e.g. `{"$datetime": "2025-01-01T00:00:00"}` (field names of documents do not
+    start with "$", as in MongoDB)."""
+    return json.dumps(record, default=_encode_value, separators=(",", ":"))
+
+
+def decode_record(line: str) -> List[Any]:
+    record = json.loads(line, object_hook=_decode_object)
+    op, _, _, *args = record
+    if op in ("set", "del") and isinstance(args[0], dict):
+        record[3] = helpers.hashdict(args[0])  # document key, as by `_document_key()`
+    elif op == "create_index":
+        # (field, direction) pairs, as created by mongomock
+        args[1]["key"] = [tuple(key) for key in args[1]["key"]]
+    return record
+
+
+def encode_records(records: Iterable[List[Any]]) -> bytes:
+    """Encode records one per line (see `encode_record()`), e.g. a snapshot."""
+    return "".join(f"{encode_record(record)}\n" for record in records).encode("utf-8")
+
+
+def decode_records(data: bytes) -> Iterator[List[Any]]:
+    for line in data.decode("utf-8").splitlines():
+        yield decode_record(line)
+
+
+def _encode_value(value: Any) -> Dict[str, str]:
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, bytes):
+        return {"$binary": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Values of type {type(value).__name__} can not be replicated")
+
+
+_VALUE_DECODERS: Dict[str, Callable[[str], Any]] = {
+    "$datetime": datetime.datetime.fromisoformat,
+    "$oid": ObjectId,
+    "$binary": base64.b64decode,
+}
+
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        ((tag, value),) = obj.items()
+        decode = _VALUE_DECODERS.get(tag)
+        if decode is not None:
+            return decode(value)
+    return obj
+
+
+class ReplicationLog:
+    """The most recent mutation records of a store, to be shipped to standbys.
+
+    Args:
+        capacity: Number of records kept.
+    """
+
+    def __init__(self, capacity: int = REPLICATION_LOG_CAPACITY):
+        # identifies the log, as LSNs restart with the process
+        self.log_id = uuid4().hex
+        self.lsn = 0  # of the last record appended
+        self._records: "collections.deque[List[Any]]" = collections.deque(
+            maxlen=capacity
+        )
+        self._lock = threading.Lock()
+        # polls waiting for the next record (see `wait()`)
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        # standby id -> (LSN up to which it applied the records, last poll time)
+        self._standbys: Dict[str, tuple] = {}
+
+    def append(self, record: List[Any]) -> None:
+        """Append a record. Records are appended in the order of the mutations."""
+        with self._lock:
+            self._records.append(record)
+            self.lsn += 1
+            waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # the event loop is closed
+                pass
+
+    async def wait(self, after: int, timeout: float) -> None:
+        """Wait up to `timeout` seconds for a record following the LSN `after`, without
+        holding a thread."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self.lsn > after:
+                return
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def read(
+        self,
+        log_id: str,
+        after: int,
+        limit: int = POLL_BATCH_SIZE,
+        standby_id: Optional[str] = None,
+    ) -> List[List[Any]]:
+        """Records following the LSN `after` (see `wait()` to wait for one).
+
+        Raises:
+            ReplicationGap: If the records are no longer kept, or `log_id` is not of this log.
+        """
+        with self._lock:
+            if standby_id is not None:
+                self._standbys[standby_id] = (after, time.time())
+            if log_id != self.log_id or after > self.lsn:
+                raise ReplicationGap(f"Unknown position {log_id}:{after}")
+            first = self.lsn - len(self._records) + 1  # LSN of the first record kept
+            if after + 1 < first:
+                raise ReplicationGap(f"Records following {after} are no longer kept")
+            start = after + 1 - first
+            return list(itertools.islice(self._records, start, start + limit))
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            for standby_id, (_, seen) in list(self._standbys.items()):
+                if now - seen > STANDBY_EXPIRY:
+                    del self._standbys[standby_id]
+            return {
+                "log_id": self.log_id,
+                "lsn": self.lsn,
+                "standbys": [
+                    {
+                        "standby_id": standby_id,
+                        "applied_lsn": applied,
+                        "lag_records": self.lsn - applied,
+                        "last_poll": seen,
+                    }
+                    for standby_id, (applied, seen) in self._standbys.items()
+                ],
+            }
+
+
+class Replica:
+    """Keeps a store up to date with the store of a primary server, until promoted.
+
+    Args:
+        store: The store of the standby.
+        primary_url: Base URL of the primary server.
+        token: Replication token of the primary (see `ServerConfig.replication_token`).
+        http_client: HTTP client to reach the primary with (defaults to one for `primary_url`).
+    """
+
+    def __init__(
+        self,
+        store: "ServerStore",
+        primary_url: str,
+        token: str,
+        http_client: Optional[httpx.Client] = None,
+        poll_timeout: float = POLL_TIMEOUT,
+    ):
+        self.store = store
+        self.primary_url = primary_url
+        self.standby_id = uuid4().hex
+        self.poll_timeout = poll_timeout
+        if urlparse(primary_url).scheme != "https":
+            logger.warning(
+                f"Replicating from {primary_url} without TLS: the replication token and the "
+                "database are sent in the clear."
+            )
+        self._client = http_client or httpx.Client(base_url=primary_url)
+        self._client.headers["Authorization"] = f"Bearer {token}"
+
+        self.log_id: Optional[str] = None  # None until a snapshot is installed
+        self.applied_lsn = 0
+        self.primary_lsn = 0
+        self.connected = False
+        self.caught_up_at: Optional[float] = None  # last time all records were applied
+
+        # held while applying records, so that none are applied once promoted or stopped
+        self._lock = threading.Lock()
+        self._promoted = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_promoted(self) -> bool:
+        return self._promoted.is_set()
+
+    @property
+    def _applying(self) -> bool:
+        return not (self._promoted.is_set() or self._stopped.is_set())
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop replicating, e.g. when the server shuts down."""
+        with self._lock:
+            self._stopped.set()
+
+    def promote(self) -> None:
+        """Stop replicating, so that the store can be written to."""
+        with self._lock:
+            if self.is_promoted:
+                return
+            self._promoted.set()
+        # a poll in progress is abandoned, its records are not applied
+        self.store.flush()
+        logger.warning(
+            f"Promoted to primary at {self.log_id}:{self.applied_lsn} "
+            f"({self.primary_lsn - self.applied_lsn} records behind {self.primary_url})"
+        )
+
+    def sync(self) -> int:
+        """Download a snapshot if needed, then apply the next records of the primary.
+
+        Returns:
+            Number of records applied.
+        """
+        try:
+            if self.log_id is None:
+                self._install_snapshot()
+            applied = self._apply_next_records()
+        except ReplicationGap as e:
+            logger.warning(f"Replication restarts from a snapshot: {e}")
+            self.log_id = None
+            return 0
+        except Exception:
+            self.connected = False
+            raise
+        self.connected = True
+        return applied
+
+    def status(self) -> Dict[str, Any]:
+        lag_records = self.primary_lsn - self.applied_lsn
+        if self.caught_up_at is None:
+            lag_seconds = None
+        elif lag_records == 0 and self.connected:
+            lag_seconds = 0.0
+        else:
+            lag_seconds = time.time() - self.caught_up_at
+        return {
+            "primary_url": self.primary_url,
+            "promoted": self.is_promoted,
+            "connected": self.connected,
+            "log_id": self.log_id,
+            "applied_lsn": self.applied_lsn,
+            "primary_lsn": self.primary_lsn,
+            "lag_records": lag_records,
+            "lag_seconds": lag_seconds,
+        }
+
+    def _run(self):
+        while self._applying:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Failed to replicate from {self.primary_url}: {e}")
+                self._stopped.wait(RETRY_INTERVAL)
+
+    def _install_snapshot(self):
+        response = self._client.get("/api/v1/replication/snapshot")
+        response.raise_for_status()
+        with self._lock:
+            if not self._applying:
+                return
+            self.store.install_snapshot(decode_records(response.content))
+            self.log_id = response.headers["X-Replication-Log-Id"]
+            self.applied_lsn = self.primary_lsn = int(
+                response.headers["X-Replication-LSN"]
+            )
+        logger.info(
+            f"Installed snapshot of {self.primary_url} at {self.log_id}:{self.applied_lsn}"
+        )
+
+    def _apply_next_records(self) -> int:
+        response = self._client.get(
+            "/api/v1/replication/log",
+            params={
+                "log_id": self.log_id,
+                "after": self.applied_lsn,
+                "limit": POLL_BATCH_SIZE,
+                "timeout": self.poll_timeout,
+                "standby_id": self.standby_id,
+            },
+            timeout=self.poll_timeout + 30,
+        )
+        if response.status_code == httpx.codes.GONE:
+            raise ReplicationGap(response.json()["detail"])
+        response.raise_for_status()
+        data = response.json()
+        records = [decode_record(line) for line in data["records"]]
+        with self._lock:
+            if not self._applying:
+                return 0
+            if records:
+                self.store.apply_records(records)
+                self.applied_lsn += len(records)
+            self.primary_lsn = data["lsn"]
+            if self.applied_lsn >= self.primary_lsn:
+                self.caught_up_at = time.time()
+        return len(records)
+
+
+_replica: Optional[Replica] = None
+
+
+def get_replica() -> Optional[Replica]:
+    """The replica of this server if it was started as a standby (`serve --replica-of`)."""
+    return _replica
+
+
+def set_replica(replica: Optional[Replica]):
+    global _replica
+    _replica = replica
+
+
+def is_standby() -> bool:
+    """Whether this server is a standby that was not promoted (yet)."""
+    return _replica is not None and not _replica.is_promoted
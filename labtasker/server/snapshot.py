@@ -0,0 +1,203 @@
+"""
+Binary snapshot format of the embedded database.
+
+Layout (integers are little endian):
+
+    header   MAGIC | format version (uint16)
+    records  the pickled state of each collection, back to back
+    index    pickled {database name: {collection name: (offset, length, crc32, created)}}
+    footer   index offset (uint64) | index length (uint64) | MAGIC
+
+On load, the file is memory-mapped and only the index is decoded. Collections are decoded
+on first access (see `LazyCollections`), and records of collections that were never accessed
+are copied as is into the next snapshot.
+"""
+
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Tuple, Union
+
+MAGIC = b"LTSNAP"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<6sH")
+_FOOTER = struct.Struct("<QQ6s")
+
+
+class SnapshotError(ValueError):
+    """The snapshot file is corrupted or of an unsupported version."""
+
+
+class _Record:
+    """Pickled state of a collection that has not been decoded yet."""
+
+    __slots__ = ("data", "crc", "created")
+
+    def __init__(self, data: memoryview, crc: int, created: bool):
+        self.data = data
+        self.crc = crc
+        self.created = created
+
+
+class LazyCollections(MutableMapping):
+    """Collections of a database, decoded from their snapshot record on first access.
+
+    Args:
+        records: Snapshot records by collection name (see `read_snapshot()`).
+        decode: Builds a collection from its name and decoded state.
+    """
+
+    def __init__(
+        self, records: Mapping[str, _Record], decode: Callable[[str, Dict], Any]
+    ):
+        self._items: Dict[str, Any] = dict(records)
+        self._decode = decode
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        item = self._items[name]
+        if not isinstance(item, _Record):
+            return item
+        with self._lock:
+            item = self._items[name]
+            if isinstance(item, _Record):
+                if zlib.crc32(item.data) != item.crc:
+                    raise SnapshotError(
+                        f"Corrupted snapshot record of collection {name}"
+                    )
+                item = self._items[name] = self._decode(name, pickle.loads(item.data))
+            return item
+
+    def __setitem__(self, name, collection):
+        self._items[name] = collection
+
+    def __delitem__(self, name):
+        del self._items[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def loaded(self) -> Dict[str, Any]:
+        """Collections decoded so far."""
+        return {
+            name: item
+            for name, item in list(self._items.items())
+            if not isinstance(item, _Record)
+        }
+
+    def created_names(self) -> List[str]:
+        """Names of the created collections (see `CollectionStore.is_created`), without
+        decoding them."""
+        return [
+            name
+            for name, item in list(self._items.items())
+            if (item.created if isinstance(item, _Record) else item.is_created)
+        ]
+
+    def raw_items(self) -> Iterator[Tuple[str, Any]]:
+        """Collections, without decoding those not decoded yet (yielded as records)."""
+        return iter(list(self._items.items()))
+
+
+def is_binary_snapshot(path: Union[str, Path]) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def encode_snapshot(
+    databases: Mapping[str, Mapping[str, Any]], get_state: Callable[[Any], Dict]
+) -> bytes:
+    """Encode collections (by database name and collection name) into a snapshot.
+
+    Args:
+        databases: Collections of each database.
+        get_state: Returns the state of a collection to be pickled. Collections may be
+            mutated concurrently, the state must not be affected by later mutations.
+    """
+    chunks = [_HEADER.pack(MAGIC, FORMAT_VERSION)]
+    offset = _HEADER.size
+    index: Dict[str, Dict[str, Tuple[int, int, int, bool]]] = {}
+    for db_name, collections in list(databases.items()):
+        if isinstance(collections, LazyCollections):
+            items = collections.raw_items()
+        else:
+            items = iter(list(collections.items()))
+        entries = index[db_name] = {}
+        for name, collection in items:
+            data: Union[bytes, memoryview]
+            if isinstance(collection, _Record):
+                data, crc = collection.data, collection.crc
+                created = collection.created
+            else:
+                data = pickle.dumps(
+                    get_state(collection), protocol=pickle.HIGHEST_PROTOCOL
+                )
+                crc = zlib.crc32(data)
+                created = bool(collection.is_created)
+            entries[name] = (offset, len(data), crc, created)
+            chunks.append(data)
+            offset += len(data)
+
+    index_data = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+    chunks.append(index_data)
+    chunks.append(_FOOTER.pack(offset, len(index_data), MAGIC))
+    return b"".join(chunks)
+
+
+def read_snapshot(path: Union[str, Path]) -> Dict[str, Dict[str, _Record]]:
+    """Map a snapshot into memory and read its index.
+
+    Returns:
+        Records of the collections of each database, to be decoded by `LazyCollections`.
+    """
+    with open(path, "rb") as f:
+        if os.name == "nt":
+            # a mapped file can not be replaced on Windows, which snapshots are
+            data = memoryview(f.read())
+        else:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    return parse_snapshot(data, name=str(path))
+
+
+def parse_snapshot(
+    data: Union[bytes, memoryview], name: str = "<snapshot>"
+) -> Dict[str, Dict[str, _Record]]:
+    """Read the index of a snapshot held in memory (see `read_snapshot()`).
+
+    Args:
+        data: The snapshot.
+        name: Name of the snapshot in error messages.
+    """
+    data = memoryview(data)
+    if len(data) < _HEADER.size + _FOOTER.size:
+        raise SnapshotError(f"Truncated snapshot: {name}")
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError(f"Not a snapshot: {name}")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(
+            f"Unsupported snapshot format version {version} (expected {FORMAT_VERSION}): {name}"
+        )
+    index_offset, index_length, magic = _FOOTER.unpack_from(
+        data, len(data) - _FOOTER.size
+    )
+    if magic != MAGIC or index_offset + index_length + _FOOTER.size != len(data):
+        raise SnapshotError(f"Truncated snapshot: {name}")
+
+    index = pickle.loads(data[index_offset : index_offset + index_length])
+    return {
+        db_name: {
+            col_name: _Record(data[offset : offset + length], crc, created)
+            for col_name, (offset, length, crc, created) in entries.items()
+        }
+        for db_name, entries in index.items()
+    }
@@ -0,0 +1,660 @@
+"""
+SQLite storage engine of the server (`serve --db-mode sqlite`).
+
+Documents are stored as JSON in one table per collection, next to generated columns for the
+fields the server filters and sorts on (`queue_id`, `status`, `priority`, timestamps, ...).
+Indexes declared with `create_index` become SQLite indexes on these columns.
+
+Query semantics are those of the embedded database: the collection API is mongomock's,
+SQLite narrows down the candidate documents (and walks the fetch order of tasks), mongomock
+matches and updates them. Sessions map to SQLite transactions, which are rolled back on error.
+The database file is in WAL journal mode, so readers do not block the writer.
+"""
+
+import contextlib
+import datetime
+import json
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import mongomock
+from mongomock import ObjectId, helpers
+
+from labtasker.server.embedded_db import MongoClient as EmbeddedMongoClient
+from labtasker.server.logging import logger
+
+# fields with a generated column, by the type of values the column holds
+TEXT_FIELDS = ("queue_id", "status", "queue_name", "worker_name")
+NUMBER_FIELDS = ("priority",)
+DATE_FIELDS = ("created_at", "last_modified", "last_heartbeat", "start_time")
+GENERATED_FIELDS = TEXT_FIELDS + NUMBER_FIELDS + DATE_FIELDS
+
+# `synchronous` pragma by durability policy (see embedded_db.DURABILITY_POLICIES): writes
+# always go to the database file, the policy only sets when it is synced to disk
+SYNCHRONOUS = {"sync": "FULL", "group": "NORMAL", "snapshot": "NORMAL", "memory": "OFF"}
+
+# expired documents (TTL indexes) are purged on writes at most this often (in seconds)
+TTL_PURGE_INTERVAL = 1.0
+
+_META_TABLE = "_labtasker_collections"
+_ARRAY_COLUMN = "f__array"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column(field: str) -> str:
+    return f"f_{field}"
+
+
+def _date_key(value: datetime.datetime) -> str:
+    """Sortable text of a datetime (UTC)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def _encode_default(value):
+    if isinstance(value, datetime.datetime):
+        return {"$date": _date_key(value), "$tz": value.tzinfo is not None}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} can not be stored")
+
+
+def _decode_hook(obj):
+    if "$date" in obj:
+        value = datetime.datetime.strptime(obj["$date"], "%Y-%m-%dT%H:%M:%S.%f")
+        return value.replace(tzinfo=datetime.timezone.utc) if obj.get("$tz") else value
+    if "$oid" in obj:
+        return ObjectId(obj["$oid"])
+    return obj
+
+
+def encode_document(doc) -> str:
+    return json.dumps(doc, default=_encode_default, separators=(",", ":"))
+
+
+def decode_document(text: str) -> "StoredDocument":
+    return StoredDocument(json.loads(text, object_hook=_decode_hook))
+
+
+def _encode_key(key) -> str:
+    return json.dumps(key, default=_encode_default, separators=(",", ":"))
+
+
+class StoredDocument(dict):
+    """A document loaded from the database.
+
+    Documents being upserted are plain dicts, so that updates in place are only written back
+    for documents that are stored.
+    """
+
+
+class _NullLock:
+    """Isolation is up to SQLite, documents are loaded afresh by every query."""
+
+    @contextlib.contextmanager
+    def reader(self):
+        yield
+
+    @contextlib.contextmanager
+    def writer(self):
+        yield
+
+
+def _column_definitions() -> List[str]:
+    columns = []
+    for field in TEXT_FIELDS:
+        path = f"'$.{field}'"
+        columns.append(
+            f"{_column(field)} TEXT GENERATED ALWAYS AS "
+            f"(CASE json_type(doc, {path}) WHEN 'text' THEN json_extract(doc, {path}) END)"
+        )
+    for field in NUMBER_FIELDS:
+        path = f"'$.{field}'"
+        columns.append(
+            f"{_column(field)} REAL GENERATED ALWAYS AS "
+            f"(CASE WHEN json_type(doc, {path}) IN ('integer', 'real') "
+            f"THEN json_extract(doc, {path}) END)"
+        )
+    for field in DATE_FIELDS:
+        columns.append(
+            f"{_column(field)} TEXT GENERATED ALWAYS AS "
+            f"(json_extract(doc, '$.{field}.\"$date\"'))"
+        )
+    # arrays match a condition if any of their elements does, so they are always candidates
+    is_array = " OR ".join(
+        f"json_type(doc, '$.{field}') = 'array'" for field in GENERATED_FIELDS
+    )
+    columns.append(f"{_ARRAY_COLUMN} INTEGER GENERATED ALWAYS AS ({is_array})")
+    return columns
+
+
+def _field_conditions(field: str, condition) -> List[Tuple[str, list]]:
+    """SQL conditions on a generated column implied by a query condition on the field."""
+    if isinstance(condition, dict):
+        if not condition or not all(k.startswith("$") for k in condition):
+            return []
+        operators = condition
+    else:
+        operators = {"$eq": condition}
+
+    column = _column(field)
+    if field in TEXT_FIELDS:
+        values = None
+        if isinstance(operators.get("$eq"), str):
+            values = [operators["$eq"]]
+        elif isinstance(operators.get("$in"), list) and all(
+            isinstance(v, str) for v in operators["$in"]
+        ):
+            values = operators["$in"]
+        if values is None:
+            return []
+        return [(f"{column} IN ({', '.join('?' * len(values))})", list(values))]
+
+    if field in NUMBER_FIELDS:
+        # numbers are equal to booleans, which the column does not hold, so only ranges apply
+        operators = {op: v for op, v in operators.items() if op != "$eq"}
+
+        def convert(value):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return None if math.isnan(value) else value
+            return None
+
+    else:
+
+        def convert(value):
+            return _date_key(value) if isinstance(value, datetime.datetime) else None
+
+    conditions = []
+    for op, sql_op in (
+        ("$eq", "="),
+        ("$gt", ">"),
+        ("$gte", ">="),
+        ("$lt", "<"),
+        ("$lte", "<="),
+    ):
+        if op in operators:
+            value = convert(operators[op])
+            if value is not None:
+                conditions.append((f"{column} {sql_op} ?", [value]))
+    return conditions
+
+
+def _id_conditions(condition) -> List[Tuple[str, list]]:
+    if isinstance(condition, dict):
+        if list(condition) != ["$in"] or not isinstance(condition["$in"], list):
+            return []
+        values = condition["$in"]
+    else:
+        values = [condition]
+    if not all(isinstance(v, (str, int, ObjectId)) for v in values):
+        return []
+    keys = [_encode_key(v) for v in values]
+    return [(f"id IN ({', '.join('?' * len(keys))})", keys)]
+
+
+def _query_conditions(query) -> Tuple[List[Tuple[str, list]], bool]:
+    """SQL conditions implied by a query, and whether any is on a generated column."""
+    conditions, on_generated = [], False
+    for field, condition in query.items():
+        if field == "$and" and isinstance(condition, list):
+            for sub in condition:
+                if isinstance(sub, dict):
+                    sub_conditions, sub_on_generated = _query_conditions(sub)
+                    conditions.extend(sub_conditions)
+                    on_generated |= sub_on_generated
+        elif field == "_id":
+            conditions.extend(_id_conditions(condition))
+        elif field in GENERATED_FIELDS:
+            field_conditions = _field_conditions(field, condition)
+            conditions.extend(field_conditions)
+            on_generated |= bool(field_conditions)
+    return conditions, on_generated
+
+
+class SQLiteCollectionStore:
+    """Collection store (see `embedded_db.CollectionStore`) backed by an SQLite table."""
+
+    def __init__(self, name: str, database_store: "SQLiteDatabaseStore"):
+        self.name = name
+        self._database_store = database_store
+        self._rwlock = _NullLock()
+        self._last_purge = 0.0
+
+        self._table = _quote(f"{database_store.name}.{name}")
+        self._execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} "
+            f"(id TEXT PRIMARY KEY, doc TEXT NOT NULL, {', '.join(_column_definitions())})"
+        )
+        self._execute(
+            f"CREATE INDEX IF NOT EXISTS {self._index_name('array')} "
+            f"ON {self._table}({_ARRAY_COLUMN}) WHERE {_ARRAY_COLUMN}"
+        )
+
+        row = self._execute(
+            f"SELECT created, indexes FROM {_META_TABLE} WHERE db = ? AND name = ?",
+            (database_store.name, name),
+        ).fetchone()
+        self._is_force_created = bool(row and row[0])
+        self.indexes: Dict[str, Dict[str, Any]] = json.loads(row[1]) if row else {}
+
+    @property
+    def _server_store(self) -> "SQLiteServerStore":
+        return self._database_store._server_store
+
+    def _execute(self, sql: str, params=()):
+        return self._server_store.connection().execute(sql, params)
+
+    def _index_name(self, index_name: str) -> str:
+        return _quote(f"{self._database_store.name}.{self.name}.{index_name}")
+
+    def _save_meta(self):
+        self._execute(
+            f"INSERT INTO {_META_TABLE} (db, name, created, indexes) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (db, name) DO UPDATE SET "
+            "created = excluded.created, indexes = excluded.indexes",
+            (
+                self._database_store.name,
+                self.name,
+                int(self._is_force_created),
+                json.dumps(self.indexes),
+            ),
+        )
+
+    @property
+    def _ttl_indexes(self):
+        return {
+            name: index
+            for name, index in self.indexes.items()
+            if index.get("expireAfterSeconds") is not None
+        }
+
+    def create(self):
+        self._is_force_created = True
+        self._save_meta()
+
+    @property
+    def is_created(self):
+        return self._is_force_created or self.indexes or not self.is_empty
+
+    def drop(self):
+        for index_name in self.indexes:
+            self._execute(f"DROP INDEX IF EXISTS {self._index_name(index_name)}")
+        self._execute(f"DELETE FROM {self._table}")
+        self.indexes = {}
+        self._is_force_created = False
+        self._save_meta()
+
+    def create_index(self, index_name, index_dict):
+        keys = [(field, direction) for field, direction in index_dict["key"]]
+        self.indexes[index_name] = {**index_dict, "key": keys}
+        if all(field in GENERATED_FIELDS for field, _ in keys):
+            columns = ", ".join(
+                f"{_column(field)} {'DESC' if direction < 0 else 'ASC'}"
+                for field, direction in keys
+            )
+            # uniqueness is checked by mongomock
+            self._execute(
+                f"CREATE INDEX IF NOT EXISTS {self._index_name(index_name)} "
+                f"ON {self._table}({columns})"
+            )
+        self._save_meta()
+
+    def drop_index(self, index_name):
+        del self.indexes[index_name]
+        self._execute(f"DROP INDEX IF EXISTS {self._index_name(index_name)}")
+        self._save_meta()
+
+    def rename(self, new_name):
+        new_table = _quote(f"{self._database_store.name}.{new_name}")
+        self._execute(f"ALTER TABLE {self._table} RENAME TO {new_table}")
+        self._execute(
+            f"DELETE FROM {_META_TABLE} WHERE db = ? AND name = ?",
+            (self._database_store.name, self.name),
+        )
+        self.name, self._table = new_name, new_table
+        self._save_meta()
+
+    @property
+    def is_empty(self):
+        return self._execute(f"SELECT 1 FROM {self._table} LIMIT 1").fetchone() is None
+
+    def __contains__(self, key):
+        row = self._execute(
+            f"SELECT 1 FROM {self._table} WHERE id = ?", (_encode_key(key),)
+        ).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        row = self._execute(
+            f"SELECT doc FROM {self._table} WHERE id = ?", (_encode_key(key),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return decode_document(row[0])
+
+    def __setitem__(self, key, val):
+        # the row keeps its position (rowid) when replaced, like in an ordered dict
+        self._execute(
+            f"INSERT INTO {self._table} (id, doc) VALUES (?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET doc = excluded.doc",
+            (_encode_key(key), encode_document(val)),
+        )
+        self._purge_expired()
+
+    def __delitem__(self, key):
+        cursor = self._execute(
+            f"DELETE FROM {self._table} WHERE id = ?", (_encode_key(key),)
+        )
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __len__(self):
+        return self._execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    @property
+    def documents(self):
+        yield from self.all_documents()
+
+    def all_documents(self) -> List[StoredDocument]:
+        rows = self._execute(f"SELECT doc FROM {self._table} ORDER BY rowid")
+        return [decode_document(doc) for (doc,) in rows]
+
+    def copy_for_update(self, doc):
+        """Documents are loaded afresh by every query, so they are updated in place."""
+        return doc
+
+    def document_updated(self, doc):
+        """Write back a document that was updated in place."""
+        if not isinstance(doc, StoredDocument):
+            return  # being upserted, it is written on insertion
+        key = doc.get("_id")
+        if isinstance(key, dict):
+            key = helpers.hashdict(key)
+        self._execute(
+            f"UPDATE {self._table} SET doc = ? WHERE id = ?",
+            (encode_document(doc), _encode_key(key)),
+        )
+
+    def _trigger_save(self):
+        """Writes are committed by SQLite."""
+
+    def find_candidates(self, filter) -> Optional[List[StoredDocument]]:
+        """Documents that may match the filter, in insertion order, or None if no generated
+        column or _id condition applies."""
+        conditions, on_generated = _query_conditions(filter)
+        if not conditions:
+            return None
+        where = " AND ".join(f"({sql})" for sql, _ in conditions)
+        params = [p for _, condition_params in conditions for p in condition_params]
+        if on_generated:
+            where = f"({where}) OR {_ARRAY_COLUMN}"
+        rows = self._execute(
+            f"SELECT doc FROM {self._table} WHERE {where} ORDER BY rowid", params
+        )
+        return [decode_document(doc) for (doc,) in rows]
+
+    def find_ordered_index(self, equalities, sort):
+        """Index spec serving documents with the given field values in the given sort order,
+        as (ORDER BY clause, WHERE clause with parameters), or None if there is none."""
+        sort = list(sort)
+        for index in self.indexes.values():
+            keys = [tuple(key) for key in index["key"]]
+            n = len(keys) - len(sort)
+            if n < 0 or keys[n:] != sort:
+                continue
+            if not all(field in GENERATED_FIELDS for field, _ in keys):
+                continue
+            prefix = [(field, equalities.get(field)) for field, _ in keys[:n]]
+            if not all(
+                field in TEXT_FIELDS and isinstance(value, str)
+                for field, value in prefix
+            ):
+                continue
+
+            where = " AND ".join(f"{_column(field)} = ?" for field, _ in prefix) or "1"
+            params = [value for _, value in prefix]
+            # values not held by the columns (e.g. missing or of other types) sort differently
+            unordered = " OR ".join(f"{_column(field)} IS NULL" for field, _ in sort)
+            if self._execute(
+                f"SELECT 1 FROM {self._table} WHERE {_ARRAY_COLUMN} "
+                f"OR ({where} AND ({unordered})) LIMIT 1",
+                params,
+            ).fetchone():
+                return None
+
+            order_by = ", ".join(
+                f"{_column(field)} {'DESC' if direction < 0 else 'ASC'}"
+                for field, direction in sort
+            )
+            return f"{order_by}, rowid", (where, params)
+        return None
+
+    def scan_ordered_index(self, index, prefix, after, n):
+        """Next `n` documents in index order, as (position, document) pairs."""
+        order_by, (where, params) = index, prefix
+        offset = after or 0
+        rows = self._execute(
+            f"SELECT doc FROM {self._table} WHERE {where} "
+            f"ORDER BY {order_by} LIMIT ? OFFSET ?",
+            [*params, n, offset],
+        )
+        return [(offset + i + 1, decode_document(doc)) for i, (doc,) in enumerate(rows)]
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        if now - self._last_purge < TTL_PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        for index in self._ttl_indexes.values():
+            keys = index["key"]
+            field = keys[0][0]
+            if len(keys) != 1 or field not in DATE_FIELDS:
+                continue
+            try:
+                expiry = int(index["expireAfterSeconds"])
+            except ValueError:
+                continue
+            deadline = mongomock.utcnow() - datetime.timedelta(seconds=expiry)
+            self._execute(
+                f"DELETE FROM {self._table} WHERE {_column(field)} <= ?",
+                (_date_key(deadline),),
+            )
+
+
+class SQLiteDatabaseStore:
+    """Database store (see `embedded_db.DatabaseStore`) of an SQLite database file."""
+
+    def __init__(self, name: str, server_store: "SQLiteServerStore"):
+        self.name = name
+        self._server_store = server_store
+        self._collections: Dict[str, SQLiteCollectionStore] = {}
+        rows = server_store.connection().execute(
+            f"SELECT name FROM {_META_TABLE} WHERE db = ?", (name,)
+        )
+        for (col_name,) in rows.fetchall():
+            self._collections[col_name] = SQLiteCollectionStore(col_name, self)
+
+    def __getitem__(self, col_name):
+        try:
+            return self._collections[col_name]
+        except KeyError:
+            col = self._collections[col_name] = SQLiteCollectionStore(col_name, self)
+            return col
+
+    def __contains__(self, col_name):
+        return self[col_name].is_created
+
+    def list_created_collection_names(self):
+        return [name for name, col in self._collections.items() if col.is_created]
+
+    def create_collection(self, name):
+        col = self[name]
+        col.create()
+        return col
+
+    def rename(self, name, new_name):
+        col = self._collections.pop(name)
+        col.rename(new_name)
+        self._collections[new_name] = col
+
+    @property
+    def is_created(self):
+        return any(col.is_created for col in self._collections.values())
+
+
+class SQLiteServerStore:
+    """Server store (see `embedded_db.ServerStore`) of an SQLite database file.
+
+    Each thread uses a connection of its own, so that a transaction spans the operations of
+    the thread that started it.
+    """
+
+    def __init__(self, path: Union[str, Path], durability: str = "sync"):
+        if durability not in SYNCHRONOUS:
+            raise ValueError(
+                f"Invalid durability policy: {durability}. Must be one of {tuple(SYNCHRONOUS)}"
+            )
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._synchronous = SYNCHRONOUS[durability]
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._databases: Dict[str, SQLiteDatabaseStore] = {}
+        self._databases_lock = threading.Lock()
+
+        self.connection().execute(
+            f"CREATE TABLE IF NOT EXISTS {_META_TABLE} ("
+            "db TEXT NOT NULL, name TEXT NOT NULL, "
+            "created INTEGER NOT NULL DEFAULT 0, indexes TEXT NOT NULL DEFAULT '{}', "
+            "PRIMARY KEY (db, name))"
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            # autocommit, transactions are started explicitly by sessions
+            conn = sqlite3.connect(
+                self.path, isolation_level=None, timeout=30, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self._synchronous}")
+            self._local.connection = conn
+            self._local.transaction_depth = 0
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def __getitem__(self, db_name):
+        with self._databases_lock:
+            db = self._databases.get(db_name)
+            if db is None:
+                db = self._databases[db_name] = SQLiteDatabaseStore(db_name, self)
+            return db
+
+    def __contains__(self, db_name):
+        return self[db_name].is_created
+
+    def list_created_database_names(self):
+        rows = self.connection().execute(f"SELECT DISTINCT db FROM {_META_TABLE}")
+        return [name for (name,) in rows.fetchall() if self[name].is_created]
+
+    def begin(self, read_only: bool = False):
+        """Begin a transaction on the connection of the current thread (reentrant)."""
+        conn = self.connection()
+        if not self._local.transaction_depth:
+            # writers take the write lock upfront, so that they never fail to upgrade
+            conn.execute("BEGIN" if read_only else "BEGIN IMMEDIATE")
+        self._local.transaction_depth += 1
+
+    def end(self, commit: bool = True):
+        conn = self.connection()
+        self._local.transaction_depth -= 1
+        if not self._local.transaction_depth:
+            conn.execute("COMMIT" if commit else "ROLLBACK")
+
+    def flush(self):
+        """Checkpoint the write-ahead log into the database file."""
+        self.connection().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to close SQLite connection: {e}")
+
+
+class SQLiteSession:
+    """Session whose transactions are SQLite transactions of the current thread."""
+
+    def __init__(self, store: SQLiteServerStore):
+        self._store = store
+        self._in_transaction = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._end_transaction(commit=exc_type is None)
+
+    @contextlib.contextmanager
+    def start_transaction(
+        self, queue_id: Optional[str] = None, read_only: bool = False, **kwargs
+    ):
+        """Start a transaction, committed on exit or rolled back on error.
+
+        Args:
+            queue_id: Unused, SQLite has a single writer at a time.
+            read_only: Whether the transaction only reads. Read-only transactions run
+                concurrently with the writer.
+        """
+        self._store.begin(read_only=read_only)
+        self._in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            self._end_transaction(commit=False)
+            raise
+        self._end_transaction(commit=True)
+
+    def commit_transaction(self):
+        self._end_transaction(commit=True)
+
+    def abort_transaction(self):
+        self._end_transaction(commit=False)
+
+    def _end_transaction(self, commit: bool):
+        if self._in_transaction:
+            self._in_transaction = False
+            self._store.end(commit=commit)
+
+
+class MongoClient(EmbeddedMongoClient):
+    """Embedded database client storing data in SQLite."""
+
+    def __init__(self, path: Union[str, Path], durability: str = "sync", **kwargs):
+        super().__init__(
+            _store=SQLiteServerStore(path, durability=durability), **kwargs
+        )
+
+    def flush(self):
+        self._store.flush()
+
+    def close(self):
+        super(EmbeddedMongoClient, self).close()
+        self._store.close()
+
+    def start_session(self, *args, **kwargs):
+        return SQLiteSession(self._store)
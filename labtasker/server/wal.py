@@ -0,0 +1,151 @@
+"""
+Append-only write-ahead log used by the embedded database.
+
+Each record is a jsonpickle encoded line. Records are buffered by `append()` and made durable
+by `commit()`. Concurrent committers are group committed: whoever finds no flush in progress
+writes out everything buffered so far with a single fsync, while the others wait for it.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Union
+
+import jsonpickle
+
+from labtasker.server.logging import logger
+
+
+def fsync_dir(path: Union[str, Path]):
+    """Make a rename/creation/removal of a file in the directory durable."""
+    if os.name == "nt":  # directories can not be opened on Windows
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: Union[str, Path], data: Union[str, bytes]):
+    """Write data to path atomically (temp file + fsync + rename)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path.parent)
+
+
+class WriteAheadLog:
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._buffer: List[str] = []
+        self._appended = 0  # number of records appended
+        self._durable = 0  # number of appended records that are written and fsynced
+        self._flushing = False
+
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.size = self._file.tell()  # in bytes (including buffered records)
+
+    def append(self, record: Any) -> int:
+        """Buffer a record.
+
+        The record is encoded right away, so later mutations of the passed objects are not
+        reflected. Callers are responsible for appending records in the order of the mutations.
+
+        Returns:
+            Sequence number of the record, to be passed to `commit()`.
+        """
+        with self._cond:
+            line = jsonpickle.encode(record, keys=True)
+            self._buffer.append(line)
+            self.size += len(line) + 1
+            self._appended += 1
+            return self._appended
+
+    def commit(self, seq: Optional[int] = None) -> None:
+        """Block until records up to `seq` (default: all appended records) are durable."""
+        with self._cond:
+            target = self._appended if seq is None else seq
+            while self._durable < target:
+                if self._flushing:
+                    # some other thread is flushing, it may cover our records as well
+                    self._cond.wait()
+                    continue
+                self._flush_locked(release=True)
+
+    def rotate(self, dest: Union[str, Path]) -> None:
+        """Flush and move the current log to `dest`, and continue with an empty log."""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._flush_locked(release=False)
+            self._file.close()
+            os.replace(self.path, dest)
+            self._file = open(self.path, "a", encoding="utf-8")
+            fsync_dir(self.path.parent)
+            self.size = 0
+
+    def close(self) -> None:
+        self.commit()
+        with self._cond:
+            self._file.close()
+
+    def _flush_locked(self, release: bool) -> None:
+        """Write out the buffered records. Must be called with the condition held and no
+        flush in progress. If `release`, the lock is released during the file I/O."""
+        batch, self._buffer = self._buffer, []
+        upto = self._appended
+        self._flushing = True
+        if release:
+            self._cond.release()
+        try:
+            if batch:
+                self._file.write("".join(f"{line}\n" for line in batch))
+                self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException:
+            if release:
+                self._cond.acquire()
+            # put them back so that they are not lost
+            self._buffer[:0] = batch
+            self._flushing = False
+            self._cond.notify_all()
+            raise
+        if release:
+            self._cond.acquire()
+        self._durable = max(self._durable, upto)
+        self._flushing = False
+        self._cond.notify_all()
+
+    @staticmethod
+    def read_records(path: Union[str, Path]) -> Iterator[Any]:
+        """Read records from a log file. Stops at a torn (partially written) record."""
+        path = Path(path)
+        if not path.exists():
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, start=1):
+                if not line.endswith("\n"):
+                    logger.warning(
+                        f"Ignoring incomplete record at line {lineno} of {path}"
+                    )
+                    return
+                try:
+                    record = jsonpickle.decode(line, keys=True)
+                except Exception as e:
+                    logger.warning(
+                        f"Ignoring corrupted records from line {lineno} of {path}: {e}"
+                    )
+                    return
+                yield record
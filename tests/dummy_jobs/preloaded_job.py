@@ -0,0 +1,22 @@
+"""
+Dummy job for testing `labtasker loop --preload`: succeeds only if the given module was
+imported before the job started.
+"""
+
+import sys
+
+# checked before the imports of the job itself
+assert sys.argv[1] in sys.modules, f"{sys.argv[1]} was not preloaded"
+
+import os  # noqa: E402
+
+import labtasker  # noqa: E402
+
+if __name__ == "__main__":
+    arg1 = sys.argv[2]  # other task args are ignored
+
+    # the job sees its own task, as in a fresh interpreter
+    task_info = labtasker.task_info()
+    assert task_info.task_id == os.environ["LABTASKER_TASK_ID"]
+    assert task_info.task_name == f"test_task_{arg1}", task_info.task_name
+    print(f"Running task {arg1}")
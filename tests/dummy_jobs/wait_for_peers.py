@@ -0,0 +1,19 @@
+"""
+Dummy job for testing concurrent runs: succeeds once the given number of jobs started.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+if __name__ == "__main__":
+    rendezvous_dir, n_peers = Path(sys.argv[1]), int(sys.argv[2])
+    (rendezvous_dir / os.environ["LABTASKER_TASK_ID"]).touch()
+
+    deadline = time.time() + 30
+    while len(list(rendezvous_dir.iterdir())) < n_peers:
+        if time.time() > deadline:
+            sys.exit(f"Only {len(list(rendezvous_dir.iterdir()))} jobs started")
+        time.sleep(0.05)
+    print(f"Running with peers {os.environ['LABTASKER_TASK_ID']}")
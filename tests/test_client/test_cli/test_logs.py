@@ -0,0 +1,79 @@
+import pytest
+from typer.testing import CliRunner
+
+from labtasker.client.cli import app
+from labtasker.client.core.api import create_queue, ls_tasks, submit_task
+from labtasker.client.core.paths import get_labtasker_log_root
+from labtasker.client.core.run_logs import apply_retention, get_runs
+from tests.fixtures.logging import silence_logger
+
+runner = CliRunner()
+
+pytestmark = [
+    pytest.mark.unit,
+    pytest.mark.integration,
+    pytest.mark.e2e,
+    pytest.mark.usefixtures("silence_logger"),
+]
+
+
+@pytest.fixture(autouse=True)
+def setup_queue(client_config):
+    return create_queue(
+        queue_name=client_config.queue.queue_name,
+        password=client_config.queue.password.get_secret_value(),
+    )
+
+
+@pytest.fixture
+def finished_task_id(db_fixture):
+    submit_task(task_name="logged", args={"word": "hello-logs"})
+    result = runner.invoke(app, ["loop", "-c", "echo %(word)"])
+    assert result.exit_code == 0, result.output
+    return ls_tasks().content[0].task_id
+
+
+def test_logs(finished_task_id):
+    # (the output of the job does not reach run.log under CliRunner, which replaces stdout)
+    result = runner.invoke(app, ["logs", finished_task_id, "--file", "task_info.json"])
+    assert result.exit_code == 0, result.output
+    assert "hello-logs" in result.output
+
+    result = runner.invoke(app, ["logs", finished_task_id, "--list"])
+    assert result.exit_code == 0, result.output
+    assert result.output.split()[:2] == ["0", "success"]
+
+    (run,) = get_runs(finished_task_id)
+    assert run.task_name == "logged"
+    assert run.status == "success"
+    assert run.started is not None and run.finished is not None
+
+    result = runner.invoke(app, ["logs", "no-such-task"])
+    assert result.exit_code == 1
+
+
+def test_logs_retention(finished_task_id):
+    log_root = get_labtasker_log_root()
+    (run,) = get_runs(finished_task_id)
+
+    assert apply_retention(compress_after=0) == {"compressed": 1, "removed": 0}
+    assert not run.run_dir.exists()
+    (run,) = get_runs(finished_task_id)
+    assert run.archive == run.run_dir.with_name(run.run_dir.name + ".tar.gz")
+    assert run.archive.exists()
+
+    # read from the archive
+    result = runner.invoke(app, ["logs", finished_task_id, "--file", "task_info.json"])
+    assert result.exit_code == 0, result.output
+    assert "hello-logs" in result.output
+    result = runner.invoke(app, ["logs", finished_task_id])  # run.log
+    assert result.exit_code == 0, result.output
+
+    # the oldest runs go first once all runs take more than max_size
+    assert apply_retention(max_size=1) == {"compressed": 0, "removed": 1}
+    assert list((log_root / "run").iterdir()) == []
+    (run,) = get_runs(finished_task_id)
+    assert run.removed
+    result = runner.invoke(app, ["logs", finished_task_id, "--file", "task_info.json"])
+    assert result.exit_code == 1
+    assert "deleted" in result.output
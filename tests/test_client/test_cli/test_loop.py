@@ -7,7 +7,7 @@
 from typer.testing import CliRunner
 
 from labtasker.client.cli import app
-from labtasker.client.core.api import create_queue, submit_task
+from labtasker.client.core.api import create_queue, ls_tasks, submit_task
 from tests.fixtures.logging import silence_logger
 
 runner = CliRunner()
@@ -68,6 +68,124 @@ def test_loop_basic(self, setup_tasks, dummy_job_script_dir):
         for i in range(TOTAL_TASKS):
             assert f"Running task {i}" in output_text, output_text
 
+    def test_loop_concurrency(self, setup_tasks, dummy_job_script_dir, tmp_path):
+        script_path = osp.join(dummy_job_script_dir, "job_1.py")
+        wait_script_path = osp.join(dummy_job_script_dir, "wait_for_peers.py")
+        rendezvous_dir = tmp_path / "rendezvous"
+        rendezvous_dir.mkdir()
+        # all tasks wait for each other, so they only succeed if run at the same time
+        result = runner.invoke(
+            app,
+            [
+                "loop",
+                "--concurrency",
+                str(TOTAL_TASKS),
+                "-c",
+                f"python {script_path} --arg1 %(arg1) --arg2 %(arg2) --arg5 %(arg5)"
+                f" && python {wait_script_path} {rendezvous_dir} {TOTAL_TASKS}",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        output_text = Text.from_ansi(result.output).plain
+        for i in range(TOTAL_TASKS):
+            assert f"Running task {i}" in output_text, output_text
+
+        tasks = ls_tasks().content
+        assert [task.status for task in tasks] == ["success"] * TOTAL_TASKS
+        # each job ran with the environment of its own task
+        assert {path.name for path in rendezvous_dir.iterdir()} == {
+            task.task_id for task in tasks
+        }
+        assert len({task.worker_id for task in tasks}) == 1
+
+    def test_loop_prefetch(self, setup_tasks, dummy_job_script_dir, tmp_path):
+        script_path = osp.join(dummy_job_script_dir, "job_1.py")
+        # each task only runs once prepared
+        result = runner.invoke(
+            app,
+            [
+                "loop",
+                "--prefetch",
+                "--prepare",
+                f"touch {tmp_path}/%(arg1).ready",
+                "-c",
+                f"test -f {tmp_path}/%(arg1).ready"
+                f" && python {script_path} --arg1 %(arg1) --arg2 %(arg2) --arg5 %(arg5)",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        output_text = Text.from_ansi(result.output).plain
+        for i in range(TOTAL_TASKS):
+            assert f"Running task {i}" in output_text, output_text
+
+        tasks = ls_tasks().content
+        assert [task.status for task in tasks] == ["success"] * TOTAL_TASKS
+
+    @pytest.mark.parametrize("use_pty", [True, False])
+    def test_loop_preload(self, setup_tasks, dummy_job_script_dir, use_pty):
+        if os.name != "posix":
+            pytest.skip("Fork server is only supported on POSIX systems")
+
+        script_path = osp.join(dummy_job_script_dir, "preloaded_job.py")
+        result = runner.invoke(
+            app,
+            [
+                "loop",
+                "--preload",
+                "fractions",
+                "--use-pty" if use_pty else "--no-use-pty",
+                "--",
+                "python",
+                script_path,
+                "fractions",
+                "%(arg1)",
+                "%(arg2)",
+                "%(arg5)",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        output_text = Text.from_ansi(result.output).plain
+        for i in range(TOTAL_TASKS):
+            assert f"Running task {i}" in output_text, output_text
+        tasks = ls_tasks().content
+        assert [task.status for task in tasks] == ["success"] * TOTAL_TASKS
+
+    def test_loop_preload_failure(self, setup_tasks, dummy_job_script_dir):
+        if os.name != "posix":
+            pytest.skip("Fork server is only supported on POSIX systems")
+
+        script_path = osp.join(dummy_job_script_dir, "preloaded_job.py")
+        # the job checks for a module that was not preloaded
+        result = runner.invoke(
+            app,
+            [
+                "loop",
+                "--preload",
+                "fractions",
+                "--",
+                "python",
+                script_path,
+                "wave",
+                "%(arg1)",
+                "%(arg2)",
+                "%(arg5)",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        assert "wave was not preloaded" in Text.from_ansi(result.output).plain
+        tasks = ls_tasks().content
+        assert all(task.status != "success" for task in tasks)
+
+    def test_loop_preload_not_posix(self, setup_tasks, monkeypatch):
+        monkeypatch.setattr(os, "name", "nt")
+        result = runner.invoke(
+            app, ["loop", "--preload", "fractions", "--", "python", "job.py"]
+        )
+        assert result.exit_code != 0
+        assert "only supported on POSIX" in Text.from_ansi(result.output).plain
+        tasks = ls_tasks().content
+        assert all(task.status == "pending" for task in tasks)
+
     def test_loop_shell_functionality(self, setup_tasks, dummy_job_script_dir):
         if os.name == "nt":
             pytest.skip("Skipping shell test on Windows")
@@ -0,0 +1,155 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from labtasker import create_queue, ls_tasks, submit_task
+from labtasker.api_models import HealthCheckResponse, Notification, TaskUpdateRequest
+from labtasker.client import aio
+from labtasker.client.core.exceptions import (
+    LabtaskerHTTPStatusError,
+    LabtaskerRuntimeError,
+)
+from labtasker.security import get_auth_headers
+from tests.fixtures.logging import silence_logger
+from tests.fixtures.server import async_test_app
+
+pytestmark = [
+    pytest.mark.unit,
+    pytest.mark.integration,
+    pytest.mark.usefixtures("silence_logger"),
+]
+
+
+@pytest.fixture(autouse=True)
+def setup_queue(client_config, db_fixture):
+    return create_queue(
+        queue_name=client_config.queue.queue_name,
+        password=client_config.queue.password.get_secret_value(),
+    )
+
+
+@pytest.fixture
+def patch_async_client(monkeypatch, client_config, async_test_app):
+    auth_headers = get_auth_headers(
+        client_config.queue.queue_name, client_config.queue.password
+    )
+    async_test_app.headers.update(
+        {**auth_headers, "Content-Type": "application/json"},
+    )
+    monkeypatch.setattr(aio, "get_httpx_client", lambda: async_test_app)
+    return async_test_app
+
+
+@pytest.mark.anyio
+async def test_submit_tasks_concurrently(patch_async_client):
+    responses = await asyncio.gather(
+        *(aio.submit_task(task_name=f"task_{i}", args={"i": i}) for i in range(50))
+    )
+
+    assert len({r.task_id for r in responses}) == 50
+    tasks = (await aio.ls_tasks(limit=100)).content
+    assert sorted(task.args["i"] for task in tasks) == list(range(50))
+
+
+@pytest.mark.anyio
+async def test_task_flow(patch_async_client):
+    for i in range(2):
+        submit_task(task_name=f"task_{i}", args={"i": i})
+    worker_id = await aio.create_worker()
+
+    task = (await aio.fetch_task(worker_id=worker_id, required_fields=["i"])).task
+    assert task.task_name == "task_0"
+
+    heartbeats = await aio.refresh_task_heartbeats(
+        task_ids=[task.task_id], worker_id=worker_id
+    )
+    assert heartbeats.failed == {}
+
+    next_task = (
+        await aio.report_and_fetch_task(
+            task_id=task.task_id,
+            status="success",
+            worker_id=worker_id,
+            required_fields=["i"],
+        )
+    ).task
+    assert next_task.task_name == "task_1"
+    await aio.report_task_status(
+        task_id=next_task.task_id,
+        status="failed",
+        summary={"reason": "test"},
+        worker_id=worker_id,
+    )
+
+    statuses = {t.task_name: t.status for t in ls_tasks().content}
+    assert statuses == {"task_0": "success", "task_1": "pending"}
+
+
+@pytest.mark.anyio
+async def test_update_tasks(patch_async_client):
+    task_id = submit_task(task_name="task", args={"foo": "bar"}).task_id
+
+    updated = await aio.update_tasks(
+        task_updates=[
+            TaskUpdateRequest(task_id=task_id, args={"foo": "baz"}),
+        ]
+    )
+
+    assert updated.content[0].args == {"foo": "baz"}
+    assert ls_tasks(task_id=task_id).content[0].args == {"foo": "baz"}
+
+
+@pytest.mark.anyio
+async def test_error_casting(patch_async_client):
+    worker_id = await aio.create_worker()
+
+    with pytest.raises(LabtaskerHTTPStatusError) as exc_info:
+        await aio.delete_task("no-such-task")
+    assert exc_info.value.response.status_code == 404
+
+    task_id = submit_task(args={"foo": "bar"}).task_id
+    await aio.fetch_task(worker_id=worker_id, required_fields=["foo"])
+    other_worker_id = await aio.create_worker()
+    with pytest.raises(LabtaskerRuntimeError):
+        await aio.report_task_status(
+            task_id=task_id, status="success", worker_id=other_worker_id
+        )
+
+
+@pytest.mark.anyio
+async def test_server_notifications(monkeypatch, capture_output):
+    app = FastAPI()
+
+    @app.get("/health/full")
+    def mock_health():
+        return HealthCheckResponse(
+            status="healthy",
+            database="connected",
+            notification=[
+                Notification(type="info", level="medium", details="Async notification.")
+            ],
+        )
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        await aio.health_check(client=client)
+
+    assert "Async notification." in capture_output.stdout
+
+
+def test_client_per_event_loop(client_config):
+    async def get_client():
+        client = aio.get_httpx_client()
+        assert aio.get_httpx_client() is client  # shared within the loop
+        return client
+
+    try:
+        first = asyncio.run(get_client())
+        second = asyncio.run(get_client())
+        assert first is not second
+        assert second.base_url == str(client_config.endpoint.api_base_url)
+    finally:
+        asyncio.run(aio.close_httpx_client())
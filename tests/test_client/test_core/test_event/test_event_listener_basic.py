@@ -2,6 +2,7 @@
 End-to-end tests for the EventListener class.
 """
 
+import asyncio
 import threading
 import time
 
@@ -9,6 +10,7 @@
 
 from labtasker import Required, create_queue, loop, report_task_status, submit_task
 from labtasker.api_models import EventResponse
+from labtasker.client import aio
 from labtasker.client.core.events import connect_events
 from tests.fixtures.logging import silence_logger
 from tests.test_client.test_core.test_event.utils import dump_events
@@ -104,3 +106,30 @@ def dummy(foo=Required()):
 
     # Join threads to clean up
     jobflow_thread.join(timeout=3)
+
+
+@pytest.mark.anyio
+async def test_aio_iter_events():
+    """Events are streamed by the asynchronous client as well."""
+    received = []
+
+    async def listen():
+        async for event_resp in aio.iter_events():
+            received.append(event_resp)
+            if len(received) == 3:
+                break
+
+    listener = asyncio.create_task(listen())
+    await asyncio.sleep(1)  # wait for the listener to connect
+    task_id = (await aio.submit_task(args={"foo": "bar"})).task_id
+    await aio.report_task_status(task_id=task_id, status="cancelled")
+    await aio.submit_task(args={"foo": "baz"})
+
+    await asyncio.wait_for(listener, timeout=10)
+    await aio.close_httpx_client()
+
+    assert [(e.event.old_state, e.event.new_state) for e in received] == [
+        ("created", "pending"),
+        ("pending", "cancelled"),
+        ("created", "pending"),
+    ]
@@ -0,0 +1,186 @@
+"""
+Tests for the client-side event buffer: batch consumption and overflow policies.
+The SSE connection is replaced by a fake event source, so that only the client is measured.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from queue import Full, Queue
+
+import pytest
+from httpx_sse import ServerSentEvent
+
+from labtasker.api_models import BaseEventModel, EventResponse
+from labtasker.client.core.events import EventListener
+from labtasker.utils import get_current_time
+
+pytestmark = [pytest.mark.unit]
+
+
+def make_sse(sequence: int) -> ServerSentEvent:
+    return ServerSentEvent(
+        event="event",
+        data=EventResponse(
+            sequence=sequence,
+            timestamp=get_current_time(),
+            event=BaseEventModel(
+                queue_id="q", timestamp=get_current_time(), metadata={}
+            ),
+        ).model_dump_json(),
+    )
+
+
+class FakeEventSource:
+    def __init__(self, n_events: int):
+        self.n_events = n_events
+        self.produced = threading.Event()  # all events are handed to the listener
+        self.disconnect = threading.Event()
+
+        class Response:
+            def raise_for_status(self):
+                pass
+
+        self.response = Response()
+
+    def iter_sse(self):
+        yield ServerSentEvent(
+            event="connection", data=json.dumps({"client_id": "fake_client"})
+        )
+        for i in range(self.n_events):
+            yield make_sse(i)
+            if i % 100 == 0:
+                yield ServerSentEvent(event="ping", data="")
+        self.produced.set()
+        self.disconnect.wait(timeout=10)
+
+
+@pytest.fixture
+def fake_event_source(monkeypatch):
+    sources = []
+
+    def setup(n_events: int) -> FakeEventSource:
+        source = FakeEventSource(n_events)
+
+        @contextmanager
+        def fake_connect_sse(*args, **kwargs):
+            yield source
+
+        monkeypatch.setattr(
+            "labtasker.client.core.events.connect_sse", fake_connect_sse
+        )
+        sources.append(source)
+        return source
+
+    yield setup
+
+    for source in sources:
+        source.disconnect.set()
+
+
+def test_get_events_batch(fake_event_source):
+    source = fake_event_source(n_events=250)
+    listener = EventListener().start(timeout=5)
+    try:
+        assert source.produced.wait(timeout=5)
+
+        batch = listener.get_events(max_n=100, timeout=1)
+        assert [e.sequence for e in batch] == list(range(100))
+
+        rest = []
+        while len(rest) < 150:
+            rest.extend(listener.get_events(max_n=100, timeout=1))
+        assert [e.sequence for e in rest] == list(range(100, 250))
+
+        # nothing left, returns empty list after timeout
+        start = time.monotonic()
+        assert listener.get_events(max_n=100, timeout=0.1) == []
+        assert time.monotonic() - start >= 0.1
+    finally:
+        source.disconnect.set()
+        listener.stop()
+
+
+@pytest.mark.parametrize(
+    "overflow_policy, expected_sequences",
+    [
+        ("drop_oldest", list(range(90, 100))),
+        # the connection SSE and the first ping take 2 slots
+        ("drop_newest", list(range(0, 8))),
+    ],
+)
+def test_overflow_policy(fake_event_source, overflow_policy, expected_sequences):
+    source = fake_event_source(n_events=100)
+    listener = EventListener(max_queue_size=10, overflow_policy=overflow_policy)
+    listener.start(timeout=5)
+    try:
+        assert source.produced.wait(timeout=5)
+
+        stats = listener.get_stats()
+        assert stats["received"] == 1 + 100 + 1  # connection + events + pings
+        assert stats["queued"] == 10
+        assert stats["dropped"] == stats["received"] - 10
+
+        events = listener.get_events(max_n=100, timeout=0.1)
+        assert [e.sequence for e in events] == expected_sequences
+    finally:
+        source.disconnect.set()
+        listener.stop()
+
+
+def test_overflow_policy_block(fake_event_source):
+    source = fake_event_source(n_events=100)
+    listener = EventListener(max_queue_size=10, overflow_policy="block")
+    listener.start(timeout=5)
+    try:
+        # producer waits for the consumer instead of dropping
+        assert not source.produced.wait(timeout=0.2)
+
+        events = []
+        while len(events) < 100:
+            events.extend(listener.get_events(max_n=100, timeout=1))
+        assert [e.sequence for e in events] == list(range(100))
+        assert listener.get_stats()["dropped"] == 0
+    finally:
+        source.disconnect.set()
+        listener.stop()
+
+
+def test_event_consumption(fake_event_source):
+    """A stream of events is consumed whole and in order (see benchmarks/event_listener.py
+    for the throughput)."""
+    n_events = 5000
+    source = fake_event_source(n_events=n_events)
+    listener = EventListener().start(timeout=5)
+    try:
+        sequences = []
+        for event in listener.iter_events():
+            sequences.append(event.sequence)
+            if len(sequences) == n_events:
+                break
+    finally:
+        source.disconnect.set()
+        listener.stop()
+
+    assert sequences == list(range(n_events))
+    assert listener.get_stats()["dropped"] == 0
+
+
+def test_overflow_drop_oldest_room_made_meanwhile():
+    """No SSE is counted as dropped when the consumer empties the buffer before the
+    oldest one is discarded."""
+
+    class RacyQueue(Queue):
+        def put_nowait(self, item):
+            if not hasattr(self, "raced"):
+                self.raced = True  # full when tried, emptied by the consumer since
+                raise Full
+            super().put_nowait(item)
+
+    listener = EventListener(max_queue_size=1, overflow_policy="drop_oldest")
+    listener._event_queue = RacyQueue(maxsize=1)
+
+    listener._enqueue(make_sse(0))
+
+    assert listener.get_stats() == {"received": 1, "dropped": 0, "queued": 1}
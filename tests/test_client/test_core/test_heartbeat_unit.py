@@ -1,3 +1,4 @@
+import contextvars
 import threading
 
 import pytest
@@ -5,6 +6,7 @@
 from fastapi.testclient import TestClient
 from starlette.status import HTTP_204_NO_CONTENT
 
+from labtasker.client.core import heartbeat
 from labtasker.client.core.exceptions import LabtaskerRuntimeError
 from labtasker.client.core.heartbeat import end_heartbeat, start_heartbeat
 from labtasker.client.core.logging import logger
@@ -34,7 +36,9 @@ def reset(self):
 
 
 cnt = Counter()
+batches = []  # task ids of each batched refresh
 app = FastAPI()
+batch_app = FastAPI()
 
 
 @app.post(
@@ -47,6 +51,12 @@ def mock_refresh_task_heartbeat_endpoint(
     logger.debug(f"Received heartbeat for task {task_id}, cnt after incr: {cnt.get()}")
 
 
+@batch_app.post("/api/v1/queues/me/tasks/heartbeat")
+def mock_refresh_task_heartbeats_endpoint(request: dict):
+    batches.append(request["task_ids"])
+    return {"refreshed": request["task_ids"], "failed": {}}
+
+
 @pytest.fixture
 def test_app_():
     return TestClient(app)
@@ -93,3 +103,39 @@ def test_heartbeat():
     # try to stop again
     with pytest.raises(LabtaskerRuntimeError):
         end_heartbeat(raise_error=True)
+
+
+def test_heartbeats_batched(monkeypatch, test_app_):
+    """Heartbeats of the tasks run at the same time are refreshed in one request."""
+    batch_client = TestClient(batch_app)
+    batch_client.headers.update(test_app_.headers)
+    monkeypatch.setattr("labtasker.client.core.api._httpx_client", batch_client)
+    monkeypatch.setattr(heartbeat._scheduler, "_batch_supported", True)
+    batches.clear()
+
+    task_ids = [f"task_{i}" for i in range(3)]
+    contexts = [contextvars.copy_context() for _ in task_ids]
+    for ctx, task_id in zip(contexts, task_ids):
+        ctx.run(start_heartbeat, task_id, heartbeat_interval=0.2)
+
+    high_precision_sleep(1.0)
+    for ctx in contexts:
+        ctx.run(end_heartbeat)
+
+    assert 4 <= len(batches) <= 8, batches
+    # after the first refresh of each, the three are due at about the same time
+    assert all(sorted(batch) == task_ids for batch in batches[2:]), batches
+    n_batches = len(batches)
+    high_precision_sleep(0.5)
+    assert len(batches) == n_batches  # stops after end_heartbeat()
+
+
+def test_heartbeat_not_refreshed_now():
+    """With refresh_now=False, the first refresh is sent after one interval."""
+    cnt.reset()
+    start_heartbeat("test_task_id", heartbeat_interval=0.5, refresh_now=False)
+    high_precision_sleep(0.3)
+    assert cnt.get() == 0
+    high_precision_sleep(0.5)
+    assert cnt.get() == 1, cnt.get()
+    end_heartbeat()
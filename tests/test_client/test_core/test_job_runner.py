@@ -1,17 +1,24 @@
+import json
+import threading
 import time
 
+import httpx
 import pytest
 
 from labtasker import (
     LabtaskerHTTPStatusError,
+    LabtaskerNetworkError,
     create_queue,
     finish,
     get_queue,
     ls_tasks,
+    reserve_task,
     submit_task,
     task_info,
 )
+from labtasker.client.core import job_runner
 from labtasker.client.core.job_runner import loop_run
+from labtasker.client.core.paths import get_labtasker_log_dir, get_labtasker_log_root
 from tests.fixtures.logging import silence_logger
 
 pytestmark = [
@@ -90,6 +97,206 @@ def job(args):
         assert task.status == "success"
 
 
+def test_job_concurrency(setup_tasks):
+    # all jobs wait for each other, so they only succeed if run at the same time
+    barrier = threading.Barrier(TOTAL_TASKS, timeout=10)
+    runs = []
+
+    @loop_run(
+        required_fields=["arg1", "arg2"], pass_args_dict=True, concurrency=TOTAL_TASKS
+    )
+    def job(args):
+        barrier.wait()
+        # each job has a task context and a run dir of its own
+        assert task_info().task_name == f"test_task_{args['arg1']}"
+        runs.append((task_info().task_id, get_labtasker_log_dir()))
+
+    job()
+
+    tasks = ls_tasks().content
+    assert [task.status for task in tasks] == ["success"] * TOTAL_TASKS
+    assert {task_id for task_id, _ in runs} == {task.task_id for task in tasks}
+    assert len({log_dir for _, log_dir in runs}) == TOTAL_TASKS
+    for _, log_dir in runs:
+        assert json.loads((log_dir / "status.json").read_text())["status"] == "success"
+
+
+def test_job_lightweight(setup_tasks, tmp_path):
+    log_file = tmp_path / "loop.log"
+
+    @loop_run(
+        required_fields=["arg1", "arg2"],
+        pass_args_dict=True,
+        lightweight=True,
+        log_file=log_file,
+    )
+    def job(args):
+        print(f"running task {args['arg1']}")
+        if args["arg1"] == 0:
+            # reported once, the loop does not report it again
+            finish("success", summary={"manual": True})
+
+    job()
+
+    tasks = ls_tasks().content
+    assert [task.status for task in tasks] == ["success"] * TOTAL_TASKS
+    assert tasks[0].summary == {"manual": True}
+    # no run dir
+    for task in tasks:
+        assert list(get_labtasker_log_root().glob(f"run/*{task.task_id}*")) == []
+    # the output of all the tasks went to the log file
+    output = log_file.read_text()
+    for i in range(TOTAL_TASKS):
+        assert f"running task {i}" in output
+
+
+def test_job_report_and_fetch(setup_tasks, monkeypatch):
+    """The status of a task is reported along with the fetch of the next one."""
+    calls = []
+
+    def spy(name, api_func):
+        def wrapped(*args, **kwargs):
+            calls.append(name)
+            return api_func(*args, **kwargs)
+
+        monkeypatch.setattr(job_runner, name, wrapped)
+
+    for name in ["fetch_task", "report_task_status", "report_and_fetch_task"]:
+        spy(name, getattr(job_runner, name))
+
+    @loop_run(required_fields=["arg1", "arg2"])
+    def job():
+        pass
+
+    job()
+
+    assert calls == ["fetch_task"] + ["report_and_fetch_task"] * TOTAL_TASKS
+    assert [task.status for task in ls_tasks().content] == ["success"] * TOTAL_TASKS
+
+
+def test_job_report_and_fetch_unsupported(setup_tasks, monkeypatch):
+    """Against servers without the endpoint, reports and fetches are sent one by one."""
+
+    def missing_route(*args, **kwargs):
+        request = httpx.Request("POST", "http://localhost")
+        raise LabtaskerHTTPStatusError(
+            "Not Found",
+            request=request,
+            response=httpx.Response(404, json={"detail": "Not Found"}, request=request),
+        )
+
+    monkeypatch.setattr(job_runner, "report_and_fetch_task", missing_route)
+    monkeypatch.setattr(job_runner, "_report_and_fetch_supported", True)
+
+    @loop_run(required_fields=["arg1", "arg2"])
+    def job():
+        pass
+
+    job()
+
+    assert not job_runner._report_and_fetch_supported
+    assert [task.status for task in ls_tasks().content] == ["success"] * TOTAL_TASKS
+
+
+def test_job_report_and_fetch_network_error(setup_tasks, monkeypatch):
+    """A report that failed on any network error is sent again, until it is answered."""
+    calls = []
+
+    def read_timeout(*args, **kwargs):
+        calls.append("report_and_fetch_task")
+        raise LabtaskerNetworkError("The read operation timed out")
+
+    report_task_status = job_runner.report_task_status
+    failures = iter([LabtaskerNetworkError("Server disconnected")])
+
+    def flaky_report(*args, **kwargs):
+        calls.append("report_task_status")
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        return report_task_status(*args, **kwargs)
+
+    monkeypatch.setattr(job_runner, "report_and_fetch_task", read_timeout)
+    monkeypatch.setattr(job_runner, "report_task_status", flaky_report)
+    monkeypatch.setattr(job_runner, "_report_and_fetch_supported", True)
+    monkeypatch.setattr(job_runner, "_loop_internal_error_handler", lambda e, n: None)
+
+    @loop_run(required_fields=["arg1", "arg2"])
+    def job():
+        pass
+
+    job()
+
+    assert calls[:4] == [
+        "report_and_fetch_task",
+        "report_task_status",  # failed, the report is kept
+        "report_and_fetch_task",
+        "report_task_status",
+    ]
+    assert job_runner._report_and_fetch_supported
+    assert [task.status for task in ls_tasks().content] == ["success"] * TOTAL_TASKS
+
+
+def test_job_prefetch(setup_tasks, monkeypatch):
+    """The next task is reserved and prepared in the background while a task runs."""
+    calls = []
+    monkeypatch.setattr(
+        job_runner,
+        "reserve_task",
+        lambda **kwargs: calls.append("reserve_task") or reserve_task(**kwargs),
+    )
+    prepared = {}
+
+    def prepare(args):
+        prepared[task_info().task_id] = (args["arg1"], threading.current_thread())
+
+    @loop_run(
+        required_fields=["arg1", "arg2"],
+        pass_args_dict=True,
+        prefetch=True,
+        prepare=prepare,
+    )
+    def job(args):
+        arg1, thread = prepared[task_info().task_id]
+        assert arg1 == args["arg1"]
+        if args["arg1"] > 0:  # reserved while the previous task ran
+            assert thread is not threading.current_thread()
+
+    job()
+
+    tasks = ls_tasks().content
+    assert [task.status for task in tasks] == ["success"] * TOTAL_TASKS
+    assert len(prepared) == TOTAL_TASKS
+    # one reservation per task started, and the last one found nothing
+    assert calls == ["reserve_task"] * TOTAL_TASKS
+
+
+def test_job_prepare_failure(setup_tasks):
+    """A task whose preparation failed is reported as failed, without running."""
+    runs = []
+
+    def prepare(args):
+        if args["arg1"] == 1:
+            raise RuntimeError("no data")
+
+    @loop_run(
+        required_fields=["arg1", "arg2"],
+        pass_args_dict=True,
+        create_worker_kwargs={"max_retries": 10},
+        prefetch=True,
+        prepare=prepare,
+    )
+    def job(args):
+        runs.append(args["arg1"])
+
+    job()
+
+    assert sorted(runs) == [0, 2]
+    task = ls_tasks(extra_filter="args.arg1 == 1").content[0]
+    assert task.status == "failed"
+    assert task.summary["labtasker_exception"]["message"] == "no data"
+
+
 def test_job_str_filter(setup_tasks):
     """Test if Pythonic query str as extra_filter works"""
     tasks = ls_tasks()
@@ -1,10 +1,20 @@
 import concurrent.futures
+import contextvars
+import os
+import subprocess
 import sys
+import threading
 import time
 
 import pytest
 
-from labtasker.client.core.logging import log_to_file, logger
+from labtasker.client.core.logging import BackgroundLogFile, log_to_file, logger
+from labtasker.client.core.utils import (
+    JobProcessGroups,
+    read_output_threaded,
+    run_with_pty,
+    run_with_subprocess,
+)
 
 pytestmark = [pytest.mark.unit]
 
@@ -44,6 +54,161 @@ def test_log_to_file(temp_log_file):
         assert "Test logger wo." not in log_content
 
 
+def test_log_raw_output_to_file(temp_log_file):
+    """Raw output (of child processes) goes to the log file, with ANSI escapes filtered out
+    even when a chunk ends in the middle of one."""
+    with log_to_file(temp_log_file):
+        print("text before")
+        sys.stdout.write_bytes(b"raw \x1b[31mred\x1b[")
+        sys.stdout.write_bytes(b"0m progress 50%\rprogress 100%\n")
+        print("text after")
+
+    with open(temp_log_file, "r", newline="") as f:
+        assert (
+            f.read() == "text before\nraw red progress 50%\rprogress 100%\ntext after\n"
+        )
+
+
+@pytest.fixture
+def stalled_disk(monkeypatch):
+    """Log files are not written until the returned event is set.
+
+    Its `stalled` event is set once the writer waits on it.
+    """
+    release = threading.Event()
+    release.stalled = threading.Event()
+    write_out = BackgroundLogFile._write_out
+
+    def stalled_write_out(self, chunks):
+        release.stalled.set()
+        release.wait(timeout=10)
+        write_out(self, chunks)
+
+    monkeypatch.setattr(BackgroundLogFile, "_write_out", stalled_write_out)
+    yield release
+    release.set()
+
+
+def test_log_overflow_drop(temp_log_file, stalled_disk):
+    """With overflow="drop", output that does not fit in the buffer of a log file that
+    can not keep up is dropped, and the gap is marked in the file."""
+    with log_to_file(temp_log_file, buffer_size=100, overflow="drop"):
+        sys.stdout.write("a" * 59 + "\n")
+        # the writer holds "a" (and nothing queued after it) until the disk is released
+        assert stalled_disk.stalled.wait(timeout=10)
+        sys.stdout.write("b" * 59 + "\n")  # does not fit
+        sys.stdout.write("c" * 59 + "\n")
+        sys.stdout.write("d" * 39 + "\n")  # fits
+        stalled_disk.set()
+
+    with open(temp_log_file, "r") as f:
+        assert f.read() == (
+            "a" * 59
+            + "\n\n[labtasker: 120 bytes of output dropped, "
+            + "the log file could not keep up]\n"
+            + "d" * 39
+            + "\n"
+        )
+
+
+def test_log_overflow_block(temp_log_file, stalled_disk):
+    """With overflow="block" (the default), writes wait for the log file to catch up."""
+    with log_to_file(temp_log_file, buffer_size=100):
+        sys.stdout.write("a" * 59 + "\n")
+        writer = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(sys.stdout.write, "b" * 59 + "\n"),
+        )
+        writer.start()
+        writer.join(timeout=0.2)
+        assert writer.is_alive()
+
+        stalled_disk.set()
+        writer.join(timeout=10)
+        assert not writer.is_alive()
+
+    with open(temp_log_file, "r") as f:
+        assert f.read() == "a" * 59 + "\n" + "b" * 59 + "\n"
+
+
+def test_log_rotation(temp_log_file):
+    """With max_bytes, full log files are moved to <file>.1, <file>.2... and the oldest
+    beyond backup_count are deleted."""
+    with log_to_file(temp_log_file, max_bytes=10, backup_count=2) as log_file:
+        for line in ["first line", "second line", "third line", "last"]:
+            print(line)
+            log_file.drain()  # one batch per line
+
+    assert temp_log_file.read_text() == "last\n"
+    assert (temp_log_file.parent / "test_log.log.1").read_text() == "third line\n"
+    assert (temp_log_file.parent / "test_log.log.2").read_text() == "second line\n"
+    assert not (temp_log_file.parent / "test_log.log.3").exists()
+
+
+@pytest.mark.parametrize(
+    "run", [run_with_subprocess] + ([run_with_pty] if os.name == "posix" else [])
+)
+def test_log_child_output_to_file(temp_log_file, run):
+    """The output of a job process ends up in the log file, stdout and stderr alike."""
+    script = (
+        "import sys\n"
+        "for i in range(2000): print(f'line {i}')\n"
+        "print('to stderr', file=sys.stderr)\n"
+    )
+    with log_to_file(temp_log_file):
+        assert run([sys.executable, "-c", script]) == 0
+
+    with open(temp_log_file, "r") as f:
+        log_content = f.read()
+    assert all(f"line {i}\n" in log_content for i in range(2000))
+    assert "to stderr" in log_content
+
+
+def test_log_child_output_to_file_threaded(temp_log_file):
+    """The reader threads used on Windows log the output of a job process as well."""
+    script = "import sys\nprint('to stdout')\nprint('to stderr', file=sys.stderr)\n"
+    with log_to_file(temp_log_file):
+        with subprocess.Popen(
+            [sys.executable, "-c", script],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        ) as process:
+            read_output_threaded(
+                {process.stdout: sys.stdout, process.stderr: sys.stderr},
+                wait=process.wait,
+            )
+        assert process.returncode == 0
+
+    log_content = temp_log_file.read_text()
+    assert "to stdout" in log_content
+    assert "to stderr" in log_content
+
+
+@pytest.mark.skipif(os.name != "posix", reason="process groups are POSIX only")
+@pytest.mark.parametrize("run", [run_with_subprocess, run_with_pty])
+def test_terminate_job_process_groups(run):
+    """The job processes of a slot of a concurrent loop are terminated from another thread,
+    along with their children."""
+    groups = JobProcessGroups()
+    exit_codes = []
+
+    def run_slot():
+        groups.setup()
+        exit_codes.append(run("sleep 30 & sleep 30; wait", use_shell=True))
+
+    slot = threading.Thread(target=contextvars.copy_context().run, args=(run_slot,))
+    start = time.time()
+    slot.start()
+    time.sleep(0.5)
+    groups.terminate()
+    slot.join(timeout=10)
+
+    assert not slot.is_alive()
+    assert exit_codes and exit_codes[0] != 0
+    assert time.time() - start < 10
+
+
 def test_concurrent_log_to_file(tmp_path):
     """
     Test that log_to_file works correctly in a concurrent environment.
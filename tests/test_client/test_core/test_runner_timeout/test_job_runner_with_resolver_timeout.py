@@ -3,14 +3,13 @@
 Note: they are quite time-consuming.
 """
 
-import os
 import time
 
 import pytest
 
 from labtasker import Required, create_queue, ls_tasks, submit_task
 from labtasker.client.client_api import loop
-from labtasker.client.core.paths import get_labtasker_log_dir
+from labtasker.client.core.heartbeat import end_heartbeat
 from tests.fixtures.logging import silence_logger
 
 pytestmark = [
@@ -51,12 +50,9 @@ def delay(interval: float):
 
 
 def trigger_heartbeat_thread_termination():
-    # This is a bit of a hack.
-    # The heartbeat thread will stop once the lock file is deleted.
+    # This is a bit of a hack: stop the heartbeat of the task while it keeps running.
     # Only use this for testing. Do not use this practice.
-    heartbeat_lock = get_labtasker_log_dir() / "heartbeat.lock"
-    if heartbeat_lock.exists():
-        os.unlink(heartbeat_lock)
+    end_heartbeat(raise_error=False)
 
 
 def test_job_task_timeout(setup_tasks, server_config):
@@ -597,6 +597,142 @@ def test_worker_suspended_no_dispatch(db_fixture, queue_args, get_task_args):
     assert worker["status"] == WorkerState.ACTIVE
 
 
+@pytest.mark.integration
+@pytest.mark.unit
+def test_report_and_fetch_task(db_fixture, queue_args, get_task_args):
+    queue_id = db_fixture.create_queue(**queue_args)
+    worker_id = db_fixture.create_worker(queue_id=queue_id, max_retries=1)
+    task_ids = [db_fixture.create_task(**get_task_args(queue_id)) for _ in range(3)]
+
+    first = db_fixture.fetch_task(queue_id=queue_id, worker_id=worker_id)
+    second = db_fixture.report_and_fetch_task(
+        queue_id=queue_id,
+        task_id=first["_id"],
+        report_status="success",
+        summary_update={"result": 1},
+        worker_id=worker_id,
+    )
+    assert [first["_id"], second["_id"]] == task_ids[:2]
+    task = db_fixture._tasks.find_one({"_id": first["_id"]})
+    assert task["status"] == TaskState.SUCCESS
+    assert task["summary"] == {"result": 1}
+    assert second["status"] == TaskState.RUNNING
+    assert second["worker_id"] == worker_id
+
+    # a report that fails changes nothing
+    with pytest.raises(HTTPException) as exc:
+        db_fixture.report_and_fetch_task(
+            queue_id=queue_id,
+            task_id=second["_id"],
+            report_status="success",
+            worker_id="another-worker",
+        )
+    assert exc.value.status_code == HTTP_409_CONFLICT
+    assert db_fixture._tasks.find_one({"_id": task_ids[2]})["status"] == (
+        TaskState.PENDING
+    )
+
+    # the failure stops the worker: the report is kept, but no task is fetched
+    with pytest.raises(HTTPException) as exc:
+        db_fixture.report_and_fetch_task(
+            queue_id=queue_id,
+            task_id=second["_id"],
+            report_status="failed",
+            worker_id=worker_id,
+        )
+    assert exc.value.status_code == HTTP_403_FORBIDDEN
+    task = db_fixture._tasks.find_one({"_id": second["_id"]})
+    assert task["status"] == TaskState.PENDING  # to be retried
+    assert task["retries"] == 1
+    worker = db_fixture._workers.find_one({"_id": worker_id})
+    assert worker["status"] == WorkerState.CRASHED
+    assert db_fixture._tasks.find_one({"_id": task_ids[2]})["status"] == (
+        TaskState.PENDING
+    )
+
+
+@pytest.mark.integration
+@pytest.mark.unit
+def test_reserve_task(db_fixture, queue_args, get_task_args):
+    queue_id = db_fixture.create_queue(**queue_args)
+    worker_id = db_fixture.create_worker(queue_id=queue_id)
+    other_worker_id = db_fixture.create_worker(queue_id=queue_id)
+    task_ids = [db_fixture.create_task(**get_task_args(queue_id)) for _ in range(3)]
+
+    # only for a worker
+    with pytest.raises(HTTPException) as exc:
+        db_fixture.reserve_task(queue_id=queue_id, worker_id="", reserve_timeout=10)
+    assert exc.value.status_code == HTTP_400_BAD_REQUEST
+
+    with freeze_time("2025-01-01 12:00:00") as frozen_time:
+        running = db_fixture.fetch_task(queue_id=queue_id, worker_id=worker_id)
+        reserved = db_fixture.reserve_task(
+            queue_id=queue_id, worker_id=worker_id, reserve_timeout=60
+        )
+        assert [running["_id"], reserved["_id"]] == task_ids[:2]
+        assert reserved["status"] == TaskState.RESERVED
+        assert reserved["worker_id"] == worker_id
+
+        # not fetched by other workers
+        other = db_fixture.fetch_task(queue_id=queue_id, worker_id=other_worker_id)
+        assert other["_id"] == task_ids[2]
+        db_fixture.report_task_status(
+            queue_id=queue_id, task_id=other["_id"], report_status="cancelled"
+        )
+        assert db_fixture.fetch_task(queue_id=queue_id) is None
+
+        # fetched first by its worker
+        frozen_time.tick(timedelta(seconds=30))
+        fetched = db_fixture.report_and_fetch_task(
+            queue_id=queue_id,
+            task_id=running["_id"],
+            report_status="success",
+            worker_id=worker_id,
+        )
+        assert fetched["_id"] == reserved["_id"]
+        assert fetched["status"] == TaskState.RUNNING
+        assert fetched["reserved_until"] is None
+
+        # a reservation that is not started in time is released
+        db_fixture.update_task(queue_id=queue_id, task_id=task_ids[0])
+        reserved = db_fixture.reserve_task(
+            queue_id=queue_id, worker_id=worker_id, reserve_timeout=60
+        )
+        assert reserved["_id"] == task_ids[0]
+        frozen_time.tick(timedelta(seconds=50))
+        # renewed by the heartbeats of the worker
+        db_fixture.refresh_task_heartbeats(
+            queue_id=queue_id, task_ids=[fetched["_id"]], worker_id=worker_id
+        )
+        frozen_time.tick(timedelta(seconds=50))
+        assert db_fixture.handle_timeouts() == []
+        frozen_time.tick(timedelta(seconds=11))
+        assert db_fixture.handle_timeouts() == [reserved["_id"]]
+        task = db_fixture._tasks.find_one({"_id": reserved["_id"]})
+        assert task["status"] == TaskState.PENDING
+        assert task["worker_id"] is None
+        assert task["retries"] == 0
+
+    # released by the worker, only if it holds it
+    db_fixture.reserve_task(queue_id=queue_id, worker_id=worker_id, reserve_timeout=60)
+    with pytest.raises(HTTPException) as exc:
+        db_fixture.release_task(
+            queue_id=queue_id, task_id=task_ids[0], worker_id=other_worker_id
+        )
+    assert exc.value.status_code == HTTP_409_CONFLICT
+    db_fixture.release_task(queue_id=queue_id, task_id=task_ids[0], worker_id=worker_id)
+    assert db_fixture._tasks.find_one({"_id": task_ids[0]})["status"] == (
+        TaskState.PENDING
+    )
+
+    # and when the worker is deleted
+    db_fixture.reserve_task(queue_id=queue_id, worker_id=worker_id, reserve_timeout=60)
+    db_fixture.delete_worker(queue_id=queue_id, worker_id=worker_id)
+    assert db_fixture._tasks.find_one({"_id": task_ids[0]})["status"] == (
+        TaskState.PENDING
+    )
+
+
 @pytest.mark.integration
 @pytest.mark.unit
 def test_fetch_priority(db_fixture, queue_args):
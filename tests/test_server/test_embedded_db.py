@@ -1,7 +1,21 @@
+import datetime
+import json
+import threading
+import time
+from pathlib import Path
+
 import mongomock
 import pytest
+from asgi_lifespan import LifespanManager
 
-from labtasker.server.embedded_db import ServerStore
+from labtasker.server.embedded_db import (
+    MongoClient,
+    ServerStore,
+    convert_persistence_file,
+)
+from labtasker.server.embedded_document import freeze
+from labtasker.server.endpoints import app
+from labtasker.server.snapshot import SnapshotError, is_binary_snapshot
 from labtasker.utils import get_current_time
 
 pytestmark = [pytest.mark.unit]
@@ -39,3 +53,372 @@ def test_dump_and_load(db_fixture, dummy_collection, persistence_path):
     ) == t.replace(microsecond=0)
     assert new_dummy_collection.find_one({"gaz": "baz"})["bool"] is True
     assert new_dummy_collection.find_one({"to-be-deleted": "baz"}) is None
+
+
+def load_collection(persistence_path, name="dummy"):
+    return MongoClient(_store=ServerStore(persistence_path=persistence_path))[
+        "test_db"
+    ][name]
+
+
+def test_mutations_are_logged(db_fixture, dummy_collection, persistence_path):
+    dummy_collection.insert_one({"_id": "a", "n": 0})
+    dummy_collection.insert_one({"_id": "b", "n": 0})
+    dummy_collection.insert_one({"_id": "c", "n": 0})
+    # in-place updates are persisted as well
+    dummy_collection.update_one({"_id": "a"}, {"$inc": {"n": 1}})
+    dummy_collection.update_many({}, {"$inc": {"n": 1}})
+    dummy_collection.find_one_and_update({"_id": "b"}, {"$set": {"tag": "x"}})
+    dummy_collection.update_one({"_id": "d"}, {"$set": {"n": 5}}, upsert=True)
+    dummy_collection.delete_one({"_id": "c"})
+
+    # without an explicit save, state is recovered from the snapshot and the write-ahead log
+    assert Path(f"{persistence_path}.wal").stat().st_size > 0
+    new_collection = load_collection(persistence_path)
+    assert list(new_collection.find({}, sort=[("_id", 1)])) == [
+        {"_id": "a", "n": 2},
+        {"_id": "b", "n": 1, "tag": "x"},
+        {"_id": "d", "n": 5},
+    ]
+    # indexes are recovered too
+    assert (
+        "queue_name_1"
+        in load_collection(persistence_path, "queues").index_information()
+    )
+
+
+def test_write_cost_does_not_depend_on_database_size(
+    db_fixture, dummy_collection, persistence_path
+):
+    dummy_collection.insert_many(
+        [{"_id": str(i), "payload": "x" * 100} for i in range(1000)]
+    )
+    db_fixture._client._store.save_to_disk()
+    snapshot_size = Path(persistence_path).stat().st_size
+
+    wal_path = Path(f"{persistence_path}.wal")
+    assert wal_path.stat().st_size == 0
+    dummy_collection.update_one({"_id": "0"}, {"$set": {"hb": get_current_time()}})
+
+    # only the mutated document is written
+    assert 0 < wal_path.stat().st_size < 1000
+    assert Path(persistence_path).stat().st_size == snapshot_size
+
+
+def test_torn_record_is_ignored(db_fixture, dummy_collection, persistence_path):
+    dummy_collection.insert_one({"_id": "a"})
+    dummy_collection.insert_one({"_id": "b"})
+    with open(f"{persistence_path}.wal", "a") as f:
+        f.write('["set", "test_db", "dummy", "c", {"_i')  # crashed halfway
+
+    new_collection = load_collection(persistence_path)
+    assert [d["_id"] for d in new_collection.find()] == ["a", "b"]
+
+
+def test_object_id_keys(db_fixture, dummy_collection, persistence_path):
+    inserted_id = dummy_collection.insert_one({"foo": "bar"}).inserted_id
+    db_fixture._client._store.save_to_disk()
+
+    new_collection = load_collection(persistence_path)
+    new_collection.delete_one({"_id": inserted_id})
+    assert new_collection.count_documents({}) == 0
+
+
+def test_compaction(tmp_path):
+    persistence_path = str(tmp_path / "compaction.json")
+    store = ServerStore(persistence_path=persistence_path, wal_compaction_size=2000)
+    collection = MongoClient(_store=store)["test_db"]["dummy"]
+
+    for i in range(100):
+        collection.insert_one({"_id": i, "payload": "x" * 50})
+        collection.update_one({"_id": i}, {"$set": {"updated": True}})
+    store.close()
+
+    # the log has been folded into the snapshot
+    assert Path(persistence_path).exists()
+    assert Path(f"{persistence_path}.wal").stat().st_size < 2000 * 2
+    assert not Path(f"{persistence_path}.wal.compacting").exists()
+
+    new_collection = load_collection(persistence_path)
+    assert new_collection.count_documents({"updated": True}) == 100
+
+
+def test_snapshot_is_decoded_lazily(tmp_path):
+    persistence_path = str(tmp_path / "lazy.json")
+    store = ServerStore(persistence_path=persistence_path)
+    db = MongoClient(_store=store)["test_db"]
+    db["a"].insert_one({"_id": 1, "t": get_current_time()})
+    db["b"].insert_one({"_id": 2})
+    db.create_collection("empty")
+    store.save_to_disk()
+    store.close()
+    assert is_binary_snapshot(persistence_path)
+
+    store = ServerStore(persistence_path=persistence_path)
+    db = MongoClient(_store=store)["test_db"]
+    assert sorted(db.list_collection_names()) == ["a", "b", "empty"]
+    collections = store["test_db"]._collections
+    assert not collections.loaded()
+
+    db["a"].insert_one({"_id": 3})
+    assert list(collections.loaded()) == ["a"]
+    # records of collections not decoded are copied into the next snapshot as is
+    store.save_to_disk()
+    store.close()
+    db = load_collection(persistence_path, "a").database
+    assert db["a"].count_documents({}) == 2
+    assert db["b"].find_one() == {"_id": 2}
+
+
+def test_convert_persistence_file(tmp_path):
+    persistence_path = tmp_path / "convert.json"
+    store = ServerStore(persistence_path=str(persistence_path))
+    collection = MongoClient(_store=store)["test_db"]["dummy"]
+    collection.insert_one({"_id": "a", "t": get_current_time()})
+    store.save_to_disk()
+    collection.insert_one({"_id": "b"})  # write-ahead log only
+    store.close()
+    expected = list(load_collection(persistence_path).find())
+
+    # JSON snapshots of previous versions are still loaded
+    json_path = tmp_path / "legacy.json"
+    convert_persistence_file(persistence_path, json_path, fmt="json")
+    assert json_path.read_text().startswith("{")
+    assert list(load_collection(json_path).find()) == expected
+
+    convert_persistence_file(json_path)  # in place
+    assert is_binary_snapshot(json_path)
+    assert list(load_collection(json_path).find()) == expected
+
+    convert_persistence_file(persistence_path)  # folds the write-ahead log
+    assert not Path(f"{persistence_path}.wal").exists()
+    assert list(load_collection(persistence_path).find()) == expected
+
+
+def test_corrupted_snapshot(tmp_path):
+    persistence_path = tmp_path / "corrupted.json"
+    store = ServerStore(persistence_path=str(persistence_path))
+    MongoClient(_store=store)["test_db"]["dummy"].insert_one({"_id": "a"})
+    store.save_to_disk()
+    store.close()
+
+    data = bytearray(persistence_path.read_bytes())
+    data[12] ^= 0xFF  # in the record of the collection
+    persistence_path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError):
+        load_collection(persistence_path).find_one()
+
+    persistence_path.write_bytes(bytes(data[:-1]))
+    with pytest.raises(SnapshotError):
+        load_collection(persistence_path)
+
+    persistence_path.write_bytes(b"\x00\xff not a database")
+    with pytest.raises(SnapshotError):
+        load_collection(persistence_path)
+
+
+def test_save_during_writes(tmp_path):
+    persistence_path = tmp_path / "db.snapshot"
+    store = ServerStore(persistence_path=str(persistence_path))
+    collection = MongoClient(_store=store)["test_db"]["dummy"]
+
+    def write():
+        for i in range(2000):
+            collection.insert_one({"_id": i})
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while writer.is_alive():
+        store.save_to_disk()
+    writer.join()
+    store.close()
+
+    # writes the snapshots missed are replayed from the write-ahead log
+    assert load_collection(persistence_path).count_documents({}) == 2000
+
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    t0 = datetime.datetime(2025, 1, 1)
+    now = [t0]
+    monkeypatch.setattr(mongomock, "utcnow", lambda: now[0])
+
+    persistence_path = str(tmp_path / "ttl.json")
+    store = ServerStore(persistence_path=persistence_path)
+    collection = MongoClient(_store=store)["test_db"]["events"]
+    collection.create_index("created_at", expireAfterSeconds=60)
+    collection.insert_many(
+        [
+            {"_id": "a", "created_at": t0},
+            {"_id": "b", "created_at": t0 + datetime.timedelta(seconds=30)},
+            {"_id": "c", "created_at": [t0 + datetime.timedelta(seconds=90), t0]},
+            {"_id": "d", "created_at": "not a date"},
+            {"_id": "e"},
+        ]
+    )
+    collection.update_one(
+        {"_id": "b"}, {"$set": {"created_at": t0 + datetime.timedelta(seconds=120)}}
+    )
+
+    def remaining():
+        return sorted(doc["_id"] for doc in collection.find())
+
+    now[0] = t0 + datetime.timedelta(seconds=59)
+    assert remaining() == ["a", "b", "c", "d", "e"]
+    now[0] = t0 + datetime.timedelta(seconds=60)
+    assert remaining() == ["b", "d", "e"]  # "c" expires at its earliest date
+    now[0] = t0 + datetime.timedelta(seconds=180)
+    assert remaining() == ["d", "e"]
+    # only the deadlines of documents that may expire are kept
+    assert not collection._store._expiry_heap
+
+    # removals are persisted
+    store.close()
+    assert sorted(
+        doc["_id"] for doc in load_collection(persistence_path, "events").find()
+    ) == ["d", "e"]
+
+
+def test_documents_are_copied_on_write(tmp_path):
+    persistence_path = str(tmp_path / "cow.json")
+    store = ServerStore(persistence_path=persistence_path)
+    collection = MongoClient(_store=store)["test_db"]["tasks"]
+    collection.create_index("status")
+    collection.insert_one({"_id": "a", "status": "pending", "args": {"x": [1]}})
+
+    # reads share the stored document, which can not be modified
+    doc = collection.find_one({"_id": "a"})
+    assert doc is collection.find_one({"status": "pending"})
+    with pytest.raises(TypeError):
+        doc["status"] = "running"
+    with pytest.raises(TypeError):
+        doc["args"]["x"].append(2)
+    # projections and copies are mutable
+    collection.find_one({"_id": "a"}, {"args": 1})["args"]["y"] = 0
+    copy = doc.copy()
+    copy["status"] = "running"
+
+    # updates replace the document, documents read before do not change
+    collection.update_one(
+        {"_id": "a"}, {"$set": {"status": "running"}, "$push": {"args.x": 2}}
+    )
+    assert doc == {"_id": "a", "status": "pending", "args": {"x": [1]}}
+    assert collection.find_one({"status": "running"})["args"] == {"x": [1, 2]}
+    assert collection.find_one({"status": "pending"}) is None
+
+    # failed updates leave the document as is
+    with pytest.raises(mongomock.WriteError):
+        collection.update_one({"_id": "a"}, {"$set": {"_id": "b"}})
+    assert collection.find_one({"_id": "a"})["status"] == "running"
+
+    # documents are frozen when loaded from the snapshot and the write-ahead log
+    store.save_to_disk()
+    collection.update_one({"_id": "a"}, {"$set": {"status": "success"}})
+    store.close()
+    doc = load_collection(persistence_path, "tasks").find_one({"status": "success"})
+    assert doc["args"] == {"x": [1, 2]}
+    with pytest.raises(TypeError):
+        doc["args"]["x"].append(3)
+
+
+def test_equal_values_are_shared(tmp_path):
+    collection = MongoClient(_store=ServerStore(durability="memory"))["test_db"][
+        "tasks"
+    ]
+    for i in range(2):
+        # decoded for each document, like request bodies
+        collection.insert_one(
+            json.loads(
+                f'{{"_id": "{i}", "queue_id": "q", "cmd": ["python", "train.py"],'
+                f' "args": {{"lr": 0.1, "seed": {i}}}, "metadata": {{}}, "summary": {{}}}}'
+            )
+        )
+    a, b = collection.find_one({"_id": "0"}), collection.find_one({"_id": "1"})
+    assert a["queue_id"] is b["queue_id"]
+    assert a["cmd"] is b["cmd"]
+    assert a["metadata"] is a["summary"] is b["metadata"]
+    assert a["args"] is not b["args"]
+    assert all(k1 is k2 for k1, k2 in zip(a, b))  # keys are interned
+
+    # updating a document leaves the values shared with others as they are
+    collection.update_one({"_id": "0"}, {"$push": {"cmd": "--lr"}})
+    assert collection.find_one({"_id": "1"})["cmd"] == ["python", "train.py"]
+    assert collection.find_one({"_id": "0"})["cmd"] == ["python", "train.py", "--lr"]
+
+
+def test_equal_datetimes_of_other_timezones_are_not_shared():
+    utc = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    cet = utc.astimezone(datetime.timezone(datetime.timedelta(hours=1)))
+    assert utc == cet
+    a = freeze({"x": {"t": utc}})
+    b = freeze({"x": {"t": cet}})
+
+    assert a["x"] is not b["x"]
+    assert b["x"]["t"].hour == 13
+
+
+def make_store(tmp_path, **kwargs):
+    persistence_path = str(tmp_path / "policy.json")
+    store = ServerStore(persistence_path=persistence_path, **kwargs)
+    return persistence_path, store, MongoClient(_store=store)["test_db"]["dummy"]
+
+
+def test_durability_memory(tmp_path):
+    persistence_path, store, collection = make_store(tmp_path, durability="memory")
+    collection.insert_one({"_id": "a"})
+    store.close()
+
+    assert not list(tmp_path.glob("policy.json*"))
+
+
+def test_durability_group(tmp_path):
+    persistence_path, store, collection = make_store(
+        tmp_path, durability="group", flush_interval=0.05
+    )
+    wal_path = Path(f"{persistence_path}.wal")
+
+    collection.insert_one({"_id": "a"})
+    # not waiting for the disk
+    assert wal_path.stat().st_size == 0
+
+    # committed in the background
+    deadline = time.monotonic() + 5
+    while wal_path.stat().st_size == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert wal_path.stat().st_size > 0
+
+    collection.insert_one({"_id": "b"})
+    store.close()  # flushes
+    assert load_collection(persistence_path).count_documents({}) == 2
+
+
+def test_durability_snapshot(tmp_path):
+    persistence_path, store, collection = make_store(tmp_path, durability="sync")
+    collection.insert_one({"_id": "a"})
+    store.close()
+
+    # switching policy: the leftover log is folded into the snapshot
+    persistence_path, store, collection = make_store(
+        tmp_path, durability="snapshot", flush_interval=3600
+    )
+    assert not Path(f"{persistence_path}.wal").exists()
+    collection.insert_one({"_id": "b"})
+    assert load_collection(persistence_path).count_documents({}) == 1
+
+    store.flush()
+    assert not Path(f"{persistence_path}.wal").exists()
+    assert load_collection(persistence_path).count_documents({}) == 2
+
+
+def test_invalid_durability(tmp_path):
+    with pytest.raises(ValueError):
+        make_store(tmp_path, durability="sometimes")
+
+
+@pytest.mark.anyio
+async def test_flush_on_shutdown(db_fixture, monkeypatch):
+    flushed = []
+    monkeypatch.setattr(db_fixture, "flush", lambda: flushed.append(True))
+
+    async with LifespanManager(app):
+        assert not flushed
+    assert flushed
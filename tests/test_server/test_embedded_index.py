@@ -0,0 +1,256 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from labtasker.server.embedded_db import (
+    ORDERED_SCAN_CHUNK_SIZE,
+    MongoClient,
+    ServerStore,
+)
+
+pytestmark = [pytest.mark.unit]
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def collection():
+    col = MongoClient(_store=ServerStore(durability="memory"))["test_db"]["tasks"]
+    col.create_index([("queue_id", ASCENDING)])
+    col.create_index([("status", ASCENDING)])
+    col.create_index([("priority", DESCENDING)])
+    col.create_index([("created_at", ASCENDING)])
+    return col
+
+
+def ids(cursor):
+    return [doc["_id"] for doc in cursor]
+
+
+def populate(col, n=300, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n):
+        doc = {
+            "_id": f"task_{i}",
+            "queue_id": rng.choice(["q1", "q2", "q3"]),
+            "status": rng.choice(["pending", "running", "success", "failed"]),
+            "priority": rng.choice([0, 10, 20, 1.5]),
+            "created_at": T0 + timedelta(seconds=rng.randint(0, 100)),
+        }
+        # values that can not be indexed, or are missing
+        if i % 50 == 0:
+            doc["status"] = ["pending", "running"]
+        if i % 70 == 0:
+            del doc["priority"]
+        if i % 90 == 0:
+            doc["priority"] = "high"
+        docs.append(doc)
+    col.insert_many(docs)
+    return docs
+
+
+QUERIES = [
+    {"_id": "task_42"},
+    {"_id": {"$in": ["task_1", "task_2", "missing"]}},
+    {"queue_id": "q1"},
+    {"queue_id": "q1", "status": "pending"},
+    {"queue_id": {"$in": ["q1", "q3"]}, "status": {"$in": ["running", "failed"]}},
+    {"status": None},
+    {"priority": {"$gte": 10}},
+    {"priority": {"$gt": 10}},
+    {"priority": {"$lt": 10, "$gte": 1}},
+    {"priority": {"$lte": 0}},
+    {"priority": {"$gt": "a"}},
+    {"created_at": {"$lte": T0 + timedelta(seconds=50)}},
+    {"created_at": {"$gt": (T0 + timedelta(seconds=50)).replace(tzinfo=None)}},
+    {"$and": [{"queue_id": "q2"}, {"priority": {"$gte": 20}}]},
+    {"queue_id": "q2", "$or": [{"status": "pending"}, {"priority": 0}]},
+    {"status": {"$regex": "^pend"}},
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_index_lookups_match_full_scan(collection, query, monkeypatch):
+    populate(collection)
+    indexed = ids(collection.find(query))
+
+    monkeypatch.setattr(collection._store, "find_candidates", lambda filter: None)
+    assert indexed == ids(collection.find(query))
+
+
+def test_lookups_only_evaluate_candidates(collection):
+    populate(collection, n=1000)
+    store = collection._store
+
+    with store._rwlock.reader():
+        assert len(store.find_candidates({"_id": "task_42"})) == 1
+        by_queue = store.find_candidates({"queue_id": "q1", "status": "pending"})
+        assert 0 < len(by_queue) < 400
+        assert all(
+            doc["status"] == "pending" or isinstance(doc["status"], list)
+            for doc in by_queue
+        )
+        assert store.find_candidates({"worker_name": "w"}) is None
+
+
+def test_indexes_follow_updates(collection, monkeypatch):
+    populate(collection)
+    collection.update_many({"queue_id": "q1"}, {"$set": {"queue_id": "q4"}})
+    collection.update_one({"_id": "task_3"}, {"$set": {"priority": 100}})
+    collection.delete_many({"status": "failed"})
+    collection.replace_one({"_id": "task_5"}, {"queue_id": "q5", "status": "pending"})
+    collection.insert_one({"_id": "task_new", "queue_id": "q4", "priority": 100})
+
+    queries = [
+        {"queue_id": "q1"},
+        {"queue_id": "q4"},
+        {"queue_id": "q5"},
+        {"status": "failed"},
+        {"priority": {"$gte": 100}},
+    ]
+    indexed = [ids(collection.find(q)) for q in queries]
+    assert not indexed[0] and not indexed[3]
+    assert "task_new" in indexed[1]
+    assert indexed[2] == ["task_5"]
+
+    monkeypatch.setattr(collection._store, "find_candidates", lambda filter: None)
+    assert indexed == [ids(collection.find(q)) for q in queries]
+
+
+def test_indexes_follow_rollback():
+    col = MongoClient(_store=ServerStore(durability="memory"))["test_db"]["queues"]
+    col.create_index([("queue_name", ASCENDING)], unique=True)
+    col.insert_many([{"_id": "a", "queue_name": "a"}, {"_id": "b", "queue_name": "b"}])
+
+    with pytest.raises(DuplicateKeyError):
+        col.update_one({"_id": "b"}, {"$set": {"queue_name": "a"}})
+
+    assert ids(col.find({"queue_name": "b"})) == ["b"]
+    assert ids(col.find({"queue_name": "a"})) == ["a"]
+
+
+def test_indexes_are_rebuilt_on_load(tmp_path):
+    path = tmp_path / "db.json"
+    client = MongoClient(_store=ServerStore(persistence_path=path))
+    col = client["test_db"]["tasks"]
+    col.create_index([("priority", DESCENDING)])
+    col.insert_many(
+        [{"_id": str(i), "queue_id": "q", "priority": i} for i in range(10)]
+    )
+    client._store.save_to_disk()  # snapshot
+    col.update_one({"_id": "3"}, {"$set": {"priority": 30}})  # write-ahead log only
+    client.close()
+
+    col = MongoClient(_store=ServerStore(persistence_path=path))["test_db"]["tasks"]
+    with col._store._rwlock.reader():
+        assert len(col._store.find_candidates({"priority": {"$gte": 9}})) == 2
+    assert ids(col.find({"queue_id": "q", "priority": {"$gte": 9}})) == ["3", "9"]
+
+
+@pytest.mark.parametrize(
+    "pipeline",
+    [
+        [{"$match": {"queue_id": "q1"}}, {"$sort": {"created_at": 1}}],
+        [
+            {"$addFields": {"task_id": "$_id", "status": "overridden"}},
+            {"$match": {"$and": [{"queue_id": "q2"}, {"task_id": "task_7"}]}},
+        ],
+        [
+            {"$addFields": {"status": "overridden"}},
+            {"$match": {"status": "overridden", "priority": {"$gte": 10}}},
+        ],
+        [{"$sort": {"priority": -1}}, {"$match": {"queue_id": "q3"}}],
+    ],
+)
+def test_aggregate_prefilter(collection, pipeline, monkeypatch):
+    populate(collection)
+    indexed = list(collection.aggregate(pipeline))
+    assert indexed
+
+    monkeypatch.setattr(collection._store, "find_candidates", lambda filter: None)
+    assert indexed == list(collection.aggregate(pipeline))
+
+
+@pytest.fixture
+def fetch_collection(collection):
+    collection.create_index(
+        [
+            ("queue_id", ASCENDING),
+            ("status", ASCENDING),
+            ("priority", DESCENDING),
+            ("last_modified", ASCENDING),
+            ("created_at", ASCENDING),
+        ]
+    )
+    populate(collection, n=200)
+    # only a few distinct values, so that ties are broken by insertion order
+    for i, doc in enumerate(collection.find({})):
+        collection.update_one(
+            {"_id": doc["_id"]},
+            {
+                "$set": {
+                    "status": ["pending", "running"][i % 2],
+                    "last_modified": T0 + timedelta(seconds=i % 3),
+                    "created_at": T0 + timedelta(seconds=i % 2),
+                }
+            },
+        )
+    return collection
+
+
+FETCH_PIPELINE = [
+    {
+        "$match": {
+            "$and": [{"queue_id": "q1"}, {}],
+            "queue_id": "q1",
+            "status": "pending",
+        }
+    },
+    {"$addFields": {"task_id": "$_id"}},
+    {
+        "$sort": {
+            "priority": DESCENDING,
+            "last_modified": ASCENDING,
+            "created_at": ASCENDING,
+        }
+    },
+]
+
+
+def test_ordered_scan_matches_sort(fetch_collection, monkeypatch):
+    assert fetch_collection._plan_ordered_scan(FETCH_PIPELINE) is not None
+    scanned = list(fetch_collection.aggregate(FETCH_PIPELINE))
+    assert len(scanned) > ORDERED_SCAN_CHUNK_SIZE  # spans several chunks
+    assert all(doc["task_id"] == doc["_id"] for doc in scanned)
+
+    monkeypatch.setattr(fetch_collection, "_plan_ordered_scan", lambda pipeline: None)
+    assert scanned == list(fetch_collection.aggregate(FETCH_PIPELINE))
+
+
+def test_ordered_scan_fallback(fetch_collection):
+    # sorted differently from the index
+    pipeline = FETCH_PIPELINE[:-1] + [{"$sort": {"priority": ASCENDING}}]
+    assert fetch_collection._plan_ordered_scan(pipeline) is None
+    # sort field changed before sorting
+    pipeline = [FETCH_PIPELINE[0], {"$addFields": {"priority": 0}}, FETCH_PIPELINE[-1]]
+    assert fetch_collection._plan_ordered_scan(pipeline) is None
+    # position of documents with values that can not be ordered is unknown
+    fetch_collection.insert_one(
+        {"queue_id": "q1", "status": "pending", "priority": [1]}
+    )
+    assert fetch_collection._plan_ordered_scan(FETCH_PIPELINE) is None
+
+
+def test_ordered_scan_is_lazy(fetch_collection):
+    cursor = fetch_collection.aggregate(FETCH_PIPELINE)
+    first = next(cursor)
+    # documents taken by others meanwhile are not returned, past the chunk in flight
+    fetch_collection.update_many(
+        {"queue_id": "q1", "_id": {"$ne": first["_id"]}},
+        {"$set": {"status": "running"}},
+    )
+    assert len(list(cursor)) < ORDERED_SCAN_CHUNK_SIZE
@@ -21,8 +21,12 @@
     Task,
     TaskFetchRequest,
     TaskFetchResponse,
+    TaskHeartbeatRequest,
+    TaskHeartbeatResponse,
     TaskLsRequest,
     TaskLsResponse,
+    TaskReportAndFetchRequest,
+    TaskReserveRequest,
     TaskStatusUpdateRequest,
     TaskSubmitRequest,
     TaskSubmitResponse,
@@ -333,6 +337,123 @@ def test_report_task_status(
                 json=TaskStatusUpdateRequest(status="illegal").model_dump(),
             )
 
+    def test_report_and_fetch_task(self, test_app, setup_queue, auth_headers):
+        for i in range(2):
+            test_app.post(
+                "/api/v1/queues/me/tasks",
+                json=TaskSubmitRequest(
+                    task_name=f"test_task_{i}", args={"param1": i}
+                ).model_dump(),
+                headers=auth_headers,
+            )
+        response = test_app.post(
+            "/api/v1/queues/me/tasks/next",
+            headers=auth_headers,
+            json=TaskFetchRequest().model_dump(),
+        )
+        first = TaskFetchResponse(**response.json()).task
+
+        # report the first task and fetch the second one
+        response = test_app.post(
+            f"/api/v1/queues/me/tasks/{first.task_id}/report_and_fetch",
+            headers=auth_headers,
+            json=TaskReportAndFetchRequest(
+                status="success", summary={"result": 0}
+            ).dump_to_json_dict(),
+        )
+        assert response.status_code == HTTP_200_OK, f"{response.json()}"
+        data = TaskFetchResponse(**response.json())
+        assert data.found is True
+        assert data.task.task_name == "test_task_1"
+        assert data.task.status == "running"
+
+        # report the second task, no task left
+        response = test_app.post(
+            f"/api/v1/queues/me/tasks/{data.task.task_id}/report_and_fetch",
+            headers=auth_headers,
+            json=TaskReportAndFetchRequest(status="success").dump_to_json_dict(),
+        )
+        assert response.status_code == HTTP_200_OK, f"{response.json()}"
+        assert TaskFetchResponse(**response.json()).found is False
+
+        response = test_app.post(
+            "/api/v1/queues/me/tasks/search",
+            headers=auth_headers,
+            json=TaskLsRequest(task_id=first.task_id).model_dump(),
+        )
+        task = TaskLsResponse(**response.json()).content[0]
+        assert task.status == "success"
+        assert task.summary == {"result": 0}
+
+        # the first task is no longer running
+        response = test_app.post(
+            f"/api/v1/queues/me/tasks/{first.task_id}/report_and_fetch",
+            headers=auth_headers,
+            json=TaskReportAndFetchRequest(status="success").dump_to_json_dict(),
+        )
+        assert response.status_code == HTTP_400_BAD_REQUEST, f"{response.json()}"
+
+    def test_reserve_and_release_task(self, test_app, setup_queue, auth_headers):
+        worker_id = test_app.post(
+            "/api/v1/queues/me/workers",
+            headers=auth_headers,
+            json=WorkerCreateRequest(worker_name="test_worker").model_dump(),
+        ).json()["worker_id"]
+        for i in range(2):
+            test_app.post(
+                "/api/v1/queues/me/tasks",
+                json=TaskSubmitRequest(
+                    task_name=f"test_task_{i}", args={"param1": i}
+                ).model_dump(),
+                headers=auth_headers,
+            )
+
+        response = test_app.post(
+            "/api/v1/queues/me/tasks/reserve",
+            headers=auth_headers,
+            json=TaskReserveRequest(
+                worker_id=worker_id, reserve_timeout=60
+            ).dump_to_json_dict(),
+        )
+        assert response.status_code == HTTP_200_OK, f"{response.json()}"
+        reserved = TaskFetchResponse(**response.json()).task
+        assert reserved.task_name == "test_task_0"
+        assert reserved.status == "reserved"
+        assert reserved.reserved_until is not None
+
+        # released, and pending again
+        response = test_app.post(
+            f"/api/v1/queues/me/tasks/{reserved.task_id}/release",
+            headers=auth_headers,
+            params={"worker_id": worker_id},
+        )
+        assert response.status_code == HTTP_204_NO_CONTENT
+        response = test_app.post(
+            f"/api/v1/queues/me/tasks/{reserved.task_id}/release",
+            headers=auth_headers,
+            params={"worker_id": worker_id},
+        )
+        assert response.status_code == HTTP_409_CONFLICT
+
+        # another one reserved, then started by the next fetch of the worker
+        response = test_app.post(
+            "/api/v1/queues/me/tasks/reserve",
+            headers=auth_headers,
+            json=TaskReserveRequest(
+                worker_id=worker_id, reserve_timeout=60
+            ).dump_to_json_dict(),
+        )
+        reserved = TaskFetchResponse(**response.json()).task
+        assert reserved.task_name == "test_task_1"  # the released one was modified
+        response = test_app.post(
+            "/api/v1/queues/me/tasks/next",
+            headers=auth_headers,
+            json=TaskFetchRequest(worker_id=worker_id).model_dump(),
+        )
+        task = TaskFetchResponse(**response.json()).task
+        assert task.task_id == reserved.task_id
+        assert task.status == "running"
+
     def test_refresh_task_heartbeat(self, test_app, setup_queue, auth_headers):
         # 1. Submit a task first
         response = test_app.post(
@@ -388,6 +509,63 @@ def test_refresh_task_heartbeat(self, test_app, setup_queue, auth_headers):
                 <= tolerance.total_seconds()
             )
 
+    def test_refresh_task_heartbeats(self, test_app, setup_queue, auth_headers):
+        # 1. Submit and fetch two tasks, submit a third one that stays pending
+        task_ids = []
+        for i in range(3):
+            response = test_app.post(
+                "/api/v1/queues/me/tasks",
+                json=TaskSubmitRequest(
+                    task_name=f"task_{i}", args={"param1": i}, heartbeat_timeout=60
+                ).model_dump(),
+                headers=auth_headers,
+            )
+            assert response.status_code == HTTP_201_CREATED, f"{response.json()}"
+            task_ids.append(response.json()["task_id"])
+
+        start = get_current_time()
+        with freeze_time(start) as frozen_time:
+            for i in range(2):
+                response = test_app.post(
+                    "/api/v1/queues/me/tasks/next",
+                    headers=auth_headers,
+                    json=TaskFetchRequest(
+                        start_heartbeat=True,
+                        extra_filter={"task_name": f"task_{i}"},
+                    ).model_dump(),
+                )
+                assert response.json()["found"], f"{response.json()}"
+
+            frozen_time.tick(timedelta(seconds=30))
+
+            # 2. Refresh the heartbeats of all three in one request
+            response = test_app.post(
+                "/api/v1/queues/me/tasks/heartbeat",
+                headers=auth_headers,
+                json=TaskHeartbeatRequest(task_ids=task_ids).model_dump(),
+            )
+            assert response.status_code == HTTP_200_OK, f"{response.json()}"
+            data = TaskHeartbeatResponse(**response.json())
+            assert data.refreshed == task_ids[:2]
+            assert list(data.failed) == [task_ids[2]]  # not running
+
+            # 3. Check heartbeat timestamps via ls
+            response = test_app.post(
+                "/api/v1/queues/me/tasks/search",
+                headers=auth_headers,
+                json=TaskLsRequest(status="running").model_dump(),
+            )
+            data = TaskLsResponse(**response.json())
+            assert len(data.content) == 2
+            for task in data.content:
+                assert (
+                    abs(
+                        task.last_heartbeat.timestamp()
+                        - (start + timedelta(seconds=30)).timestamp()
+                    )
+                    <= 1
+                )
+
     def test_delete_task(
         self, test_app, setup_queue, auth_headers, task_submit_request
     ):
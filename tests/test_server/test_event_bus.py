@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from labtasker.api_models import StateTransitionEvent
+from labtasker.server.event_bus import (
+    DatabaseEventBus,
+    InProcessEventBus,
+    get_event_bus,
+    set_event_bus,
+)
+from labtasker.server.event_manager import EventManager
+from labtasker.server.fsm import EntityType
+from labtasker.utils import get_current_time
+
+pytestmark = [pytest.mark.unit]
+
+
+def make_event(queue_id, entity_id="task_1"):
+    return StateTransitionEvent(
+        queue_id=queue_id,
+        timestamp=get_current_time(),
+        metadata={},
+        entity_type=EntityType.TASK,
+        entity_id=entity_id,
+        old_state="created",
+        new_state="pending",
+        entity_data={"_id": entity_id, "created_at": get_current_time()},
+    )
+
+
+def subscribe(manager: EventManager, queue_id: str) -> asyncio.Queue:
+    buffer: asyncio.Queue = asyncio.Queue()
+    manager.get_queue_event_manager(queue_id).client_buffers["client"] = buffer
+    return buffer
+
+
+@pytest.fixture
+def restore_event_bus():
+    original = get_event_bus()
+    yield
+    set_event_bus(original)
+
+
+def test_in_process_event_bus():
+    manager = EventManager()
+    buffer = subscribe(manager, "q")
+
+    InProcessEventBus(manager).publish("q", make_event("q"))
+
+    assert buffer.qsize() == 1
+    assert buffer.get_nowait().event.entity_id == "task_1"
+
+
+def test_database_event_bus_relays_across_processes(db_fixture):
+    # two "processes", each with its own event manager, sharing one database
+    manager_a, manager_b = EventManager(), EventManager()
+    bus_a = DatabaseEventBus(db_fixture, manager=manager_a)
+    bus_b = DatabaseEventBus(db_fixture, manager=manager_b)
+
+    buffer_a = subscribe(manager_a, "q")
+    buffer_b = subscribe(manager_b, "q")
+    buffer_b_other_queue = subscribe(manager_b, "other_q")
+
+    bus_a.publish("q", make_event("q", entity_id="task_1"))
+
+    # delivered locally right away
+    assert buffer_a.qsize() == 1
+    # delivered to the other process once it polls the journal
+    assert buffer_b.qsize() == 0
+    assert bus_b.poll() == 1
+    assert buffer_b.qsize() == 1
+    assert buffer_b_other_queue.qsize() == 0
+
+    relayed = buffer_b.get_nowait().event
+    assert isinstance(relayed, StateTransitionEvent)
+    assert relayed.entity_id == "task_1"
+    assert relayed.new_state == "pending"
+
+    # events of its own are not delivered twice
+    assert bus_a.poll() == 0
+    assert buffer_a.qsize() == 1
+
+    # entries within the lookback window are de-duplicated
+    assert bus_b.poll() == 0
+
+    bus_a.publish("q", make_event("q", entity_id="task_2"))
+    assert bus_b.poll() == 1
+    assert buffer_b.get_nowait().event.entity_id == "task_2"
+
+
+def test_fsm_transitions_go_through_event_bus(db_fixture, restore_event_bus):
+    manager = EventManager()
+    bus = DatabaseEventBus(db_fixture, manager=manager)
+    set_event_bus(bus)
+
+    queue_id = db_fixture.create_queue(queue_name="test_queue", password="test")
+    buffer = subscribe(manager, queue_id)
+
+    task_id = db_fixture.create_task(queue_id=queue_id, args={"foo": "bar"})
+
+    assert buffer.qsize() == 1
+    assert buffer.get_nowait().event.entity_id == task_id
+
+    journaled = db_fixture.read_events(since=get_current_time().replace(year=2000))
+    assert [e["event"]["entity_id"] for e in journaled] == [task_id]
+    assert journaled[0]["origin"] == bus.origin
@@ -46,6 +46,7 @@ def test_cancel_from_any_state(self, task_db_entry):
         """Test cancelling task from any state."""
         states = [
             TaskState.PENDING,
+            TaskState.RESERVED,
             TaskState.RUNNING,
             TaskState.SUCCESS,
             TaskState.FAILED,
@@ -64,6 +65,7 @@ def test_cancel_from_any_state(self, task_db_entry):
     def test_reset_from_any_state(self, task_db_entry):
         """Test resetting task from any state."""
         states = [
+            TaskState.RESERVED,
             TaskState.RUNNING,
             TaskState.SUCCESS,
             TaskState.FAILED,
@@ -107,6 +109,36 @@ def test_fail_retry_behavior(self, task_db_entry):
         assert event_handle.old_state == TaskState.RUNNING
         assert event_handle.new_state == TaskState.FAILED
 
+    def test_reserve_and_release(self, task_db_entry):
+        """Test reserving a task, then starting or releasing it."""
+        fsm = TaskFSM.from_db_entry(task_db_entry)
+        event_handle = fsm.reserve()
+        assert fsm.state == TaskState.RESERVED
+        assert event_handle.old_state == TaskState.PENDING
+        assert event_handle.new_state == TaskState.RESERVED
+
+        # released without counting a retry
+        event_handle = fsm.release()
+        assert fsm.state == TaskState.PENDING
+        assert fsm.retries == 0
+        assert event_handle.old_state == TaskState.RESERVED
+
+        fsm.reserve()
+        event_handle = fsm.fetch()
+        assert fsm.state == TaskState.RUNNING
+        assert event_handle.old_state == TaskState.RESERVED
+
+        # only pending tasks are reserved, and only reserved ones released
+        with pytest.raises(HTTPException):
+            fsm.reserve()
+        with pytest.raises(HTTPException):
+            fsm.release()
+        # a reserved task has not run
+        fsm.force_set_state(TaskState.RESERVED)
+        for transition in [fsm.complete, fsm.fail]:
+            with pytest.raises(HTTPException):
+                transition()
+
 
 @pytest.mark.unit
 class TestWorkerFSM:
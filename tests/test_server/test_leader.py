@@ -0,0 +1,103 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi import FastAPI
+
+from labtasker.server.endpoints import periodic_task
+from labtasker.server.leader import LeaderLease
+from tests.fixtures.mock_datetime_now import mock_get_current_time
+
+pytestmark = [pytest.mark.unit]
+
+
+def test_acquire_lease(db_fixture, mock_get_current_time):
+    assert db_fixture.acquire_lease("sweeper", holder="a", ttl=10)
+    # held by "a", others can not acquire it
+    assert not db_fixture.acquire_lease("sweeper", holder="b", ttl=10)
+    # the holder can renew it
+    mock_get_current_time.tick(timedelta(seconds=8))
+    assert db_fixture.acquire_lease("sweeper", holder="a", ttl=10)
+
+    # leases with different names are independent
+    assert db_fixture.acquire_lease("other", holder="b", ttl=10)
+
+    # taken over once expired
+    mock_get_current_time.tick(timedelta(seconds=8))
+    assert not db_fixture.acquire_lease("sweeper", holder="b", ttl=10)
+    mock_get_current_time.tick(timedelta(seconds=3))
+    assert db_fixture.acquire_lease("sweeper", holder="b", ttl=10)
+    assert not db_fixture.acquire_lease("sweeper", holder="a", ttl=10)
+
+
+def test_release_lease(db_fixture):
+    assert db_fixture.acquire_lease("sweeper", holder="a", ttl=10)
+    # only the holder can release it
+    assert not db_fixture.release_lease("sweeper", holder="b")
+    assert db_fixture.release_lease("sweeper", holder="a")
+    # others can take over right away
+    assert db_fixture.acquire_lease("sweeper", holder="b", ttl=10)
+
+
+def test_leader_lease_failover(db_fixture, mock_get_current_time):
+    lease_a = LeaderLease(db_fixture, name="sweeper", ttl=10)
+    lease_b = LeaderLease(db_fixture, name="sweeper", ttl=10)
+
+    assert lease_a.refresh()
+    assert not lease_b.refresh()
+    assert lease_a.is_leader
+    assert not lease_b.is_leader
+
+    # leader dies without releasing, the lease expires
+    mock_get_current_time.tick(timedelta(seconds=11))
+    assert lease_b.refresh()
+    assert lease_b.is_leader
+
+    # the previous leader steps down on its next refresh
+    assert not lease_a.refresh()
+    assert not lease_a.is_leader
+
+    # graceful shutdown hands over immediately
+    lease_b.release()
+    assert not lease_b.is_leader
+    assert lease_a.refresh()
+
+
+def test_leader_lease_expires_locally(db_fixture, monkeypatch):
+    lease = LeaderLease(db_fixture, name="sweeper", ttl=0.05)
+    assert lease.refresh()
+
+    def unreachable(*args, **kwargs):
+        raise RuntimeError("database unreachable")
+
+    monkeypatch.setattr(db_fixture, "acquire_lease", unreachable)
+    # keeps leadership until the lease would have expired
+    assert lease.refresh()
+
+    time.sleep(0.06)
+    assert not lease.refresh()
+    assert not lease.is_leader
+
+
+@pytest.mark.anyio
+async def test_periodic_task_only_sweeps_as_leader(db_fixture, monkeypatch):
+    calls = []
+    monkeypatch.setattr(db_fixture, "handle_timeouts", lambda: calls.append(1) or [])
+
+    app = FastAPI()
+    leader = LeaderLease(db_fixture, name="sweeper", ttl=10)
+    follower = LeaderLease(db_fixture, name="sweeper", ttl=10)
+    assert leader.refresh()
+    assert not follower.refresh()
+
+    task = asyncio.create_task(periodic_task(app, 0.01, follower))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert not calls
+    assert app.state.prev_polling
+
+    task = asyncio.create_task(periodic_task(app, 0.01, leader))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert calls
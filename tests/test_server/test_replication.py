@@ -0,0 +1,198 @@
+import asyncio
+import datetime
+import threading
+import time
+
+import pytest
+from mongomock import ObjectId, helpers
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
+from starlette.testclient import TestClient
+
+from labtasker.security import get_auth_headers
+from labtasker.server.config import get_server_config
+from labtasker.server.database import DBService
+from labtasker.server.embedded_db import MongoClient, ServerStore
+from labtasker.server.endpoints import app
+from labtasker.server.replication import (
+    Replica,
+    ReplicationLog,
+    decode_record,
+    encode_record,
+    set_replica,
+)
+
+pytestmark = [pytest.mark.unit]
+
+TOKEN = "replication-token"
+
+
+@pytest.fixture
+def primary(db_fixture, monkeypatch):
+    monkeypatch.setattr(get_server_config(), "replication_token", TOKEN)
+    db_fixture.embedded_store.enable_replication()
+    return db_fixture
+
+
+@pytest.fixture
+def standby(tmp_path):
+    store = ServerStore(persistence_path=str(tmp_path / "standby.json"))
+    db = DBService(db_name="test_db", client=MongoClient(_store=store))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def replica(primary, standby):
+    return Replica(
+        standby.embedded_store,
+        "http://testserver",
+        token=TOKEN,
+        http_client=TestClient(app),
+        poll_timeout=0,
+    )
+
+
+def dump(db: DBService):
+    return {
+        col_name: sorted(db._db[col_name].find({}), key=lambda doc: doc["_id"])
+        for col_name in ("queues", "tasks", "workers")
+    }
+
+
+def test_standby_applies_mutations_of_primary(primary, standby, replica):
+    queue_id = primary.create_queue(queue_name="q", password="password")
+    task_ids = [primary.create_task(queue_id=queue_id, args={"i": i}) for i in range(3)]
+
+    replica.sync()  # snapshot
+    assert dump(standby) == dump(primary)
+
+    primary.fetch_task(queue_id=queue_id)
+    primary.delete_task(queue_id=queue_id, task_id=task_ids[2])
+    primary.create_worker(queue_id=queue_id)
+    lsn = primary.embedded_store.replication_log.lsn
+
+    assert replica.status()["lag_records"] == 0  # not polled yet
+    assert replica.sync() > 0
+    assert dump(standby) == dump(primary)
+    status = replica.status()
+    assert status["applied_lsn"] == status["primary_lsn"] == lsn
+    assert status["lag_records"] == 0 and status["lag_seconds"] == 0.0
+
+    # the primary reports the standby
+    (reported,) = primary.embedded_store.replication_log.status()["standbys"]
+    assert reported["standby_id"] == replica.standby_id
+
+    # the standby persists what it applied
+    standby.embedded_store.flush()
+    restored = ServerStore(persistence_path=standby.embedded_store._persistence_path)
+    restored_db = DBService(db_name="test_db", client=MongoClient(_store=restored))
+    assert dump(restored_db) == dump(primary)
+    restored_db.close()
+
+
+def test_standby_restarts_from_snapshot_after_gap(primary, standby, replica):
+    queue_id = primary.create_queue(queue_name="q", password="password")
+    replica.sync()
+
+    # e.g. the primary restarted, its log starts over
+    primary.embedded_store.replication_log = ReplicationLog()
+    primary.create_task(queue_id=queue_id, args={"i": 0})
+    assert replica.sync() == 0
+    assert replica.log_id is None
+
+    replica.sync()
+    assert replica.log_id == primary.embedded_store.replication_log.log_id
+    assert dump(standby) == dump(primary)
+
+
+def test_replication_requires_token(primary, monkeypatch):
+    client = TestClient(app)
+    response = client.get("/api/v1/replication/status")
+    assert response.status_code == HTTP_401_UNAUTHORIZED
+    response = client.get(
+        "/api/v1/replication/snapshot", headers={"Authorization": "Bearer wrong"}
+    )
+    assert response.status_code == HTTP_401_UNAUTHORIZED
+
+    monkeypatch.setattr(get_server_config(), "replication_token", None)
+    response = client.get(
+        "/api/v1/replication/status", headers={"Authorization": f"Bearer {TOKEN}"}
+    )
+    assert response.status_code == HTTP_404_NOT_FOUND
+
+
+def test_standby_serves_requests_once_promoted(
+    primary, replica, queue_create_request, auth_headers
+):
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {TOKEN}"
+    replica.sync()
+    set_replica(replica)
+    try:
+        response = client.post(
+            "/api/v1/queues", json=queue_create_request.to_request_dict()
+        )
+        assert response.status_code == HTTP_503_SERVICE_UNAVAILABLE
+        assert client.get("/health").status_code == HTTP_200_OK
+
+        response = client.get("/api/v1/replication/status")
+        assert response.json()["role"] == "standby"
+        assert response.json()["replication"]["connected"]
+
+        response = client.post("/api/v1/replication/promote")
+        assert response.status_code == HTTP_200_OK, response.json()
+        assert response.json()["role"] == "primary"
+        assert response.json()["replication"]["promoted"]
+        assert replica.sync() == 0  # no longer applies records
+
+        del client.headers["Authorization"]
+        response = client.post(
+            "/api/v1/queues", json=queue_create_request.to_request_dict()
+        )
+        assert response.status_code != HTTP_503_SERVICE_UNAVAILABLE
+        response = client.get("/api/v1/queues/me", headers=auth_headers)
+        assert response.status_code == HTTP_200_OK
+    finally:
+        set_replica(None)
+
+
+def test_records_are_shipped_as_data(tmp_path):
+    when = datetime.datetime(2025, 1, 2, 3, 4, 5, 678901)
+    record = [
+        "set",
+        "test_db",
+        "dummy",
+        helpers.hashdict({"a": 1}),
+        {"_id": {"a": 1}, "t": when, "oid": ObjectId(), "raw": b"\x00", "l": [1.5]},
+    ]
+    line = encode_record(record)
+    assert "py/" not in line  # no object is built from the data
+    assert decode_record(line) == record
+    assert isinstance(decode_record(line)[3], helpers.hashdict)
+
+    index_record = ["create_index", "test_db", "dummy", "t_1", {"key": [("t", 1)]}]
+    assert decode_record(encode_record(index_record)) == index_record
+
+    with pytest.raises(TypeError):
+        encode_record(["set", "test_db", "dummy", "k", {"_id": "k", "v": object()}])
+
+
+@pytest.mark.anyio
+async def test_poll_waits_for_records():
+    log = ReplicationLog()
+    loop = asyncio.get_running_loop()
+
+    start = time.monotonic()
+    await log.wait(0, timeout=0.1)  # times out
+    assert time.monotonic() - start >= 0.1
+
+    # records are appended by threads of the request handlers
+    loop.call_later(0.1, lambda: threading.Thread(target=log.append, args=[[]]).start())
+    await log.wait(0, timeout=30)
+    assert log.read(log.log_id, 0) == [[]]
+    assert log._waiters == []
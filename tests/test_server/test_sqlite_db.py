@@ -0,0 +1,219 @@
+from datetime import timedelta
+
+import pytest
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from labtasker.server.database import DBService
+from labtasker.server.embedded_db import MongoClient as EmbeddedMongoClient
+from labtasker.server.embedded_db import ServerStore
+from labtasker.server.sqlite_db import MongoClient
+from tests.test_server.test_embedded_index import (
+    FETCH_PIPELINE,
+    QUERIES,
+    T0,
+    ids,
+    populate,
+)
+
+pytestmark = [pytest.mark.unit]
+
+
+def create_indexes(col):
+    col.create_index([("queue_id", ASCENDING)])
+    col.create_index([("priority", DESCENDING)])
+    col.create_index(
+        [
+            ("queue_id", ASCENDING),
+            ("status", ASCENDING),
+            ("priority", DESCENDING),
+            ("last_modified", ASCENDING),
+            ("created_at", ASCENDING),
+        ]
+    )
+
+
+@pytest.fixture
+def client(tmp_path):
+    client = MongoClient(tmp_path / "db.sqlite")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def collection(client):
+    col = client["test_db"]["tasks"]
+    create_indexes(col)
+    return col
+
+
+@pytest.fixture
+def embedded_collection():
+    col = EmbeddedMongoClient(_store=ServerStore(durability="memory"))["test_db"][
+        "tasks"
+    ]
+    create_indexes(col)
+    return col
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries_match_embedded(collection, embedded_collection, query):
+    populate(collection)
+    populate(embedded_collection)
+    assert ids(collection.find(query)) == ids(embedded_collection.find(query))
+
+
+def test_candidates_are_narrowed_down(collection):
+    populate(collection, n=1000)
+    store = collection._store
+
+    assert len(store.find_candidates({"_id": "task_42"})) == 1
+    by_queue = store.find_candidates({"queue_id": "q1", "status": "pending"})
+    assert 0 < len(by_queue) < 400
+    assert all(
+        doc["status"] == "pending" or isinstance(doc["status"], list)
+        for doc in by_queue
+    )
+    assert store.find_candidates({"args.x": 1}) is None
+
+
+def test_updates(collection, embedded_collection):
+    for col in (collection, embedded_collection):
+        populate(col)
+        col.update_many({"queue_id": "q1"}, {"$set": {"queue_id": "q4"}})
+        col.update_one({"_id": "task_3"}, {"$inc": {"priority": 100}})
+        col.delete_many({"status": "failed"})
+        col.replace_one({"_id": "task_5"}, {"queue_id": "q5", "status": "pending"})
+        col.update_one({"_id": "new"}, {"$set": {"queue_id": "q4"}}, upsert=True)
+
+    assert list(collection.find({})) == list(embedded_collection.find({}))
+    assert ids(collection.find({"queue_id": "q4", "priority": {"$gte": 100}})) == [
+        "task_3"
+    ]
+
+
+def test_unique_index(client):
+    col = client["test_db"]["queues"]
+    col.create_index([("queue_name", ASCENDING)], unique=True)
+    col.insert_many([{"_id": "a", "queue_name": "a"}, {"_id": "b", "queue_name": "b"}])
+
+    with pytest.raises(DuplicateKeyError):
+        col.update_one({"_id": "b"}, {"$set": {"queue_name": "a"}})
+    with pytest.raises(DuplicateKeyError):
+        col.insert_one({"_id": "a"})
+    assert list(col.find({}, {"queue_name": 1})) == [
+        {"_id": "a", "queue_name": "a"},
+        {"_id": "b", "queue_name": "b"},
+    ]
+
+
+def test_transaction_rollback(client, collection):
+    collection.insert_one({"_id": "t", "queue_id": "q", "status": "pending"})
+
+    with pytest.raises(RuntimeError):
+        with client.start_session() as session:
+            with session.start_transaction(queue_id="q"):
+                collection.update_one({"_id": "t"}, {"$set": {"status": "running"}})
+                collection.insert_one({"_id": "u", "queue_id": "q"})
+                raise RuntimeError
+
+    assert list(collection.find({})) == [
+        {"_id": "t", "queue_id": "q", "status": "pending"}
+    ]
+
+    with client.start_session() as session:
+        with session.start_transaction(queue_id="q"):
+            collection.update_one({"_id": "t"}, {"$set": {"status": "running"}})
+            with session.start_transaction(read_only=True):  # nested
+                assert collection.find_one({"_id": "t"})["status"] == "running"
+    assert collection.find_one({"_id": "t"})["status"] == "running"
+
+
+def test_persistence(tmp_path):
+    path = tmp_path / "db.sqlite"
+    client = MongoClient(path)
+    col = client["test_db"]["tasks"]
+    create_indexes(col)
+    col.insert_one({"_id": "t", "queue_id": "q", "created_at": T0, "args": {"x": [1]}})
+    client["test_db"].create_collection("empty")
+    client.close()
+
+    client = MongoClient(path, durability="memory")
+    try:
+        db = client["test_db"]
+        assert sorted(db.list_collection_names()) == ["empty", "tasks"]
+        assert len(db["tasks"].index_information()) == 4
+        assert db["tasks"].find_one({"created_at": {"$lte": T0}}) == {
+            "_id": "t",
+            "queue_id": "q",
+            "created_at": T0.replace(tzinfo=None),
+            "args": {"x": [1]},
+        }
+    finally:
+        client.close()
+
+
+def test_ttl_index(collection):
+    collection.create_index([("created_at", ASCENDING)], expireAfterSeconds=60)
+    collection.insert_one({"_id": "old", "created_at": T0})
+    collection._store._last_purge = 0
+    collection.insert_one({"_id": "new", "created_at": T0 + timedelta(days=365 * 100)})
+    assert ids(collection.find({})) == ["new"]
+
+
+@pytest.fixture
+def fetch_collections(collection, embedded_collection):
+    for col in (collection, embedded_collection):
+        populate(col, n=200)
+        # only a few distinct values, so that ties are broken by insertion order
+        for i in range(200):
+            col.update_one(
+                {"_id": f"task_{i}"},
+                {
+                    "$set": {
+                        "status": ["pending", "running"][i % 2],
+                        "priority": [0, 10, 1.5][i % 3],
+                        "last_modified": T0 + timedelta(seconds=i % 3),
+                        "created_at": T0 + timedelta(seconds=i % 2),
+                    }
+                },
+            )
+    return collection, embedded_collection
+
+
+def test_ordered_scan_matches_embedded(fetch_collections):
+    collection, embedded_collection = fetch_collections
+    assert collection._plan_ordered_scan(FETCH_PIPELINE) is not None
+    assert list(collection.aggregate(FETCH_PIPELINE)) == list(
+        embedded_collection.aggregate(FETCH_PIPELINE)
+    )
+
+    # position of documents with values that are not held by the columns is unknown
+    for col in fetch_collections:
+        col.insert_one(
+            {"_id": "bool", "queue_id": "q1", "status": "pending", "priority": True}
+        )
+    assert collection._plan_ordered_scan(FETCH_PIPELINE) is None
+    assert list(collection.aggregate(FETCH_PIPELINE)) == list(
+        embedded_collection.aggregate(FETCH_PIPELINE)
+    )
+
+
+def test_db_service(tmp_path):
+    client = MongoClient(tmp_path / "db.sqlite")
+    db = DBService(client=client, db_name="test_db")
+    try:
+        queue_id = db.create_queue(queue_name="q", password="pw")
+        task_ids = [
+            db.create_task(queue_id=queue_id, args={"i": i}, priority=i % 2)
+            for i in range(4)
+        ]
+
+        task = db.fetch_task(queue_id=queue_id)
+        assert task["_id"] == task_ids[1]
+        assert db.report_task_status(queue_id, task["_id"], "success")
+        tasks = db.query_collection(queue_id, "tasks", {"status": "success"})
+        assert [t["task_id"] for t in tasks] == [task_ids[1]]
+        assert db.fetch_task(queue_id=queue_id)["_id"] == task_ids[3]
+    finally:
+        client.close()
@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from labtasker.server.embedded_db import ReentrantRWLock, TransactionLocks
+
+pytestmark = [pytest.mark.unit]
+
+
+def blocks(acquire, timeout=0.1) -> bool:
+    """Whether `acquire` blocks when called from another thread. Releases it otherwise."""
+    acquired = threading.Event()
+    done = threading.Event()
+
+    def run():
+        release = acquire()
+        acquired.set()
+        done.wait(timeout=5)
+        if release is not None:
+            release()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    result = not acquired.wait(timeout=timeout)
+    done.set()
+    if not result:
+        thread.join()
+    return result
+
+
+def test_reentrant_rw_lock():
+    lock = ReentrantRWLock()
+
+    with lock.reader():
+        with lock.reader():
+            # readers share the lock
+            assert not blocks(lambda: lock.acquire_read() or lock.release_read)
+            assert blocks(lambda: lock.acquire_write() or lock.release_write)
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+
+    with lock.writer():
+        # the writer may read and write again
+        with lock.writer(), lock.reader():
+            pass
+        assert blocks(lambda: lock.acquire_read() or lock.release_read)
+
+    assert not blocks(lambda: lock.acquire_write() or lock.release_write)
+
+
+def test_transaction_locks():
+    locks = TransactionLocks()
+
+    # read-only transactions run concurrently
+    release = locks.acquire("q1", read_only=True)
+    assert not blocks(lambda: locks.acquire("q1", read_only=True))
+    assert not blocks(lambda: locks.acquire(None, read_only=True))
+    assert blocks(lambda: locks.acquire("q1"))
+    release()
+
+    # writers of different queues run concurrently
+    release = locks.acquire("q1")
+    assert not blocks(lambda: locks.acquire("q2"))
+    assert blocks(lambda: locks.acquire("q1", read_only=True))
+    # transactions spanning all queues wait for writers
+    assert blocks(lambda: locks.acquire(None))
+    release()
+
+    release = locks.acquire(None)
+    assert blocks(lambda: locks.acquire("q2", read_only=True))
+    release()
+
+
+def test_concurrent_fetch_is_atomic(db_fixture):
+    queue_id = db_fixture.create_queue(queue_name="test_queue", password="test")
+    n_tasks = 50
+    for i in range(n_tasks):
+        db_fixture.create_task(queue_id=queue_id, args={"i": i})
+
+    def fetch(_):
+        fetched = []
+        while True:
+            task = db_fixture.fetch_task(queue_id=queue_id)
+            if task is None:
+                return fetched
+            fetched.append(task["_id"])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(fetch, range(8)))
+
+    fetched = [task_id for result in results for task_id in result]
+    # every task is fetched exactly once
+    assert len(fetched) == n_tasks
+    assert len(set(fetched)) == n_tasks
+
+
+def test_reads_do_not_wait_for_writers_of_other_queues(db_fixture):
+    q1 = db_fixture.create_queue(queue_name="q1", password="test")
+    q2 = db_fixture.create_queue(queue_name="q2", password="test")
+    db_fixture.create_task(queue_id=q2, args={"foo": "bar"})
+
+    with db_fixture._client.start_session() as session:
+        with db_fixture._start_transaction(session, queue_id=q1):
+            # would time out if it waited for the transaction above
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                tasks = executor.submit(
+                    db_fixture.query_collection,
+                    queue_id=q2,
+                    collection_name="tasks",
+                    query={},
+                ).result(timeout=5)
+            assert len(tasks) == 1